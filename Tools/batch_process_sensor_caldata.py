@@ -0,0 +1,191 @@
+#! /usr/bin/env python3
+"""
+Runs the thermal calibration of process_sensor_caldata.py on all .ulg files in the supplied directory with
+a pool of worker processes, e.g. for a rack of boards calibrated at once. A <file>.params file is written
+per log file, and a report with the fit quality of every sensor of every board. Boards whose temperature
+range or fit residuals fall outside the limits are flagged.
+"""
+
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import time
+from typing import Dict, List, Tuple
+
+from process_sensor_caldata import process_sensor_caldata, SensorCalibration, SENSOR_TYPES, \
+    DEFAULT_BIN_WIDTH
+
+REPORT_FILENAME = 'thermal_calibration_report.csv'
+
+# the default fit quality limits: the minimum temperature range in degC covered by a sensor, and the
+# maximum rms of the residuals of the samples to the fitted polynomial of every sensor type.
+DEFAULT_FIT_LIMITS = {
+    'temperature_range_min': 10.0,
+    'accel_residual_rms_max': 0.5,
+    'baro_residual_rms_max': 20.0,
+    'gyro_residual_rms_max': 0.05,
+}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Perform the thermal calibration of the .ulg files in the '
+                                                 'specified directory, one board per file.')
+    parser.add_argument('directory_path')
+    parser.add_argument('-j', '--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='The number of worker processes used to process the log files in parallel.')
+    parser.add_argument('--bin-width', type=float, default=DEFAULT_BIN_WIDTH,
+                        help='The width of the temperature bins in degC the samples are reduced to '
+                             'before the fit. 0 fits the samples directly.')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Whether to only write the parameters and not plot the biases.')
+    parser.add_argument('--fit-limits', type=str, default=None,
+                        help='A csv file of limit_id,threshold rows overriding the default fit quality '
+                             'limits: {:s}.'.format(', '.join(
+                                 '{:s}={:g}'.format(key, value)
+                                 for key, value in DEFAULT_FIT_LIMITS.items())))
+    parser.add_argument('--report', type=str, default=None,
+                        help='The csv file the fit quality report is written to. Defaults to {:s} in '
+                             'the specified directory.'.format(REPORT_FILENAME))
+    return parser.parse_args()
+
+
+def load_fit_limits(filename: str) -> Dict[str, float]:
+    """
+    :param filename: a csv file with a limit_id and a threshold column.
+    :return: the default fit limits updated with the limits of the file.
+    """
+    fit_limits = dict(DEFAULT_FIT_LIMITS)
+    with open(filename, 'r') as file:
+        for row in csv.DictReader(file):
+            if row['limit_id'] not in fit_limits:
+                raise ValueError('unknown fit limit {:s} in {:s}'.format(row['limit_id'], filename))
+            fit_limits[row['limit_id']] = float(row['threshold'])
+    return fit_limits
+
+
+def get_fit_quality(
+        calibrations: Dict[str, List[SensorCalibration]],
+        fit_limits: Dict[str, float]) -> List[Dict[str, object]]:
+    """
+    checks the fit quality of every field of every sensor instance of a board.
+    :param calibrations: the calibrations as returned by process_sensor_caldata.
+    :param fit_limits:
+    :return: a list of report rows, one per sensor instance and field.
+    """
+    rows = list()
+    for topic, param_prefix, name, fields, _, _, _, _ in SENSOR_TYPES:
+        for instance, calibration in enumerate(calibrations[topic]):
+            prefix = '{:s}{:d}'.format(param_prefix, instance)
+            temperature_min = float(calibration.params['{:s}_TMIN'.format(prefix)])
+            temperature_max = float(calibration.params['{:s}_TMAX'.format(prefix)])
+            for (field, _), residual_rms in zip(fields, calibration.residual_rms):
+                flags = list()
+                if temperature_max - temperature_min < fit_limits['temperature_range_min']:
+                    flags.append('temperature range')
+                if residual_rms > fit_limits['{:s}_residual_rms_max'.format(name.lower())]:
+                    flags.append('residual rms')
+                rows.append({
+                    'sensor': prefix, 'device_id': calibration.params['{:s}_ID'.format(prefix)],
+                    'field': field, 'temperature_min': temperature_min,
+                    'temperature_max': temperature_max, 'residual_rms': float(residual_rms),
+                    'flags': ';'.join(flags)})
+    return rows
+
+
+def process_file(job: Tuple[str, float, bool, Dict[str, float]]) -> Dict[str, object]:
+    """
+    calibrates the sensors of a single log file and records the wall time and outcome.
+    :param job: a tuple of (ulog_file, bin_width, plot, fit_limits)
+    :return: a result entry with the fit quality report rows of the board.
+    """
+    ulog_file, bin_width, plot, fit_limits = job
+    start_time = time.time()
+    try:
+        calibrations = process_sensor_caldata(ulog_file, bin_width=bin_width, plot=plot)
+        rows = get_fit_quality(calibrations, fit_limits)
+        status = 'flagged' if any(row['flags'] for row in rows) else 'ok'
+        error = ''
+    except Exception as e:
+        rows = list()
+        status = 'failed'
+        error = str(e)
+    return {'filename': ulog_file, 'status': status, 'error': error, 'rows': rows,
+            'wall_time': time.time() - start_time}
+
+
+def write_report(results: List[Dict[str, object]], report_filename: str) -> None:
+    """
+    writes the fit quality of every sensor of every board to a csv file. Failed boards are written
+    with an empty sensor.
+    :param results:
+    :param report_filename:
+    :return:
+    """
+    columns = ['sensor', 'device_id', 'field', 'temperature_min', 'temperature_max',
+               'residual_rms', 'flags']
+    with open(report_filename, 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow(['filename', 'status'] + columns + ['error'])
+        for result in sorted(results, key=lambda r: r['filename']):
+            if not result['rows']:
+                writer.writerow([result['filename'], result['status']] + [''] * len(columns) +
+                                [result['error']])
+            for row in result['rows']:
+                writer.writerow([result['filename'], result['status']] +
+                                [row[column] for column in columns] + [result['error']])
+
+
+def main() -> None:
+
+    args = get_arguments()
+
+    fit_limits = load_fit_limits(args.fit_limits) if args.fit_limits is not None else \
+        dict(DEFAULT_FIT_LIMITS)
+
+    ulog_directory = args.directory_path
+    report_filename = args.report if args.report is not None else \
+        os.path.join(ulog_directory, REPORT_FILENAME)
+
+    ulog_files = sorted(glob.glob(os.path.join(ulog_directory, '*.ulg')))
+    n_files = len(ulog_files)
+    print("found {:d} .ulg files in {:s}".format(n_files, ulog_directory))
+
+    jobs = [(ulog_file, args.bin_width, not args.no_plots, fit_limits) for ulog_file in ulog_files]
+
+    if args.workers > 1:
+        pool = multiprocessing.Pool(processes=args.workers, maxtasksperchild=1)
+        result_iterator = pool.imap_unordered(process_file, jobs)
+    else:
+        pool = None
+        result_iterator = map(process_file, jobs)
+
+    results = list()
+    try:
+        for i, result in enumerate(result_iterator):
+            print('processed file {:d}/{:d}: {:s} ({:s}, {:.1f}s)'.format(
+                i + 1, n_files, result['filename'], result['status'], result['wall_time']))
+            if result['status'] == 'failed':
+                print(result['error'])
+            results.append(result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    write_report(results, report_filename)
+    print('Fit quality report written to {:s}'.format(report_filename))
+
+    for status in ['flagged', 'failed']:
+        filenames = [result['filename'] for result in results if result['status'] == status]
+        if filenames:
+            print('{:d} boards {:s}:'.format(len(filenames), status))
+            for filename in sorted(filenames):
+                print('    {:s}'.format(filename))
+    print('{:d}/{:d} boards calibrated within the fit limits.'.format(
+        sum(1 for result in results if result['status'] == 'ok'), n_files))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#! /usr/bin/env python3
+"""
+Benchmarks px_uploader.py against the bootloader emulator of px_bootloader_emulator.py. Times the upload
+and verify of a synthetic firmware end to end for bootloader revisions and links, and appends the results
+to a json lines file, such that the throughput can be compared between commits. With --max-regression
+the benchmark fails if a case got slower than the reference run, e.g. in CI.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from px_bootloader_emulator import BootloaderEmulator, DEFAULT_FLASH_SIZE
+
+BENCHMARK_RESULTS_FILENAME = 'px_uploader_benchmark.jsonl'
+
+# bootloader name -> (bootloader protocol revision, baud rate of a UART link or None for USB CDC)
+BOOTLOADERS = {
+    'v2_usb': (2, None),
+    'v3_usb': (3, None),
+    'v5_usb': (5, None),
+    'v3_uart': (3, 921600),
+}
+
+# upload mode -> additional px_uploader.py arguments
+UPLOAD_MODES = {
+    'default': [],
+    'adaptive': ['--adaptive-window'],
+}
+
+# firmware file format -> px_mkfw.py arguments
+FIRMWARE_FORMATS = {
+    'json': [],
+    'binary': ['--format', 'binary'],
+    'binary_raw': ['--format', 'binary', '--raw_image'],
+}
+
+# not board id 9, which bootloaders before v5 only accept with up to 1 MB images
+BENCHMARK_BOARD_ID = 50
+
+UPLOAD_TIMEOUT = 600.0
+
+
+def get_git_revision() -> Optional[str]:
+    """
+    :return: the git commit of the working tree, or None if it can not be determined.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_firmware(work_directory: str, image_size: int, flash_size: int, firmware_format: str) -> \
+        Tuple[str, bytes]:
+    """
+    packs a random image with px_mkfw.py.
+    :param work_directory:
+    :param image_size: the size of the image in bytes.
+    :param flash_size: the maximum image size of the firmware.
+    :param firmware_format: a key of FIRMWARE_FORMATS.
+    :return: the firmware file name and the image.
+    """
+    image = os.urandom(image_size)
+    image_filename = os.path.join(work_directory, 'image.bin')
+    with open(image_filename, 'wb') as file:
+        file.write(image)
+    prototype_filename = os.path.join(work_directory, 'prototype.json')
+    with open(prototype_filename, 'w') as file:
+        json.dump({'magic': 'PX4FWv1', 'board_id': BENCHMARK_BOARD_ID, 'board_revision': 0,
+                   'image_maxsize': flash_size}, file)
+    firmware_filename = os.path.join(work_directory, 'benchmark.px4')
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'px_mkfw.py')
+    subprocess.check_call([sys.executable, script, '--prototype', prototype_filename,
+                           '--image', image_filename, '--output', firmware_filename] +
+                          FIRMWARE_FORMATS[firmware_format])
+    return firmware_filename, image
+
+
+def parse_phase_times(output: str) -> Dict[str, float]:
+    """
+    :param output: the output of px_uploader.py --stats.
+    :return: the duration of the erase, program and verify phases in seconds.
+    """
+    return {match.group(1): float(match.group(2)) for match in
+            re.finditer(r'^\s+(erase|program|verify)\s+([0-9.]+) s$', output, re.MULTILINE)}
+
+
+def benchmark_upload(firmware_filename: str, image: bytes, bootloader: str, mode: str, repeat: int,
+                     erase_time: float, flash_size: int) -> Dict[str, float]:
+    """
+    times px_uploader.py uploading to a fresh emulated bootloader, and checks the programmed flash.
+    :param firmware_filename:
+    :param image: the image of the firmware.
+    :param bootloader: a key of BOOTLOADERS.
+    :param mode: a key of UPLOAD_MODES.
+    :param repeat: the number of uploads.
+    :param erase_time: the duration of the chip erase of the emulator in seconds.
+    :param flash_size:
+    :return: the minimum, median and maximum wall time of the uploads in seconds, and the median
+    duration of the program and verify phases.
+    """
+    bl_rev, baudrate = BOOTLOADERS[bootloader]
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'px_uploader.py')
+    wall_times = list()
+    phase_times = list()
+    for _ in range(repeat):
+        with BootloaderEmulator(bl_rev=bl_rev, board_id=BENCHMARK_BOARD_ID, flash_size=flash_size,
+                                baudrate=baudrate, erase_time=erase_time) as emulator:
+            command = [sys.executable, script, '--port', emulator.port, '--stats'] + UPLOAD_MODES[mode]
+            if baudrate is not None:
+                command += ['--baud-bootloader', str(baudrate)]
+            start_time = time.perf_counter()
+            result = subprocess.run(command + [firmware_filename], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, timeout=UPLOAD_TIMEOUT)
+            wall_times.append(time.perf_counter() - start_time)
+            output = result.stdout.decode('utf-8', 'replace').replace('\r', '\n')
+            if result.returncode != 0 or bytes(emulator.flash[:len(image)]) != image:
+                raise RuntimeError('upload to {:s} in {:s} mode failed:\n{:s}'.format(
+                    bootloader, mode, output))
+            phase_times.append(parse_phase_times(output))
+    program = statistics.median(p['program'] for p in phase_times)
+    return {'min': min(wall_times), 'median': statistics.median(wall_times), 'max': max(wall_times),
+            'program': program, 'verify': statistics.median(p['verify'] for p in phase_times),
+            'program_bytes_per_second': len(image) / program}
+
+
+def run_benchmarks(bootloaders: List[str], modes: List[str], image_size: int, firmware_format: str,
+                   repeat: int, erase_time: float, flash_size: int) -> \
+        Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    :param bootloaders: the names of the bootloaders.
+    :param modes: the upload modes.
+    :param image_size:
+    :param firmware_format:
+    :param repeat:
+    :param erase_time:
+    :param flash_size:
+    :return: a dict of bootloader name to upload mode to timing statistics.
+    """
+    results = dict()
+    work_directory = tempfile.mkdtemp(prefix='px_uploader_benchmark_')
+    try:
+        firmware_filename, image = make_firmware(work_directory, image_size, flash_size, firmware_format)
+        for bootloader in bootloaders:
+            results[bootloader] = dict()
+            for mode in modes:
+                timing = benchmark_upload(firmware_filename, image, bootloader, mode, repeat,
+                                          erase_time, flash_size)
+                results[bootloader][mode] = timing
+                print('{:<8s} {:<9s} median {:8.3f}s (program {:.3f}s at {:.0f} bytes/s, '
+                      'verify {:.3f}s)'.format(bootloader, mode, timing['median'], timing['program'],
+                                               timing['program_bytes_per_second'], timing['verify']))
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    return results
+
+
+def load_benchmark_records(results_filename: str) -> List[Dict[str, object]]:
+    """
+    :param results_filename:
+    :return: the benchmark records of a json lines file in the order they were recorded.
+    """
+    if not os.path.exists(results_filename):
+        return []
+    with open(results_filename, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def print_comparison(reference: Dict[str, object], record: Dict[str, object]) -> float:
+    """
+    prints the change of the median wall times relative to a reference record.
+    :param reference:
+    :param record:
+    :return: the largest slowdown in percent.
+    """
+    print('comparison to {:s} ({:s}):'.format(
+        str(reference.get('git_revision')), str(reference.get('date'))))
+    max_regression = 0.0
+    for bootloader, modes in record['results'].items():
+        for mode, timing in modes.items():
+            reference_timing = reference['results'].get(bootloader, {}).get(mode)
+            if reference_timing is None:
+                continue
+            change = 100.0 * (timing['median'] / reference_timing['median'] - 1.0)
+            max_regression = max(max_regression, change)
+            print('{:<8s} {:<9s} {:8.3f}s -> {:8.3f}s ({:+.1f}%)'.format(
+                bootloader, mode, reference_timing['median'], timing['median'], change))
+    return max_regression
+
+
+def main() -> None:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(
+        description='Benchmark px_uploader.py against emulated bootloaders.')
+    parser.add_argument('--bootloaders', type=str, default='v2_usb,v3_usb',
+                        help='Comma separated bootloaders out of {:s}.'.format(', '.join(BOOTLOADERS.keys())))
+    parser.add_argument('--modes', type=str, default=','.join(UPLOAD_MODES),
+                        help='Comma separated upload modes out of {:s}.'.format(', '.join(UPLOAD_MODES.keys())))
+    parser.add_argument('--image-size', type=int, default=256 * 1024,
+                        help='The size of the uploaded image in bytes.')
+    parser.add_argument('--firmware-format', type=str, default='json', choices=list(FIRMWARE_FORMATS.keys()),
+                        help='The format of the firmware file written by px_mkfw.py.')
+    parser.add_argument('--flash-size', type=int, default=DEFAULT_FLASH_SIZE,
+                        help='The flash size of the emulated bootloaders in bytes.')
+    parser.add_argument('--erase-time', type=float, default=0.5,
+                        help='The duration of the chip erase of the emulated bootloaders in seconds.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of uploads of every benchmark case.')
+    parser.add_argument('--results', type=str,
+                        default=os.path.join(file_dir, BENCHMARK_RESULTS_FILENAME),
+                        help='The json lines file the benchmark results are appended to.')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='The git revision of a recorded run to compare to. Defaults to the '
+                             'latest recorded run.')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='Fail if the median time of a case is more than this percentage above '
+                             'the reference run.')
+    args = parser.parse_args()
+
+    bootloaders = args.bootloaders.split(',')
+    modes = args.modes.split(',')
+    for bootloader in bootloaders:
+        if bootloader not in BOOTLOADERS:
+            parser.error('unknown bootloader {:s}'.format(bootloader))
+    for mode in modes:
+        if mode not in UPLOAD_MODES:
+            parser.error('unknown upload mode {:s}'.format(mode))
+
+    records = load_benchmark_records(args.results)
+
+    record = {
+        'git_revision': get_git_revision(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'machine': platform.machine(),
+        'repeat': args.repeat, 'image_size': args.image_size, 'firmware_format': args.firmware_format,
+        'erase_time': args.erase_time,
+        'results': run_benchmarks(bootloaders, modes, args.image_size, args.firmware_format,
+                                  args.repeat, args.erase_time, args.flash_size)}
+
+    with open(args.results, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+    print('Benchmark results appended to {:s}'.format(args.results))
+
+    if args.compare is not None:
+        references = [r for r in records if r.get('git_revision') == args.compare]
+    else:
+        references = records
+    # only runs of the same image size and firmware format are comparable
+    references = [r for r in references if r.get('image_size') == args.image_size and
+                  r.get('firmware_format', 'json') == args.firmware_format]
+    if references:
+        max_regression = print_comparison(references[-1], record)
+        if args.max_regression is not None and max_regression > args.max_regression:
+            print('FAILED: {:.1f}% slower than the reference, more than {:g}%'.format(
+                max_regression, args.max_regression))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
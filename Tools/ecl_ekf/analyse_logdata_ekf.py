@@ -3,7 +3,7 @@
 the ecl ekf analysis
 """
 
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 
 import numpy as np
 from pyulog import ULog
@@ -11,12 +11,19 @@ from pyulog import ULog
 from analysis.detectors import InAirDetector, PreconditionError
 from analysis.metrics import calculate_ecl_ekf_metrics
 from analysis.checks import perform_ecl_ekf_checks
-from analysis.post_processing import get_estimator_check_flags
+from analysis.post_processing import get_ulog_estimator_check_flags
+from analysis.topic_requirements import register_topic_requirements
+from stage_profiler import StageProfiler
+
+register_topic_requirements('analysis.checks_that_apply', {
+    'estimator_status': ['tas_test_ratio', 'hagl_test_ratio'], 'ekf2_innovations': []})
 
 def analyse_ekf(
         ulog: ULog, check_levels: Dict[str, float], red_thresh: float = 1.0,
         amb_thresh: float = 0.5, min_flight_duration_seconds: float = 5.0,
-        in_air_margin_seconds: float = 5.0, pos_checks_when_sensors_not_fused: bool = False) -> \
+        in_air_margin_seconds: float = 5.0, pos_checks_when_sensors_not_fused: bool = False,
+        profiler: Optional[StageProfiler] = None, window_seconds: Optional[float] = None,
+        window_overlap: float = 0.5, check_worst_window: bool = False) -> \
         Tuple[str, Dict[str, str], Dict[str, float], Dict[str, float]]:
     """
     :param ulog:
@@ -26,8 +33,15 @@ def analyse_ekf(
     :param min_flight_duration_seconds:
     :param in_air_margin_seconds:
     :param pos_checks_when_sensors_not_fused:
+    :param profiler: records the analysis stages if specified.
+    :param window_seconds: if specified, the metrics are also calculated per rolling window of
+    this duration and per airborne segment, and the worst values are added to the metrics.
+    :param window_overlap: the overlap of consecutive rolling windows as a fraction of the window.
+    :param check_worst_window: whether the checks also fail or warn on the worst window values.
     :return:
     """
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
 
     try:
         estimator_status = ulog.get_dataset('estimator_status').data
@@ -42,11 +56,13 @@ def analyse_ekf(
         raise PreconditionError('could not find ekf2_innovation data')
 
     try:
-        in_air = InAirDetector(
-            ulog, min_flight_time_seconds=min_flight_duration_seconds, in_air_margin_seconds=0.0)
-        in_air_no_ground_effects = InAirDetector(
-            ulog, min_flight_time_seconds=min_flight_duration_seconds,
-            in_air_margin_seconds=in_air_margin_seconds)
+        with profiler.stage('in_air_detector'):
+            in_air = InAirDetector(
+                ulog, min_flight_time_seconds=min_flight_duration_seconds,
+                in_air_margin_seconds=0.0)
+            in_air_no_ground_effects = InAirDetector(
+                ulog, min_flight_time_seconds=min_flight_duration_seconds,
+                in_air_margin_seconds=in_air_margin_seconds)
     except Exception as e:
         raise PreconditionError(str(e))
 
@@ -57,18 +73,24 @@ def analyse_ekf(
         'in_air_transition_time': round(in_air.take_off + in_air.log_start, 2),
         'on_ground_transition_time': round(in_air.landing + in_air.log_start, 2)}
 
-    control_mode, innov_flags, gps_fail_flags = get_estimator_check_flags(estimator_status)
+    with profiler.stage('flag_decoding'):
+        control_mode, innov_flags, gps_fail_flags = get_ulog_estimator_check_flags(ulog)
 
-    sensor_checks, innov_fail_checks = find_checks_that_apply(
-        control_mode, estimator_status,
-        pos_checks_when_sensors_not_fused=pos_checks_when_sensors_not_fused)
+    with profiler.stage('checks_that_apply'):
+        sensor_checks, innov_fail_checks = find_checks_that_apply(
+            control_mode, estimator_status,
+            pos_checks_when_sensors_not_fused=pos_checks_when_sensors_not_fused)
 
-    metrics = calculate_ecl_ekf_metrics(
-        ulog, innov_flags, innov_fail_checks, sensor_checks, in_air, in_air_no_ground_effects,
-        red_thresh=red_thresh, amb_thresh=amb_thresh)
+    with profiler.stage('metrics'):
+        metrics = calculate_ecl_ekf_metrics(
+            ulog, innov_flags, innov_fail_checks, sensor_checks, in_air, in_air_no_ground_effects,
+            red_thresh=red_thresh, amb_thresh=amb_thresh, window_seconds=window_seconds,
+            window_overlap=window_overlap)
 
-    check_status, master_status = perform_ecl_ekf_checks(
-        metrics, sensor_checks, innov_fail_checks, check_levels)
+    with profiler.stage('checks'):
+        check_status, master_status = perform_ecl_ekf_checks(
+            metrics, sensor_checks, innov_fail_checks, check_levels,
+            check_worst_window=check_worst_window)
 
     return master_status, check_status, metrics, airtime_info
 
@@ -5,19 +5,103 @@ function collection for performing ecl ekf checks
 
 from typing import Tuple, List, Dict
 
+import numpy as np
+
+
+# the check status values in the order of severity
+STATUS_SEVERITY = ['Pass', 'Warning', 'Fail']
+
+# the status codes of the vectorized checks: a check that does not apply has the code -1
+STATUS_NOT_APPLICABLE = -1
+STATUS_CODES = {status: code for code, status in enumerate(STATUS_SEVERITY)}
+
+# the imu checks warn if any metric exceeds its warning level:
+# (check name, warning message, metric and check level pairs)
+IMU_CHECK_RULES = [
+    ('imu_vibration_check', 'IMU vibration check warning.', [
+        ('imu_coning_mean', 'imu_coning_mean_warn'), ('imu_coning_peak', 'imu_coning_peak_warn'),
+        ('imu_hfdang_mean', 'imu_hfdang_mean_warn'), ('imu_hfdang_peak', 'imu_hfdang_peak_warn'),
+        ('imu_hfdvel_mean', 'imu_hfdvel_mean_warn'), ('imu_hfdvel_peak', 'imu_hfdvel_peak_warn')]),
+    ('imu_bias_check', 'IMU bias check warning.', [
+        ('imu_dang_bias_median', 'imu_dang_bias_median_warn'),
+        ('imu_dvel_bias_median', 'imu_dvel_bias_median_warn')]),
+    ('imu_output_predictor_check', 'IMU output predictor check warning.', [
+        ('output_obs_ang_err_median', 'obs_ang_err_median_warn'),
+        ('output_obs_vel_err_median', 'obs_vel_err_median_warn'),
+        ('output_obs_pos_err_median', 'obs_pos_err_median_warn')]),
+]
+
+# the sensors whose amber percentage is checked against a warning and a fail level
+SENSOR_CHECK_IDS = ['hgt', 'mag', 'vel', 'pos', 'tas', 'hagl']
+
+# the innovation fail checks: (signal id, metric name, result id)
+INNOV_FAIL_CHECK_RULES = [
+    ('posv', 'hgt_fail_percentage', 'hgt'),
+    ('magx', 'magx_fail_percentage', 'mag'),
+    ('magy', 'magy_fail_percentage', 'mag'),
+    ('magz', 'magz_fail_percentage', 'mag'),
+    ('yaw', 'yaw_fail_percentage', 'yaw'),
+    ('vel', 'vel_fail_percentage', 'vel'),
+    ('posh', 'pos_fail_percentage', 'pos'),
+    ('tas', 'tas_fail_percentage', 'tas'),
+    ('hagl', 'hagl_fail_percentage', 'hagl'),
+    ('ofx', 'ofx_fail_percentage', 'flow'),
+    ('ofy', 'ofy_fail_percentage', 'flow'),
+]
+
 
 def perform_ecl_ekf_checks(
         metrics: Dict[str, float], sensor_checks: List[str], innov_fail_checks: List[str],
-        check_levels: Dict[str, float]) -> Tuple[Dict[str, str], str]:
+        check_levels: Dict[str, float],
+        check_worst_window: bool = False) -> Tuple[Dict[str, str], str]:
     """
     # performs the imu, sensor, amd ekf checks and calculates a master status.
     :param metrics:
     :param sensor_checks:
     :param innov_fail_checks:
     :param check_levels:
+    :param check_worst_window: whether to also perform the checks on the worst rolling window
+    values of the metrics (<metric>_worst_window), if available. The more severe status of both
+    is reported.
     :return:
     """
 
+    combined_status = perform_metric_checks(
+        metrics, sensor_checks, innov_fail_checks, check_levels)
+
+    if check_worst_window:
+        worst_window_metrics = {
+            name: metrics.get('{:s}_worst_window'.format(name), value)
+            for name, value in metrics.items()}
+        worst_window_status = perform_metric_checks(
+            worst_window_metrics, sensor_checks, innov_fail_checks, check_levels)
+        for name, status in worst_window_status.items():
+            if STATUS_SEVERITY.index(status) > STATUS_SEVERITY.index(combined_status[name]):
+                print('{:s}: {:s} in the worst window.'.format(name, status))
+                combined_status[name] = status
+
+    if any(val == 'Fail' for val in combined_status.values()):
+        master_status = 'Fail'
+    elif any(val == 'Warning' for val in combined_status.values()):
+        master_status = 'Warning'
+    else:
+        master_status = 'Pass'
+
+    return combined_status, master_status
+
+
+def perform_metric_checks(
+        metrics: Dict[str, float], sensor_checks: List[str], innov_fail_checks: List[str],
+        check_levels: Dict[str, float]) -> Dict[str, str]:
+    """
+    performs the imu, sensor and ekf checks on a set of metrics.
+    :param metrics:
+    :param sensor_checks:
+    :param innov_fail_checks:
+    :param check_levels:
+    :return: a dict of check name to status.
+    """
+
     imu_status = perform_imu_checks(metrics, check_levels)
 
     sensor_status = perform_sensor_innov_checks(
@@ -31,14 +115,8 @@ def perform_ecl_ekf_checks(
     combined_status.update(imu_status)
     combined_status.update(sensor_status)
     combined_status.update(ekf_status)
-    if any(val == 'Fail' for val in combined_status.values()):
-        master_status = 'Fail'
-    elif any(val == 'Warning' for val in combined_status.values()):
-        master_status = 'Warning'
-    else:
-        master_status = 'Pass'
 
-    return combined_status, master_status
+    return combined_status
 
 
 def perform_imu_checks(
@@ -53,34 +131,13 @@ def perform_imu_checks(
     # check for IMU sensor warnings
     imu_status = dict()
 
-    # perform the vibration check
-    imu_status['imu_vibration_check'] = 'Pass'
-    for imu_vibr_metric in ['imu_coning', 'imu_hfdang', 'imu_hfdvel']:
-        mean_metric = '{:s}_mean'.format(imu_vibr_metric)
-        peak_metric = '{:s}_peak'.format(imu_vibr_metric)
-        if imu_metrics[mean_metric] > check_levels['{:s}_warn'.format(mean_metric)] \
-                or imu_metrics[peak_metric] > check_levels['{:s}_warn'.format(peak_metric)]:
-            imu_status['imu_vibration_check'] = 'Warning'
-
-    if imu_status['imu_vibration_check'] == 'Warning':
-        print('IMU vibration check warning.')
-
-    # perform the imu bias check
-    if imu_metrics['imu_dang_bias_median'] > check_levels['imu_dang_bias_median_warn'] \
-            or imu_metrics['imu_dvel_bias_median'] > check_levels['imu_dvel_bias_median_warn']:
-        imu_status['imu_bias_check'] = 'Warning'
-        print('IMU bias check warning.')
-    else:
-        imu_status['imu_bias_check'] = 'Pass'
-
-    # perform output predictor
-    if imu_metrics['output_obs_ang_err_median'] > check_levels['obs_ang_err_median_warn'] \
-            or imu_metrics['output_obs_vel_err_median'] > check_levels['obs_vel_err_median_warn'] \
-            or imu_metrics['output_obs_pos_err_median'] > check_levels['obs_pos_err_median_warn']:
-        imu_status['imu_output_predictor_check'] = 'Warning'
-        print('IMU output predictor check warning.')
-    else:
-        imu_status['imu_output_predictor_check'] = 'Pass'
+    for check_name, warning_message, metric_levels in IMU_CHECK_RULES:
+        if any(imu_metrics[metric_name] > check_levels[level_name]
+               for metric_name, level_name in metric_levels):
+            imu_status[check_name] = 'Warning'
+            print(warning_message)
+        else:
+            imu_status[check_name] = 'Pass'
 
     imu_status['imu_sensor_status'] = 'Warning' if any(
         val == 'Warning' for val in imu_status.values()) else 'Pass'
@@ -102,7 +159,7 @@ def perform_sensor_innov_checks(
 
     sensor_status = dict()
 
-    for result_id in ['hgt', 'mag', 'vel', 'pos', 'tas', 'hagl']:
+    for result_id in SENSOR_CHECK_IDS:
 
         # only run sensor checks, if they apply.
         if result_id in sensor_checks:
@@ -118,17 +175,7 @@ def perform_sensor_innov_checks(
                 sensor_status['{:s}_sensor_status'.format(result_id)] = 'Pass'
 
     # perform innovation checks.
-    for signal_id, metric_name, result_id in [('posv', 'hgt_fail_percentage', 'hgt'),
-                                              ('magx', 'magx_fail_percentage', 'mag'),
-                                              ('magy', 'magy_fail_percentage', 'mag'),
-                                              ('magz', 'magz_fail_percentage', 'mag'),
-                                              ('yaw', 'yaw_fail_percentage', 'yaw'),
-                                              ('vel', 'vel_fail_percentage', 'vel'),
-                                              ('posh', 'pos_fail_percentage', 'pos'),
-                                              ('tas', 'tas_fail_percentage', 'tas'),
-                                              ('hagl', 'hagl_fail_percentage', 'hagl'),
-                                              ('ofx', 'ofx_fail_percentage', 'flow'),
-                                              ('ofy', 'ofy_fail_percentage', 'flow')]:
+    for signal_id, metric_name, result_id in INNOV_FAIL_CHECK_RULES:
 
         # only run innov fail checks, if they apply.
         if signal_id in innov_fail_checks:
@@ -141,3 +188,97 @@ def perform_sensor_innov_checks(
                     sensor_status['{:s}_sensor_status'.format(result_id)] = 'Pass'
 
     return sensor_status
+
+
+def perform_fleet_checks(
+        metrics: Dict[str, np.ndarray], check_levels: Dict[str, float],
+        check_worst_window: bool = False) -> Dict[str, np.ndarray]:
+    """
+    performs the imu, sensor and ekf checks on the metrics of many logs at once. The checks are
+    the same as those of perform_ecl_ekf_checks, evaluated on whole metric columns. A sensor or
+    innovation check applies to the logs whose metric is not NaN, as the metrics of checks that
+    did not apply to a log are stored as NaN.
+    :param metrics: a dict of metric name to an array with one value per log.
+    :param check_levels:
+    :param check_worst_window: whether to also perform the checks on the worst rolling window
+    values of the metrics (<metric>_worst_window), where available.
+    :return: a dict of check status name, including master_status, to an array of status codes
+    (STATUS_NOT_APPLICABLE or an index into STATUS_SEVERITY) with one entry per log.
+    """
+
+    status_codes = perform_fleet_metric_checks(metrics, check_levels)
+
+    if check_worst_window:
+        worst_window_metrics = dict()
+        for name, values in metrics.items():
+            worst_window_values = metrics.get('{:s}_worst_window'.format(name))
+            worst_window_metrics[name] = values if worst_window_values is None else np.where(
+                np.isnan(worst_window_values), values, worst_window_values)
+        worst_window_codes = perform_fleet_metric_checks(worst_window_metrics, check_levels)
+        for name, codes in worst_window_codes.items():
+            status_codes[name] = np.maximum(status_codes[name], codes)
+
+    status_codes['master_status'] = np.maximum(
+        np.amax(np.array(list(status_codes.values())), axis=0), STATUS_CODES['Pass'])
+
+    return status_codes
+
+
+def perform_fleet_metric_checks(
+        metrics: Dict[str, np.ndarray], check_levels: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """
+    performs the imu, sensor and ekf checks on the metrics of many logs.
+    :param metrics: a dict of metric name to an array with one value per log.
+    :param check_levels:
+    :return: a dict of check status name to an array of status codes.
+    """
+
+    n_logs = len(metrics['filter_faults_max'])
+    status_codes = dict()
+
+    def fleet_status(fail: np.ndarray, warn: np.ndarray) -> np.ndarray:
+        return np.where(fail, STATUS_CODES['Fail'], np.where(
+            warn, STATUS_CODES['Warning'], STATUS_CODES['Pass']))
+
+    def get_metric(name: str) -> np.ndarray:
+        return np.asarray(metrics.get(name, np.full(n_logs, np.nan)), dtype=float)
+
+    # the imu checks always apply, NaN metrics pass.
+    with np.errstate(invalid='ignore'):
+        for check_name, _, metric_levels in IMU_CHECK_RULES:
+            warn = np.zeros(n_logs, dtype=bool)
+            for metric_name, level_name in metric_levels:
+                warn |= get_metric(metric_name) > check_levels[level_name]
+            status_codes[check_name] = fleet_status(np.zeros(n_logs, dtype=bool), warn)
+        status_codes['imu_sensor_status'] = np.amax(np.array(
+            [status_codes[check_name] for check_name, _, _ in IMU_CHECK_RULES]), axis=0)
+
+        for result_id in SENSOR_CHECK_IDS:
+            amber = get_metric('{:s}_percentage_amber'.format(result_id))
+            status_codes['{:s}_sensor_status'.format(result_id)] = np.where(
+                np.isnan(amber), STATUS_NOT_APPLICABLE, fleet_status(
+                    amber > check_levels['{:s}_amber_fail_pct'.format(result_id)],
+                    amber > check_levels['{:s}_amber_warn_pct'.format(result_id)]))
+
+        for _, metric_name, result_id in INNOV_FAIL_CHECK_RULES:
+            fail_percentage = get_metric(metric_name)
+            status_name = '{:s}_sensor_status'.format(result_id)
+            codes = status_codes.get(status_name, np.full(n_logs, STATUS_NOT_APPLICABLE))
+            status_codes[status_name] = np.where(np.isnan(fail_percentage), codes, np.maximum(
+                codes, fleet_status(
+                    fail_percentage > check_levels['{:s}_fail_pct'.format(result_id)],
+                    np.zeros(n_logs, dtype=bool))))
+
+        status_codes['filter_fault_status'] = fleet_status(
+            get_metric('filter_faults_max') > 0, np.zeros(n_logs, dtype=bool))
+
+    return status_codes
+
+
+def get_status_names(status_codes: np.ndarray) -> np.ndarray:
+    """
+    converts status codes to the status names used in the results tables.
+    :param status_codes:
+    :return: an array of 'nan', 'Pass', 'Warning' or 'Fail'.
+    """
+    return np.array(['nan'] + STATUS_SEVERITY)[np.asarray(status_codes) + 1]
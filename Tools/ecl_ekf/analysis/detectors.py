@@ -2,10 +2,14 @@
 """
 detectors
 """
-from typing import Optional
+from typing import Optional, List, Dict
 import numpy as np
 from pyulog import ULog
 
+from analysis.topic_requirements import register_topic_requirements
+
+register_topic_requirements('analysis.in_air_detector', {'vehicle_land_detected': ['landed']})
+
 
 class PreconditionError(Exception):
     """
@@ -55,6 +59,10 @@ class InAirDetector(object):
 
         self._in_air = self._detect_airtime()
 
+        # airtime slices and indices per dataset, computed on first request
+        self._airtime_slices = dict()  # type: Dict[str, List[slice]]
+        self._airtime_indices = dict()  # type: Dict[str, np.ndarray]
+
 
     def _detect_airtime(self) -> Optional[Airtime]:
         """
@@ -136,47 +144,110 @@ class InAirDetector(object):
         """
         return self._log_start
 
-    def get_take_off_to_last_landing(self, dataset) -> list:
+    def _get_log_time(self, dataset: str) -> np.ndarray:
         """
-        return all indices of the log file between the first take_off and the
-        last landing.
+        returns the timestamps of a dataset in seconds since the log start.
         :param dataset:
         :return:
         """
         try:
             data = self._ulog.get_dataset(dataset).data
         except:
+            raise PreconditionError('InAirDetector: {:s} not found in log.'.format(dataset))
+
+        return (data['timestamp'] - self._ulog.start_timestamp) / 1.0e6
+
+    def get_log_time(self, dataset: str) -> np.ndarray:
+        """
+        returns the timestamps of a dataset in seconds since the log start, the time base of the
+        airtimes.
+        :param dataset:
+        :return:
+        """
+        return self._get_log_time(dataset)
+
+    def get_take_off_to_last_landing(self, dataset) -> np.ndarray:
+        """
+        return all indices of the log file between the first take_off and the
+        last landing.
+        :param dataset:
+        :return:
+        """
+        try:
+            log_time = self._get_log_time(dataset)
+        except PreconditionError:
             print('InAirDetector: {:s} not found in log.'.format(dataset))
-            return []
+            return np.array([], dtype=int)
 
         if self._in_air:
-            airtime = np.where(((data['timestamp'] - self._ulog.start_timestamp) / 1.0e6 >=
-                                self._in_air[0].take_off) & (
-                                    (data['timestamp'] - self._ulog.start_timestamp) /
-                                    1.0e6 < self._in_air[-1].landing))[0]
-
+            start, stop = np.searchsorted(
+                log_time, [self._in_air[0].take_off, self._in_air[-1].landing], side='left')
+            airtime = np.arange(start, max(start, stop))
         else:
-            airtime = []
+            airtime = np.array([], dtype=int)
 
         return airtime
 
-    def get_airtime(self, dataset) -> list:
+    def get_airtime_slices(self, dataset) -> List[slice]:
         """
-        return all indices of the log file that are in air
+        return a slice for every airtime of the dataset. The slices are computed once per dataset
+        by a binary search on the sorted timestamps and cached for the lifetime of the detector.
+        Indexing with a slice returns a view of the data instead of a copy.
         :param dataset:
         :return:
         """
-        try:
-            data = self._ulog.get_dataset(dataset).data
-        except:
-            raise PreconditionError('InAirDetector: {:s} not found in log.'.format(dataset))
+        if dataset not in self._airtime_slices:
+            log_time = self._get_log_time(dataset)
+            airtime_slices = list()
+            if self._in_air:
+                starts = np.searchsorted(
+                    log_time, [airtime.take_off for airtime in self._in_air], side='left')
+                stops = np.searchsorted(
+                    log_time, [airtime.landing for airtime in self._in_air], side='left')
+                airtime_slices = [slice(int(start), int(stop))
+                                  for start, stop in zip(starts, stops) if stop > start]
+            self._airtime_slices[dataset] = airtime_slices
+
+        return self._airtime_slices[dataset]
+
+    def get_airtime(self, dataset) -> np.ndarray:
+        """
+        return all indices of the log file that are in air. The indices are cached per dataset.
+        :param dataset:
+        :return:
+        """
+        if dataset not in self._airtime_indices:
+            airtime_slices = self.get_airtime_slices(dataset)
+            if airtime_slices:
+                airtime = np.concatenate([
+                    np.arange(airtime_slice.start, airtime_slice.stop)
+                    for airtime_slice in airtime_slices])
+            else:
+                airtime = np.array([], dtype=int)
+            self._airtime_indices[dataset] = airtime
+
+        return self._airtime_indices[dataset]
 
-        airtime = []
-        if self._in_air is not None:
-            for i in range(len(self._in_air)):
-                airtime.extend(np.where(((data['timestamp'] - self._ulog.start_timestamp) / 1.0e6 >=
-                                         self._in_air[i].take_off) & (
-                                             (data['timestamp'] - self._ulog.start_timestamp) /
-                                             1.0e6 < self._in_air[i].landing))[0])
+    def get_airtime_mask(self, dataset) -> np.ndarray:
+        """
+        return a boolean mask of the in air samples of a dataset.
+        :param dataset:
+        :return:
+        """
+        mask = np.zeros(len(self._get_log_time(dataset)), dtype=bool)
+        for airtime_slice in self.get_airtime_slices(dataset):
+            mask[airtime_slice] = True
+        return mask
 
-        return airtime
\ No newline at end of file
+    def get_airtime_data(self, data: np.ndarray, dataset: str) -> np.ndarray:
+        """
+        returns the in air samples of the data of a dataset. A single airtime returns a view of
+        the data, multiple airtimes are concatenated.
+        :param data: a signal of the dataset.
+        :param dataset:
+        :return:
+        """
+        airtime_slices = self.get_airtime_slices(dataset)
+        if len(airtime_slices) == 1:
+            return data[airtime_slices[0]]
+        return data[self.get_airtime(dataset)]
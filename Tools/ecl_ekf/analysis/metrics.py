@@ -3,26 +3,80 @@
 function collection for calculation ecl ekf metrics.
 """
 
-from typing import Dict, List, Tuple, Callable
+import warnings
+from typing import Dict, List, Tuple, Callable, Optional
+from collections import OrderedDict
 
 from pyulog import ULog
 import numpy as np
 
 from analysis.detectors import InAirDetector
+from analysis.topic_requirements import register_topic_requirements
+
+# a metric table entry declares a signal of a data source, the in air detector that selects its
+# airborne samples, and a dict of the statistics to compute mapped to the resulting metric names.
+MetricTableEntry = Tuple[str, str, str, Dict[str, str]]
+
+# a windowed statistic is computed from per block reductions of the (transformed) samples: 'mean'
+# from cumulative sums, 'max' from per block maxima and 'median' from the samples of the window.
+WindowedStatistic = Tuple[str, Optional[Callable]]
+
+# the suffixes of the worst window and worst airborne segment metrics, and their descriptions
+WINDOWED_METRIC_SUFFIXES = [
+    ('_worst_window', 'The worst value of {:s} over all rolling in-flight windows.'),
+    ('_worst_window_time', 'The start time in seconds since the log start of the rolling window '
+                           'with the worst value of {:s}.'),
+    ('_worst_segment', 'The worst value of {:s} over all airborne segments.'),
+    ('_worst_segment_time', 'The take-off time in seconds since the log start of the airborne '
+                            'segment with the worst value of {:s}.')]
+
+
+def get_metric_topic_requirements() -> Dict[str, List[str]]:
+    """
+    :return: the topics and fields accessed by the metrics, if all checks apply.
+    """
+    requirements = {'estimator_status': ['filter_fault_flags']}
+    for data_source, signal, _, _ in get_sensor_metric_table(
+            ['hgt', 'mag', 'vel', 'pos', 'tas', 'hagl']) + get_imu_metric_table():
+        requirements.setdefault(data_source, list()).append(signal)
+    return requirements
+
 
 def calculate_ecl_ekf_metrics(
         ulog: ULog, innov_flags: Dict[str, float], innov_fail_checks: List[str],
         sensor_checks: List[str], in_air: InAirDetector, in_air_no_ground_effects: InAirDetector,
-        red_thresh: float = 1.0, amb_thresh: float = 0.5) -> Tuple[dict, dict, dict, dict]:
+        red_thresh: float = 1.0, amb_thresh: float = 0.5,
+        window_seconds: Optional[float] = None, window_overlap: float = 0.5) -> Dict[str, float]:
+    """
+    :param ulog:
+    :param innov_flags:
+    :param innov_fail_checks:
+    :param sensor_checks:
+    :param in_air:
+    :param in_air_no_ground_effects:
+    :param red_thresh:
+    :param amb_thresh:
+    :param window_seconds: if specified, every metric is also calculated per rolling window of
+    this duration and per airborne segment, and the worst window and segment values and times
+    are added to the metrics.
+    :param window_overlap: the overlap of consecutive rolling windows as a fraction of the window.
+    :return:
+    """
+    metric_table = get_sensor_metric_table(sensor_checks) + \
+        get_innov_fail_metric_table(innov_fail_checks) + get_imu_metric_table()
+    data_sources = get_metric_data_sources(ulog, innov_flags)
+    detectors = {'in_air': in_air, 'in_air_no_ground_effects': in_air_no_ground_effects}
 
-    sensor_metrics = calculate_sensor_metrics(
-        ulog, sensor_checks, in_air, in_air_no_ground_effects,
-        red_thresh=red_thresh, amb_thresh=amb_thresh)
+    # evaluate the sensor, innovation fail and imu metrics in a single pass over the data
+    raw_metrics = calculate_metric_table(
+        metric_table, data_sources, detectors,
+        get_metric_statistics(red_thresh=red_thresh, amb_thresh=amb_thresh))
 
-    innov_fail_metrics = calculate_innov_fail_metrics(
-        innov_flags, innov_fail_checks, in_air, in_air_no_ground_effects)
+    sensor_metrics = finalize_sensor_metrics(raw_metrics, sensor_checks)
 
-    imu_metrics = calculate_imu_metrics(ulog, in_air_no_ground_effects)
+    innov_fail_metrics = finalize_innov_fail_metrics(raw_metrics, innov_fail_checks)
+
+    imu_metrics = finalize_imu_metrics(raw_metrics)
 
     estimator_status_data = ulog.get_dataset('estimator_status').data
 
@@ -39,17 +93,312 @@ def calculate_ecl_ekf_metrics(
     combined_metrics.update(innov_fail_metrics)
     combined_metrics.update(ekf_metrics)
 
+    if window_seconds is not None:
+        windowed_statistics = get_windowed_metric_statistics(
+            red_thresh=red_thresh, amb_thresh=amb_thresh)
+
+        # rolling windows, and airborne segments as windows of a single block
+        for block_times, blocks_per_window, min_coverage, suffix in [
+                get_rolling_window_blocks(in_air, window_seconds, window_overlap) + (
+                    0.5, '_worst_window'),
+                (get_segment_blocks(in_air), 1, 0.0, '_worst_segment')]:
+            windowed_raw_metrics = calculate_windowed_metric_table(
+                metric_table, data_sources, detectors, windowed_statistics, block_times,
+                blocks_per_window, min_coverage=min_coverage)
+            windowed_metrics = dict()
+            windowed_metrics.update(finalize_sensor_metrics(windowed_raw_metrics, sensor_checks))
+            windowed_metrics.update(
+                finalize_innov_fail_metrics(windowed_raw_metrics, innov_fail_checks))
+            windowed_metrics.update(finalize_imu_metrics(windowed_raw_metrics))
+            combined_metrics.update(get_worst_window_metrics(
+                windowed_metrics, block_times[:len(block_times) - blocks_per_window + 1, 0],
+                suffix, names=combined_metrics.keys()))
+
     return combined_metrics
 
 
-def calculate_sensor_metrics(
-        ulog: ULog, sensor_checks: List[str], in_air: InAirDetector,
-        in_air_no_ground_effects: InAirDetector, red_thresh: float = 1.0,
-        amb_thresh: float = 0.5) -> Dict[str, float]:
+def get_metric_data_sources(
+        ulog: ULog, innov_flags: Optional[dict] = None) -> Dict[str, Tuple[dict, str]]:
+    """
+    returns the data sources referenced by the metric tables.
+    :param ulog:
+    :param innov_flags:
+    :return: a dict of data source name to a tuple of (data, dataset), where the dataset provides
+    the timestamps of the data.
+    """
+    data_sources = {
+        'estimator_status': (ulog.get_dataset('estimator_status').data, 'estimator_status'),
+        'ekf2_innovations': (ulog.get_dataset('ekf2_innovations').data, 'ekf2_innovations')}
+    if innov_flags is not None:
+        data_sources['innov_flags'] = (innov_flags, 'estimator_status')
+    return data_sources
 
-    estimator_status_data = ulog.get_dataset('estimator_status').data
 
-    sensor_metrics = dict()
+def get_metric_statistics(
+        red_thresh: float = 1.0, amb_thresh: float = 0.5) -> Dict[str, Callable]:
+    """
+    returns the statistics available to the metric tables. Every statistic reduces a 2-D array of
+    signals (one signal per row) along its rows.
+    :param red_thresh:
+    :param amb_thresh:
+    :return:
+    """
+    return {
+        'max': lambda x: np.amax(x, axis=1),
+        'mean': lambda x: np.mean(x, axis=1),
+        'median': lambda x: np.median(x, axis=1),
+        'percentage_red': lambda x: 100.0 * np.mean(x > red_thresh, axis=1),
+        'percentage_amber': lambda x: 100.0 * np.mean(x > amb_thresh, axis=1),
+        'percentage_failed': lambda x: 100.0 * np.mean(x > 0.5, axis=1)}
+
+
+def calculate_metric_table(
+        metric_table: List[MetricTableEntry], data_sources: Dict[str, Tuple[dict, str]],
+        detectors: Dict[str, InAirDetector],
+        statistics: Dict[str, Callable]) -> Dict[str, float]:
+    """
+    calculates the metrics of a metric table. The airborne samples of all signals that share a
+    data source and an in air detector are gathered once into a 2-D array and all requested
+    statistics are computed on it in one pass.
+    :param metric_table: a list of (data source, signal, detector, {statistic: metric name}).
+    :param data_sources: a dict of data source name to a tuple of (data, dataset).
+    :param detectors: a dict of detector name to in air detector.
+    :param statistics: a dict of statistic name to a function reducing a 2-D array along its rows.
+    :return: a dict of metric name to metric value.
+    """
+
+    # group the table entries by data source and detector
+    groups = OrderedDict()
+    for data_source, signal, detector, metric_names in metric_table:
+        group = groups.setdefault((data_source, detector), OrderedDict())
+        group.setdefault(signal, dict()).update(metric_names)
+
+    metrics = dict()
+    for (data_source, detector), group in groups.items():
+        data, dataset = data_sources[data_source]
+        signals = list(group.keys())
+
+        # gather the airborne samples of all signals once, one signal per row
+        airborne_data = np.vstack([
+            detectors[detector].get_airtime_data(data[signal], dataset) for signal in signals])
+
+        requested_statistics = set()
+        for metric_names in group.values():
+            requested_statistics.update(metric_names.keys())
+
+        for statistic in sorted(requested_statistics):
+            values = statistics[statistic](airborne_data)
+            for i, signal in enumerate(signals):
+                if statistic in group[signal]:
+                    metrics[group[signal][statistic]] = values[i]
+
+    return metrics
+
+
+def get_windowed_metric_statistics(
+        red_thresh: float = 1.0, amb_thresh: float = 0.5) -> Dict[str, WindowedStatistic]:
+    """
+    returns the windowed counterparts of get_metric_statistics. The percentage statistics are
+    the mean of a transformed signal.
+    :param red_thresh:
+    :param amb_thresh:
+    :return: a dict of statistic name to a tuple of (reduction, transform of the samples or None).
+    """
+    return {
+        'max': ('max', None),
+        'mean': ('mean', None),
+        'median': ('median', None),
+        'percentage_red': ('mean', lambda x: 100.0 * (x > red_thresh)),
+        'percentage_amber': ('mean', lambda x: 100.0 * (x > amb_thresh)),
+        'percentage_failed': ('mean', lambda x: 100.0 * (x > 0.5))}
+
+
+def get_rolling_window_blocks(
+        in_air: InAirDetector, window_seconds: float,
+        window_overlap: float = 0.5) -> Tuple[np.ndarray, int]:
+    """
+    divides the time from the first take-off to the last landing into blocks, such that a rolling
+    window consists of a number of consecutive blocks.
+    :param in_air: the in air detector without margins.
+    :param window_seconds:
+    :param window_overlap: the overlap of consecutive windows as a fraction of the window. It is
+    rounded such that the window is an integer number of blocks.
+    :return: a tuple of an array of the start and end time of every block, and the number of
+    blocks per window.
+    """
+    blocks_per_window = max(1, int(round(1.0 / (1.0 - window_overlap))))
+    block_seconds = window_seconds / blocks_per_window
+    if not in_air.airtimes:
+        return np.zeros((0, 2)), blocks_per_window
+    start = in_air.airtimes[0].take_off
+    n_blocks = max(blocks_per_window,
+                   int(np.ceil((in_air.airtimes[-1].landing - start) / block_seconds)))
+    block_starts = start + block_seconds * np.arange(n_blocks)
+    return np.column_stack([block_starts, block_starts + block_seconds]), blocks_per_window
+
+
+def get_segment_blocks(in_air: InAirDetector) -> np.ndarray:
+    """
+    :param in_air: the in air detector without margins.
+    :return: an array of the take-off and landing time of every airborne segment.
+    """
+    return np.array([[airtime.take_off, airtime.landing] for airtime in in_air.airtimes],
+                    dtype=float).reshape(-1, 2)
+
+
+def calculate_windowed_metric_table(
+        metric_table: List[MetricTableEntry], data_sources: Dict[str, Tuple[dict, str]],
+        detectors: Dict[str, InAirDetector], statistics: Dict[str, WindowedStatistic],
+        block_times: np.ndarray, blocks_per_window: int,
+        min_coverage: float = 0.5) -> Dict[str, np.ndarray]:
+    """
+    calculates the metrics of a metric table per window of consecutive time blocks. Only the in
+    air samples of every block are used. The per block reductions are computed from cumulative
+    sums and with reduceat, and combined to windows with strided views of the blocks, without
+    slicing the data per window.
+    :param metric_table: a list of (data source, signal, detector, {statistic: metric name}).
+    :param data_sources: a dict of data source name to a tuple of (data, dataset).
+    :param detectors: a dict of detector name to in air detector.
+    :param statistics: a dict of statistic name to a windowed statistic.
+    :param block_times: an array of the start and end time of every non-overlapping block.
+    :param blocks_per_window:
+    :param min_coverage: windows with fewer in air samples than this fraction of the largest
+    number of samples in a window are set to nan.
+    :return: a dict of metric name to an array with the metric value of every window.
+    """
+    n_windows = max(0, len(block_times) - blocks_per_window + 1)
+
+    # group the table entries by data source and detector
+    groups = OrderedDict()
+    for data_source, signal, detector, metric_names in metric_table:
+        group = groups.setdefault((data_source, detector), OrderedDict())
+        group.setdefault(signal, dict()).update(metric_names)
+
+    metrics = dict()
+    for (data_source, detector), group in groups.items():
+        data, dataset = data_sources[data_source]
+        in_air_mask = detectors[detector].get_airtime_mask(dataset)
+        block_indices = np.searchsorted(
+            detectors[detector].get_log_time(dataset), block_times, side='left')
+        starts, stops = block_indices[:, 0], block_indices[:, 1]
+
+        # the number of in air samples per window
+        cumulative_count = np.concatenate([[0], np.cumsum(in_air_mask)])
+        window_count = get_window_sums(
+            cumulative_count[stops] - cumulative_count[starts], blocks_per_window)
+        is_covered = window_count > min_coverage * np.amax(window_count, initial=0)
+        is_covered &= window_count > 0
+
+        for signal, metric_names in group.items():
+            signal_data = np.asarray(data[signal], dtype=float)
+            for statistic, metric_name in metric_names.items():
+                reduction, transform = statistics[statistic]
+                values = signal_data if transform is None else transform(signal_data)
+                if reduction == 'mean':
+                    cumulative_sum = np.concatenate(
+                        [[0.0], np.cumsum(np.where(in_air_mask, values, 0.0))])
+                    window_values = get_window_sums(
+                        cumulative_sum[stops] - cumulative_sum[starts], blocks_per_window) / \
+                        np.maximum(window_count, 1)
+                elif reduction == 'max':
+                    window_values = get_window_maxima(
+                        np.where(in_air_mask, values, np.nan), starts, stops, blocks_per_window)
+                else:
+                    window_values = get_window_medians(
+                        np.where(in_air_mask, values, np.nan), starts, stops, blocks_per_window)
+                metrics[metric_name] = np.where(is_covered, window_values[:n_windows], np.nan)
+
+    return metrics
+
+
+def get_window_sums(block_sums: np.ndarray, blocks_per_window: int) -> np.ndarray:
+    """
+    :param block_sums: the sum of every block.
+    :param blocks_per_window:
+    :return: the sum of every window of consecutive blocks.
+    """
+    cumulative_sum = np.concatenate([[0], np.cumsum(block_sums)])
+    return cumulative_sum[blocks_per_window:] - cumulative_sum[:-blocks_per_window]
+
+
+def get_window_maxima(
+        values: np.ndarray, starts: np.ndarray, stops: np.ndarray,
+        blocks_per_window: int) -> np.ndarray:
+    """
+    :param values: the samples, nan for samples to ignore.
+    :param starts: the index of the first sample of every block.
+    :param stops: the index after the last sample of every block.
+    :param blocks_per_window:
+    :return: the maximum of every window of consecutive blocks, nan if it has no samples.
+    """
+    if len(starts) < blocks_per_window:
+        return np.zeros(0)
+    # reduce the blocks and the gaps in between, the appended nan terminates the last block
+    padded_values = np.append(values, np.nan)
+    boundaries = np.column_stack([starts, stops]).ravel()
+    block_maxima = np.fmax.reduceat(padded_values, boundaries)[::2]
+    # reduceat returns the sample at the start index for empty blocks
+    block_maxima[stops <= starts] = np.nan
+    return np.fmax.reduce(np.lib.stride_tricks.sliding_window_view(
+        block_maxima, blocks_per_window), axis=1)
+
+
+def get_window_medians(
+        values: np.ndarray, starts: np.ndarray, stops: np.ndarray,
+        blocks_per_window: int) -> np.ndarray:
+    """
+    :param values: the samples, nan for samples to ignore.
+    :param starts: the index of the first sample of every block.
+    :param stops: the index after the last sample of every block.
+    :param blocks_per_window:
+    :return: the median of every window of consecutive blocks, nan if it has no samples.
+    """
+    if len(starts) < blocks_per_window:
+        return np.zeros(0)
+    # gather the blocks into a nan padded matrix with one block per row
+    block_length = max(1, int(np.amax(stops - starts)))
+    indices = starts[:, np.newaxis] + np.arange(block_length)
+    padded_values = np.append(values, np.nan)
+    blocks = np.where(indices < stops[:, np.newaxis],
+                      padded_values[np.minimum(indices, len(values))], np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(blocks, blocks_per_window, axis=0)
+    with warnings.catch_warnings():
+        # windows without samples are nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(windows.reshape(len(windows), -1), axis=1)
+
+
+def get_worst_window_metrics(
+        windowed_metrics: Dict[str, np.ndarray], window_times: np.ndarray, suffix: str,
+        names: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    selects the worst, i.e. largest, value of every windowed metric and the time of its window.
+    :param windowed_metrics: a dict of metric name to an array with the value of every window.
+    :param window_times: the time of every window.
+    :param suffix: the suffix of the worst window metrics, e.g. '_worst_window'.
+    :param names: the metrics to select, all if None.
+    :return: a dict with the worst value as <name><suffix> and its time as <name><suffix>_time.
+    """
+    worst_metrics = dict()
+    for name, values in windowed_metrics.items():
+        if names is not None and name not in names:
+            continue
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0 or np.all(np.isnan(values)):
+            continue
+        worst = int(np.nanargmax(values))
+        worst_metrics['{:s}{:s}'.format(name, suffix)] = float(values[worst])
+        worst_metrics['{:s}{:s}_time'.format(name, suffix)] = round(float(window_times[worst]), 2)
+    return worst_metrics
+
+
+def get_sensor_metric_table(sensor_checks: List[str]) -> List[MetricTableEntry]:
+    """
+    :param sensor_checks:
+    :return: the metric table of the sensor checks that apply.
+    """
+
+    metric_table = list()
 
     # calculates peak, mean, percentage above 0.5 std, and percentage above std metrics for
     # estimator status variables
@@ -64,43 +413,73 @@ def calculate_sensor_metrics(
         if result_id in sensor_checks:
 
             if result_id == 'mag' or result_id == 'hgt':
-                in_air_detector = in_air_no_ground_effects
+                in_air_detector = 'in_air_no_ground_effects'
             else:
-                in_air_detector = in_air
+                in_air_detector = 'in_air'
+
+            metric_table.append(('estimator_status', signal, in_air_detector, {
+                'percentage_red': '{:s}_percentage_red'.format(result_id),
+                'percentage_amber': '{:s}_percentage_amber'.format(result_id),
+                'max': '{:s}_test_max'.format(result_id),
+                'mean': '{:s}_test_mean'.format(result_id)}))
+
+    return metric_table
+
+
+def finalize_sensor_metrics(
+        raw_metrics: Dict[str, float], sensor_checks: List[str]) -> Dict[str, float]:
+    """
+    derives the sensor metrics from the metrics of the sensor metric table. The raw metrics may
+    be arrays of windowed metrics.
+    :param raw_metrics:
+    :param sensor_checks:
+    :return:
+    """
+
+    sensor_metrics = dict()
+
+    for result_id in ['hgt', 'mag', 'vel', 'pos', 'tas', 'hagl']:
+
+        # only run sensor checks, if they apply.
+        if result_id in sensor_checks:
 
             # the percentage of samples above / below std dev
-            sensor_metrics['{:s}_percentage_red'.format(result_id)] = calculate_stat_from_signal(
-                estimator_status_data, 'estimator_status', signal, in_air_detector,
-                lambda x: 100.0 * np.mean(x > red_thresh))
-            sensor_metrics['{:s}_percentage_amber'.format(result_id)] = calculate_stat_from_signal(
-                estimator_status_data, 'estimator_status', signal, in_air_detector,
-                lambda x: 100.0 * np.mean(x > amb_thresh)) - \
+            sensor_metrics['{:s}_percentage_red'.format(result_id)] = raw_metrics[
+                '{:s}_percentage_red'.format(result_id)]
+            sensor_metrics['{:s}_percentage_amber'.format(result_id)] = raw_metrics[
+                '{:s}_percentage_amber'.format(result_id)] - \
                     sensor_metrics['{:s}_percentage_red'.format(result_id)]
 
             # the peak and mean ratio of samples above / below std dev
-            peak = calculate_stat_from_signal(
-                estimator_status_data, 'estimator_status', signal, in_air_detector, np.amax)
-            if peak > 0.0:
+            peak = raw_metrics['{:s}_test_max'.format(result_id)]
+            if np.any(peak > 0.0):
                 sensor_metrics['{:s}_test_max'.format(result_id)] = peak
-                sensor_metrics['{:s}_test_mean'.format(result_id)] = calculate_stat_from_signal(
-                    estimator_status_data, 'estimator_status', signal,
-                    in_air_detector, np.mean)
+                sensor_metrics['{:s}_test_mean'.format(result_id)] = raw_metrics[
+                    '{:s}_test_mean'.format(result_id)]
 
     return sensor_metrics
 
 
-def calculate_innov_fail_metrics(
-        innov_flags: dict, innov_fail_checks: List[str], in_air: InAirDetector,
-        in_air_no_ground_effects: InAirDetector) -> dict:
+def calculate_sensor_metrics(
+        ulog: ULog, sensor_checks: List[str], in_air: InAirDetector,
+        in_air_no_ground_effects: InAirDetector, red_thresh: float = 1.0,
+        amb_thresh: float = 0.5) -> Dict[str, float]:
+
+    raw_metrics = calculate_metric_table(
+        get_sensor_metric_table(sensor_checks), get_metric_data_sources(ulog),
+        {'in_air': in_air, 'in_air_no_ground_effects': in_air_no_ground_effects},
+        get_metric_statistics(red_thresh=red_thresh, amb_thresh=amb_thresh))
+
+    return finalize_sensor_metrics(raw_metrics, sensor_checks)
+
+
+def get_innov_fail_metric_table(innov_fail_checks: List[str]) -> List[MetricTableEntry]:
     """
-    :param innov_flags:
     :param innov_fail_checks:
-    :param in_air:
-    :param in_air_no_ground_effects:
-    :return:
+    :return: the metric table of the innovation fail checks that apply.
     """
 
-    innov_fail_metrics = dict()
+    metric_table = list()
 
     # calculate innovation check fail metrics
     for signal_id, signal, result in [('posv', 'posv_innov_fail', 'hgt_fail_percentage'),
@@ -120,56 +499,120 @@ def calculate_innov_fail_metrics(
 
             if signal_id.startswith('mag') or signal_id == 'yaw' or signal_id == 'posv' or \
                 signal_id.startswith('of'):
-                in_air_detector = in_air_no_ground_effects
+                in_air_detector = 'in_air_no_ground_effects'
             else:
-                in_air_detector = in_air
+                in_air_detector = 'in_air'
 
-            innov_fail_metrics[result] = calculate_stat_from_signal(
-                innov_flags, 'estimator_status', signal, in_air_detector,
-                lambda x: 100.0 * np.mean(x > 0.5))
+            metric_table.append(
+                ('innov_flags', signal, in_air_detector, {'percentage_failed': result}))
 
-    return innov_fail_metrics
+    return metric_table
 
 
-def calculate_imu_metrics(
-        ulog: ULog, in_air_no_ground_effects: InAirDetector) -> dict:
+def finalize_innov_fail_metrics(
+        raw_metrics: Dict[str, float], innov_fail_checks: List[str]) -> Dict[str, float]:
+    """
+    selects the innovation fail metrics from the metrics of the innovation fail metric table.
+    :param raw_metrics:
+    :param innov_fail_checks:
+    :return:
+    """
+    return {
+        metric_names['percentage_failed']: raw_metrics[metric_names['percentage_failed']]
+        for _, _, _, metric_names in get_innov_fail_metric_table(innov_fail_checks)}
 
-    ekf2_innovation_data = ulog.get_dataset('ekf2_innovations').data
 
-    estimator_status_data = ulog.get_dataset('estimator_status').data
+def calculate_innov_fail_metrics(
+        innov_flags: dict, innov_fail_checks: List[str], in_air: InAirDetector,
+        in_air_no_ground_effects: InAirDetector) -> dict:
+    """
+    :param innov_flags:
+    :param innov_fail_checks:
+    :param in_air:
+    :param in_air_no_ground_effects:
+    :return:
+    """
 
-    imu_metrics = dict()
+    raw_metrics = calculate_metric_table(
+        get_innov_fail_metric_table(innov_fail_checks),
+        {'innov_flags': (innov_flags, 'estimator_status')},
+        {'in_air': in_air, 'in_air_no_ground_effects': in_air_no_ground_effects},
+        get_metric_statistics())
+
+    return finalize_innov_fail_metrics(raw_metrics, innov_fail_checks)
+
+
+def get_imu_metric_table() -> List[MetricTableEntry]:
+    """
+    :return: the metric table of the imu checks.
+    """
+
+    metric_table = list()
 
     # calculates the median of the output tracking error ekf innovations
     for signal, result in [('output_tracking_error[0]', 'output_obs_ang_err_median'),
                            ('output_tracking_error[1]', 'output_obs_vel_err_median'),
                            ('output_tracking_error[2]', 'output_obs_pos_err_median')]:
-        imu_metrics[result] = calculate_stat_from_signal(
-            ekf2_innovation_data, 'ekf2_innovations', signal, in_air_no_ground_effects, np.median)
+        metric_table.append(
+            ('ekf2_innovations', signal, 'in_air_no_ground_effects', {'median': result}))
 
     # calculates peak and mean for IMU vibration checks
     for signal, result in [('vibe[0]', 'imu_coning'),
                            ('vibe[1]', 'imu_hfdang'),
                            ('vibe[2]', 'imu_hfdvel')]:
-        peak = calculate_stat_from_signal(
-            estimator_status_data, 'estimator_status', signal, in_air_no_ground_effects, np.amax)
-        if peak > 0.0:
+        metric_table.append(('estimator_status', signal, 'in_air_no_ground_effects', {
+            'max': '{:s}_peak'.format(result), 'mean': '{:s}_mean'.format(result)}))
+
+    # IMU bias checks: the median of every bias state
+    for signal in ['states[10]', 'states[11]', 'states[12]',
+                   'states[13]', 'states[14]', 'states[15]']:
+        metric_table.append(('estimator_status', signal, 'in_air_no_ground_effects', {
+            'median': '{:s}_median'.format(signal)}))
+
+    return metric_table
+
+
+def finalize_imu_metrics(raw_metrics: Dict[str, float]) -> Dict[str, float]:
+    """
+    derives the imu metrics from the metrics of the imu metric table. The raw metrics may be
+    arrays of windowed metrics.
+    :param raw_metrics:
+    :return:
+    """
+
+    imu_metrics = dict()
+
+    for result in ['output_obs_ang_err_median', 'output_obs_vel_err_median',
+                   'output_obs_pos_err_median']:
+        imu_metrics[result] = raw_metrics[result]
+
+    for result in ['imu_coning', 'imu_hfdang', 'imu_hfdvel']:
+        peak = raw_metrics['{:s}_peak'.format(result)]
+        if np.any(peak > 0.0):
             imu_metrics['{:s}_peak'.format(result)] = peak
-            imu_metrics['{:s}_mean'.format(result)] = calculate_stat_from_signal(
-                estimator_status_data, 'estimator_status', signal,
-                in_air_no_ground_effects, np.mean)
+            imu_metrics['{:s}_mean'.format(result)] = raw_metrics['{:s}_mean'.format(result)]
 
     # IMU bias checks
-    imu_metrics['imu_dang_bias_median'] = np.sqrt(np.sum([np.square(calculate_stat_from_signal(
-        estimator_status_data, 'estimator_status', signal, in_air_no_ground_effects, np.median))
-        for signal in ['states[10]', 'states[11]', 'states[12]']]))
-    imu_metrics['imu_dvel_bias_median'] = np.sqrt(np.sum([np.square(calculate_stat_from_signal(
-        estimator_status_data, 'estimator_status', signal, in_air_no_ground_effects, np.median))
-        for signal in ['states[13]', 'states[14]', 'states[15]']]))
+    imu_metrics['imu_dang_bias_median'] = np.sqrt(np.sum([np.square(
+        raw_metrics['{:s}_median'.format(signal)])
+        for signal in ['states[10]', 'states[11]', 'states[12]']], axis=0))
+    imu_metrics['imu_dvel_bias_median'] = np.sqrt(np.sum([np.square(
+        raw_metrics['{:s}_median'.format(signal)])
+        for signal in ['states[13]', 'states[14]', 'states[15]']], axis=0))
 
     return imu_metrics
 
 
+def calculate_imu_metrics(
+        ulog: ULog, in_air_no_ground_effects: InAirDetector) -> dict:
+
+    raw_metrics = calculate_metric_table(
+        get_imu_metric_table(), get_metric_data_sources(ulog),
+        {'in_air_no_ground_effects': in_air_no_ground_effects}, get_metric_statistics())
+
+    return finalize_imu_metrics(raw_metrics)
+
+
 def calculate_stat_from_signal(
         data: Dict[str, np.ndarray], dataset: str, variable: str,
         in_air_det: InAirDetector, stat_function: Callable) -> float:
@@ -180,4 +623,7 @@ def calculate_stat_from_signal(
     :return:
     """
 
-    return stat_function(data[variable][in_air_det.get_airtime(dataset)])
+    return stat_function(in_air_det.get_airtime_data(data[variable], dataset))
+
+
+register_topic_requirements('analysis.metrics', get_metric_topic_requirements())
@@ -3,9 +3,70 @@
 function collection for post-processing of ulog data.
 """
 
-from typing import Tuple
+from typing import Tuple, List, Dict
+import weakref
 
 import numpy as np
+from pyulog import ULog
+
+from analysis.topic_requirements import register_topic_requirements
+
+register_topic_requirements('analysis.check_flags', {'estimator_status': [
+    'control_mode_flags', 'innovation_check_flags', 'gps_check_fail_flags']})
+
+
+# extract control mode metadata from estimator_status.control_mode_flags
+CONTROL_MODE_FLAGS = [
+    (0, 'tilt_aligned'),  # true if the filter tilt alignment is complete
+    (1, 'yaw_aligned'),  # true if the filter yaw alignment is complete
+    (2, 'using_gps'),  # true if GPS measurements are being fused
+    (3, 'using_optflow'),  # true if optical flow measurements are being fused
+    (4, 'using_magyaw'),  # true if a simple magnetic yaw heading is being fused
+    (5, 'using_mag3d'),  # true if 3-axis magnetometer measurement are being fused
+    (6, 'using_magdecl'),  # true if synthetic magnetic declination measurements are being fused
+    (7, 'airborne'),  # true when the vehicle is airborne
+    (8, 'estimating_wind'),  # true when wind velocity is being estimated
+    (9, 'using_barohgt'),  # true when baro height is being fused as a primary height reference
+    (10, 'using_rnghgt'),  # true when range finder height is being fused as a primary height reference
+    (11, 'using_gpshgt'),  # true when range finder height is being fused as a primary height reference
+    (12, 'using_evpos'),  # true when local position data from external vision is being fused
+    (13, 'using_evyaw'),  # true when yaw data from external vision measurements is being fused
+    (14, 'using_evhgt'),  # true when height data from external vision measurements is being fused
+]
+
+# innovation_check_flags summary
+INNOVATION_CHECK_FLAGS = [
+    (0, 'vel_innov_fail'),  # true if velocity observations have been rejected
+    (1, 'posh_innov_fail'),  # true if horizontal position observations have been rejected
+    (2, 'posv_innov_fail'),  # true if true if vertical position observations have been rejected
+    (3, 'magx_innov_fail'),  # true if the X magnetometer observation has been rejected
+    (4, 'magy_innov_fail'),  # true if the Y magnetometer observation has been rejected
+    (5, 'magz_innov_fail'),  # true if the Z magnetometer observation has been rejected
+    (6, 'yaw_innov_fail'),  # true if the yaw observation has been rejected
+    (7, 'tas_innov_fail'),  # true if the airspeed observation has been rejected
+    (8, 'sli_innov_fail'),  # true if synthetic sideslip observation has been rejected
+    (9, 'hagl_innov_fail'),  # true if the height above ground observation has been rejected
+    (10, 'ofx_innov_fail'),  # true if the X optical flow observation has been rejected
+    (11, 'ofy_innov_fail'),  # true if the Y optical flow observation has been rejected
+]
+
+# gps_check_fail_flags summary
+GPS_CHECK_FAIL_FLAGS = [
+    (0, 'gfix_fail'),  # insufficient fix type (no 3D solution)
+    (1, 'nsat_fail'),  # minimum required sat count fail
+    (2, 'gdop_fail'),  # minimum required GDoP fail
+    (3, 'herr_fail'),  # maximum allowed horizontal position error fail
+    (4, 'verr_fail'),  # maximum allowed vertical position error fail
+    (5, 'serr_fail'),  # maximum allowed speed error fail
+    (6, 'hdrift_fail'),  # maximum allowed horizontal position drift fail
+    (7, 'vdrift_fail'),  # maximum allowed vertical position drift fail
+    (8, 'hspd_fail'),  # maximum allowed horizontal speed fail
+    (9, 'veld_diff_fail'),  # maximum allowed vertical velocity discrepancy fail
+]
+
+# the decoded estimator check flags of every ULog, shared by the analysis and the pdf report. ULog
+# objects are not hashable, thus the cache is keyed by their id and cleared on finalization.
+_estimator_check_flags_cache = dict()  # type: Dict[int, Tuple[dict, dict, dict]]
 
 
 def get_estimator_check_flags(estimator_status: dict) -> Tuple[dict, dict, dict]:
@@ -19,45 +80,52 @@ def get_estimator_check_flags(estimator_status: dict) -> Tuple[dict, dict, dict]
     return control_mode, innov_flags, gps_fail_flags
 
 
+def get_ulog_estimator_check_flags(ulog: ULog) -> Tuple[dict, dict, dict]:
+    """
+    returns the estimator check flags of a ULog. The flags are decoded once per ULog and cached.
+    :param ulog:
+    :return:
+    """
+    key = id(ulog)
+    if key not in _estimator_check_flags_cache:
+        _estimator_check_flags_cache[key] = get_estimator_check_flags(
+            ulog.get_dataset('estimator_status').data)
+        weakref.finalize(ulog, _estimator_check_flags_cache.pop, key, None)
+    return _estimator_check_flags_cache[key]
+
+
+def decode_bitfield(field: np.ndarray, n_bits: int) -> np.ndarray:
+    """
+    unpacks the bits of an unsigned integer field in a single pass.
+    :param field: an array of N unsigned integers.
+    :param n_bits: the number of least significant bits to unpack.
+    :return: an (N, n_bits) uint8 matrix whose column k holds bit k of the field.
+    """
+    field = np.asarray(field)
+    itemsize = field.dtype.itemsize
+    field_bytes = np.ascontiguousarray(
+        field, dtype='<u{:d}'.format(itemsize)).view(np.uint8).reshape(-1, itemsize)
+    return np.unpackbits(field_bytes, axis=1, bitorder='little')[:, :n_bits]
+
+
+def get_bitfield_flags(field: np.ndarray, flag_table: List[Tuple[int, str]]) -> dict:
+    """
+    decodes the flags of a bitfield according to a table of bits and flag names.
+    :param field:
+    :param flag_table: a list of (bit, flag name)
+    :return: a dict of flag name to an array of 0 and 1 for every flag in the table.
+    """
+    # view as int8 such that differences of the flags stay signed
+    bits = decode_bitfield(field, max(bit for bit, _ in flag_table) + 1).view(np.int8)
+    return {name: bits[:, bit] for bit, name in flag_table}
+
+
 def get_control_mode_flags(estimator_status: dict) -> dict:
     """
     :param estimator_status:
     :return:
     """
-
-    control_mode = dict()
-    # extract control mode metadata from estimator_status.control_mode_flags
-    # 0 - true if the filter tilt alignment is complete
-    # 1 - true if the filter yaw alignment is complete
-    # 2 - true if GPS measurements are being fused
-    # 3 - true if optical flow measurements are being fused
-    # 4 - true if a simple magnetic yaw heading is being fused
-    # 5 - true if 3-axis magnetometer measurement are being fused
-    # 6 - true if synthetic magnetic declination measurements are being fused
-    # 7 - true when the vehicle is airborne
-    # 8 - true when wind velocity is being estimated
-    # 9 - true when baro height is being fused as a primary height reference
-    # 10 - true when range finder height is being fused as a primary height reference
-    # 11 - true when range finder height is being fused as a primary height reference
-    # 12 - true when local position data from external vision is being fused
-    # 13 - true when yaw data from external vision measurements is being fused
-    # 14 - true when height data from external vision measurements is being fused
-    control_mode['tilt_aligned'] = ((2 ** 0 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['yaw_aligned'] = ((2 ** 1 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_gps'] = ((2 ** 2 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_optflow'] = ((2 ** 3 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_magyaw'] = ((2 ** 4 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_mag3d'] = ((2 ** 5 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_magdecl'] = ((2 ** 6 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['airborne'] = ((2 ** 7 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['estimating_wind'] = ((2 ** 8 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_barohgt'] = ((2 ** 9 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_rnghgt'] = ((2 ** 10 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_gpshgt'] = ((2 ** 11 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_evpos'] = ((2 ** 12 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_evyaw'] = ((2 ** 13 & estimator_status['control_mode_flags']) > 0) * 1
-    control_mode['using_evhgt'] = ((2 ** 14 & estimator_status['control_mode_flags']) > 0) * 1
-    return control_mode
+    return get_bitfield_flags(estimator_status['control_mode_flags'], CONTROL_MODE_FLAGS)
 
 
 def get_innovation_check_flags(estimator_status: dict) -> dict:
@@ -65,34 +133,7 @@ def get_innovation_check_flags(estimator_status: dict) -> dict:
     :param estimator_status:
     :return:
     """
-
-    innov_flags = dict()
-    # innovation_check_flags summary
-    # 0 - true if velocity observations have been rejected
-    # 1 - true if horizontal position observations have been rejected
-    # 2 - true if true if vertical position observations have been rejected
-    # 3 - true if the X magnetometer observation has been rejected
-    # 4 - true if the Y magnetometer observation has been rejected
-    # 5 - true if the Z magnetometer observation has been rejected
-    # 6 - true if the yaw observation has been rejected
-    # 7 - true if the airspeed observation has been rejected
-    # 8 - true if synthetic sideslip observation has been rejected
-    # 9 - true if the height above ground observation has been rejected
-    # 10 - true if the X optical flow observation has been rejected
-    # 11 - true if the Y optical flow observation has been rejected
-    innov_flags['vel_innov_fail'] = ((2 ** 0 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['posh_innov_fail'] = ((2 ** 1 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['posv_innov_fail'] = ((2 ** 2 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['magx_innov_fail'] = ((2 ** 3 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['magy_innov_fail'] = ((2 ** 4 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['magz_innov_fail'] = ((2 ** 5 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['yaw_innov_fail'] = ((2 ** 6 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['tas_innov_fail'] = ((2 ** 7 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['sli_innov_fail'] = ((2 ** 8 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['hagl_innov_fail'] = ((2 ** 9 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['ofx_innov_fail'] = ((2 ** 10 & estimator_status['innovation_check_flags']) > 0) * 1
-    innov_flags['ofy_innov_fail'] = ((2 ** 11 & estimator_status['innovation_check_flags']) > 0) * 1
-    return innov_flags
+    return get_bitfield_flags(estimator_status['innovation_check_flags'], INNOVATION_CHECK_FLAGS)
 
 
 def get_gps_check_fail_flags(estimator_status: dict) -> dict:
@@ -100,29 +141,7 @@ def get_gps_check_fail_flags(estimator_status: dict) -> dict:
     :param estimator_status:
     :return:
     """
-    gps_fail_flags = dict()
-
-    # 0 : insufficient fix type (no 3D solution)
-    # 1 : minimum required sat count fail
-    # 2 : minimum required GDoP fail
-    # 3 : maximum allowed horizontal position error fail
-    # 4 : maximum allowed vertical position error fail
-    # 5 : maximum allowed speed error fail
-    # 6 : maximum allowed horizontal position drift fail
-    # 7 : maximum allowed vertical position drift fail
-    # 8 : maximum allowed horizontal speed fail
-    # 9 : maximum allowed vertical velocity discrepancy fail
-    gps_fail_flags['gfix_fail'] = ((2 ** 0 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['nsat_fail'] = ((2 ** 1 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['gdop_fail'] = ((2 ** 2 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['herr_fail'] = ((2 ** 3 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['verr_fail'] = ((2 ** 4 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['serr_fail'] = ((2 ** 5 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['hdrift_fail'] = ((2 ** 6 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['vdrift_fail'] = ((2 ** 7 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['hspd_fail'] = ((2 ** 8 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    gps_fail_flags['veld_diff_fail'] = ((2 ** 9 & estimator_status['gps_check_fail_flags']) > 0) * 1
-    return gps_fail_flags
+    return get_bitfield_flags(estimator_status['gps_check_fail_flags'], GPS_CHECK_FAIL_FLAGS)
 
 
 def magnetic_field_estimates_from_status(estimator_status: dict) -> Tuple[float, float, float]:
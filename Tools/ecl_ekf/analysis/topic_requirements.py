@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+"""
+registry of the ulog topics and fields required by the analysis stages and plots. The loader
+passes the union of the requirements as message filter to pyulog and drops unneeded fields.
+"""
+
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from pyulog import ULog
+
+from ulog_cache import open_ulog, CachedULog
+
+
+# stage name -> topic name -> field names
+_topic_requirements = dict()  # type: Dict[str, Dict[str, Set[str]]]
+
+
+def register_topic_requirements(stage: str, requirements: Dict[str, List[str]]) -> None:
+    """
+    declares the topics and fields a stage accesses. The timestamp field is always required.
+    :param stage: the stage name, e.g. 'analysis.metrics' or 'pdf_report.innovations'.
+    :param requirements: a dict of topic name to a list of field names.
+    :return:
+    """
+    stage_requirements = _topic_requirements.setdefault(stage, dict())
+    for topic, fields in requirements.items():
+        stage_requirements.setdefault(topic, {'timestamp'}).update(fields)
+
+
+def get_topic_requirements(stages: Optional[List[str]] = None) -> Dict[str, Set[str]]:
+    """
+    returns the union of the requirements of the specified stages.
+    :param stages: a list of stage names or stage name prefixes, e.g. 'pdf_report' selects all
+    'pdf_report.*' stages. All stages are selected if None.
+    :return: a dict of topic name to the set of required field names.
+    """
+    requirements = dict()  # type: Dict[str, Set[str]]
+    for stage, stage_requirements in _topic_requirements.items():
+        if stages is not None and not any(
+                stage == prefix or stage.startswith('{:s}.'.format(prefix)) for prefix in stages):
+            continue
+        for topic, fields in stage_requirements.items():
+            requirements.setdefault(topic, set()).update(fields)
+    return requirements
+
+
+def load_ulog(filename: str, stages: Optional[List[str]] = None,
+              cache_directory: Optional[str] = None) -> ULog:
+    """
+    loads only the topics required by the specified stages from a ulog file and drops the fields
+    that are not required.
+    :param filename:
+    :param stages: see get_topic_requirements.
+    :param cache_directory: the ulog cache to open the log from, see ulog_cache.open_ulog.
+    :return:
+    """
+    requirements = get_topic_requirements(stages)
+
+    ulog = open_ulog(filename, list(requirements.keys()), cache_directory=cache_directory)
+    if isinstance(ulog, CachedULog):
+        # the cached fields are memory mapped and only read when accessed
+        return ulog
+
+    for dataset in ulog.data_list:
+        fields = requirements.get(dataset.name)
+        if fields is None or set(dataset.data.keys()) <= fields:
+            continue
+        # copy the required fields, such that the buffer holding all fields can be released
+        dataset.data = {
+            name: np.array(value) for name, value in dataset.data.items() if name in fields}
+        dataset.field_data = [
+            field for field in dataset.field_data if field.field_name in fields]
+
+    return ulog
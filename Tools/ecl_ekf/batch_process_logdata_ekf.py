@@ -1,14 +1,29 @@
 #! /usr/bin/env python3
 """
-Runs process_logdata_ekf.py on the .ulg files in the supplied directory. ulog files are skipped from the analysis, if a
- corresponding .pdf file already exists (unless the overwrite flag was set).
+Runs process_logdata_ekf.py on the .ulg files in the supplied directory. ulog files are skipped from the analysis, if
+ they are recorded as analysed in the batch manifest with an unchanged size, modification time and check table
+ version, or if a corresponding .pdf file already exists (unless the overwrite flag was set).
 """
 # -*- coding: utf-8 -*-
 
 import argparse
 import os, glob
+import csv
+import json
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from process_logdata_ekf import process_logdata_ekf
+from results_store import RESULTS_STORE_FILENAME
+from stage_profiler import PROFILE_SUFFIX, aggregate_profiles
+
+MANIFEST_FILENAME = 'ecl_ekf_manifest.jsonl'
+SUMMARY_FILENAME = 'ecl_ekf_batch_summary.csv'
+PROFILE_FILENAME = 'ecl_ekf_batch_profile.json'
 
 def get_arguments():
     parser = argparse.ArgumentParser(description='Analyse the estimator_status and ekf2_innovation message data for the'
@@ -26,9 +41,270 @@ def get_arguments():
     parser.add_argument('--no-sensor-safety-margin', action='store_true',
                         help='Whether to not cut-off 5s after take-off and 5s before landing '
                              '(for certain sensors that might be influence by proximity to ground).')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='The number of worker processes used to analyse the log files in parallel.')
+    parser.add_argument('--worker-memory-limit', type=int, default=None,
+                        help='The maximum address space of a worker process in MB. A log file that exceeds it '
+                             'is recorded as failed.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='The json file used to record the analysed log files. Defaults to {:s} in the '
+                             'specified directory.'.format(MANIFEST_FILENAME))
+    parser.add_argument('--results-store', type=str, default=None,
+                        help='The sqlite results store the test results are appended to. Defaults to {:s} in '
+                             'the specified directory.'.format(RESULTS_STORE_FILENAME))
+    parser.add_argument('--no-mdat-csv', action='store_true',
+                        help='Whether to not write the test results to a <file>.mdat.csv file per log file.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Whether to record the wall time, cpu time and peak memory of every analysis stage per '
+                             'log file and aggregate them over the batch in {:s}.'.format(PROFILE_FILENAME))
     return parser.parse_args()
 
 
+def get_check_table_version(check_level_dict_filename: str, check_table_filename: str) -> str:
+    """
+    computes a version string of the check thresholds and the check table. A change to either file
+    invalidates the entries of the manifest.
+    :param check_level_dict_filename:
+    :param check_table_filename:
+    :return: the hex digest of the contents of both files.
+    """
+    sha = hashlib.sha1()
+    for filename in [check_level_dict_filename, check_table_filename]:
+        with open(filename, 'rb') as file:
+            sha.update(file.read())
+    return sha.hexdigest()
+
+
+def get_file_key(ulog_file: str) -> Dict[str, float]:
+    """
+    returns the size and the modification time that identify the content of a log file.
+    :param ulog_file:
+    :return:
+    """
+    stat = os.stat(ulog_file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_manifest(manifest_filename: str) -> Dict[str, dict]:
+    """
+    loads the manifest of analysed log files, a json lines file with an entry per analysed log file
+    in which a later entry of a log file replaces the earlier ones. A line cut short by an
+    interrupted run is ignored. Returns an empty manifest if the file does not exist.
+    :param manifest_filename:
+    :return: a dict of the absolute log file name to its entry.
+    """
+    manifest = dict()
+    try:
+        with open(manifest_filename, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    manifest[entry.pop('filename')] = entry
+                except (ValueError, KeyError, AttributeError):
+                    continue
+    except OSError:
+        pass
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, dict], manifest_filename: str) -> None:
+    """
+    writes the manifest compacted to one entry per log file. The file is replaced atomically, such
+    that an interrupted run never loses the entries.
+    :param manifest:
+    :param manifest_filename:
+    :return:
+    """
+    tmp_filename = '{:s}.tmp'.format(manifest_filename)
+    with open(tmp_filename, 'w') as file:
+        for filename in sorted(manifest):
+            append_manifest_entry(file, filename, manifest[filename])
+    os.replace(tmp_filename, manifest_filename)
+
+
+def append_manifest_entry(file, filename: str, entry: Dict[str, object]) -> None:
+    """
+    appends the entry of a log file to the open manifest, such that a batch run writes every
+    entry once instead of rewriting the whole manifest per log file.
+    :param file: the manifest opened for appending.
+    :param filename: the absolute log file name.
+    :param entry:
+    :return:
+    """
+    file.write(json.dumps(dict(entry, filename=filename), sort_keys=True) + '\n')
+    file.flush()
+
+
+def is_analysed(
+        ulog_file: str, manifest: Dict[str, dict], check_table_version: str, plot: bool) -> bool:
+    """
+    checks whether a log file has been analysed before with the same content and check table.
+    :param ulog_file:
+    :param manifest:
+    :param check_table_version:
+    :param plot: whether the pdf report is required as well.
+    :return:
+    """
+    entry = manifest.get(os.path.abspath(ulog_file))
+    if entry is None:
+        # fall back to the pdf report of runs without manifest
+        return plot and os.path.exists('{}.pdf'.format(ulog_file))
+
+    file_key = get_file_key(ulog_file)
+    return entry['status'] == 'ok' and entry['size'] == file_key['size'] and \
+           entry['mtime'] == file_key['mtime'] and \
+           entry['check_table_version'] == check_table_version and \
+           (entry['plot'] or not plot)
+
+
+def init_worker(memory_limit_mb: Optional[int]) -> None:
+    """
+    initializes a worker process and limits its address space.
+    :param memory_limit_mb:
+    :return:
+    """
+    if memory_limit_mb is not None:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def analyse_file(job: Tuple[str, str, str, bool, bool, str, bool, bool]) -> Dict[str, object]:
+    """
+    analyses a single log file and records the wall time and outcome.
+    :param job: a tuple of (ulog_file, check_level_dict_filename, check_table_filename, plot,
+    sensor_safety_margins, results_store_filename, mdat_csv, profile)
+    :return: a result entry for the manifest and the summary, with the stage profile if profiled.
+    """
+    ulog_file, check_level_dict_filename, check_table_filename, plot, sensor_safety_margins, \
+        results_store_filename, mdat_csv, profile = job
+    start_time = time.time()
+    file_key = get_file_key(ulog_file)
+    try:
+        test_results = process_logdata_ekf(
+            ulog_file, check_level_dict_filename, check_table_filename,
+            plot=plot, sensor_safety_margins=sensor_safety_margins,
+            results_store_filename=results_store_filename, mdat_csv=mdat_csv, profile=profile)
+        status = 'ok'
+        error = ''
+        master_status = test_results['master_status'][0]
+    except MemoryError:
+        status = 'failed'
+        error = 'worker memory limit exceeded'
+        master_status = ''
+    except Exception as e:
+        status = 'failed'
+        error = str(e)
+        master_status = ''
+
+    result = {'filename': ulog_file, 'size': file_key['size'], 'mtime': file_key['mtime'],
+              'status': status, 'error': error, 'master_status': master_status,
+              'wall_time': time.time() - start_time, 'plot': plot}
+    if profile and status == 'ok':
+        with open('{:s}{:s}'.format(ulog_file, PROFILE_SUFFIX), 'r') as file:
+            result['profile'] = json.load(file)
+    return result
+
+
+def analyse_files(
+        jobs: List[tuple], n_workers: int, memory_limit_mb: Optional[int]) -> Iterator[Dict[str, object]]:
+    """
+    analyses the log files in a pool of worker processes and yields the result of every file as it
+    completes. If a worker process dies, e.g. by a segmentation fault or the kernel OOM killer, the
+    files in progress are analysed again one at a time, such that the file that kills its worker is
+    recorded as failed and the batch continues with a new pool.
+    :param jobs: the jobs of analyse_file.
+    :param n_workers:
+    :param memory_limit_mb: the address space limit of a worker process.
+    :return:
+    """
+    pending = deque(jobs)
+    suspects = deque()
+    while pending or suspects:
+        isolated = bool(suspects)
+        queue = suspects if isolated else pending
+        max_running = 1 if isolated else n_workers
+        executor = ProcessPoolExecutor(
+            max_workers=max_running, initializer=init_worker, initargs=(memory_limit_mb,))
+        # only as many files as workers are submitted, such that the files in progress are known
+        # when the pool breaks
+        running = dict()
+        try:
+            while queue or running:
+                while queue and len(running) < max_running:
+                    job = queue.popleft()
+                    running[executor.submit(analyse_file, job)] = (job, time.time())
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                try:
+                    for future in done:
+                        result = future.result()
+                        del running[future]
+                        yield result
+                except BrokenProcessPool:
+                    if isolated:
+                        job, start_time = running.pop(future)
+                        yield get_died_result(job, time.time() - start_time)
+                    else:
+                        suspects.extend(job for job, _ in running.values())
+                        running.clear()
+                    break
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+def get_died_result(job: tuple, wall_time: float) -> Dict[str, object]:
+    """
+    :param job: the job of analyse_file whose worker process died.
+    :param wall_time:
+    :return: the failed result entry of the log file.
+    """
+    ulog_file, plot = job[0], job[3]
+    file_key = get_file_key(ulog_file)
+    return {'filename': ulog_file, 'size': file_key['size'], 'mtime': file_key['mtime'],
+            'status': 'failed', 'error': 'worker process died', 'master_status': '',
+            'wall_time': wall_time, 'plot': plot}
+
+
+def write_summary(results: List[Dict[str, object]], summary_filename: str) -> None:
+    """
+    writes the per-file wall time and failures of a batch run to a csv file.
+    :param results:
+    :param summary_filename:
+    :return:
+    """
+    with open(summary_filename, 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow(['filename', 'status', 'master_status', 'wall_time', 'error'])
+        for result in sorted(results, key=lambda r: r['wall_time'], reverse=True):
+            writer.writerow([result['filename'], result['status'], result['master_status'],
+                             '{:.3f}'.format(result['wall_time']), result['error']])
+
+
+def write_profile(results: List[Dict[str, object]], profile_filename: str) -> None:
+    """
+    aggregates the stage profiles of the analysed log files, writes them to a json file and prints
+    a table of the stages.
+    :param results:
+    :param profile_filename:
+    :return:
+    """
+    profiles = [result['profile'] for result in results if 'profile' in result]
+    aggregate = aggregate_profiles(profiles)
+    with open(profile_filename, 'w') as file:
+        json.dump({'n_files': len(profiles), 'stages': aggregate}, file, indent=2)
+
+    print('{:<20s} {:>10s} {:>10s} {:>10s} {:>10s} {:>12s}'.format(
+        'stage', 'wall sum', 'wall p95', 'cpu sum', 'cpu p95', 'peak rss max'))
+    for name, stage in aggregate.items():
+        peak_rss = stage.get('peak_rss_mb')
+        print('{:<20s} {:>9.2f}s {:>9.2f}s {:>9.2f}s {:>9.2f}s {:>10s}'.format(
+            name, stage['wall_time']['sum'], stage['wall_time']['p95'], stage['cpu_time']['sum'],
+            stage['cpu_time']['p95'],
+            '{:.0f}MB'.format(peak_rss['max']) if peak_rss is not None else '-'))
+
+
 def main() -> None:
 
     args = get_arguments()
@@ -47,41 +323,85 @@ def main() -> None:
 
     ulog_directory = args.directory_path
 
+    if args.manifest is not None:
+        manifest_filename = args.manifest
+    else:
+        manifest_filename = os.path.join(ulog_directory, MANIFEST_FILENAME)
+
+    if args.results_store is not None:
+        results_store_filename = args.results_store
+    else:
+        results_store_filename = os.path.join(ulog_directory, RESULTS_STORE_FILENAME)
+
+    # the entries appended by earlier runs are compacted once per run
+    manifest = load_manifest(manifest_filename)
+    save_manifest(manifest, manifest_filename)
+    check_table_version = get_check_table_version(check_level_dict_filename, check_table_filename)
+    plot = not args.no_plots
+
     # get all the ulog files found in the specified directory and in subdirectories
     ulog_files = glob.glob(os.path.join(ulog_directory, '**/*.ulg'), recursive=True)
     print("found {:d} .ulg files in {:s}".format(len(ulog_files), ulog_directory))
 
-    # remove the files already analysed unless the overwrite flag was specified. A ulog file is consired to be analysed if
-    # a corresponding .pdf file exists.'
+    # remove the files already analysed unless the overwrite flag was specified. A ulog file is
+    # considered to be analysed if it is recorded in the manifest with the same size, modification
+    # time and check table version, or if a corresponding .pdf file exists.
     if not args.overwrite:
         print("skipping already analysed ulg files.")
         ulog_files = [ulog_file for ulog_file in ulog_files if
-                      not os.path.exists('{}.pdf'.format(ulog_file))]
+                      not is_analysed(ulog_file, manifest, check_table_version, plot)]
 
     n_files = len(ulog_files)
 
     print("analysing the {:d} .ulg files".format(n_files))
 
+    jobs = [(ulog_file, check_level_dict_filename, check_table_filename, plot,
+             not args.no_sensor_safety_margin, results_store_filename, not args.no_mdat_csv,
+             args.profile) for ulog_file in ulog_files]
+
+    # the files are analysed in worker processes also with a single worker, such that the memory
+    # limit applies to the workers and not to the batch, and a crash does not end the batch
+    result_iterator = analyse_files(jobs, max(args.workers, 1), args.worker_memory_limit)
+
     i = 1
-    n_skipped = 0
+    results = list()
     # analyse all ulog files
-    for ulog_file in ulog_files:
-        print('analysing file {:d}/{:d}: {:s}'.format(i, n_files, ulog_file))
+    manifest_file = open(manifest_filename, 'a')
+    try:
+        for result in result_iterator:
+            print('analysed file {:d}/{:d}: {:s} ({:s}, {:.1f}s)'.format(
+                i, n_files, result['filename'], result['status'], result['wall_time']))
+            if result['status'] != 'ok':
+                print(result['error'])
+                print('an exception occurred, skipping file {:s}'.format(result['filename']))
 
-        try:
-            _ = process_logdata_ekf(
-                ulog_file, check_level_dict_filename, check_table_filename,
-                plot=not args.no_plots, sensor_safety_margins=not args.no_sensor_safety_margin)
+            results.append(result)
+            append_manifest_entry(manifest_file, os.path.abspath(result['filename']), {
+                'size': result['size'], 'mtime': result['mtime'], 'status': result['status'],
+                'check_table_version': check_table_version, 'plot': result['plot'],
+                'wall_time': result['wall_time']})
+
+            i = i + 1
+    finally:
+        manifest_file.close()
+        result_iterator.close()
 
-        except Exception as e:
-            print(str(e))
-            print('an exception occurred, skipping file {:s}'.format(ulog_file))
-            n_skipped = n_skipped + 1
+    n_skipped = sum(1 for result in results if result['status'] != 'ok')
 
-        i = i + 1
+    summary_filename = os.path.join(ulog_directory, SUMMARY_FILENAME)
+    write_summary(results, summary_filename)
+    print('Batch summary written to {:s}'.format(summary_filename))
+    if args.profile:
+        profile_filename = os.path.join(ulog_directory, PROFILE_FILENAME)
+        write_profile(results, profile_filename)
+        print('Batch profile written to {:s}'.format(profile_filename))
+    if results:
+        print('total wall time {:.1f}s, slowest file {:.1f}s'.format(
+            sum(result['wall_time'] for result in results),
+            max(result['wall_time'] for result in results)))
 
     print('{:d}/{:d} files analysed, {:d} skipped.'.format(n_files-n_skipped, n_files, n_skipped))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,17 +2,35 @@
 # -*- coding: utf-8 -*-
 import argparse
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+from results_store import ResultsStore, RESULTS_STORE_FILENAME, load_mdat_csv_files
+from population_sketch import PopulationSketch
+
 """
-Performs a composite analysis of ekf log analysis meta data for all .ulg.csv files in the specified directory
+Performs a composite analysis of ekf log analysis meta data for all .ulg.csv files in the specified directory, or
+for all logs in the results store
 Generates and saves histogram plots for the meta data in population_data.pdf
 Generates and saves population summary data in population_data.csv
+In incremental mode, only the results of logs not analysed before are folded into persisted population sketches,
+from which the histogram plots, the population summary data and percentiles of every metric are generated. If a log
+of the sketches was analysed again, e.g. after a change of the check table, the sketches are rebuilt from the latest
+results of all logs.
 """
 
 parser = argparse.ArgumentParser(description='Perform a composite analysis of ekf log analysis meta data for all .ulg.csv files in the specified directory')
 parser.add_argument("directory_path")
+parser.add_argument('--results-store', type=str, default=None,
+                    help='The sqlite results store to analyse. Defaults to '+RESULTS_STORE_FILENAME+' in the specified '
+                         'directory if it exists, otherwise the .mdat.csv files in the directory are analysed.')
+parser.add_argument('--incremental', action='store_true',
+                    help='Whether to fold only the results of new logs into the persisted population sketches and '
+                         'generate the population summary from the sketches.')
+parser.add_argument('--sketch', type=str, default=None,
+                    help='The file of the persisted population sketches. Defaults to population_sketch.npz in the '
+                         'specified directory.')
 
 def is_valid_directory(parser, arg):
     if os.path.isdir(arg):
@@ -24,32 +42,68 @@ def is_valid_directory(parser, arg):
 args = parser.parse_args()
 metadata_directory = args.directory_path
 
+results_store_filename = args.results_store
+if results_store_filename is None and os.path.exists(os.path.join(metadata_directory, RESULTS_STORE_FILENAME)):
+    results_store_filename = os.path.join(metadata_directory, RESULTS_STORE_FILENAME)
+
 # Run the metadata analsyis tool to generate population statistics
-# Loop through the csv files in the directory and load the metadata into a nested dictionary
-print("\n"+"analysing all .ulog.csv files in "+metadata_directory)
-population_data = {}
-for filename in os.listdir(metadata_directory):
-    if filename.endswith(".mdat.csv"):
-        print("loading "+filename)
-        # get the dictionary of fail and warning test thresholds from a csv file
-        file = open(metadata_directory+"/"+filename)
-        single_log_data = { } # meta data dictionary for a single log
-        for line in file:
-            x = line.split(",")
-            a=x[0]
-            b=x[1]
-            c=x[2]
-            try:
-                single_log_data[a]=float(b)
-            except:
-                single_log_data[a]=b
-        file.close()
-        population_data[filename]=single_log_data
-
-#        # print out the check levels
-#        print('\n'+'The following metadata loaded from '+filename+' were used'+'\n')
-#        val = population_data.get(filename, {}).get('imu_hfdang_mean')
-#        print(val)
+if args.incremental:
+    # fold the results of the new logs into the population sketch
+    sketch_filename = args.sketch if args.sketch is not None else os.path.join(metadata_directory,
+                                                                               "population_sketch.npz")
+    population_sketch = PopulationSketch.load(sketch_filename) if os.path.exists(sketch_filename) \
+        else PopulationSketch()
+    # the earlier results of a log analysed again cannot be removed from the sketches, which are rebuilt instead
+    if results_store_filename is not None:
+        with ResultsStore(results_store_filename) as results_store:
+            new_data = results_store.get_columns(after_id=population_sketch.last_result_id)
+            if not population_sketch.logs.isdisjoint(new_data['log_filename']):
+                print("logs of {:s} were analysed again, rebuilding it".format(sketch_filename))
+                population_sketch = PopulationSketch()
+                new_data = results_store.get_columns()
+    else:
+        sketch_time = os.path.getmtime(sketch_filename) if os.path.exists(sketch_filename) else 0.0
+        if any(os.path.getmtime(os.path.join(metadata_directory, log)) > sketch_time
+               for log in population_sketch.logs if os.path.exists(os.path.join(metadata_directory, log))):
+            print("logs of {:s} were analysed again, rebuilding it".format(sketch_filename))
+            population_sketch = PopulationSketch()
+        new_data = load_mdat_csv_files(metadata_directory, exclude=population_sketch.logs)
+    n_new_logs = population_sketch.add_columns(new_data)
+    population_sketch.save(sketch_filename)
+    print("added the results of {:d} new logs to {:s}, population size {:d}".format(
+        n_new_logs, sketch_filename, len(population_sketch.logs)))
+
+# Load the metadata of all logs into a dictionary of columns with one entry per log
+elif results_store_filename is not None:
+    print("\n"+"analysing all results in "+results_store_filename)
+    with ResultsStore(results_store_filename) as results_store:
+        population_data = results_store.get_columns()
+else:
+    print("\n"+"analysing all .ulog.csv files in "+metadata_directory)
+    population_data = load_mdat_csv_files(metadata_directory)
+if not args.incremental:
+    n_logs = len(population_data['log_filename'])
+    print("loaded the results of {:d} logs".format(n_logs))
+
+def get_metric_column(name):
+    """
+    :param name:
+    :return: the values of a metric for all logs, nan if not available.
+    """
+    column = population_data.get(name)
+    if column is None or column.dtype.kind != 'f':
+        return np.full(n_logs, float('NaN'))
+    return column
+
+def get_status_column(name):
+    """
+    :param name:
+    :return: the values of a check status for all logs, an empty string if not available.
+    """
+    column = population_data.get(name)
+    if column is None:
+        return np.full(n_logs, '', dtype=str)
+    return column.astype(str)
 
 # Open pdf file for plotting
 from matplotlib.backends.backend_pdf import PdfPages
@@ -99,54 +153,125 @@ population_results = {
 'obs_pos_median_avg':[float('NaN'),'The mean of the median in-flight value of the output observer position tracking error magnitude (m)'],
 }
 
+def write_population_results(population_results, population_results_filename):
+    """
+    writes the population summary data to a .csv file.
+    :param population_results:
+    :param population_results_filename:
+    :return:
+    """
+    with open(population_results_filename, "w") as file:
+
+        file.write("name,value,description\n")
+
+        # loop through the dictionary and write each entry on a separate row, with data comma separated
+        # save data in alphabetical order
+        key_list = list(population_results.keys())
+        key_list.sort()
+        for key in key_list:
+            file.write(key+","+str(population_results[key][0])+","+population_results[key][1]+"\n")
+
+if args.incremental:
+    # get population summary statistics from the sketches
+    for status_name, result_id in [('master_status', 'master'), ('mag_sensor_status', 'mag'),
+                                   ('yaw_sensor_status', 'yaw'), ('vel_sensor_status', 'vel'),
+                                   ('pos_sensor_status', 'pos'), ('hgt_sensor_status', 'hgt'),
+                                   ('hagl_sensor_status', 'hagl'), ('tas_sensor_status', 'tas')]:
+        population_results[result_id+'_warning_pct'][0] = population_sketch.get_status_percentage(
+            status_name, 'Warning')
+        population_results[result_id+'_fail_pct'][0] = population_sketch.get_status_percentage(
+            status_name, 'Fail')
+
+    # result name, metric name, scale factor
+    for result_name, metric_name, scale in [
+            ('mag_test_max_avg', 'mag_test_max', 1.0), ('mag_test_mean_avg', 'mag_test_mean', 1.0),
+            ('vel_test_max_avg', 'vel_test_max', 1.0), ('vel_test_mean_avg', 'vel_test_mean', 1.0),
+            ('pos_test_max_avg', 'pos_test_max', 1.0), ('pos_test_mean_avg', 'pos_test_mean', 1.0),
+            ('hgt_test_max_avg', 'hgt_test_max', 1.0), ('hgt_test_mean_avg', 'hgt_test_mean', 1.0),
+            ('tas_test_max_avg', 'tas_test_max', 1.0), ('tas_test_mean_avg', 'tas_test_mean', 1.0),
+            ('hagl_test_max_avg', 'hagl_test_max', 1.0), ('hagl_test_mean_avg', 'hagl_test_mean', 1.0),
+            ('ofx_fail_pct_avg', 'ofx_fail_percentage', 1.0), ('ofy_fail_pct_avg', 'ofy_fail_percentage', 1.0),
+            ('imu_coning_max_avg', 'imu_coning_peak', 1000.0), ('imu_coning_mean_avg', 'imu_coning_mean', 1000.0),
+            ('imu_hfdang_max_avg', 'imu_hfdang_peak', 1000.0), ('imu_hfdang_mean_avg', 'imu_hfdang_mean', 1000.0),
+            ('imu_hfdvel_max_avg', 'imu_hfdvel_peak', 1.0), ('imu_hfdvel_mean_avg', 'imu_hfdvel_mean', 1.0),
+            ('obs_ang_median_avg', 'output_obs_ang_err_median', 1000.0),
+            ('obs_vel_median_avg', 'output_obs_vel_err_median', 1.0),
+            ('obs_pos_median_avg', 'output_obs_pos_err_median', 1.0)]:
+        if metric_name in population_sketch.metrics:
+            population_results[result_name][0] = scale * population_sketch.metrics[metric_name].mean
+
+    # percentiles and histograms of every metric
+    for fig_num, metric_name in enumerate(sorted(population_sketch.metrics.keys())):
+        metric = population_sketch.metrics[metric_name]
+        if metric.count == 0:
+            continue
+        for percentile in [50, 95, 99]:
+            population_results['{:s}_p{:d}'.format(metric_name, percentile)] = [
+                metric.quantile(percentile / 100.0),
+                'The {:d}th percentile of {:s} over all logs'.format(percentile, metric_name)]
+
+        plt.figure(fig_num, figsize=(20, 13))
+        counts, edges = metric.histogram()
+        plt.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+        plt.title("Histogram - "+metric_name)
+        plt.xlabel(metric_name)
+        plt.ylabel("Frequency")
+        pp.savefig()
+        plt.close(fig_num)
+
+    pp.close()
+    print('Population summary plots saved in population_data.pdf')
+    write_population_results(population_results, metadata_directory + "/population_data.csv")
+    print('Population summary data saved in population_data.csv')
+    sys.exit(0)
+
 # get population summary statistics
-found_keys = population_data.keys()
 
 # master status
-result = [population_data[k].get('master_status') for k in found_keys]
-population_results['master_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['master_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('master_status')
+population_results['master_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['master_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # magnetometer sensor
-result = [population_data[k].get('mag_sensor_status') for k in found_keys]
-population_results['mag_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['mag_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('mag_sensor_status')
+population_results['mag_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['mag_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # yaw sensor
-result = [population_data[k].get('yaw_sensor_status') for k in found_keys]
-population_results['yaw_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['yaw_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('yaw_sensor_status')
+population_results['yaw_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['yaw_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # velocity sensor
-result = [population_data[k].get('vel_sensor_status') for k in found_keys]
-population_results['vel_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['vel_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('vel_sensor_status')
+population_results['vel_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['vel_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # position sensor
-result = [population_data[k].get('pos_sensor_status') for k in found_keys]
-population_results['pos_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['pos_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('pos_sensor_status')
+population_results['pos_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['pos_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # height sensor
-result = [population_data[k].get('hgt_sensor_status') for k in found_keys]
-population_results['hgt_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['hgt_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('hgt_sensor_status')
+population_results['hgt_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['hgt_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # height above ground sensor
-result = [population_data[k].get('hagl_sensor_status') for k in found_keys]
-population_results['hagl_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['hagl_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('hagl_sensor_status')
+population_results['hagl_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['hagl_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # height above ground sensor
-result = [population_data[k].get('tas_sensor_status') for k in found_keys]
-population_results['tas_warning_pct'][0] = 100.0 * result.count('Warning') / len(result)
-population_results['tas_fail_pct'][0] = 100.0 * result.count('Fail') / len(result)
+result = get_status_column('tas_sensor_status')
+population_results['tas_warning_pct'][0] = 100.0 * np.count_nonzero(result == 'Warning') / len(result)
+population_results['tas_fail_pct'][0] = 100.0 * np.count_nonzero(result == 'Fail') / len(result)
 
 # Mean and max innovation test levels
 # Magnetometer
-temp = np.asarray([population_data[k].get('mag_test_max') for k in found_keys])
+temp = get_metric_column('mag_test_max')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('mag_test_mean') for k in found_keys])
+temp = get_metric_column('mag_test_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -171,9 +296,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(1)
 
 # Velocity Sensor (GPS)
-temp = np.asarray([population_data[k].get('vel_test_max') for k in found_keys])
+temp = get_metric_column('vel_test_max')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('vel_test_mean') for k in found_keys])
+temp = get_metric_column('vel_test_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -198,9 +323,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(2)
 
 # Position Sensor (GPS or external vision)
-temp = np.asarray([population_data[k].get('pos_test_max') for k in found_keys])
+temp = get_metric_column('pos_test_max')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('pos_test_mean') for k in found_keys])
+temp = get_metric_column('pos_test_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -225,9 +350,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(3)
 
 # Height Sensor
-temp = np.asarray([population_data[k].get('hgt_test_max') for k in found_keys])
+temp = get_metric_column('hgt_test_max')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('hgt_test_mean') for k in found_keys])
+temp = get_metric_column('hgt_test_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -252,9 +377,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(4)
 
 # Airspeed Sensor
-temp = np.asarray([population_data[k].get('tas_test_max') for k in found_keys])
+temp = get_metric_column('tas_test_max')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('tas_test_mean') for k in found_keys])
+temp = get_metric_column('tas_test_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -279,9 +404,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(5)
 
 # Height Above Ground Sensor
-temp = np.asarray([population_data[k].get('hagl_test_max') for k in found_keys])
+temp = get_metric_column('hagl_test_max')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('hagl_test_mean') for k in found_keys])
+temp = get_metric_column('hagl_test_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -306,9 +431,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(6)
 
 # Optical Flow Sensor
-temp = np.asarray([population_data[k].get('ofx_fail_percentage') for k in found_keys])
+temp = get_metric_column('ofx_fail_percentage')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('ofy_fail_percentage') for k in found_keys])
+temp = get_metric_column('ofy_fail_percentage')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -333,9 +458,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(7)
 
 # IMU coning vibration levels
-temp = np.asarray([population_data[k].get('imu_coning_peak') for k in found_keys])
+temp = get_metric_column('imu_coning_peak')
 result1 = 1000.0 * temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('imu_coning_mean') for k in found_keys])
+temp = get_metric_column('imu_coning_mean')
 result2 = 1000.0 * temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -360,9 +485,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(8)
 
 # IMU high frequency delta angle vibration levels
-temp = np.asarray([population_data[k].get('imu_hfdang_peak') for k in found_keys])
+temp = get_metric_column('imu_hfdang_peak')
 result1 = 1000.0 * temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('imu_hfdang_mean') for k in found_keys])
+temp = get_metric_column('imu_hfdang_mean')
 result2 = 1000.0 * temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -387,9 +512,9 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(9)
 
 # IMU high frequency delta velocity vibration levels
-temp = np.asarray([population_data[k].get('imu_hfdvel_peak') for k in found_keys])
+temp = get_metric_column('imu_hfdvel_peak')
 result1 = temp[np.isfinite(temp)]
-temp = np.asarray([population_data[k].get('imu_hfdvel_mean') for k in found_keys])
+temp = get_metric_column('imu_hfdvel_mean')
 result2 = temp[np.isfinite(temp)]
 
 if (len(result1) > 0 and len(result2) > 0):
@@ -414,7 +539,7 @@ if (len(result1) > 0 and len(result2) > 0):
     plt.close(10)
 
 # Output Observer Angular Tracking
-temp = np.asarray([population_data[k].get('output_obs_ang_err_median') for k in found_keys])
+temp = get_metric_column('output_obs_ang_err_median')
 result = 1000.0 * temp[np.isfinite(temp)]
 
 if (len(result) > 0):
@@ -431,7 +556,7 @@ if (len(result) > 0):
     plt.close(11)
 
 # Output Observer Velocity Tracking
-temp = np.asarray([population_data[k].get('output_obs_vel_err_median') for k in found_keys])
+temp = get_metric_column('output_obs_vel_err_median')
 result = temp[np.isfinite(temp)]
 
 if (len(result) > 0):
@@ -448,7 +573,7 @@ if (len(result) > 0):
     plt.close(12)
 
 # Output Observer Position Tracking
-temp = np.asarray([population_data[k].get('output_obs_pos_err_median') for k in found_keys])
+temp = get_metric_column('output_obs_pos_err_median')
 result = temp[np.isfinite(temp)]
 
 if (len(result) > 0):
@@ -465,7 +590,7 @@ if (len(result) > 0):
     plt.close(13)
 
 # IMU delta angle bias
-temp = np.asarray([population_data[k].get('imu_dang_bias_median') for k in found_keys])
+temp = get_metric_column('imu_dang_bias_median')
 result = temp[np.isfinite(temp)]
 
 if (len(result) > 0):
@@ -480,7 +605,7 @@ if (len(result) > 0):
     plt.close(14)
 
 # IMU delta velocity bias
-temp = np.asarray([population_data[k].get('imu_dvel_bias_median') for k in found_keys])
+temp = get_metric_column('imu_dvel_bias_median')
 result = temp[np.isfinite(temp)]
 
 if (len(result) > 0):
@@ -505,19 +630,7 @@ print('Population summary plots saved in population_data.pdf')
 plt.close("all")
 
 # write metadata to a .csv file
-population_results_filename = metadata_directory + "/population_data.csv"
-file = open(population_results_filename,"w")
-
-file.write("name,value,description\n")
-
-# loop through the dictionary and write each entry on a separate row, with data comma separated
-# save data in alphabetical order
-key_list = list(population_results.keys())
-key_list.sort()
-for key in key_list:
-    file.write(key+","+str(population_results[key][0])+","+population_results[key][1]+"\n")
-
-file.close()
+write_population_results(population_results, metadata_directory + "/population_data.csv")
 
 print('Population summary data saved in population_data.csv')
 
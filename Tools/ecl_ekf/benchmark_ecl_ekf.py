@@ -0,0 +1,258 @@
+#! /usr/bin/env python3
+"""
+Benchmarks the ecl ekf analysis against synthetic ULog fixtures. Times analyse_ekf, create_pdf_report
+and the batch driver, and appends the results to a json lines file, such that the performance can
+be compared between commits.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from synthetic_ulog import generate_ulog
+from analyse_logdata_ekf import analyse_ekf
+from analysis.topic_requirements import load_ulog
+from plotting.pdf_report import create_pdf_report
+
+BENCHMARK_RESULTS_FILENAME = 'ecl_ekf_benchmark.jsonl'
+
+# fixture name -> (duration in seconds, estimator rate in Hz, number of flights)
+FIXTURES = {
+    '10min_100hz': (600.0, 100.0, 2),
+    '1h_200hz': (3600.0, 200.0, 3),
+    '6h_250hz': (21600.0, 250.0, 4),
+}
+
+BENCHMARK_CASES = ['analyse_ekf', 'create_pdf_report', 'batch']
+
+
+def get_fixture(fixture_directory: str, name: str) -> str:
+    """
+    returns the file name of a fixture and generates the fixture if it does not exist yet.
+    :param fixture_directory:
+    :param name: a key of FIXTURES.
+    :return:
+    """
+    filename = os.path.join(fixture_directory, '{:s}.ulg'.format(name))
+    if not os.path.exists(filename):
+        duration_seconds, estimator_rate_hz, n_flights = FIXTURES[name]
+        print('generating fixture {:s}'.format(filename))
+        os.makedirs(fixture_directory, exist_ok=True)
+        generate_ulog(filename, duration_seconds=duration_seconds,
+                      estimator_rate_hz=estimator_rate_hz, n_flights=n_flights)
+    return filename
+
+
+def get_check_levels() -> Dict[str, float]:
+    """
+    :return: the default fail and warning test thresholds.
+    """
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(file_dir, 'check_level_dict.csv'), 'r') as file:
+        reader = csv.DictReader(file)
+        return {row['check_id']: float(row['threshold']) for row in reader}
+
+
+def get_git_revision() -> Optional[str]:
+    """
+    :return: the git commit of the working tree, or None if it can not be determined.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_function(function: Callable[[], None], repeat: int) -> Dict[str, float]:
+    """
+    :param function:
+    :param repeat: the number of times the function is called.
+    :return: the minimum, median and maximum wall time of the calls in seconds.
+    """
+    wall_times = list()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - start_time)
+    return {'min': float(np.amin(wall_times)), 'median': float(np.median(wall_times)),
+            'max': float(np.amax(wall_times))}
+
+
+def benchmark_analyse_ekf(ulog_file: str, repeat: int) -> Dict[str, float]:
+    """
+    times loading a log and analysing it with analyse_ekf.
+    :param ulog_file:
+    :param repeat:
+    :return:
+    """
+    check_levels = get_check_levels()
+
+    def run() -> None:
+        ulog = load_ulog(ulog_file, ['analysis'])
+        analyse_ekf(ulog, check_levels)
+
+    return time_function(run, repeat)
+
+
+def benchmark_create_pdf_report(ulog_file: str, repeat: int, work_directory: str) -> \
+        Dict[str, float]:
+    """
+    times creating the pdf report of a loaded log.
+    :param ulog_file:
+    :param repeat:
+    :param work_directory: the directory the report is written to.
+    :return:
+    """
+    ulog = load_ulog(ulog_file, ['pdf_report'])
+    output_filename = os.path.join(work_directory, 'report.pdf')
+    return time_function(lambda: create_pdf_report(ulog, output_filename), repeat)
+
+
+def benchmark_batch(ulog_file: str, repeat: int, work_directory: str) -> Dict[str, float]:
+    """
+    times the batch driver without plots on a directory containing a copy of the log.
+    :param ulog_file:
+    :param repeat:
+    :param work_directory:
+    :return:
+    """
+    batch_directory = os.path.join(work_directory, 'batch')
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          'batch_process_logdata_ekf.py')
+
+    def run() -> None:
+        shutil.rmtree(batch_directory, ignore_errors=True)
+        os.makedirs(batch_directory)
+        shutil.copy(ulog_file, batch_directory)
+        subprocess.check_call([sys.executable, script, batch_directory, '--no-plots'],
+                              stdout=subprocess.DEVNULL)
+
+    return time_function(run, repeat)
+
+
+def run_benchmarks(fixture_directory: str, fixtures: List[str], cases: List[str],
+                   repeat: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    :param fixture_directory:
+    :param fixtures: the names of the fixtures.
+    :param cases: the benchmark cases.
+    :param repeat:
+    :return: a dict of fixture name to case to wall time statistics.
+    """
+    results = dict()
+    work_directory = tempfile.mkdtemp(prefix='ecl_ekf_benchmark_')
+    try:
+        for fixture in fixtures:
+            ulog_file = get_fixture(fixture_directory, fixture)
+            results[fixture] = dict()
+            for case in cases:
+                if case == 'analyse_ekf':
+                    timing = benchmark_analyse_ekf(ulog_file, repeat)
+                elif case == 'create_pdf_report':
+                    timing = benchmark_create_pdf_report(ulog_file, repeat, work_directory)
+                else:
+                    timing = benchmark_batch(ulog_file, repeat, work_directory)
+                results[fixture][case] = timing
+                print('{:<12s} {:<18s} median {:8.3f}s (min {:.3f}s, max {:.3f}s)'.format(
+                    fixture, case, timing['median'], timing['min'], timing['max']))
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    return results
+
+
+def load_benchmark_records(results_filename: str) -> List[Dict[str, object]]:
+    """
+    :param results_filename:
+    :return: the benchmark records of a json lines file in the order they were recorded.
+    """
+    if not os.path.exists(results_filename):
+        return []
+    with open(results_filename, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def print_comparison(reference: Dict[str, object], record: Dict[str, object]) -> None:
+    """
+    prints the change of the median wall times relative to a reference record.
+    :param reference:
+    :param record:
+    :return:
+    """
+    print('comparison to {:s} ({:s}):'.format(
+        str(reference.get('git_revision')), str(reference.get('date'))))
+    for fixture, cases in record['results'].items():
+        for case, timing in cases.items():
+            reference_timing = reference['results'].get(fixture, {}).get(case)
+            if reference_timing is None:
+                continue
+            print('{:<12s} {:<18s} {:8.3f}s -> {:8.3f}s ({:+.1f}%)'.format(
+                fixture, case, reference_timing['median'], timing['median'],
+                100.0 * (timing['median'] / reference_timing['median'] - 1.0)))
+
+
+def main() -> None:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(
+        description='Benchmark the ecl ekf analysis against synthetic ULog fixtures.')
+    parser.add_argument('--fixtures', type=str, default='10min_100hz',
+                        help='Comma separated fixture names out of {:s}.'.format(
+                            ', '.join(FIXTURES.keys())))
+    parser.add_argument('--cases', type=str, default=','.join(BENCHMARK_CASES),
+                        help='Comma separated benchmark cases out of {:s}.'.format(
+                            ', '.join(BENCHMARK_CASES)))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of runs of every benchmark case.')
+    parser.add_argument('--fixture-directory', type=str,
+                        default=os.path.join(file_dir, 'benchmark_fixtures'),
+                        help='The directory the generated fixtures are cached in.')
+    parser.add_argument('--results', type=str,
+                        default=os.path.join(file_dir, BENCHMARK_RESULTS_FILENAME),
+                        help='The json lines file the benchmark results are appended to.')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='The git revision of a recorded run to compare to. Defaults to the '
+                             'latest recorded run.')
+    args = parser.parse_args()
+
+    fixtures = args.fixtures.split(',')
+    cases = args.cases.split(',')
+    for fixture in fixtures:
+        if fixture not in FIXTURES:
+            parser.error('unknown fixture {:s}'.format(fixture))
+    for case in cases:
+        if case not in BENCHMARK_CASES:
+            parser.error('unknown benchmark case {:s}'.format(case))
+
+    records = load_benchmark_records(args.results)
+
+    record = {
+        'git_revision': get_git_revision(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'machine': platform.machine(), 'repeat': args.repeat,
+        'results': run_benchmarks(args.fixture_directory, fixtures, cases, args.repeat)}
+
+    with open(args.results, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+    print('Benchmark results appended to {:s}'.format(args.results))
+
+    if args.compare is not None:
+        references = [r for r in records if r.get('git_revision') == args.compare]
+    else:
+        references = records
+    if references:
+        print_comparison(references[-1], record)
+
+
+if __name__ == '__main__':
+    main()
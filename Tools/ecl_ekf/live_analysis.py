@@ -0,0 +1,512 @@
+#! /usr/bin/env python3
+"""
+Incremental ecl ekf analysis of a log that is still being written. The airtimes are detected and
+the metrics are accumulated from the newly appended data only, such that the check status can be
+reported during the flight without re-parsing the whole log.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from analyse_logdata_ekf import find_checks_that_apply
+from analysis.checks import perform_fleet_checks, get_status_names
+from analysis.detectors import Airtime
+from analysis.metrics import get_sensor_metric_table, get_innov_fail_metric_table, \
+    get_imu_metric_table, get_windowed_metric_statistics, finalize_sensor_metrics, \
+    finalize_innov_fail_metrics, finalize_imu_metrics
+from analysis.post_processing import get_control_mode_flags, get_innovation_check_flags
+from analysis.topic_requirements import get_topic_requirements
+from population_sketch import MetricSketch
+from ulog_tail import ULogTail
+
+# all sensor and innovation checks: the metrics of every check are accumulated, as a check can
+# start to apply at any time of the log.
+ALL_SENSOR_CHECKS = ['hgt', 'mag', 'vel', 'pos', 'tas', 'hagl']
+ALL_INNOV_FAIL_CHECKS = [
+    'posv', 'magx', 'magy', 'magz', 'yaw', 'vel', 'posh', 'tas', 'hagl', 'ofx', 'ofy']
+
+
+class LiveFlight(object):
+    """
+    a take-off and landing of the land detector. The landing is None while the vehicle is in air,
+    and accepted is None while it is not known whether the flight is long enough.
+    """
+
+    def __init__(self, take_off: float) -> None:
+        self.take_off = take_off
+        self.landing = None  # type: Optional[float]
+        self.accepted = None  # type: Optional[bool]
+
+
+class LiveInAirDetector(object):
+    """
+    detects the airtimes of a log while it is being written. Take-offs, landings, the in air
+    margin and the minimum flight time follow the rules of InAirDetector, such that the completed
+    log yields the same airtimes.
+    """
+
+    def __init__(self, min_flight_time_seconds: float = 0.0,
+                 in_air_margin_seconds: float = 0.0) -> None:
+        """
+        :param min_flight_time_seconds:
+        :param in_air_margin_seconds:
+        """
+        self._min_flight_time_seconds = min_flight_time_seconds
+        self._in_air_margin_seconds = in_air_margin_seconds
+        self._flights = list()  # type: List[LiveFlight]
+        self._landed = 1
+        self._last_landed_time = None  # type: Optional[float]
+        self._decided_time = -np.inf
+
+    @property
+    def in_air_margin_seconds(self) -> float:
+        """
+        :return: the margin removed from the airtimes.
+        """
+        return self._in_air_margin_seconds
+
+    @property
+    def flights(self) -> List[LiveFlight]:
+        """
+        :return: all flights detected so far, including the flights shorter than the minimum.
+        """
+        return self._flights
+
+    @property
+    def airtimes(self) -> List[Airtime]:
+        """
+        :return: the accepted airtimes, the airtime of a flight in progress ends at the time up to
+        which it is decided.
+        """
+        airtimes = list()
+        for flight in self._flights:
+            if flight.accepted:
+                landing = flight.landing if flight.landing is not None else \
+                    self._decided_time + self._in_air_margin_seconds
+                airtimes.append(Airtime(take_off=flight.take_off + self._in_air_margin_seconds,
+                                        landing=landing - self._in_air_margin_seconds))
+        return airtimes
+
+    @property
+    def in_air(self) -> bool:
+        """
+        :return: whether the vehicle is in air according to the latest land detector message.
+        """
+        return self._landed == 0
+
+    @property
+    def decided_time(self) -> float:
+        """
+        :return: the time since the log start up to which it is known for every sample whether
+        it is in air.
+        """
+        return self._decided_time
+
+    def update(self, log_time: np.ndarray, landed: np.ndarray, horizon: float) -> None:
+        """
+        processes new land detector messages.
+        :param log_time: the timestamps of the messages in seconds since the log start.
+        :param landed: the landed flag of the messages.
+        :param horizon: the time up to which all land detector messages have been received. The
+        land detector only publishes changes of its state.
+        :return:
+        """
+        if len(landed) > 0:
+            # the vehicle is on ground before the first message, as in InAirDetector
+            landed = np.concatenate([[self._landed], (np.asarray(landed) > 0).astype(int)])
+            for i in np.flatnonzero(np.diff(landed)):
+                if landed[i + 1] == 0:
+                    self._flights.append(LiveFlight(float(log_time[i])))
+                else:
+                    self._flights[-1].landing = float(log_time[i])
+            self._landed = int(landed[-1])
+            self._last_landed_time = float(log_time[-1])
+            horizon = max(horizon, self._last_landed_time)
+
+        self._update_flights(horizon)
+
+    def finish(self) -> None:
+        """
+        completes the detection at the end of the log. A flight without landing ends with the last
+        land detector message.
+        :return:
+        """
+        if self._flights and self._flights[-1].landing is None:
+            print('No final landing detected. Assume last timestamp is landing.')
+            self._flights[-1].landing = self._last_landed_time
+        self._update_flights(np.inf)
+
+    def _update_flights(self, horizon: float) -> None:
+        """
+        decides which flights are long enough and advances the decided time.
+        :param horizon:
+        :return:
+        """
+        margin = self._in_air_margin_seconds
+        for flight in self._flights:
+            if flight.accepted is not None:
+                continue
+            if flight.landing is not None:
+                flight.accepted = (flight.landing - margin) - (flight.take_off + margin) >= \
+                    self._min_flight_time_seconds
+            elif (horizon - margin) - (flight.take_off + margin) >= self._min_flight_time_seconds:
+                flight.accepted = True
+
+        # in air, samples within the margin before the (yet unknown) landing are not decided
+        in_flight = self._flights and self._flights[-1].landing is None
+        self._decided_time = max(self._decided_time, horizon - margin if in_flight else horizon)
+
+
+class RunningStatistics(object):
+    """
+    accumulates the windowed statistics ('mean', 'max' and 'median' of transformed samples) of the
+    signals of a metric table group. The median is estimated from a histogram sketch.
+    """
+
+    def __init__(self, metrics: List[Tuple[int, str, str, Optional[object]]]) -> None:
+        """
+        :param metrics: a list of (signal row, metric name, reduction, transform).
+        """
+        self._metrics = metrics
+        self._count = 0
+        self._sums = {name: 0.0 for _, name, reduction, _ in metrics if reduction == 'mean'}
+        self._maxima = {name: -np.inf for _, name, reduction, _ in metrics if reduction == 'max'}
+        self._sketches = {
+            name: MetricSketch() for _, name, reduction, _ in metrics if reduction == 'median'}
+
+    @property
+    def count(self) -> int:
+        """
+        :return: the number of accumulated samples.
+        """
+        return self._count
+
+    def add(self, samples: np.ndarray) -> None:
+        """
+        :param samples: a 2-D array of samples, one signal per row.
+        :return:
+        """
+        if samples.shape[1] == 0:
+            return
+        self._count += samples.shape[1]
+        for row, name, reduction, transform in self._metrics:
+            values = samples[row] if transform is None else transform(samples[row])
+            if reduction == 'mean':
+                self._sums[name] += float(np.sum(values))
+            elif reduction == 'max':
+                self._maxima[name] = max(self._maxima[name], float(np.amax(values)))
+            else:
+                self._sketches[name].add(values)
+
+    def merge(self, other: 'RunningStatistics') -> None:
+        """
+        merges the statistics of other samples of the same signals.
+        :param other:
+        :return:
+        """
+        self._count += other._count
+        for name in self._sums:
+            self._sums[name] += other._sums[name]
+        for name in self._maxima:
+            self._maxima[name] = max(self._maxima[name], other._maxima[name])
+        for name in self._sketches:
+            self._sketches[name].merge(other._sketches[name])
+
+    def get_metrics(self) -> Dict[str, float]:
+        """
+        :return: a dict of metric name to value, nan if no samples were accumulated.
+        """
+        if self._count == 0:
+            return {name: float('NaN') for _, name, _, _ in self._metrics}
+        metrics = {name: value / self._count for name, value in self._sums.items()}
+        metrics.update(self._maxima)
+        metrics.update({name: sketch.quantile(0.5) for name, sketch in self._sketches.items()})
+        return metrics
+
+
+class LiveMetricGroup(object):
+    """
+    the signals of a data source whose airborne samples are selected by the same detector. New
+    samples are held back until the detector has decided whether they are in air, and the samples
+    of a flight are accumulated separately until the flight is known to be long enough.
+    """
+
+    def __init__(self, signals: List[str], detector: LiveInAirDetector,
+                 metrics: List[Tuple[int, str, str, Optional[object]]]) -> None:
+        """
+        :param signals:
+        :param detector:
+        :param metrics: a list of (signal row, metric name, reduction, transform).
+        """
+        self._signals = signals
+        self._detector = detector
+        self._metrics = metrics
+        self._statistics = RunningStatistics(metrics)
+        self._flight_statistics = dict()  # type: Dict[int, RunningStatistics]
+        self._pending_time = np.zeros(0)
+        self._pending_samples = np.zeros((len(signals), 0))
+
+    def append(self, log_time: np.ndarray, data: Dict[str, np.ndarray]) -> None:
+        """
+        :param log_time: the timestamps of the new samples in seconds since the log start.
+        :param data: a dict of signal name to the new samples.
+        :return:
+        """
+        self._pending_time = np.concatenate([self._pending_time, log_time])
+        self._pending_samples = np.hstack([self._pending_samples, np.vstack([
+            np.asarray(data[signal], dtype=float) for signal in self._signals])])
+
+    def update(self) -> None:
+        """
+        accumulates the samples that are decided by the detector.
+        :return:
+        """
+        n_decided = np.searchsorted(self._pending_time, self._detector.decided_time, side='left')
+        log_time = self._pending_time[:n_decided]
+        samples = self._pending_samples[:, :n_decided]
+        self._pending_time = self._pending_time[n_decided:]
+        self._pending_samples = self._pending_samples[:, n_decided:]
+
+        margin = self._detector.in_air_margin_seconds
+        for i, flight in enumerate(self._detector.flights):
+            if n_decided > 0 and flight.accepted is not False:
+                landing = np.inf if flight.landing is None else flight.landing - margin
+                start, stop = np.searchsorted(
+                    log_time, [flight.take_off + margin, landing], side='left')
+                if stop > start:
+                    if flight.accepted:
+                        self._statistics.add(samples[:, start:stop])
+                    else:
+                        self._flight_statistics.setdefault(
+                            i, RunningStatistics(self._metrics)).add(samples[:, start:stop])
+
+            # merge or discard the samples of a flight, once it is decided
+            if i in self._flight_statistics and flight.accepted is not None:
+                flight_statistics = self._flight_statistics.pop(i)
+                if flight.accepted:
+                    self._statistics.merge(flight_statistics)
+
+    def get_metrics(self) -> Dict[str, float]:
+        """
+        :return: a dict of metric name to the value over the accepted airborne samples.
+        """
+        return self._statistics.get_metrics()
+
+
+class LiveEkfAnalysis(object):
+    """
+    the ecl ekf analysis of a log that is still being written. Every update processes only the new
+    data messages, the metrics and checks of analyse_ekf are evaluated from running statistics.
+    """
+
+    def __init__(self, check_levels: Dict[str, float], red_thresh: float = 1.0,
+                 amb_thresh: float = 0.5, min_flight_duration_seconds: float = 5.0,
+                 in_air_margin_seconds: float = 5.0,
+                 pos_checks_when_sensors_not_fused: bool = False,
+                 max_latency_seconds: float = 1.0) -> None:
+        """
+        :param check_levels:
+        :param red_thresh:
+        :param amb_thresh:
+        :param min_flight_duration_seconds:
+        :param in_air_margin_seconds:
+        :param pos_checks_when_sensors_not_fused:
+        :param max_latency_seconds: the maximum delay between the timestamp of a message and the
+        time it is written to the log. Samples are only accumulated once the land detector state
+        is known up to their time.
+        """
+        self._check_levels = check_levels
+        self._pos_checks_when_sensors_not_fused = pos_checks_when_sensors_not_fused
+        self._max_latency_seconds = max_latency_seconds
+        self._start_timestamp = None  # type: Optional[int]
+        self._latest_time = -np.inf
+
+        self._detectors = OrderedDict([
+            ('in_air', LiveInAirDetector(
+                min_flight_time_seconds=min_flight_duration_seconds, in_air_margin_seconds=0.0)),
+            ('in_air_no_ground_effects', LiveInAirDetector(
+                min_flight_time_seconds=min_flight_duration_seconds,
+                in_air_margin_seconds=in_air_margin_seconds))])
+
+        # the metric table of all checks, grouped by data source and detector
+        statistics = get_windowed_metric_statistics(red_thresh=red_thresh, amb_thresh=amb_thresh)
+        grouped_signals = OrderedDict()
+        for data_source, signal, detector, metric_names in \
+                get_sensor_metric_table(ALL_SENSOR_CHECKS) + \
+                get_innov_fail_metric_table(ALL_INNOV_FAIL_CHECKS) + get_imu_metric_table():
+            group = grouped_signals.setdefault((data_source, detector), OrderedDict())
+            group.setdefault(signal, dict()).update(metric_names)
+        self._groups = OrderedDict()
+        for (data_source, detector), group in grouped_signals.items():
+            signals = list(group.keys())
+            metrics = [(row, metric_name) + statistics[statistic]
+                       for row, signal in enumerate(signals)
+                       for statistic, metric_name in sorted(group[signal].items())]
+            self._groups[(data_source, detector)] = LiveMetricGroup(
+                signals, self._detectors[detector], metrics)
+
+        # running maxima of the flags and test ratios that decide which checks apply, and of the
+        # filter faults
+        self._control_mode_max = dict()  # type: Dict[str, float]
+        self._estimator_status_max = dict()  # type: Dict[str, float]
+
+    @property
+    def detector(self) -> LiveInAirDetector:
+        """
+        :return: the in air detector without margins.
+        """
+        return self._detectors['in_air']
+
+    @property
+    def log_time(self) -> float:
+        """
+        :return: the latest timestamp received in seconds since the log start.
+        """
+        return self._latest_time
+
+    def update(self, new_data: Dict[str, Dict[str, np.ndarray]],
+               start_timestamp: Optional[int]) -> None:
+        """
+        processes new data messages.
+        :param new_data: a dict of topic name to a dict of field name to the new values.
+        :param start_timestamp: the timestamp of the log start in microseconds.
+        :return:
+        """
+        if start_timestamp is None:
+            return
+        self._start_timestamp = start_timestamp
+        log_times = {topic: (data['timestamp'] - start_timestamp) / 1.0e6
+                     for topic, data in new_data.items() if len(data['timestamp']) > 0}
+        for log_time in log_times.values():
+            self._latest_time = max(self._latest_time, float(log_time[-1]))
+
+        land_detected = new_data.get('vehicle_land_detected', {'landed': np.zeros(0)})
+        for detector in self._detectors.values():
+            detector.update(log_times.get('vehicle_land_detected', np.zeros(0)),
+                            land_detected['landed'],
+                            self._latest_time - self._max_latency_seconds)
+
+        data_sources = dict()
+        if 'estimator_status' in log_times:
+            estimator_status = new_data['estimator_status']
+            data_sources['estimator_status'] = (estimator_status, 'estimator_status')
+            data_sources['innov_flags'] = (
+                get_innovation_check_flags(estimator_status), 'estimator_status')
+            for name, flags in get_control_mode_flags(estimator_status).items():
+                self._control_mode_max[name] = max(
+                    self._control_mode_max.get(name, -np.inf), float(np.amax(flags)))
+            for name in ['tas_test_ratio', 'hagl_test_ratio', 'filter_fault_flags']:
+                self._estimator_status_max[name] = max(
+                    self._estimator_status_max.get(name, -np.inf),
+                    float(np.amax(estimator_status[name])))
+        if 'ekf2_innovations' in log_times:
+            data_sources['ekf2_innovations'] = (new_data['ekf2_innovations'], 'ekf2_innovations')
+
+        for (data_source, _), group in self._groups.items():
+            if data_source in data_sources:
+                data, dataset = data_sources[data_source]
+                group.append(log_times[dataset], data)
+            group.update()
+
+    def finish(self) -> None:
+        """
+        completes the analysis at the end of the log.
+        :return:
+        """
+        for detector in self._detectors.values():
+            detector.finish()
+        for group in self._groups.values():
+            group.update()
+
+    def get_results(self) -> Optional[Tuple[str, Dict[str, str], Dict[str, float]]]:
+        """
+        evaluates the checks on the metrics accumulated so far. Checks without airborne samples
+        yet have the status 'nan'.
+        :return: a tuple of the master status, the check status and the metrics, or None if no
+        estimator status was received yet.
+        """
+        if not self._estimator_status_max:
+            return None
+
+        sensor_checks, innov_fail_checks = find_checks_that_apply(
+            {name: np.array([value]) for name, value in self._control_mode_max.items()},
+            {name: np.array([value]) for name, value in self._estimator_status_max.items()},
+            pos_checks_when_sensors_not_fused=self._pos_checks_when_sensors_not_fused)
+
+        raw_metrics = dict()
+        for group in self._groups.values():
+            raw_metrics.update(group.get_metrics())
+
+        metrics = dict()
+        metrics.update(finalize_imu_metrics(raw_metrics))
+        metrics.update(finalize_sensor_metrics(raw_metrics, sensor_checks))
+        metrics.update(finalize_innov_fail_metrics(raw_metrics, innov_fail_checks))
+        metrics['filter_faults_max'] = self._estimator_status_max['filter_fault_flags']
+
+        status_codes = perform_fleet_checks(
+            {name: np.array([value], dtype=float) for name, value in metrics.items()},
+            self._check_levels)
+        check_status = {name: str(get_status_names(codes[0]))
+                        for name, codes in status_codes.items() if name != 'master_status'}
+        return str(get_status_names(status_codes['master_status'][0])), check_status, metrics
+
+
+def format_live_status(analysis: LiveEkfAnalysis) -> str:
+    """
+    :param analysis:
+    :return: a single line with the log time, the master status and the checks that do not pass.
+    """
+    results = analysis.get_results()
+    if results is None:
+        return '{:8.1f}s waiting for estimator_status data'.format(max(analysis.log_time, 0.0))
+    master_status, check_status, _ = results
+    failed_checks = ', '.join('{:s}: {:s}'.format(name, status)
+                              for name, status in sorted(check_status.items())
+                              if status in ['Warning', 'Fail'])
+    return '{:8.1f}s {:s} master_status: {:s}{:s}'.format(
+        analysis.log_time, 'in air   ' if analysis.detector.in_air else 'on ground',
+        master_status, ' ({:s})'.format(failed_checks) if failed_checks else '')
+
+
+def monitor_logdata_ekf(
+        filename: str, check_levels: Dict[str, float], interval_seconds: float = 5.0,
+        idle_timeout_seconds: float = 30.0, poll_seconds: float = 0.5,
+        **analysis_kwargs) -> LiveEkfAnalysis:
+    """
+    follows a log while it is being written and prints the check status at a fixed interval,
+    until the log has not grown for the idle timeout or the monitoring is interrupted.
+    :param filename:
+    :param check_levels:
+    :param interval_seconds: the wall time between two status reports.
+    :param idle_timeout_seconds:
+    :param poll_seconds: the wall time between two reads of the log.
+    :param analysis_kwargs: the parameters of LiveEkfAnalysis.
+    :return: the completed live analysis.
+    """
+    analysis = LiveEkfAnalysis(check_levels, **analysis_kwargs)
+    print('Monitoring {:s}, status every {:.1f}s'.format(filename, interval_seconds))
+
+    with ULogTail(filename, get_topic_requirements(['analysis'])) as ulog_tail:
+        last_growth_time = time.monotonic()
+        next_status_time = last_growth_time + interval_seconds
+        try:
+            while time.monotonic() - last_growth_time < idle_timeout_seconds:
+                bytes_read = ulog_tail.bytes_read
+                analysis.update(ulog_tail.read(), ulog_tail.start_timestamp)
+                now = time.monotonic()
+                if ulog_tail.bytes_read > bytes_read:
+                    last_growth_time = now
+                if now >= next_status_time:
+                    print(format_live_status(analysis))
+                    next_status_time = now + interval_seconds
+                if ulog_tail.bytes_read == bytes_read:
+                    time.sleep(poll_seconds)
+        except KeyboardInterrupt:
+            print('Monitoring interrupted.')
+
+    analysis.finish()
+    print(format_live_status(analysis))
+    return analysis
@@ -3,13 +3,21 @@
 function collection for plotting
 """
 
-from typing import Optional, List, Tuple, Dict
+import io
+from typing import Optional, List, Tuple, Dict, Any
 
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import Figure, Axes
 from matplotlib.backends.backend_pdf import PdfPages
 
+# a line of a subplot: x values, y values, color
+Trace = Tuple[np.ndarray, np.ndarray, str]
+
+# the default maximum number of points plotted per line. Twice the horizontal resolution of a
+# 20 inch figure at 100 dpi, as the decimation keeps a minimum and a maximum per pixel column.
+DEFAULT_MAX_POINTS = 4000
+
 
 def get_min_arg_time_value(
         time_series_data: np.ndarray, data_time: np.ndarray) -> Tuple[int, float, float]:
@@ -37,6 +45,59 @@ def get_max_arg_time_value(
     return max_arg, max_value, max_time
 
 
+def get_min_max_decimation_indices(values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    selects the indices of the minimum and the maximum value in each of max_points / 2 equally
+    sized buckets of consecutive samples, as well as the first and the last sample. Plotting the
+    selected samples preserves the peaks and the envelope of the full resolution signal.
+    :param values:
+    :param max_points: the maximum number of indices to select (approximately).
+    :return: the sorted selected indices.
+    """
+    n_values = len(values)
+    if max_points is None or max_points <= 0 or n_values <= max_points:
+        return np.arange(n_values)
+
+    bucket_size = int(np.ceil(n_values / (max_points // 2)))
+    n_buckets = n_values // bucket_size
+    buckets = values[:n_buckets * bucket_size].reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    indices = [np.array([0]), offsets + np.argmin(buckets, axis=1),
+               offsets + np.argmax(buckets, axis=1), np.array([n_values - 1])]
+
+    # the remaining samples that do not fill a bucket
+    if n_buckets * bucket_size < n_values:
+        remainder = values[n_buckets * bucket_size:]
+        indices.append(n_buckets * bucket_size + np.array(
+            [np.argmin(remainder), np.argmax(remainder)]))
+
+    return np.unique(np.concatenate(indices))
+
+
+def decimate_trace(trace: Trace, max_points: int) -> Trace:
+    """
+    decimates a trace with get_min_max_decimation_indices.
+    :param trace:
+    :param max_points:
+    :return: the decimated trace.
+    """
+    x, y, color = trace
+    indices = get_min_max_decimation_indices(y, max_points)
+    if len(indices) == len(y):
+        return trace
+    return x[indices], y[indices], color
+
+
+def _to_rounded_list(values: np.ndarray, significant_digits: int = 7) -> List[float]:
+    """
+    :param values:
+    :param significant_digits:
+    :return: the values rounded to a number of significant digits as list, which keeps the json
+    representation short.
+    """
+    return np.char.mod('%.{:d}g'.format(significant_digits), values).astype(float).tolist()
+
+
 class DataPlot(object):
     """
     A plotting class interface. Provides functions such as saving the figure.
@@ -46,11 +107,13 @@ class DataPlot(object):
         plot_title: str = '', sub_titles: Optional[List[str]] = None,
         x_labels: Optional[List[str]] = None, y_labels: Optional[List[str]] = None,
         y_lim: Optional[Tuple[int, int]] = None, legend: Optional[List[str]] = None,
-        pdf_handle: Optional[PdfPages] = None) -> None:
+        pdf_handle: Optional[PdfPages] = None, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         Initializes the data plot class interface.
         :param plot_title:
         :param pdf_handle:
+        :param max_points: the maximum number of points plotted per line. Lines with more samples
+        are decimated to the minimum and maximum of each bucket of samples. 0 disables decimation.
         """
         self._plot_data = plot_data
         self._variable_names = variable_names
@@ -61,6 +124,7 @@ class DataPlot(object):
         self._y_lim = y_lim
         self._legend = legend
         self._pdf_handle = pdf_handle
+        self._max_points = max_points
         self._fig = None
         self._ax = None
         self._fig_size = (20, 13)
@@ -93,6 +157,69 @@ class DataPlot(object):
             self._generate_plot_data()
         return self._plot_data
 
+    @property
+    def plot_title(self) -> str:
+        """
+        :return: the plot title
+        """
+        return self._plot_title
+
+    @property
+    def fig_size(self) -> Tuple[int, int]:
+        """
+        :return: the figure size in inches
+        """
+        return self._fig_size
+
+    @property
+    def n_subplots(self) -> int:
+        """
+        :return: the number of subplots
+        """
+        return len(self._variable_names)
+
+    def get_traces(self, i: int) -> List[Trace]:
+        """
+        placeholder for a function that returns the full resolution lines of a subplot. A child
+        class should implement this function.
+        :param i: the subplot index.
+        :return:
+        """
+        return []
+
+    def get_decimated_traces(self, i: int) -> List[Trace]:
+        """
+        :param i: the subplot index.
+        :return: the lines of a subplot, decimated to at most max_points points each.
+        """
+        return [decimate_trace(trace, self._max_points) for trace in self.get_traces(i)]
+
+    def plot_traces(self, i: int) -> None:
+        """
+        plots the decimated lines of a subplot into the current axes.
+        :param i: the subplot index.
+        :return:
+        """
+        for x, y, color in self.get_decimated_traces(i):
+            plt.plot(x, y, color)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        returns the titles, labels and decimated lines of the plot as a json serializable dict.
+        :return:
+        """
+        subplots = []
+        for i in range(self.n_subplots):
+            subplots.append({
+                'title': self._sub_titles[i] if self._sub_titles is not None else '',
+                'x_label': self._x_labels[i] if self._x_labels is not None else '',
+                'y_label': self._y_labels[i] if self._y_labels is not None else '',
+                'y_lim': list(self._y_lim) if self._y_lim is not None else None,
+                'legend': list(self._legend[i]) if self._legend is not None else [],
+                'traces': [{'x': _to_rounded_list(x), 'y': _to_rounded_list(y), 'color': color}
+                           for x, y, color in self.get_decimated_traces(i)]})
+        return {'title': self._plot_title, 'subplots': subplots}
+
     def plot(self) -> None:
         """
         placeholder for the plotting function. A child class should implement this function.
@@ -135,12 +262,28 @@ class DataPlot(object):
             print('skipping saving to pdf: handle was not initialized.')
 
 
+    def render(self, image_format: str = 'png', dpi: int = 100) -> bytes:
+        """
+        plots and renders the figure to an image and closes it. The plot object can be sent to
+        another process to render it there, as long as the figure has not been created yet.
+        :param image_format: an image format supported by matplotlib, e.g. 'png' or 'svg'.
+        :param dpi:
+        :return: the image file content.
+        """
+        self.plot()
+        buffer = io.BytesIO()
+        self.fig.savefig(buffer, format=image_format, dpi=dpi)
+        self.close()
+        return buffer.getvalue()
+
     def close(self) -> None:
         """
         closes the figure.
         :return:
         """
         plt.close(self._fig)
+        self._fig = None
+        self._ax = None
 
 
 class TimeSeriesPlot(DataPlot):
@@ -150,7 +293,7 @@ class TimeSeriesPlot(DataPlot):
     def __init__(
         self, plot_data: dict, variable_names: List[List[str]], x_labels: List[str],
         y_labels: List[str], plot_title: str = '', sub_titles: Optional[List[str]] = None,
-        pdf_handle: Optional[PdfPages] = None) -> None:
+        pdf_handle: Optional[PdfPages] = None, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         initializes a timeseries plot
         :param plot_data:
@@ -159,10 +302,19 @@ class TimeSeriesPlot(DataPlot):
         :param ylabels:
         :param plot_title:
         :param pdf_handle:
+        :param max_points:
         """
         super().__init__(
             plot_data, variable_names, plot_title=plot_title, sub_titles=sub_titles,
-            x_labels=x_labels, y_labels=y_labels, pdf_handle=pdf_handle)
+            x_labels=x_labels, y_labels=y_labels, pdf_handle=pdf_handle, max_points=max_points)
+
+    def get_traces(self, i: int) -> List[Trace]:
+        """
+        :param i: the subplot index.
+        :return: the time series of the subplot over the data index.
+        """
+        return [(np.arange(len(self.plot_data[v])), self.plot_data[v], 'b')
+                for v in self._variable_names[i]]
 
     def plot(self):
         """
@@ -174,8 +326,7 @@ class TimeSeriesPlot(DataPlot):
 
         for i in range(len(self._variable_names)):
             plt.subplot(len(self._variable_names), 1, i + 1)
-            for v in self._variable_names[i]:
-                plt.plot(self.plot_data[v], 'b')
+            self.plot_traces(i)
             plt.xlabel(self._x_labels[i])
             plt.ylabel(self._y_labels[i])
 
@@ -189,7 +340,7 @@ class InnovationPlot(DataPlot):
     def __init__(
         self, plot_data: dict, variable_names: List[Tuple[str, str]], x_labels: List[str],
         y_labels: List[str], plot_title: str = '', sub_titles: Optional[List[str]] = None,
-        pdf_handle: Optional[PdfPages] = None) -> None:
+        pdf_handle: Optional[PdfPages] = None, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         initializes a timeseries plot
         :param plot_data:
@@ -199,12 +350,23 @@ class InnovationPlot(DataPlot):
         :param plot_title:
         :param sub_titles:
         :param pdf_handle:
+        :param max_points:
         """
         super().__init__(
             plot_data, variable_names, plot_title=plot_title, sub_titles=sub_titles,
-            x_labels=x_labels, y_labels=y_labels, pdf_handle=pdf_handle)
+            x_labels=x_labels, y_labels=y_labels, pdf_handle=pdf_handle, max_points=max_points)
 
 
+    def get_traces(self, i: int) -> List[Trace]:
+        """
+        :param i: the subplot index.
+        :return: the innovation and the positive and negative standard deviation.
+        """
+        time = 1e-6 * self.plot_data['timestamp']
+        std_dev = np.sqrt(self.plot_data[self._variable_names[i][1]])
+        return [(time, self.plot_data[self._variable_names[i][0]], 'b'), (time, std_dev, 'r'),
+                (time, -std_dev, 'r')]
+
     def plot(self):
         """
         plots the Innovation data.
@@ -221,14 +383,7 @@ class InnovationPlot(DataPlot):
                 plt.title(self._sub_titles[i])
 
             # plot the value and the standard deviation
-            plt.plot(
-                1e-6 * self.plot_data['timestamp'], self.plot_data[self._variable_names[i][0]], 'b')
-            plt.plot(
-                1e-6 * self.plot_data['timestamp'],
-                np.sqrt(self.plot_data[self._variable_names[i][1]]), 'r')
-            plt.plot(
-                1e-6 * self.plot_data['timestamp'],
-                -np.sqrt(self.plot_data[self._variable_names[i][1]]), 'r')
+            self.plot_traces(i)
 
             plt.xlabel(self._x_labels[i])
             plt.ylabel(self._y_labels[i])
@@ -262,7 +417,7 @@ class ControlModeSummaryPlot(DataPlot):
             x_label: str, y_labels: List[str], annotation_text: List[str],
             additional_annotation: Optional[List[str]] = None, plot_title: str = '',
             sub_titles: Optional[List[str]] = None,
-            pdf_handle: Optional[PdfPages] = None) -> None:
+            pdf_handle: Optional[PdfPages] = None, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         initializes a timeseries plot
         :param plot_data:
@@ -272,13 +427,24 @@ class ControlModeSummaryPlot(DataPlot):
         :param plot_title:
         :param sub_titles:
         :param pdf_handle:
+        :param max_points:
         """
         super().__init__(
             plot_data, variable_names, plot_title=plot_title, sub_titles=sub_titles,
-            x_labels=[x_label]*len(y_labels), y_labels=y_labels, pdf_handle=pdf_handle)
+            x_labels=[x_label]*len(y_labels), y_labels=y_labels, pdf_handle=pdf_handle,
+            max_points=max_points)
         self._data_time = data_time
         self._annotation_text = annotation_text
         self._additional_annotation = additional_annotation
+        self._colors = ['b', 'r', 'g', 'c']
+
+    def get_traces(self, i: int) -> List[Trace]:
+        """
+        :param i: the subplot index.
+        :return: the control mode flags of the subplot over time.
+        """
+        return [(self._data_time, self.plot_data[var], col) for col, var in zip(
+            self._colors[:len(self._variable_names[i])], self._variable_names[i])]
 
 
     def plot(self):
@@ -290,7 +456,7 @@ class ControlModeSummaryPlot(DataPlot):
         if self.fig is None:
             return
 
-        colors = ['b', 'r', 'g', 'c']
+        colors = self._colors
 
         for i in range(len(self._variable_names)):
             # create a subplot for every variable
@@ -298,8 +464,7 @@ class ControlModeSummaryPlot(DataPlot):
             if self._sub_titles is not None:
                 plt.title(self._sub_titles[i])
 
-            for col, var in zip(colors[:len(self._variable_names[i])], self._variable_names[i]):
-                plt.plot(self._data_time, self.plot_data[var], col)
+            self.plot_traces(i)
 
             plt.xlabel(self._x_labels[i])
             plt.ylabel(self._y_labels[i])
@@ -345,7 +510,7 @@ class CheckFlagsPlot(DataPlot):
             x_label: str, y_labels: List[str], y_lim: Optional[Tuple[int, int]] = None,
             plot_title: str = '', legend: Optional[List[str]] = None,
             sub_titles: Optional[List[str]] = None, pdf_handle: Optional[PdfPages] = None,
-            annotate: bool = False) -> None:
+            annotate: bool = False, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         initializes a timeseries plot
         :param plot_data:
@@ -355,13 +520,23 @@ class CheckFlagsPlot(DataPlot):
         :param plot_title:
         :param sub_titles:
         :param pdf_handle:
+        :param max_points:
         """
         super().__init__(
             plot_data, variable_names, plot_title=plot_title, sub_titles=sub_titles,
             x_labels=[x_label]*len(y_labels), y_labels=y_labels, y_lim=y_lim, legend=legend,
-            pdf_handle=pdf_handle)
+            pdf_handle=pdf_handle, max_points=max_points)
         self._data_time = data_time
         self._b_annotate = annotate
+        self._colors = ['b', 'r', 'g', 'c', 'k', 'm']
+
+    def get_traces(self, i: int) -> List[Trace]:
+        """
+        :param i: the subplot index.
+        :return: the check data of the subplot over time.
+        """
+        return [(self._data_time, self.plot_data[var], col) for col, var in zip(
+            self._colors[:len(self._variable_names[i])], self._variable_names[i])]
 
 
     def plot(self):
@@ -373,7 +548,7 @@ class CheckFlagsPlot(DataPlot):
         if self.fig is None:
             return
 
-        colors = ['b', 'r', 'g', 'c', 'k', 'm']
+        colors = self._colors
 
         for i in range(len(self._variable_names)):
             # create a subplot for every variable
@@ -381,8 +556,7 @@ class CheckFlagsPlot(DataPlot):
             if self._sub_titles is not None:
                 plt.title(self._sub_titles[i])
 
-            for col, var in zip(colors[:len(self._variable_names[i])], self._variable_names[i]):
-                plt.plot(self._data_time, self.plot_data[var], col)
+            self.plot_traces(i)
 
             plt.xlabel(self._x_labels[i])
             plt.ylabel(self._y_labels[i])
@@ -3,30 +3,167 @@
 function collection for plotting
 """
 
+import html
+import io
+import json
+import multiprocessing
+import os
+from typing import List, Optional, Tuple
+
 # matplotlib don't use Xwindows backend (must be before pyplot import)
 import matplotlib
 matplotlib.use('Agg')
 
 import numpy as np
+import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from pyulog import ULog
 
-from analysis.post_processing import magnetic_field_estimates_from_status, get_estimator_check_flags
-from plotting.data_plots import TimeSeriesPlot, InnovationPlot, ControlModeSummaryPlot, \
-    CheckFlagsPlot
+from analysis.post_processing import magnetic_field_estimates_from_status, \
+    get_ulog_estimator_check_flags
+from plotting.data_plots import DataPlot, TimeSeriesPlot, InnovationPlot, \
+    ControlModeSummaryPlot, CheckFlagsPlot, DEFAULT_MAX_POINTS
 from analysis.detectors import PreconditionError
+from analysis.topic_requirements import register_topic_requirements
+
+# the topics and fields accessed by the plots of the report
+register_topic_requirements('pdf_report.imu_consistency', {
+    'sensor_preflight': ['accel_inconsistency_m_s_s', 'gyro_inconsistency_rad_s']})
+register_topic_requirements('pdf_report.innovations', {'ekf2_innovations': [
+    'vel_pos_innov[{:d}]'.format(i) for i in range(6)] + [
+    'vel_pos_innov_var[{:d}]'.format(i) for i in range(6)] + [
+    'mag_innov[{:d}]'.format(i) for i in range(3)] + [
+    'mag_innov_var[{:d}]'.format(i) for i in range(3)] + [
+    'heading_innov', 'heading_innov_var', 'airspeed_innov', 'airspeed_innov_var', 'beta_innov',
+    'beta_innov_var', 'flow_innov[0]', 'flow_innov[1]', 'flow_innov_var[0]', 'flow_innov_var[1]']})
+register_topic_requirements('pdf_report.test_levels', {'estimator_status': [
+    'mag_test_ratio', 'vel_test_ratio', 'pos_test_ratio', 'hgt_test_ratio', 'hagl_test_ratio',
+    'tas_test_ratio']})
+register_topic_requirements('pdf_report.check_flags', {'estimator_status': [
+    'control_mode_flags', 'innovation_check_flags', 'gps_check_fail_flags']})
+register_topic_requirements('pdf_report.accuracy', {'estimator_status': [
+    'pos_horiz_accuracy', 'pos_vert_accuracy']})
+register_topic_requirements('pdf_report.imu_vibration', {'estimator_status': [
+    'vibe[0]', 'vibe[1]', 'vibe[2]']})
+register_topic_requirements('pdf_report.output_tracking_error', {'ekf2_innovations': [
+    'output_tracking_error[0]', 'output_tracking_error[1]', 'output_tracking_error[2]']})
+register_topic_requirements('pdf_report.states', {'estimator_status': [
+    'states[{:d}]'.format(i) for i in range(10, 24)]})
+
+# a self-contained page drawing the embedded plot data as svg polylines
+_HTML_REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: sans-serif; }
+svg { display: block; margin-bottom: 8px; }
+text { font-size: 12px; }
+</style>
+</head>
+<body>
+<h1>__TITLE__</h1>
+<div id="report"></div>
+<script>
+var report = __REPORT_DATA__;
+var colors = {b: 'blue', r: 'red', g: 'green', c: 'darkcyan', k: 'black', m: 'magenta'};
+var width = 1200, height = 220, margin = {left: 70, right: 20, top: 25, bottom: 40};
+
+function finiteRange(values, range) {
+  values.forEach(function (v) {
+    if (isFinite(v)) { range[0] = Math.min(range[0], v); range[1] = Math.max(range[1], v); }
+  });
+  return range;
+}
+
+function drawSubplot(container, subplot) {
+  var ns = 'http://www.w3.org/2000/svg';
+  var svg = document.createElementNS(ns, 'svg');
+  svg.setAttribute('width', width);
+  svg.setAttribute('height', height);
+  var xRange = [Infinity, -Infinity], yRange = [Infinity, -Infinity];
+  subplot.traces.forEach(function (trace) {
+    finiteRange(trace.x, xRange);
+    finiteRange(trace.y, yRange);
+  });
+  if (subplot.y_lim) { yRange = subplot.y_lim; }
+  if (!(xRange[1] > xRange[0])) { xRange = [xRange[0] - 1, xRange[0] + 1]; }
+  if (!(yRange[1] > yRange[0])) { yRange = [yRange[0] - 1, yRange[0] + 1]; }
+  var plotWidth = width - margin.left - margin.right;
+  var plotHeight = height - margin.top - margin.bottom;
+  function px(x) { return margin.left + (x - xRange[0]) / (xRange[1] - xRange[0]) * plotWidth; }
+  function py(y) { return margin.top + (yRange[1] - y) / (yRange[1] - yRange[0]) * plotHeight; }
+  function addText(x, y, content, anchor) {
+    var text = document.createElementNS(ns, 'text');
+    text.setAttribute('x', x);
+    text.setAttribute('y', y);
+    text.setAttribute('text-anchor', anchor);
+    text.textContent = content;
+    svg.appendChild(text);
+  }
+
+  var frame = document.createElementNS(ns, 'rect');
+  frame.setAttribute('x', margin.left);
+  frame.setAttribute('y', margin.top);
+  frame.setAttribute('width', plotWidth);
+  frame.setAttribute('height', plotHeight);
+  frame.setAttribute('fill', 'none');
+  frame.setAttribute('stroke', 'gray');
+  svg.appendChild(frame);
+
+  subplot.traces.forEach(function (trace, index) {
+    var points = [];
+    for (var i = 0; i < trace.x.length; i++) {
+      if (isFinite(trace.x[i]) && isFinite(trace.y[i])) {
+        points.push(px(trace.x[i]).toFixed(1) + ',' + py(trace.y[i]).toFixed(1));
+      }
+    }
+    var line = document.createElementNS(ns, 'polyline');
+    line.setAttribute('points', points.join(' '));
+    line.setAttribute('fill', 'none');
+    line.setAttribute('stroke', colors[trace.color] || trace.color);
+    svg.appendChild(line);
+    if (index < subplot.legend.length) {
+      addText(width - margin.right - 5, margin.top + 15 * (index + 1), subplot.legend[index], 'end');
+      svg.lastChild.setAttribute('fill', colors[trace.color] || trace.color);
+    }
+  });
+
+  addText(margin.left + plotWidth / 2, 15, subplot.title, 'middle');
+  addText(margin.left + plotWidth / 2, height - 5, subplot.x_label, 'middle');
+  addText(margin.left, height - margin.bottom + 15, xRange[0].toPrecision(4), 'start');
+  addText(width - margin.right, height - margin.bottom + 15, xRange[1].toPrecision(4), 'end');
+  addText(margin.left - 5, margin.top + 10, yRange[1].toPrecision(4), 'end');
+  addText(margin.left - 5, height - margin.bottom, yRange[0].toPrecision(4), 'end');
+  addText(margin.left - 5, margin.top + plotHeight / 2, subplot.y_label, 'end');
+  container.appendChild(svg);
+}
+
+report.forEach(function (plot) {
+  var container = document.getElementById('report');
+  var heading = document.createElement('h2');
+  heading.textContent = plot.title;
+  container.appendChild(heading);
+  plot.subplots.forEach(function (subplot) { drawSubplot(container, subplot); });
+});
+</script>
+</body>
+</html>
+"""
 
-def create_pdf_report(ulog: ULog, output_plot_filename: str) -> None:
+def get_report_plots(
+        ulog: ULog, pdf_handle: Optional[PdfPages] = None,
+        max_points: int = DEFAULT_MAX_POINTS) -> List[DataPlot]:
     """
-    creates a pdf report of the ekf analysis.
+    creates the summary plots of the ekf analysis. The figures are only created when the plots
+    are saved or rendered.
     :param ulog:
-    :param output_plot_filename:
-    :return:
+    :param pdf_handle: the pdf the plots are saved to.
+    :param max_points: the maximum number of points plotted per line.
+    :return: the list of plots in the order of the report.
     """
 
-    # create summary plots
-    # save the plots to PDF
-
     try:
         estimator_status = ulog.get_dataset('estimator_status').data
         print('found estimator_status data')
@@ -45,276 +182,307 @@ def create_pdf_report(ulog: ULog, output_plot_filename: str) -> None:
     except:
         raise PreconditionError('could not find sensor_preflight data')
 
-    control_mode, innov_flags, gps_fail_flags = get_estimator_check_flags(estimator_status)
+    control_mode, innov_flags, gps_fail_flags = get_ulog_estimator_check_flags(ulog)
 
     status_time = 1e-6 * estimator_status['timestamp']
 
     b_finishes_in_air, b_starts_in_air, in_air_duration, in_air_transition_time, \
     on_ground_transition_time = detect_airtime(control_mode, status_time)
 
+    report_plots = list()
+
+    # plot IMU consistency data
+    if ('accel_inconsistency_m_s_s' in sensor_preflight.keys()) and (
+            'gyro_inconsistency_rad_s' in sensor_preflight.keys()):
+        report_plots.append(TimeSeriesPlot(
+            sensor_preflight, [['accel_inconsistency_m_s_s'], ['gyro_inconsistency_rad_s']],
+            x_labels=['data index', 'data index'],
+            y_labels=['acceleration (m/s/s)', 'angular rate (rad/s)'],
+            plot_title='IMU Consistency Check Levels', pdf_handle=pdf_handle,
+            max_points=max_points))
+
+    # vertical velocity and position innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations, [('vel_pos_innov[2]', 'vel_pos_innov_var[2]'),
+                           ('vel_pos_innov[5]', 'vel_pos_innov_var[5]')],
+        x_labels=['time (sec)', 'time (sec)'],
+        y_labels=['Down Vel (m/s)', 'Down Pos (m)'], plot_title='Vertical Innovations',
+        pdf_handle=pdf_handle, max_points=max_points))
+
+    # horizontal velocity innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations, [('vel_pos_innov[0]', 'vel_pos_innov_var[0]'),
+                           ('vel_pos_innov[1]','vel_pos_innov_var[1]')],
+        x_labels=['time (sec)', 'time (sec)'],
+        y_labels=['North Vel (m/s)', 'East Vel (m/s)'],
+        plot_title='Horizontal Velocity  Innovations', pdf_handle=pdf_handle,
+        max_points=max_points))
+
+    # horizontal position innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations, [('vel_pos_innov[3]', 'vel_pos_innov_var[3]'), ('vel_pos_innov[4]',
+                                                                          'vel_pos_innov_var[4]')],
+        x_labels=['time (sec)', 'time (sec)'],
+        y_labels=['North Pos (m)', 'East Pos (m)'], plot_title='Horizontal Position Innovations',
+        pdf_handle=pdf_handle, max_points=max_points))
+
+    # magnetometer innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations, [('mag_innov[0]', 'mag_innov_var[0]'),
+       ('mag_innov[1]', 'mag_innov_var[1]'), ('mag_innov[2]', 'mag_innov_var[2]')],
+        x_labels=['time (sec)', 'time (sec)', 'time (sec)'],
+        y_labels=['X (Gauss)', 'Y (Gauss)', 'Z (Gauss)'], plot_title='Magnetometer Innovations',
+        pdf_handle=pdf_handle, max_points=max_points))
+
+    # magnetic heading innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations, [('heading_innov', 'heading_innov_var')],
+        x_labels=['time (sec)'], y_labels=['Heading (rad)'],
+        plot_title='Magnetic Heading Innovations', pdf_handle=pdf_handle, max_points=max_points))
+
+    # air data innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations,
+        [('airspeed_innov', 'airspeed_innov_var'), ('beta_innov', 'beta_innov_var')],
+        x_labels=['time (sec)', 'time (sec)'],
+        y_labels=['innovation (m/sec)', 'innovation (rad)'],
+        sub_titles=['True Airspeed Innovations', 'Synthetic Sideslip Innovations'],
+        pdf_handle=pdf_handle, max_points=max_points))
+
+    # optical flow innovations
+    report_plots.append(InnovationPlot(
+        ekf2_innovations, [('flow_innov[0]', 'flow_innov_var[0]'), ('flow_innov[1]',
+                                                                    'flow_innov_var[1]')],
+        x_labels=['time (sec)', 'time (sec)'],
+        y_labels=['X (rad/sec)', 'Y (rad/sec)'],
+        plot_title='Optical Flow Innovations', pdf_handle=pdf_handle, max_points=max_points))
+
+    # plot normalised innovation test levels
+    # define variables to plot
+    variables = [['mag_test_ratio'], ['vel_test_ratio', 'pos_test_ratio'], ['hgt_test_ratio']]
+    y_labels = ['mag', 'vel, pos', 'hgt']
+    legend = [['mag'], ['vel', 'pos'], ['hgt']]
+    if np.amax(estimator_status['hagl_test_ratio']) > 0.0:  # plot hagl test ratio, if applicable
+        variables[-1].append('hagl_test_ratio')
+        y_labels[-1] += ', hagl'
+        legend[-1].append('hagl')
+
+    if np.amax(estimator_status[
+                   'tas_test_ratio']) > 0.0:  # plot airspeed sensor test ratio, if applicable
+        variables.append(['tas_test_ratio'])
+        y_labels.append('TAS')
+        legend.append(['airspeed'])
+
+    report_plots.append(CheckFlagsPlot(
+        status_time, estimator_status, variables, x_label='time (sec)', y_labels=y_labels,
+        plot_title='Normalised Innovation Test Levels', pdf_handle=pdf_handle,
+        max_points=max_points, annotate=True,
+        legend=legend
+    ))
+
+    # plot control mode summary A
+    report_plots.append(ControlModeSummaryPlot(
+        status_time, control_mode, [['tilt_aligned', 'yaw_aligned'],
+        ['using_gps', 'using_optflow', 'using_evpos'], ['using_barohgt', 'using_gpshgt',
+         'using_rnghgt', 'using_evhgt'], ['using_magyaw', 'using_mag3d', 'using_magdecl']],
+        x_label='time (sec)', y_labels=['aligned', 'pos aiding', 'hgt aiding', 'mag aiding'],
+        annotation_text=[['tilt alignment', 'yaw alignment'], ['GPS aiding', 'optical flow aiding',
+         'external vision aiding'], ['Baro aiding', 'GPS aiding', 'rangefinder aiding',
+         'external vision aiding'], ['magnetic yaw aiding', '3D magnetoemter aiding',
+         'magnetic declination aiding']], plot_title='EKF Control Status - Figure A',
+        pdf_handle=pdf_handle, max_points=max_points))
+
+    # plot control mode summary B
+    # construct additional annotations for the airborne plot
+    airborne_annotations = list()
+    if np.amin(np.diff(control_mode['airborne'])) > -0.5:
+        airborne_annotations.append(
+            (on_ground_transition_time, 'air to ground transition not detected'))
+    else:
+        airborne_annotations.append((on_ground_transition_time, 'on-ground at {:.1f} sec'.format(
+            on_ground_transition_time)))
+    if in_air_duration > 0.0:
+        airborne_annotations.append(((in_air_transition_time + on_ground_transition_time) / 2,
+                                     'duration = {:.1f} sec'.format(in_air_duration)))
+    if np.amax(np.diff(control_mode['airborne'])) < 0.5:
+        airborne_annotations.append(
+            (in_air_transition_time, 'ground to air transition not detected'))
+    else:
+        airborne_annotations.append(
+            (in_air_transition_time, 'in-air at {:.1f} sec'.format(in_air_transition_time)))
+
+    report_plots.append(ControlModeSummaryPlot(
+        status_time, control_mode, [['airborne'], ['estimating_wind']],
+        x_label='time (sec)', y_labels=['airborne', 'estimating wind'], annotation_text=[[], []],
+        additional_annotation=[airborne_annotations, []],
+        plot_title='EKF Control Status - Figure B', pdf_handle=pdf_handle, max_points=max_points))
+
+    # plot innovation_check_flags summary
+    report_plots.append(CheckFlagsPlot(
+        status_time, innov_flags, [['vel_innov_fail', 'posh_innov_fail'], ['posv_innov_fail',
+                                                                           'hagl_innov_fail'],
+                                   ['magx_innov_fail', 'magy_innov_fail', 'magz_innov_fail',
+                                    'yaw_innov_fail'], ['tas_innov_fail'], ['sli_innov_fail'],
+                                   ['ofx_innov_fail',
+                                    'ofy_innov_fail']], x_label='time (sec)',
+        y_labels=['failed', 'failed', 'failed', 'failed', 'failed', 'failed'],
+        y_lim=(-0.1, 1.1),
+        legend=[['vel NED', 'pos NE'], ['hgt absolute', 'hgt above ground'],
+                ['mag_x', 'mag_y', 'mag_z', 'yaw'], ['airspeed'], ['sideslip'],
+                ['flow X', 'flow Y']],
+        plot_title='EKF Innovation Test Fails', annotate=False, pdf_handle=pdf_handle,
+        max_points=max_points))
+
+    # gps_check_fail_flags summary
+    report_plots.append(CheckFlagsPlot(
+        status_time, gps_fail_flags,
+        [['nsat_fail', 'gdop_fail', 'herr_fail', 'verr_fail', 'gfix_fail', 'serr_fail'],
+         ['hdrift_fail', 'vdrift_fail', 'hspd_fail', 'veld_diff_fail']],
+        x_label='time (sec)', y_lim=(-0.1, 1.1), y_labels=['failed', 'failed'],
+        sub_titles=['GPS Direct Output Check Failures', 'GPS Derived Output Check Failures'],
+        legend=[['N sats', 'GDOP', 'horiz pos error', 'vert pos error', 'fix type',
+                 'speed error'], ['horiz drift', 'vert drift', 'horiz speed',
+                                  'vert vel inconsistent']], annotate=False, pdf_handle=pdf_handle,
+                                  max_points=max_points))
+
+    # filter reported accuracy
+    report_plots.append(CheckFlagsPlot(
+        status_time, estimator_status, [['pos_horiz_accuracy', 'pos_vert_accuracy']],
+        x_label='time (sec)', y_labels=['accuracy (m)'], plot_title='Reported Accuracy',
+        legend=[['horizontal', 'vertical']], annotate=False, pdf_handle=pdf_handle,
+        max_points=max_points))
+
+    # Plot the EKF IMU vibration metrics
+    scaled_estimator_status = {'vibe[0]': 1000. * estimator_status['vibe[0]'],
+                               'vibe[1]': 1000. * estimator_status['vibe[1]'],
+                               'vibe[2]': estimator_status['vibe[2]']
+                               }
+    report_plots.append(CheckFlagsPlot(
+        status_time, scaled_estimator_status, [['vibe[0]'], ['vibe[1]'], ['vibe[2]']],
+        x_label='time (sec)', y_labels=['Del Ang Coning (mrad)', 'HF Del Ang (mrad)',
+                                        'HF Del Vel (m/s)'], plot_title='IMU Vibration Metrics',
+        pdf_handle=pdf_handle, max_points=max_points, annotate=True))
+
+    # Plot the EKF output observer tracking errors
+    scaled_innovations = {
+        'output_tracking_error[0]': 1000. * ekf2_innovations['output_tracking_error[0]'],
+        'output_tracking_error[1]': ekf2_innovations['output_tracking_error[1]'],
+        'output_tracking_error[2]': ekf2_innovations['output_tracking_error[2]']
+        }
+    report_plots.append(CheckFlagsPlot(
+        1e-6 * ekf2_innovations['timestamp'], scaled_innovations,
+        [['output_tracking_error[0]'], ['output_tracking_error[1]'],
+         ['output_tracking_error[2]']], x_label='time (sec)',
+        y_labels=['angles (mrad)', 'velocity (m/s)', 'position (m)'],
+        plot_title='Output Observer Tracking Error Magnitudes',
+        pdf_handle=pdf_handle, max_points=max_points, annotate=True))
+
+    # Plot the delta angle bias estimates
+    report_plots.append(CheckFlagsPlot(
+        1e-6 * estimator_status['timestamp'], estimator_status,
+        [['states[10]'], ['states[11]'], ['states[12]']],
+        x_label='time (sec)', y_labels=['X (rad)', 'Y (rad)', 'Z (rad)'],
+        plot_title='Delta Angle Bias Estimates', annotate=False, pdf_handle=pdf_handle,
+        max_points=max_points))
+
+    # Plot the delta velocity bias estimates
+    report_plots.append(CheckFlagsPlot(
+        1e-6 * estimator_status['timestamp'], estimator_status,
+        [['states[13]'], ['states[14]'], ['states[15]']],
+        x_label='time (sec)', y_labels=['X (m/s)', 'Y (m/s)', 'Z (m/s)'],
+        plot_title='Delta Velocity Bias Estimates', annotate=False, pdf_handle=pdf_handle,
+        max_points=max_points))
+
+    # Plot the earth frame magnetic field estimates
+    declination, field_strength, inclination = magnetic_field_estimates_from_status(
+        estimator_status)
+    report_plots.append(CheckFlagsPlot(
+        1e-6 * estimator_status['timestamp'],
+        {'strength': field_strength, 'declination': declination, 'inclination': inclination},
+        [['declination'], ['inclination'], ['strength']],
+        x_label='time (sec)', y_labels=['declination (deg)', 'inclination (deg)',
+                                        'strength (Gauss)'],
+        plot_title='Earth Magnetic Field Estimates', annotate=False,
+        pdf_handle=pdf_handle, max_points=max_points))
+
+    # Plot the body frame magnetic field estimates
+    report_plots.append(CheckFlagsPlot(
+        1e-6 * estimator_status['timestamp'], estimator_status,
+        [['states[19]'], ['states[20]'], ['states[21]']],
+        x_label='time (sec)', y_labels=['X (Gauss)', 'Y (Gauss)', 'Z (Gauss)'],
+        plot_title='Magnetometer Bias Estimates', annotate=False, pdf_handle=pdf_handle,
+        max_points=max_points))
+
+    # Plot the EKF wind estimates
+    report_plots.append(CheckFlagsPlot(
+        1e-6 * estimator_status['timestamp'], estimator_status,
+        [['states[22]'], ['states[23]']], x_label='time (sec)',
+        y_labels=['North (m/s)', 'East (m/s)'], plot_title='Wind Velocity Estimates',
+        annotate=False, pdf_handle=pdf_handle, max_points=max_points))
+
+    return report_plots
+
+
+def render_plot(job: Tuple[DataPlot, int]) -> bytes:
+    """
+    renders a plot to a png image. Used by the worker processes of create_pdf_report.
+    :param job: a tuple of the plot and the resolution in dpi.
+    :return:
+    """
+    data_plot, dpi = job
+    return data_plot.render('png', dpi=dpi)
+
+
+def create_pdf_report(
+        ulog: ULog, output_plot_filename: str, workers: int = 1,
+        max_points: int = DEFAULT_MAX_POINTS, dpi: int = 100) -> None:
+    """
+    creates a pdf report of the ekf analysis.
+    :param ulog:
+    :param output_plot_filename:
+    :param workers: the number of processes rendering the figures. With more than one worker, the
+    figures are rendered to images of the specified resolution and the pages of the pdf are images.
+    :param max_points: the maximum number of points plotted per line.
+    :param dpi: the resolution of the rendered pages when rendering in parallel.
+    :return:
+    """
+
     with PdfPages(output_plot_filename) as pdf_pages:
 
-        # plot IMU consistency data
-        if ('accel_inconsistency_m_s_s' in sensor_preflight.keys()) and (
-                'gyro_inconsistency_rad_s' in sensor_preflight.keys()):
-            data_plot = TimeSeriesPlot(
-                sensor_preflight, [['accel_inconsistency_m_s_s'], ['gyro_inconsistency_rad_s']],
-                x_labels=['data index', 'data index'],
-                y_labels=['acceleration (m/s/s)', 'angular rate (rad/s)'],
-                plot_title='IMU Consistency Check Levels', pdf_handle=pdf_pages)
-            data_plot.save()
-            data_plot.close()
-
-        # vertical velocity and position innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations, [('vel_pos_innov[2]', 'vel_pos_innov_var[2]'),
-                               ('vel_pos_innov[5]', 'vel_pos_innov_var[5]')],
-            x_labels=['time (sec)', 'time (sec)'],
-            y_labels=['Down Vel (m/s)', 'Down Pos (m)'], plot_title='Vertical Innovations',
-            pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # horizontal velocity innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations, [('vel_pos_innov[0]', 'vel_pos_innov_var[0]'),
-                               ('vel_pos_innov[1]','vel_pos_innov_var[1]')],
-            x_labels=['time (sec)', 'time (sec)'],
-            y_labels=['North Vel (m/s)', 'East Vel (m/s)'],
-            plot_title='Horizontal Velocity  Innovations', pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # horizontal position innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations, [('vel_pos_innov[3]', 'vel_pos_innov_var[3]'), ('vel_pos_innov[4]',
-                                                                              'vel_pos_innov_var[4]')],
-            x_labels=['time (sec)', 'time (sec)'],
-            y_labels=['North Pos (m)', 'East Pos (m)'], plot_title='Horizontal Position Innovations',
-            pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # magnetometer innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations, [('mag_innov[0]', 'mag_innov_var[0]'),
-           ('mag_innov[1]', 'mag_innov_var[1]'), ('mag_innov[2]', 'mag_innov_var[2]')],
-            x_labels=['time (sec)', 'time (sec)', 'time (sec)'],
-            y_labels=['X (Gauss)', 'Y (Gauss)', 'Z (Gauss)'], plot_title='Magnetometer Innovations',
-            pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # magnetic heading innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations, [('heading_innov', 'heading_innov_var')],
-            x_labels=['time (sec)'], y_labels=['Heading (rad)'],
-            plot_title='Magnetic Heading Innovations', pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # air data innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations,
-            [('airspeed_innov', 'airspeed_innov_var'), ('beta_innov', 'beta_innov_var')],
-            x_labels=['time (sec)', 'time (sec)'],
-            y_labels=['innovation (m/sec)', 'innovation (rad)'],
-            sub_titles=['True Airspeed Innovations', 'Synthetic Sideslip Innovations'],
-            pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # optical flow innovations
-        data_plot = InnovationPlot(
-            ekf2_innovations, [('flow_innov[0]', 'flow_innov_var[0]'), ('flow_innov[1]',
-                                                                        'flow_innov_var[1]')],
-            x_labels=['time (sec)', 'time (sec)'],
-            y_labels=['X (rad/sec)', 'Y (rad/sec)'],
-            plot_title='Optical Flow Innovations', pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # plot normalised innovation test levels
-        # define variables to plot
-        variables = [['mag_test_ratio'], ['vel_test_ratio', 'pos_test_ratio'], ['hgt_test_ratio']]
-        y_labels = ['mag', 'vel, pos', 'hgt']
-        legend = [['mag'], ['vel', 'pos'], ['hgt']]
-        if np.amax(estimator_status['hagl_test_ratio']) > 0.0:  # plot hagl test ratio, if applicable
-            variables[-1].append('hagl_test_ratio')
-            y_labels[-1] += ', hagl'
-            legend[-1].append('hagl')
-
-        if np.amax(estimator_status[
-                       'tas_test_ratio']) > 0.0:  # plot airspeed sensor test ratio, if applicable
-            variables.append(['tas_test_ratio'])
-            y_labels.append('TAS')
-            legend.append(['airspeed'])
-
-        data_plot = CheckFlagsPlot(
-            status_time, estimator_status, variables, x_label='time (sec)', y_labels=y_labels,
-            plot_title='Normalised Innovation Test Levels', pdf_handle=pdf_pages, annotate=True,
-            legend=legend
-        )
-        data_plot.save()
-        data_plot.close()
-
-        # plot control mode summary A
-        data_plot = ControlModeSummaryPlot(
-            status_time, control_mode, [['tilt_aligned', 'yaw_aligned'],
-            ['using_gps', 'using_optflow', 'using_evpos'], ['using_barohgt', 'using_gpshgt',
-             'using_rnghgt', 'using_evhgt'], ['using_magyaw', 'using_mag3d', 'using_magdecl']],
-            x_label='time (sec)', y_labels=['aligned', 'pos aiding', 'hgt aiding', 'mag aiding'],
-            annotation_text=[['tilt alignment', 'yaw alignment'], ['GPS aiding', 'optical flow aiding',
-             'external vision aiding'], ['Baro aiding', 'GPS aiding', 'rangefinder aiding',
-             'external vision aiding'], ['magnetic yaw aiding', '3D magnetoemter aiding',
-             'magnetic declination aiding']], plot_title='EKF Control Status - Figure A',
-            pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # plot control mode summary B
-        # construct additional annotations for the airborne plot
-        airborne_annotations = list()
-        if np.amin(np.diff(control_mode['airborne'])) > -0.5:
-            airborne_annotations.append(
-                (on_ground_transition_time, 'air to ground transition not detected'))
-        else:
-            airborne_annotations.append((on_ground_transition_time, 'on-ground at {:.1f} sec'.format(
-                on_ground_transition_time)))
-        if in_air_duration > 0.0:
-            airborne_annotations.append(((in_air_transition_time + on_ground_transition_time) / 2,
-                                         'duration = {:.1f} sec'.format(in_air_duration)))
-        if np.amax(np.diff(control_mode['airborne'])) < 0.5:
-            airborne_annotations.append(
-                (in_air_transition_time, 'ground to air transition not detected'))
-        else:
-            airborne_annotations.append(
-                (in_air_transition_time, 'in-air at {:.1f} sec'.format(in_air_transition_time)))
-
-        data_plot = ControlModeSummaryPlot(
-            status_time, control_mode, [['airborne'], ['estimating_wind']],
-            x_label='time (sec)', y_labels=['airborne', 'estimating wind'], annotation_text=[[], []],
-            additional_annotation=[airborne_annotations, []],
-            plot_title='EKF Control Status - Figure B', pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # plot innovation_check_flags summary
-        data_plot = CheckFlagsPlot(
-            status_time, innov_flags, [['vel_innov_fail', 'posh_innov_fail'], ['posv_innov_fail',
-                                                                               'hagl_innov_fail'],
-                                       ['magx_innov_fail', 'magy_innov_fail', 'magz_innov_fail',
-                                        'yaw_innov_fail'], ['tas_innov_fail'], ['sli_innov_fail'],
-                                       ['ofx_innov_fail',
-                                        'ofy_innov_fail']], x_label='time (sec)',
-            y_labels=['failed', 'failed', 'failed', 'failed', 'failed', 'failed'],
-            y_lim=(-0.1, 1.1),
-            legend=[['vel NED', 'pos NE'], ['hgt absolute', 'hgt above ground'],
-                    ['mag_x', 'mag_y', 'mag_z', 'yaw'], ['airspeed'], ['sideslip'],
-                    ['flow X', 'flow Y']],
-            plot_title='EKF Innovation Test Fails', annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # gps_check_fail_flags summary
-        data_plot = CheckFlagsPlot(
-            status_time, gps_fail_flags,
-            [['nsat_fail', 'gdop_fail', 'herr_fail', 'verr_fail', 'gfix_fail', 'serr_fail'],
-             ['hdrift_fail', 'vdrift_fail', 'hspd_fail', 'veld_diff_fail']],
-            x_label='time (sec)', y_lim=(-0.1, 1.1), y_labels=['failed', 'failed'],
-            sub_titles=['GPS Direct Output Check Failures', 'GPS Derived Output Check Failures'],
-            legend=[['N sats', 'GDOP', 'horiz pos error', 'vert pos error', 'fix type',
-                     'speed error'], ['horiz drift', 'vert drift', 'horiz speed',
-                                      'vert vel inconsistent']], annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # filter reported accuracy
-        data_plot = CheckFlagsPlot(
-            status_time, estimator_status, [['pos_horiz_accuracy', 'pos_vert_accuracy']],
-            x_label='time (sec)', y_labels=['accuracy (m)'], plot_title='Reported Accuracy',
-            legend=[['horizontal', 'vertical']], annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the EKF IMU vibration metrics
-        scaled_estimator_status = {'vibe[0]': 1000. * estimator_status['vibe[0]'],
-                                   'vibe[1]': 1000. * estimator_status['vibe[1]'],
-                                   'vibe[2]': estimator_status['vibe[2]']
-                                   }
-        data_plot = CheckFlagsPlot(
-            status_time, scaled_estimator_status, [['vibe[0]'], ['vibe[1]'], ['vibe[2]']],
-            x_label='time (sec)', y_labels=['Del Ang Coning (mrad)', 'HF Del Ang (mrad)',
-                                            'HF Del Vel (m/s)'], plot_title='IMU Vibration Metrics',
-            pdf_handle=pdf_pages, annotate=True)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the EKF output observer tracking errors
-        scaled_innovations = {
-            'output_tracking_error[0]': 1000. * ekf2_innovations['output_tracking_error[0]'],
-            'output_tracking_error[1]': ekf2_innovations['output_tracking_error[1]'],
-            'output_tracking_error[2]': ekf2_innovations['output_tracking_error[2]']
-            }
-        data_plot = CheckFlagsPlot(
-            1e-6 * ekf2_innovations['timestamp'], scaled_innovations,
-            [['output_tracking_error[0]'], ['output_tracking_error[1]'],
-             ['output_tracking_error[2]']], x_label='time (sec)',
-            y_labels=['angles (mrad)', 'velocity (m/s)', 'position (m)'],
-            plot_title='Output Observer Tracking Error Magnitudes',
-            pdf_handle=pdf_pages, annotate=True)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the delta angle bias estimates
-        data_plot = CheckFlagsPlot(
-            1e-6 * estimator_status['timestamp'], estimator_status,
-            [['states[10]'], ['states[11]'], ['states[12]']],
-            x_label='time (sec)', y_labels=['X (rad)', 'Y (rad)', 'Z (rad)'],
-            plot_title='Delta Angle Bias Estimates', annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the delta velocity bias estimates
-        data_plot = CheckFlagsPlot(
-            1e-6 * estimator_status['timestamp'], estimator_status,
-            [['states[13]'], ['states[14]'], ['states[15]']],
-            x_label='time (sec)', y_labels=['X (m/s)', 'Y (m/s)', 'Z (m/s)'],
-            plot_title='Delta Velocity Bias Estimates', annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the earth frame magnetic field estimates
-        declination, field_strength, inclination = magnetic_field_estimates_from_status(
-            estimator_status)
-        data_plot = CheckFlagsPlot(
-            1e-6 * estimator_status['timestamp'],
-            {'strength': field_strength, 'declination': declination, 'inclination': inclination},
-            [['declination'], ['inclination'], ['strength']],
-            x_label='time (sec)', y_labels=['declination (deg)', 'inclination (deg)',
-                                            'strength (Gauss)'],
-            plot_title='Earth Magnetic Field Estimates', annotate=False,
-            pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the body frame magnetic field estimates
-        data_plot = CheckFlagsPlot(
-            1e-6 * estimator_status['timestamp'], estimator_status,
-            [['states[19]'], ['states[20]'], ['states[21]']],
-            x_label='time (sec)', y_labels=['X (Gauss)', 'Y (Gauss)', 'Z (Gauss)'],
-            plot_title='Magnetometer Bias Estimates', annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
-
-        # Plot the EKF wind estimates
-        data_plot = CheckFlagsPlot(
-            1e-6 * estimator_status['timestamp'], estimator_status,
-            [['states[22]'], ['states[23]']], x_label='time (sec)',
-            y_labels=['North (m/s)', 'East (m/s)'], plot_title='Wind Velocity Estimates',
-            annotate=False, pdf_handle=pdf_pages)
-        data_plot.save()
-        data_plot.close()
+        if workers <= 1:
+            for data_plot in get_report_plots(ulog, pdf_handle=pdf_pages, max_points=max_points):
+                data_plot.save()
+                data_plot.close()
+            return
+
+        report_plots = get_report_plots(ulog, max_points=max_points)
+        with multiprocessing.Pool(min(workers, len(report_plots))) as pool:
+            images = pool.map(render_plot, [(data_plot, dpi) for data_plot in report_plots])
+
+        # place every rendered figure on a page of the same size
+        for data_plot, image in zip(report_plots, images):
+            fig = plt.figure(figsize=data_plot.fig_size, dpi=dpi)
+            fig.figimage(plt.imread(io.BytesIO(image), format='png'), resize=True)
+            pdf_pages.savefig(figure=fig, dpi=dpi)
+            plt.close(fig)
+
+
+def create_html_report(
+        ulog: ULog, output_filename: str, max_points: int = DEFAULT_MAX_POINTS) -> None:
+    """
+    creates a self-contained html report of the ekf analysis. The decimated plot data is embedded
+    as json and drawn by the browser, such that no figures need to be rendered.
+    :param ulog:
+    :param output_filename:
+    :param max_points: the maximum number of points plotted per line.
+    :return:
+    """
+    report = [data_plot.to_dict() for data_plot in get_report_plots(ulog, max_points=max_points)]
+
+    with open(output_filename, 'w') as file:
+        file.write(_HTML_REPORT_TEMPLATE.replace(
+            '__TITLE__', html.escape(os.path.basename(output_filename))).replace(
+                '__REPORT_DATA__', json.dumps(report)))
 
 
 def detect_airtime(control_mode, status_time):
@@ -0,0 +1,263 @@
+#! /usr/bin/env python3
+"""
+Mergeable sketches of the ecl ekf analysis results of a log population. Every metric is summarised
+by a fixed-bin histogram with logarithmically spaced bins, such that percentiles can be estimated
+with a bounded relative error and the population statistics can be updated incrementally as new
+logs are analysed, without keeping or reprocessing the results of earlier logs.
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# the histogram bins cover magnitudes from 10**MIN_EXPONENT to 10**MAX_EXPONENT for positive and
+# negative values. Smaller magnitudes are counted as zero, larger magnitudes in the outermost bins.
+MIN_EXPONENT = -12
+MAX_EXPONENT = 12
+BINS_PER_DECADE = 64
+N_BINS = (MAX_EXPONENT - MIN_EXPONENT) * BINS_PER_DECADE
+
+# the geometric centers of the bins in ascending order of value: the negative bins, the zero bin
+# and the positive bins.
+_magnitudes = 10.0 ** (MIN_EXPONENT + (np.arange(N_BINS) + 0.5) / BINS_PER_DECADE)
+BIN_CENTERS = np.concatenate([-_magnitudes[::-1], [0.0], _magnitudes])
+# the edges of the bins in ascending order of value, the zero bin spans the smallest magnitudes
+_edge_magnitudes = 10.0 ** (MIN_EXPONENT + np.arange(N_BINS + 1) / BINS_PER_DECADE)
+BIN_EDGES = np.concatenate([-_edge_magnitudes[::-1], _edge_magnitudes])
+
+
+class MetricSketch(object):
+    """
+    a fixed-bin histogram of the values of a metric with their count, sum, minimum and maximum.
+    """
+
+    def __init__(self, counts: Optional[np.ndarray] = None,
+                 stats: Optional[np.ndarray] = None) -> None:
+        """
+        initializes an empty sketch, or a sketch from a saved state.
+        :param counts: the bin counts.
+        :param stats: an array of count, sum, minimum and maximum.
+        """
+        self._counts = np.zeros(2 * N_BINS + 1, dtype=np.int64) if counts is None else counts
+        self._stats = np.array([0.0, 0.0, np.inf, -np.inf]) if stats is None else stats
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        :return: the bin counts.
+        """
+        return self._counts
+
+    @property
+    def stats(self) -> np.ndarray:
+        """
+        :return: an array of count, sum, minimum and maximum.
+        """
+        return self._stats
+
+    @property
+    def count(self) -> int:
+        """
+        :return: the number of values.
+        """
+        return int(self._stats[0])
+
+    @property
+    def mean(self) -> float:
+        """
+        :return: the exact mean of the values.
+        """
+        return self._stats[1] / self._stats[0] if self._stats[0] > 0 else float('NaN')
+
+    @staticmethod
+    def get_bin_indices(values: np.ndarray) -> np.ndarray:
+        """
+        :param values:
+        :return: the index of the histogram bin of every value.
+        """
+        magnitude = np.abs(values)
+        with np.errstate(divide='ignore'):
+            bins = np.floor((np.log10(magnitude) - MIN_EXPONENT) * BINS_PER_DECADE)
+        bins = np.clip(np.nan_to_num(bins, neginf=-1), -1, N_BINS - 1).astype(np.int64)
+        return np.where(bins < 0, N_BINS, np.where(values > 0, N_BINS + 1 + bins, N_BINS - 1 - bins))
+
+    def add(self, values: np.ndarray) -> None:
+        """
+        adds the finite values of an array to the sketch.
+        :param values:
+        :return:
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self._counts += np.bincount(self.get_bin_indices(values), minlength=len(self._counts))
+        self._stats += [len(values), np.sum(values), 0.0, 0.0]
+        self._stats[2] = min(self._stats[2], np.amin(values))
+        self._stats[3] = max(self._stats[3], np.amax(values))
+
+    def merge(self, other: 'MetricSketch') -> None:
+        """
+        merges another sketch into this sketch.
+        :param other:
+        :return:
+        """
+        self._counts += other.counts
+        self._stats[:2] += other.stats[:2]
+        self._stats[2] = min(self._stats[2], other.stats[2])
+        self._stats[3] = max(self._stats[3], other.stats[3])
+
+    def quantile(self, q: float) -> float:
+        """
+        estimates a quantile of the values with a relative error of less than half a bin width. The
+        values are interpolated linearly within the bin of the quantile, such that the error is
+        much smaller for values with a smooth distribution.
+        :param q: the quantile between 0 and 1.
+        :return:
+        """
+        if self.count == 0:
+            return float('NaN')
+        cumulative_counts = np.cumsum(self._counts)
+        rank = q * cumulative_counts[-1]
+        index = np.searchsorted(cumulative_counts, rank, side='left')
+        fraction = (rank - (cumulative_counts[index] - self._counts[index])) / self._counts[index] \
+            if self._counts[index] > 0 else 0.5
+        lower = max(BIN_EDGES[index], self._stats[2])
+        upper = min(BIN_EDGES[index + 1], self._stats[3])
+        return float(np.clip(lower + fraction * (upper - lower), self._stats[2], self._stats[3]))
+
+    def histogram(self, n_bins: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        approximates a histogram with linearly spaced bins between the minimum and maximum value.
+        :param n_bins:
+        :return: a tuple of the counts and the bin edges.
+        """
+        centers = np.clip(BIN_CENTERS, self._stats[2], self._stats[3])
+        return np.histogram(centers, bins=n_bins, range=(self._stats[2], self._stats[3]),
+                            weights=self._counts)
+
+
+class PopulationSketch(object):
+    """
+    the sketches of all metrics and the counts of all check statuses of a log population.
+    """
+
+    def __init__(self) -> None:
+        """
+        initializes an empty population sketch.
+        """
+        self._metrics = dict()  # type: Dict[str, MetricSketch]
+        self._status_counts = dict()  # type: Dict[str, Dict[str, int]]
+        self._logs = set()
+        self._last_result_id = 0
+
+    @property
+    def metrics(self) -> Dict[str, MetricSketch]:
+        """
+        :return: a dict of metric name to sketch.
+        """
+        return self._metrics
+
+    @property
+    def logs(self) -> set:
+        """
+        :return: the set of the logs in the population.
+        """
+        return self._logs
+
+    @property
+    def last_result_id(self) -> int:
+        """
+        :return: the largest results store id added to the sketch.
+        """
+        return self._last_result_id
+
+    def get_status_percentage(self, name: str, status: str) -> float:
+        """
+        :param name: the check status name.
+        :param status: the status value, e.g. 'Warning' or 'Fail'.
+        :return: the percentage of logs with the status.
+        """
+        return 100.0 * self._status_counts.get(name, {}).get(status, 0) / len(self._logs) \
+            if self._logs else float('NaN')
+
+    def add_columns(self, columns: Dict[str, np.ndarray]) -> int:
+        """
+        adds the results of logs that are not yet part of the population. The results of logs that
+        are part of it already are ignored, as their earlier results cannot be removed from the
+        histograms. A population with logs that were analysed again has to be rebuilt.
+        :param columns: a dict of result name to an array with one entry per log, including the
+        log_filename column and optionally the results store id column.
+        :return: the number of logs added.
+        """
+        is_new = np.array([log not in self._logs for log in columns['log_filename']], dtype=bool)
+        if 'id' in columns and len(columns['id']) > 0:
+            self._last_result_id = max(self._last_result_id, int(np.amax(columns['id'])))
+
+        for name, column in columns.items():
+            if name in ['id', 'log_filename', 'analysis_time']:
+                continue
+            if column.dtype.kind == 'f' and not name.endswith('_status'):
+                self._metrics.setdefault(name, MetricSketch()).add(column[is_new])
+            elif column.dtype.kind != 'f' and name.endswith('_status'):
+                status_counts = self._status_counts.setdefault(name, dict())
+                statuses, counts = np.unique(column[is_new], return_counts=True)
+                for status, count in zip(statuses, counts):
+                    status_counts[str(status)] = status_counts.get(str(status), 0) + int(count)
+
+        self._logs.update(columns['log_filename'][is_new])
+        return int(np.count_nonzero(is_new))
+
+    def merge(self, other: 'PopulationSketch') -> None:
+        """
+        merges the sketch of a disjoint population into this sketch.
+        :param other:
+        :return:
+        """
+        for name, metric in other.metrics.items():
+            self._metrics.setdefault(name, MetricSketch()).merge(metric)
+        for name, status_counts in other._status_counts.items():
+            own_counts = self._status_counts.setdefault(name, dict())
+            for status, count in status_counts.items():
+                own_counts[status] = own_counts.get(status, 0) + count
+        self._logs.update(other.logs)
+        self._last_result_id = max(self._last_result_id, other.last_result_id)
+
+    def save(self, filename: str) -> None:
+        """
+        saves the sketch to a compressed .npz file.
+        :param filename:
+        :return:
+        """
+        arrays = {'logs': np.array(sorted(self._logs), dtype=str),
+                  'last_result_id': np.array(self._last_result_id)}
+        for name, metric in self._metrics.items():
+            arrays['counts/{:s}'.format(name)] = metric.counts
+            arrays['stats/{:s}'.format(name)] = metric.stats
+        for name, status_counts in self._status_counts.items():
+            arrays['status/{:s}'.format(name)] = np.array(
+                [list(status_counts.keys()), [str(c) for c in status_counts.values()]], dtype=str)
+        with open(filename, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+
+    @classmethod
+    def load(cls, filename: str) -> 'PopulationSketch':
+        """
+        loads a sketch saved with save().
+        :param filename:
+        :return:
+        """
+        sketch = cls()
+        with np.load(filename) as arrays:
+            sketch._logs = set(arrays['logs'].tolist())
+            sketch._last_result_id = int(arrays['last_result_id'])
+            for key in arrays.files:
+                if key.startswith('counts/'):
+                    name = key[len('counts/'):]
+                    sketch._metrics[name] = MetricSketch(
+                        arrays[key], arrays['stats/{:s}'.format(name)])
+                elif key.startswith('status/'):
+                    statuses, counts = arrays[key]
+                    sketch._status_counts[key[len('status/'):]] = {
+                        str(s): int(c) for s, c in zip(statuses, counts)}
+        return sketch
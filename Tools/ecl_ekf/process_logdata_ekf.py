@@ -6,18 +6,26 @@ import argparse
 import os
 import sys
 import csv
-from typing import Dict
-
-from pyulog import ULog
+from typing import Dict, Optional
 
 from analyse_logdata_ekf import analyse_ekf
-from plotting.pdf_report import create_pdf_report
+from plotting.pdf_report import create_pdf_report, create_html_report
+from plotting.data_plots import DEFAULT_MAX_POINTS
 from analysis.detectors import PreconditionError
+from analysis.topic_requirements import load_ulog
+from analysis.metrics import WINDOWED_METRIC_SUFFIXES
+from results_store import ResultsStore
+from stage_profiler import StageProfiler, PROFILE_SUFFIX
+from live_analysis import monitor_logdata_ekf
+from ulog_cache import ULOG_CACHE_DIR_ENV
 
 """
 Performs a health assessment on the ecl EKF navigation estimator data contained in a an ULog file
 Outputs a health assessment summary in a csv file named <inputfilename>.mdat.csv
-Outputs summary plots in a pdf file named <inputfilename>.pdf
+Optionally appends the health assessment summary to a results store
+Outputs summary plots in a pdf file named <inputfilename>.pdf, or an html file named <inputfilename>.html
+Optionally outputs the wall time, cpu time and peak memory of every stage in <inputfilename>.profile.json
+Optionally follows the log while it is being written and prints the check status during the flight
 """
 
 def get_arguments():
@@ -32,6 +40,43 @@ def get_arguments():
     parser.add_argument('--no-sensor-safety-margin', action='store_true',
                         help='Whether to not cut-off 5s after take-off and 5s before landing '
                              '(for certain sensors that might be influence by proximity to ground).')
+    parser.add_argument('--results-store', type=str, default=None,
+                        help='The sqlite results store the test results are appended to.')
+    parser.add_argument('--no-mdat-csv', action='store_true',
+                        help='Whether to not write the test results to a <file>.mdat.csv file.')
+    parser.add_argument('--report-format', choices=['pdf', 'html'], default='pdf',
+                        help='The format of the report with the summary plots.')
+    parser.add_argument('--plot-workers', type=int, default=1,
+                        help='The number of processes rendering the figures of the pdf report. '
+                             'With more than one, the pages of the pdf are rendered as images.')
+    parser.add_argument('--max-plot-points', type=int, default=DEFAULT_MAX_POINTS,
+                        help='The maximum number of points plotted per line. Longer lines are '
+                             'decimated preserving the minima and maxima. 0 plots all samples.')
+    parser.add_argument('--window-seconds', type=float, default=None,
+                        help='Whether to also calculate the metrics per rolling window of this '
+                             'duration and per airborne segment, and output the worst window and '
+                             'segment values.')
+    parser.add_argument('--window-overlap', type=float, default=0.5,
+                        help='The overlap of consecutive rolling windows as a fraction of the '
+                             'window.')
+    parser.add_argument('--check-worst-window', action='store_true',
+                        help='Whether the checks also fail or warn on the worst rolling window '
+                             'values.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Whether to record the wall time, cpu time and peak memory of every '
+                             'stage in a <file>{:s} file.'.format(PROFILE_SUFFIX))
+    parser.add_argument('--ulog-cache', type=str, default=None,
+                        help='The directory of the cache of decoded logs shared with other tools. '
+                             'Defaults to ${:s} if set.'.format(ULOG_CACHE_DIR_ENV))
+    parser.add_argument('--live', action='store_true',
+                        help='Whether to follow the log while it is being written and print the '
+                             'check status during the flight, before analysing the complete log.')
+    parser.add_argument('--live-interval', type=float, default=5.0,
+                        help='The time in seconds between two check status reports of the live '
+                             'analysis.')
+    parser.add_argument('--live-idle-timeout', type=float, default=30.0,
+                        help='The live analysis ends when the log has not grown for this time in '
+                             'seconds.')
     return parser.parse_args()
 
 
@@ -57,8 +102,13 @@ def create_results_table(
     except:
         raise PreconditionError('could not find {:s}'.format(check_table_filename))
 
-    # store metrics
+    # store metrics, the descriptions of the worst window and segment metrics are derived from
+    # the metric name
     for key, value in metrics.items():
+        if key not in test_results_table:
+            for suffix, description in WINDOWED_METRIC_SUFFIXES:
+                if key.endswith(suffix) and key[:-len(suffix)] in test_results_table:
+                    test_results_table[key] = [float('NaN'), description.format(key[:-len(suffix)])]
         test_results_table[key][0] = value
 
     # store check results
@@ -82,13 +132,15 @@ def create_results_table(
 
 def process_logdata_ekf(
         filename: str, check_level_dict_filename: str, check_table_filename: str,
-        plot: bool = True, sensor_safety_margins: bool = True):
+        plot: bool = True, sensor_safety_margins: bool = True,
+        results_store_filename: Optional[str] = None, mdat_csv: bool = True,
+        report_format: str = 'pdf', plot_workers: int = 1,
+        max_plot_points: int = DEFAULT_MAX_POINTS, profile: bool = False,
+        window_seconds: Optional[float] = None, window_overlap: float = 0.5,
+        check_worst_window: bool = False, live: bool = False, live_interval: float = 5.0,
+        live_idle_timeout: float = 30.0, ulog_cache_directory: Optional[str] = None):
 
-    ## load the log and extract the necessary data for the analyses
-    try:
-        ulog = ULog(filename)
-    except:
-        raise PreconditionError('could not open {:s}'.format(filename))
+    profiler = StageProfiler(enabled=profile)
 
     try:
         # get the dictionary of fail and warning test thresholds from a csv file
@@ -100,31 +152,68 @@ def process_logdata_ekf(
         raise PreconditionError('could not find {:s}'.format(check_level_dict_filename))
 
     in_air_margin = 5.0 if sensor_safety_margins else 0.0
-    # perform the ekf analysis
-    master_status, check_status, metrics, airtime_info = analyse_ekf(
-        ulog, check_levels, red_thresh=1.0, amb_thresh=0.5, min_flight_duration_seconds=5.0,
-        in_air_margin_seconds=in_air_margin)
-
-    test_results = create_results_table(
-        check_table_filename, master_status, check_status, metrics, airtime_info)
 
-    # write metadata to a .csv file
-    with open('{:s}.mdat.csv'.format(filename), "w") as file:
+    if live:
+        # report the check status while the log is being written
+        with profiler.stage('live_analysis'):
+            monitor_logdata_ekf(
+                filename, check_levels, interval_seconds=live_interval,
+                idle_timeout_seconds=live_idle_timeout, red_thresh=1.0, amb_thresh=0.5,
+                min_flight_duration_seconds=5.0, in_air_margin_seconds=in_air_margin)
 
-        file.write("name,value,description\n")
-
-        # loop through the test results dictionary and write each entry on a separate row, with data comma separated
-        # save data in alphabetical order
-        key_list = list(test_results.keys())
-        key_list.sort()
-        for key in key_list:
-            file.write(key + "," + str(test_results[key][0]) + "," + test_results[key][1] + "\n")
-    print('Test results written to {:s}.mdat.csv'.format(filename))
+    ## load the log and extract the necessary data for the analyses. Only the topics and fields
+    ## required by the analysis (and the report) are loaded.
+    try:
+        with profiler.stage('load_ulog'):
+            ulog = load_ulog(filename, ['analysis', 'pdf_report'] if plot else ['analysis'],
+                             cache_directory=ulog_cache_directory)
+    except:
+        raise PreconditionError('could not open {:s}'.format(filename))
 
-    if plot:
-        create_pdf_report(ulog, '{:s}.pdf'.format(filename))
+    # perform the ekf analysis
+    master_status, check_status, metrics, airtime_info = analyse_ekf(
+        ulog, check_levels, red_thresh=1.0, amb_thresh=0.5, min_flight_duration_seconds=5.0,
+        in_air_margin_seconds=in_air_margin, profiler=profiler, window_seconds=window_seconds,
+        window_overlap=window_overlap, check_worst_window=check_worst_window)
+
+    with profiler.stage('results_table'):
+        test_results = create_results_table(
+            check_table_filename, master_status, check_status, metrics, airtime_info)
+
+    if mdat_csv:
+        # write metadata to a .csv file
+        with profiler.stage('write_mdat_csv'), open('{:s}.mdat.csv'.format(filename), "w") as file:
+
+            file.write("name,value,description\n")
+
+            # loop through the test results dictionary and write each entry on a separate row, with data comma separated
+            # save data in alphabetical order
+            key_list = list(test_results.keys())
+            key_list.sort()
+            for key in key_list:
+                file.write(key + "," + str(test_results[key][0]) + "," + test_results[key][1] + "\n")
+        print('Test results written to {:s}.mdat.csv'.format(filename))
+
+    if results_store_filename is not None:
+        with profiler.stage('results_store'), ResultsStore(results_store_filename) as results_store:
+            results_store.append(os.path.abspath(filename), test_results)
+        print('Test results appended to {:s}'.format(results_store_filename))
+
+    if plot and report_format == 'html':
+        with profiler.stage('html_report'):
+            create_html_report(ulog, '{:s}.html'.format(filename), max_points=max_plot_points)
+        print('Plots saved to {:s}.html'.format(filename))
+    elif plot:
+        with profiler.stage('pdf_report'):
+            create_pdf_report(
+                ulog, '{:s}.pdf'.format(filename), workers=plot_workers,
+                max_points=max_plot_points)
         print('Plots saved to {:s}.pdf'.format(filename))
 
+    if profile:
+        profiler.save('{:s}{:s}'.format(filename, PROFILE_SUFFIX), log_filename=filename)
+        print('Profile saved to {:s}{:s}'.format(filename, PROFILE_SUFFIX))
+
     return test_results
 
 
@@ -147,7 +236,14 @@ def main() -> None:
     try:
         test_results = process_logdata_ekf(
             args.filename, check_level_dict_filename, check_table_filename,
-            plot=not args.no_plots, sensor_safety_margins=not args.no_sensor_safety_margin)
+            plot=not args.no_plots, sensor_safety_margins=not args.no_sensor_safety_margin,
+            results_store_filename=args.results_store, mdat_csv=not args.no_mdat_csv,
+            report_format=args.report_format, plot_workers=args.plot_workers,
+            max_plot_points=args.max_plot_points, profile=args.profile,
+            window_seconds=args.window_seconds, window_overlap=args.window_overlap,
+            check_worst_window=args.check_worst_window, live=args.live,
+            live_interval=args.live_interval, live_idle_timeout=args.live_idle_timeout,
+            ulog_cache_directory=args.ulog_cache)
     except Exception as e:
         print(str(e))
         sys.exit(-1)
@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+"""
+Re-scores the stored ecl ekf analysis results of a log population against new check thresholds,
+without reanalysing the logs. All logs are checked at once by the vectorized check engine, and the
+number of logs whose check status changed is reported.
+"""
+
+import argparse
+import csv
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from analysis.checks import perform_fleet_checks, get_status_names, STATUS_CODES, \
+    STATUS_NOT_APPLICABLE
+from results_store import ResultsStore, RESULTS_STORE_FILENAME, load_mdat_csv_files
+
+
+def load_check_levels(filename: str) -> Dict[str, float]:
+    """
+    :param filename: a check level csv file in the format of check_level_dict.csv.
+    :return: a dict of check level name to threshold.
+    """
+    with open(filename, 'r') as file:
+        reader = csv.DictReader(file)
+        return {row['check_id']: float(row['threshold']) for row in reader}
+
+
+def load_results(path: str) -> Dict[str, np.ndarray]:
+    """
+    loads the analysis results of a log population.
+    :param path: a results store, or a directory containing a results store or .mdat.csv files.
+    :return: a dict of result name to an array with one entry per log.
+    """
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, RESULTS_STORE_FILENAME)):
+        path = os.path.join(path, RESULTS_STORE_FILENAME)
+    if os.path.isdir(path):
+        return load_mdat_csv_files(path)
+    with ResultsStore(path) as results_store:
+        return results_store.get_columns()
+
+
+def get_stored_status_codes(results: Dict[str, np.ndarray], names: List[str]) -> \
+        Dict[str, np.ndarray]:
+    """
+    converts the stored check statuses to status codes.
+    :param results:
+    :param names: the check status names.
+    :return: a dict of check status name to an array of status codes.
+    """
+    n_logs = len(results['log_filename'])
+    status_codes = dict()
+    for name in names:
+        statuses = results.get(name, np.full(n_logs, 'nan'))
+        status_codes[name] = np.array([STATUS_CODES.get(str(status), STATUS_NOT_APPLICABLE)
+                                       for status in statuses], dtype=int)
+    return status_codes
+
+
+def get_metric_columns(results: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    :param results:
+    :return: the numeric result columns.
+    """
+    return {name: column for name, column in results.items()
+            if column.dtype.kind == 'f' and not name.endswith('_status')}
+
+
+def print_status_changes(baseline: Dict[str, np.ndarray], rescored: Dict[str, np.ndarray]) -> None:
+    """
+    prints the number of logs per status transition of every check.
+    :param baseline: a dict of check status name to the baseline status codes.
+    :param rescored: a dict of check status name to the re-scored status codes.
+    :return:
+    """
+    names = ['master_status'] + sorted(name for name in rescored if name != 'master_status')
+    for name in names:
+        baseline_names = get_status_names(baseline[name])
+        rescored_names = get_status_names(rescored[name])
+        changed = baseline[name] != rescored[name]
+        print('{:<30s} {:6d} changed'.format(name, int(np.count_nonzero(changed))))
+        transitions, counts = np.unique(
+            np.array(['{:s} -> {:s}'.format(b, r) for b, r in zip(
+                baseline_names[changed], rescored_names[changed])], dtype=str),
+            return_counts=True)
+        for transition, count in zip(transitions, counts):
+            print('    {:<26s} {:6d}'.format(transition, int(count)))
+
+
+def write_status_changes(
+        filename: str, log_filenames: np.ndarray, baseline: Dict[str, np.ndarray],
+        rescored: Dict[str, np.ndarray]) -> None:
+    """
+    writes the logs with a changed status to a csv file with one row per log and check.
+    :param filename:
+    :param log_filenames:
+    :param baseline:
+    :param rescored:
+    :return:
+    """
+    with open(filename, 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow(['log_filename', 'check', 'baseline_status', 'rescored_status'])
+        for name in sorted(rescored.keys()):
+            for i in np.flatnonzero(baseline[name] != rescored[name]):
+                writer.writerow([log_filenames[i], name, get_status_names(baseline[name][i]),
+                                 get_status_names(rescored[name][i])])
+
+
+def rescore_checks(
+        results: Dict[str, np.ndarray], check_levels: Dict[str, float],
+        baseline_check_levels: Optional[Dict[str, float]] = None,
+        check_worst_window: bool = False) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    re-scores the results of a log population.
+    :param results: a dict of result name to an array with one entry per log.
+    :param check_levels: the new check levels.
+    :param baseline_check_levels: the check levels to compare to. The stored check statuses are
+    the baseline if None.
+    :param check_worst_window:
+    :return: a dict with the baseline and the re-scored status codes.
+    """
+    metrics = get_metric_columns(results)
+    rescored = perform_fleet_checks(metrics, check_levels, check_worst_window=check_worst_window)
+    if baseline_check_levels is None:
+        baseline = get_stored_status_codes(results, list(rescored.keys()))
+    else:
+        baseline = perform_fleet_checks(
+            metrics, baseline_check_levels, check_worst_window=check_worst_window)
+    return {'baseline': baseline, 'rescored': rescored}
+
+
+def main() -> None:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(
+        description='Re-score stored ecl ekf analysis results against new check thresholds.')
+    parser.add_argument('results', help='a results store, or a directory containing a results '
+                                        'store or .mdat.csv files')
+    parser.add_argument('--check-level-thresholds', type=str, required=True,
+                        help='the csv file of the new fail and warning test thresholds.')
+    parser.add_argument('--baseline-thresholds', type=str, default=None,
+                        help='the csv file of the thresholds to compare to. Defaults to the '
+                             'stored check statuses. Use {:s} to compare to the default '
+                             'thresholds.'.format(os.path.join(file_dir, 'check_level_dict.csv')))
+    parser.add_argument('--check-worst-window', action='store_true',
+                        help='whether to also check the worst rolling window metrics.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='a csv file to write the logs with a changed status to.')
+    args = parser.parse_args()
+
+    results = load_results(args.results)
+    n_logs = len(results['log_filename'])
+
+    start_time = time.perf_counter()
+    status_codes = rescore_checks(
+        results, load_check_levels(args.check_level_thresholds),
+        baseline_check_levels=load_check_levels(args.baseline_thresholds)
+        if args.baseline_thresholds is not None else None,
+        check_worst_window=args.check_worst_window)
+    rescore_time = time.perf_counter() - start_time
+
+    baseline, rescored = status_codes['baseline'], status_codes['rescored']
+    print_status_changes(baseline, rescored)
+
+    changed = np.zeros(n_logs, dtype=bool)
+    for name in rescored.keys():
+        changed |= baseline[name] != rescored[name]
+    print('{:d} of {:d} logs changed status, {:d} changed master status ({:.3f}s)'.format(
+        int(np.count_nonzero(changed)), n_logs,
+        int(np.count_nonzero(baseline['master_status'] != rescored['master_status'])),
+        rescore_time))
+
+    if args.output is not None:
+        write_status_changes(args.output, results['log_filename'], baseline, rescored)
+        print('Status changes written to {:s}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+"""
+Append-only columnar store of the ecl ekf analysis results. Every analysed log adds one row with
+one column per metric and check status to an sqlite database. The population analysis reads
+whole columns as numpy arrays, instead of parsing one .mdat.csv file per log.
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+RESULTS_STORE_FILENAME = 'ecl_ekf_results.sqlite'
+
+
+class ResultsStore(object):
+    """
+    an sqlite database with one row per analysed log and one column per result.
+    """
+
+    def __init__(self, filename: str, timeout: float = 60.0) -> None:
+        """
+        opens or creates a results store.
+        :param filename:
+        :param timeout: the time in seconds to wait for a concurrent writer.
+        """
+        self._filename = filename
+        # autocommit mode: transactions are started explicitly
+        self._connection = sqlite3.connect(filename, timeout=timeout, isolation_level=None)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'log_filename TEXT NOT NULL, analysis_time REAL NOT NULL)')
+
+    def close(self) -> None:
+        """
+        closes the database connection.
+        :return:
+        """
+        self._connection.close()
+
+    def __enter__(self) -> 'ResultsStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _get_column_types(self) -> Dict[str, str]:
+        """
+        :return: a dict of column name to declared sql type.
+        """
+        return {row[1]: row[2] for row in self._connection.execute('PRAGMA table_info(results)')}
+
+    def append(self, log_filename: str, test_results: Dict[str, list]) -> None:
+        """
+        appends the results of a log. Columns of results not seen before are added.
+        :param log_filename:
+        :param test_results: a dict of result name to [value, description] as created by
+        process_logdata_ekf.
+        :return:
+        """
+        values = {key: value[0] for key, value in test_results.items()}
+        for key, value in values.items():
+            if isinstance(value, np.generic):
+                values[key] = value.item()
+
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            column_types = self._get_column_types()
+            for key in sorted(values.keys()):
+                if key not in column_types:
+                    self._connection.execute('ALTER TABLE results ADD COLUMN "{:s}" {:s}'.format(
+                        key, 'TEXT' if isinstance(values[key], str) else 'REAL'))
+
+            names = ['log_filename', 'analysis_time'] + list(values.keys())
+            self._connection.execute(
+                'INSERT INTO results ({:s}) VALUES ({:s})'.format(
+                    ', '.join('"{:s}"'.format(name) for name in names),
+                    ', '.join(['?'] * len(names))),
+                [log_filename, time.time()] + list(values.values()))
+            self._connection.execute('COMMIT')
+        except:
+            self._connection.execute('ROLLBACK')
+            raise
+
+    def get_columns(
+            self, names: Optional[List[str]] = None, after_id: int = 0) -> Dict[str, np.ndarray]:
+        """
+        returns the latest results of every log as columns.
+        :param names: the names of the columns to return. Returns all columns if None.
+        :param after_id: only returns results appended after the result with this id.
+        :return: a dict of column name to numpy array with one entry per log. Numeric columns are
+        float arrays with nan for missing values, text columns are string arrays. The id and
+        log_filename columns are always returned.
+        """
+        column_types = self._get_column_types()
+        if names is None:
+            names = list(column_types.keys())
+        else:
+            names = ['id', 'log_filename'] + [
+                name for name in names if name not in ['id', 'log_filename']]
+
+        rows = self._connection.execute(
+            'SELECT {:s} FROM results WHERE id IN (SELECT MAX(id) FROM results WHERE id > ? '
+            'GROUP BY log_filename) ORDER BY log_filename'.format(
+                ', '.join('"{:s}"'.format(name) for name in names if name in column_types)
+            ), (after_id,)).fetchall()
+        values = dict(zip([name for name in names if name in column_types], zip(*rows)))
+
+        columns = dict()
+        for name in names:
+            column = values.get(name, (None,) * len(rows))
+            if name == 'id':
+                columns[name] = np.array(column, dtype=np.int64)
+            elif column_types.get(name, 'REAL') == 'REAL':
+                columns[name] = np.array(column, dtype=float)
+            else:
+                columns[name] = np.array(['' if v is None else v for v in column], dtype=str)
+        return columns
+
+    def export_csv(self, csv_filename: str) -> None:
+        """
+        exports the latest results of every log to a csv file with one row per log.
+        :param csv_filename:
+        :return:
+        """
+        columns = self.get_columns()
+        names = ['log_filename'] + sorted(
+            name for name in columns.keys() if name not in ['id', 'log_filename'])
+        with open(csv_filename, 'w') as file:
+            writer = csv.writer(file)
+            writer.writerow(names)
+            for i in range(len(columns['log_filename'])):
+                writer.writerow([columns[name][i] for name in names])
+
+
+def load_mdat_csv_files(
+        metadata_directory: str, exclude: Iterable[str] = ()) -> Dict[str, np.ndarray]:
+    """
+    loads the .mdat.csv files in a directory into columns with one entry per log, in the format
+    of ResultsStore.get_columns.
+    :param metadata_directory:
+    :param exclude: the .mdat.csv files to skip.
+    :return: a dict of result name to numpy array.
+    """
+    # Loop through the csv files in the directory and load the metadata into a list of dictionaries
+    log_data = []
+    for filename in sorted(os.listdir(metadata_directory)):
+        if filename.endswith(".mdat.csv") and filename not in exclude:
+            print("loading "+filename)
+            single_log_data = {'log_filename': filename} # meta data dictionary for a single log
+            with open(os.path.join(metadata_directory, filename)) as file:
+                for line in file:
+                    x = line.split(",")
+                    try:
+                        single_log_data[x[0]] = float(x[1])
+                    except:
+                        single_log_data[x[0]] = x[1]
+            log_data.append(single_log_data)
+
+    # convert to columns: numeric results to float arrays, all other results to string arrays
+    columns = {}
+    for name in set(key for single_log_data in log_data for key in single_log_data.keys()):
+        values = [single_log_data.get(name, float('NaN')) for single_log_data in log_data]
+        if all(isinstance(value, float) for value in values):
+            columns[name] = np.array(values, dtype=float)
+        else:
+            columns[name] = np.array([str(value) for value in values], dtype=str)
+    columns.setdefault('log_filename', np.array([], dtype=str))
+    return columns
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Export an ecl ekf results store to csv.')
+    parser.add_argument('results_store', help='the sqlite results store')
+    parser.add_argument('csv_filename', help='the csv file to write')
+    args = parser.parse_args()
+
+    with ResultsStore(args.results_store) as results_store:
+        results_store.export_csv(args.csv_filename)
+    print('Results exported to {:s}'.format(args.csv_filename))
+
+
+if __name__ == '__main__':
+    main()
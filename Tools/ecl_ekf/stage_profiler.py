@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+"""
+Opt-in instrumentation of the stages of the ecl ekf analysis. Records the wall time, cpu time and
+peak resident set size of every stage and saves them to a json sidecar file per log.
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+PROFILE_SUFFIX = '.profile.json'
+
+
+def _reset_peak_rss() -> bool:
+    """
+    resets the peak resident set size of the process (linux only).
+    :return: whether the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _get_peak_rss_mb() -> Optional[float]:
+    """
+    :return: the peak resident set size of the process in MB since the last reset, or None if it
+    is not available on this platform.
+    """
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KB on linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else max_rss / 1024.0
+
+
+class StageProfiler(object):
+    """
+    records the wall time, cpu time and peak resident set size of consecutive stages. A disabled
+    profiler records nothing, such that the stages can be instrumented unconditionally.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        """
+        :param enabled:
+        """
+        self._enabled = enabled
+        self._stages = list()  # type: List[Dict[str, object]]
+        self._start_wall_time = time.perf_counter()
+        self._start_cpu_time = time.process_time()
+
+    @property
+    def enabled(self) -> bool:
+        """
+        :return: whether the profiler records the stages.
+        """
+        return self._enabled
+
+    @property
+    def stages(self) -> List[Dict[str, object]]:
+        """
+        :return: a list of the recorded stages in the order they completed.
+        """
+        return self._stages
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        a context manager recording a stage. Stages should not be nested, as the peak resident set
+        size is reset at the beginning of every stage where supported.
+        :param name:
+        :return:
+        """
+        if not self._enabled:
+            yield
+            return
+
+        peak_is_reset = _reset_peak_rss()
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        try:
+            yield
+        finally:
+            self._stages.append({
+                'name': name, 'wall_time': time.perf_counter() - start_wall_time,
+                'cpu_time': time.process_time() - start_cpu_time,
+                'peak_rss_mb': _get_peak_rss_mb(), 'peak_rss_is_per_stage': peak_is_reset})
+
+    def to_dict(self) -> Dict[str, object]:
+        """
+        :return: the recorded stages and the totals since the profiler was created.
+        """
+        peak_rss = [stage['peak_rss_mb'] for stage in self._stages
+                    if stage['peak_rss_mb'] is not None]
+        return {'stages': self._stages, 'total': {
+            'wall_time': time.perf_counter() - self._start_wall_time,
+            'cpu_time': time.process_time() - self._start_cpu_time,
+            'peak_rss_mb': max(peak_rss) if peak_rss else None}}
+
+    def save(self, filename: str, log_filename: Optional[str] = None) -> None:
+        """
+        saves the profile to a json file.
+        :param filename:
+        :param log_filename: the analysed log.
+        :return:
+        """
+        profile = self.to_dict()
+        if log_filename is not None:
+            profile['log_filename'] = log_filename
+        with open(filename, 'w') as file:
+            json.dump(profile, file, indent=2)
+
+
+def aggregate_profiles(profiles: List[Dict[str, object]]) -> Dict[str, Dict[str, object]]:
+    """
+    aggregates the profiles of several logs to statistics per stage.
+    :param profiles: a list of profiles as created by StageProfiler.to_dict().
+    :return: a dict of stage name to the number of logs and the sum, mean, median, 95th percentile
+    and maximum of the wall time, cpu time and peak resident set size. The stages are in the order
+    of their first occurrence.
+    """
+    values = dict()  # type: Dict[str, Dict[str, List[float]]]
+    for profile in profiles:
+        for stage in profile['stages'] + [dict(profile['total'], name='total')]:
+            stage_values = values.setdefault(
+                stage['name'], {'wall_time': [], 'cpu_time': [], 'peak_rss_mb': []})
+            for key, value_list in stage_values.items():
+                if stage.get(key) is not None:
+                    value_list.append(stage[key])
+
+    aggregate = dict()
+    for name, stage_values in values.items():
+        aggregate[name] = {'count': len(stage_values['wall_time'])}
+        for key, value_list in stage_values.items():
+            if not value_list:
+                continue
+            value_array = np.array(value_list, dtype=float)
+            aggregate[name][key] = {
+                'sum': float(np.sum(value_array)), 'mean': float(np.mean(value_array)),
+                'median': float(np.median(value_array)),
+                'p95': float(np.percentile(value_array, 95)),
+                'max': float(np.amax(value_array))}
+    return aggregate
@@ -0,0 +1,253 @@
+#! /usr/bin/env python3
+"""
+Writes synthetic but valid ULog files with the topics used by the ecl ekf analysis: estimator_status,
+ekf2_innovations, vehicle_land_detected and sensor_preflight. The logs contain a configurable number
+of take-off / landing cycles and are used as fixtures to benchmark the analysis.
+"""
+
+import argparse
+import struct
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+ULOG_HEADER_MAGIC = b'\x55\x4c\x6f\x67\x01\x12\x35'
+ULOG_FILE_VERSION = 1
+
+# uORB type name -> numpy type
+_FIELD_TYPES = {
+    'uint64_t': '<u8', 'int64_t': '<i8', 'uint32_t': '<u4', 'int32_t': '<i4', 'uint16_t': '<u2',
+    'int16_t': '<i2', 'uint8_t': 'u1', 'int8_t': 'i1', 'bool': 'u1', 'float': '<f4',
+    'double': '<f8'}
+
+# the size of the message header: msg_size (uint16_t) and msg_type (uint8_t)
+_MESSAGE_HEADER_SIZE = 3
+
+# a field of a topic: type, field name, array length (0 for a scalar)
+Field = Tuple[str, str, int]
+
+# topic name -> list of fields
+TOPICS = {
+    'estimator_status': [
+        ('uint64_t', 'timestamp', 0), ('float', 'vibe', 3), ('float', 'states', 24),
+        ('float', 'pos_horiz_accuracy', 0), ('float', 'pos_vert_accuracy', 0),
+        ('float', 'mag_test_ratio', 0), ('float', 'vel_test_ratio', 0),
+        ('float', 'pos_test_ratio', 0), ('float', 'hgt_test_ratio', 0),
+        ('float', 'tas_test_ratio', 0), ('float', 'hagl_test_ratio', 0),
+        ('uint32_t', 'control_mode_flags', 0), ('uint32_t', 'filter_fault_flags', 0),
+        ('uint16_t', 'gps_check_fail_flags', 0), ('uint16_t', 'innovation_check_flags', 0)],
+    'ekf2_innovations': [
+        ('uint64_t', 'timestamp', 0), ('float', 'vel_pos_innov', 6), ('float', 'mag_innov', 3),
+        ('float', 'heading_innov', 0), ('float', 'airspeed_innov', 0),
+        ('float', 'beta_innov', 0), ('float', 'flow_innov', 2),
+        ('float', 'vel_pos_innov_var', 6), ('float', 'mag_innov_var', 3),
+        ('float', 'heading_innov_var', 0), ('float', 'airspeed_innov_var', 0),
+        ('float', 'beta_innov_var', 0), ('float', 'flow_innov_var', 2),
+        ('float', 'output_tracking_error', 3)],
+    'vehicle_land_detected': [
+        ('uint64_t', 'timestamp', 0), ('bool', 'landed', 0)],
+    'sensor_preflight': [
+        ('uint64_t', 'timestamp', 0), ('float', 'accel_inconsistency_m_s_s', 0),
+        ('float', 'gyro_inconsistency_rad_s', 0)],
+}
+
+# the topics logged at the estimator rate, the other topics are logged at the status rate
+ESTIMATOR_RATE_TOPICS = ['estimator_status', 'ekf2_innovations']
+
+# control mode flags set during the whole log: tilt_aligned, yaw_aligned, using_gps, using_magyaw,
+# using_barohgt, and the airborne flag set while in air.
+_CONTROL_MODE_FLAGS = (1 << 0) | (1 << 1) | (1 << 2) | (1 << 5) | (1 << 9)
+_AIRBORNE_FLAG = 1 << 7
+
+
+def get_format_message(topic: str, fields: List[Field]) -> bytes:
+    """
+    :param topic:
+    :param fields:
+    :return: the format definition of a topic, e.g. b'sensor_preflight:uint64_t timestamp;...'.
+    """
+    return '{:s}:{:s}'.format(topic, ''.join(
+        '{:s}{:s} {:s};'.format(
+            field_type, '[{:d}]'.format(array_length) if array_length > 0 else '', field_name)
+        for field_type, field_name, array_length in fields)).encode()
+
+
+def get_message(msg_type: bytes, payload: bytes) -> bytes:
+    """
+    :param msg_type: the single character message type.
+    :param payload:
+    :return: the message with header.
+    """
+    return struct.pack('<HB', len(payload), ord(msg_type)) + payload
+
+
+def get_data_dtype(fields: List[Field]) -> np.dtype:
+    """
+    :param fields:
+    :return: the numpy dtype of a data message of a topic, including the message header and the
+    message id.
+    """
+    dtype = [('msg_size', '<u2'), ('msg_type', 'u1'), ('msg_id', '<u2')]
+    for field_type, field_name, array_length in fields:
+        if array_length > 0:
+            dtype.append((field_name, _FIELD_TYPES[field_type], (array_length,)))
+        else:
+            dtype.append((field_name, _FIELD_TYPES[field_type]))
+    return np.dtype(dtype)
+
+
+def write_ulog(filename: str, topic_data: Dict[str, np.ndarray], start_timestamp: int = 0,
+               block_duration_us: int = 1000000) -> None:
+    """
+    writes a ulog file with one subscription per topic.
+    :param filename:
+    :param topic_data: a dict of topic name to the data messages as structured array with the
+    dtype of get_data_dtype. The message headers are filled in.
+    :param start_timestamp: the timestamp of the file header in microseconds.
+    :param block_duration_us: the data messages of all topics are interleaved in blocks of this
+    duration, such that the file is approximately ordered by time.
+    :return:
+    """
+    with open(filename, 'wb') as file:
+        file.write(ULOG_HEADER_MAGIC + struct.pack('<BQ', ULOG_FILE_VERSION, start_timestamp))
+        for topic, fields in TOPICS.items():
+            file.write(get_message(b'F', get_format_message(topic, fields)))
+        for msg_id, topic in enumerate(TOPICS):
+            file.write(get_message(b'A', struct.pack('<BH', 0, msg_id) + topic.encode()))
+
+        messages = list()
+        for msg_id, topic in enumerate(TOPICS):
+            data = topic_data[topic]
+            data['msg_size'] = data.dtype.itemsize - _MESSAGE_HEADER_SIZE
+            data['msg_type'] = ord('D')
+            data['msg_id'] = msg_id
+            messages.append(data)
+
+        end_timestamp = max(int(data['timestamp'][-1]) for data in messages)
+        start_indices = [0] * len(messages)
+        for block_end in range(block_duration_us, end_timestamp + 2 * block_duration_us,
+                               block_duration_us):
+            for i, data in enumerate(messages):
+                end_index = np.searchsorted(data['timestamp'], block_end)
+                file.write(data[start_indices[i]:end_index].tobytes())
+                start_indices[i] = end_index
+
+
+def generate_topic_data(
+        duration_seconds: float = 600.0, estimator_rate_hz: float = 100.0,
+        status_rate_hz: float = 10.0, n_flights: int = 2, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    generates the data of a log with alternating on-ground and in-air segments of equal duration,
+    starting and finishing on ground.
+    :param duration_seconds:
+    :param estimator_rate_hz: the rate of estimator_status and ekf2_innovations.
+    :param status_rate_hz: the rate of vehicle_land_detected and sensor_preflight.
+    :param n_flights: the number of take-off / landing cycles.
+    :param seed: the seed of the random number generator.
+    :return: a dict of topic name to data messages.
+    """
+    rng = np.random.default_rng(seed)
+    start_timestamp = 1000000
+
+    topic_data = dict()
+    for topic, fields in TOPICS.items():
+        rate_hz = estimator_rate_hz if topic in ESTIMATOR_RATE_TOPICS else status_rate_hz
+        n_samples = int(duration_seconds * rate_hz)
+        data = np.zeros(n_samples, dtype=get_data_dtype(fields))
+        data['timestamp'] = start_timestamp + (np.arange(n_samples) * 1e6 / rate_hz).astype(
+            np.uint64)
+        topic_data[topic] = data
+
+    # land detector: the flights are the odd segments of 2 * n_flights + 1 equal segments
+    land_detected = topic_data['vehicle_land_detected']
+    land_time = 1e-6 * land_detected['timestamp']
+    segment_edges = np.linspace(land_time[0], land_time[-1], 2 * n_flights + 2)
+    landed = np.ones(len(land_time), dtype=np.uint8)
+    for flight in range(n_flights):
+        landed[(land_time >= segment_edges[2 * flight + 1]) &
+               (land_time < segment_edges[2 * flight + 2])] = 0
+    land_detected['landed'] = landed
+
+    # estimator status
+    estimator_status = topic_data['estimator_status']
+    n_samples = len(estimator_status)
+    for field in ['mag_test_ratio', 'vel_test_ratio', 'pos_test_ratio', 'hgt_test_ratio']:
+        estimator_status[field] = np.abs(rng.normal(0.3, 0.2, n_samples))
+    estimator_status['tas_test_ratio'] = 0.0
+    estimator_status['hagl_test_ratio'] = np.abs(rng.normal(0.2, 0.2, n_samples))
+    estimator_status['vibe'] = np.abs(rng.normal(0.001, 0.0005, (n_samples, 3)))
+    estimator_status['states'] = rng.normal(0.0, 0.001, (n_samples, 24))
+    # earth magnetic field (states[16:19]) of a plausible strength and inclination
+    estimator_status['states'][:, 16] = 0.2
+    estimator_status['states'][:, 18] = 0.4
+    estimator_status['pos_horiz_accuracy'] = 0.5
+    estimator_status['pos_vert_accuracy'] = 0.8
+    airborne = np.interp(1e-6 * estimator_status['timestamp'], land_time,
+                         1.0 - landed.astype(float)) > 0.5
+    estimator_status['control_mode_flags'] = _CONTROL_MODE_FLAGS + airborne * _AIRBORNE_FLAG
+    estimator_status['innovation_check_flags'] = (rng.random(n_samples) < 0.01) * rng.integers(
+        0, 1 << 12, n_samples)
+    estimator_status['gps_check_fail_flags'] = (rng.random(n_samples) < 0.01) * rng.integers(
+        0, 1 << 10, n_samples)
+
+    # innovations
+    innovations = topic_data['ekf2_innovations']
+    n_samples = len(innovations)
+    for field, array_length in [('vel_pos_innov', 6), ('mag_innov', 3), ('flow_innov', 2)]:
+        innovations[field] = rng.normal(0.0, 0.1, (n_samples, array_length))
+        innovations['{:s}_var'.format(field)] = 0.01
+    for field in ['heading_innov', 'airspeed_innov', 'beta_innov']:
+        innovations[field] = rng.normal(0.0, 0.1, n_samples)
+        innovations['{:s}_var'.format(field)] = 0.01
+    innovations['output_tracking_error'] = np.abs(rng.normal(0.01, 0.005, (n_samples, 3)))
+
+    # sensor preflight
+    sensor_preflight = topic_data['sensor_preflight']
+    n_samples = len(sensor_preflight)
+    sensor_preflight['accel_inconsistency_m_s_s'] = np.abs(rng.normal(0.1, 0.05, n_samples))
+    sensor_preflight['gyro_inconsistency_rad_s'] = np.abs(rng.normal(0.01, 0.005, n_samples))
+
+    return topic_data
+
+
+def generate_ulog(
+        filename: str, duration_seconds: float = 600.0, estimator_rate_hz: float = 100.0,
+        status_rate_hz: float = 10.0, n_flights: int = 2, seed: int = 0) -> None:
+    """
+    generates a synthetic ulog file. See generate_topic_data for the parameters.
+    :param filename:
+    :param duration_seconds:
+    :param estimator_rate_hz:
+    :param status_rate_hz:
+    :param n_flights:
+    :param seed:
+    :return:
+    """
+    write_ulog(filename, generate_topic_data(
+        duration_seconds=duration_seconds, estimator_rate_hz=estimator_rate_hz,
+        status_rate_hz=status_rate_hz, n_flights=n_flights, seed=seed))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic ULog file with the topics used by the ecl ekf analysis.')
+    parser.add_argument('filename', metavar='file.ulg', help='ULog output file')
+    parser.add_argument('--duration', type=float, default=600.0,
+                        help='The duration of the log in seconds.')
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help='The rate of estimator_status and ekf2_innovations in Hz.')
+    parser.add_argument('--status-rate', type=float, default=10.0,
+                        help='The rate of vehicle_land_detected and sensor_preflight in Hz.')
+    parser.add_argument('--flights', type=int, default=2,
+                        help='The number of take-off / landing cycles.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the random number generator.')
+    args = parser.parse_args()
+
+    generate_ulog(args.filename, duration_seconds=args.duration, estimator_rate_hz=args.rate,
+                  status_rate_hz=args.status_rate, n_flights=args.flights, seed=args.seed)
+    print('Synthetic log written to {:s}'.format(args.filename))
+
+
+if __name__ == '__main__':
+    main()
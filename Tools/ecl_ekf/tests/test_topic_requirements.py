@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+"""
+tests that the registered topic requirements match the topics and fields accessed by the analysis
+and the pdf report.
+"""
+
+import os
+import sys
+import csv
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from analyse_logdata_ekf import analyse_ekf
+from plotting.pdf_report import create_pdf_report
+from analysis.topic_requirements import get_topic_requirements
+
+
+class RecordingDict(dict):
+    """
+    a dict of topic data that records the accessed fields. Fields that are not part of the
+    requirements are created on access.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.accessed = set()
+
+    def __getitem__(self, key):
+        self.accessed.add(key)
+        if not super().__contains__(key):
+            super().__setitem__(key, np.random.random(len(super().__getitem__('timestamp'))))
+        return super().__getitem__(key)
+
+
+class Dataset(object):
+    """
+    a ulog dataset stub.
+    """
+    def __init__(self, data: RecordingDict) -> None:
+        self.data = data
+
+
+class RecordingULog(object):
+    """
+    a ulog stub that records the accessed topics.
+    """
+    def __init__(self, requirements: dict, n_samples: int = 2000) -> None:
+        self.start_timestamp = 0
+        self.accessed = set()
+        self._datasets = dict()
+        timestamp = np.arange(n_samples, dtype=np.uint64) * 10000 + 1000000
+        for topic, fields in requirements.items():
+            data = RecordingDict({
+                field: np.random.uniform(0.1, 1.2, n_samples) for field in fields})
+            data['timestamp'] = timestamp
+            self._datasets[topic] = Dataset(data)
+
+        # make all checks and plots apply
+        estimator_status = self._datasets['estimator_status'].data
+        estimator_status['control_mode_flags'] = np.full(n_samples, 2 ** 15 - 1, dtype=np.uint32)
+        estimator_status['innovation_check_flags'] = np.random.randint(
+            0, 2 ** 12, n_samples).astype(np.uint16)
+        estimator_status['gps_check_fail_flags'] = np.random.randint(
+            0, 2 ** 10, n_samples).astype(np.uint16)
+        estimator_status['filter_fault_flags'] = np.zeros(n_samples, dtype=np.uint32)
+        landed = np.ones(n_samples, dtype=np.int8)
+        landed[n_samples // 10: -n_samples // 10] = 0
+        self._datasets['vehicle_land_detected'].data['landed'] = landed
+
+    def get_dataset(self, name: str) -> Dataset:
+        self.accessed.add(name)
+        return self._datasets[name]
+
+    def get_accessed(self) -> dict:
+        # the timestamp field is always loaded
+        return {topic: dataset.data.accessed | {'timestamp'}
+                for topic, dataset in self._datasets.items() if topic in self.accessed}
+
+
+def get_check_levels() -> dict:
+    check_level_dict_filename = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir, 'check_level_dict.csv')
+    with open(check_level_dict_filename, 'r') as file:
+        reader = csv.DictReader(file)
+        return {row['check_id']: float(row['threshold']) for row in reader}
+
+
+def test_analysis_requirements():
+    requirements = get_topic_requirements(['analysis'])
+    ulog = RecordingULog(get_topic_requirements())
+    analyse_ekf(ulog, get_check_levels())
+    assert ulog.get_accessed() == requirements
+
+
+def test_pdf_report_requirements(tmp_path):
+    requirements = get_topic_requirements(['pdf_report'])
+    ulog = RecordingULog(get_topic_requirements(), n_samples=500)
+    create_pdf_report(ulog, str(tmp_path / 'report.pdf'))
+    assert ulog.get_accessed() == requirements
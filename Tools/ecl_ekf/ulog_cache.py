@@ -0,0 +1,315 @@
+#! /usr/bin/env python3
+"""
+On-disk cache of decoded ULog files, shared by the ecl ekf analysis, process_sensor_caldata.py and
+geotag_images_ulog.py. Every topic of a log is stored as a structured .npy array, such that later
+tools map the data with np.load(mmap_mode='r') instead of parsing the log again. The cache entries
+are keyed by a hash of the log content and the cache format version, and evicted by age and by the
+total size of the cache.
+
+The cache is enabled by passing a cache directory to open_ulog, or by setting the ULOG_CACHE_DIR
+environment variable.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pyulog import ULog
+
+# increment when the layout of the cache entries changes
+ULOG_CACHE_FORMAT_VERSION = 1
+ULOG_CACHE_DIR_ENV = 'ULOG_CACHE_DIR'
+
+DEFAULT_MAX_CACHE_BYTES = 4 * 1024 ** 3
+DEFAULT_MAX_AGE_DAYS = 30.0
+
+_METADATA_FILENAME = 'ulog.json'
+
+# the size of the chunks the log is hashed in
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def get_ulog_cache_key(filename: str) -> str:
+    """
+    hashes the whole content of a log, such that a log rewritten in place at the same size is not
+    mistaken for its cache entry. Reading the log is far cheaper than decoding it.
+    :param filename:
+    :return: the cache key of the log.
+    """
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_BYTES), b''):
+            file_hash.update(chunk)
+    return '{:s}-v{:d}'.format(file_hash.hexdigest(), ULOG_CACHE_FORMAT_VERSION)
+
+
+class CachedDataset(object):
+    """
+    a topic instance of a cached log with the attributes of pyulog's ULog.Data that the tools use.
+    The data is mapped from the cache on first access.
+    """
+
+    def __init__(self, filename: str, name: str, multi_id: int) -> None:
+        """
+        :param filename: the .npy file of the topic instance.
+        :param name:
+        :param multi_id:
+        """
+        self._filename = filename
+        self.name = name
+        self.multi_id = multi_id
+        self._data = None  # type: Optional[Dict[str, np.ndarray]]
+
+    @property
+    def data(self) -> Dict[str, np.ndarray]:
+        """
+        :return: a dict of field name to a read-only memory mapped array.
+        """
+        if self._data is None:
+            messages = np.load(self._filename, mmap_mode='r')
+            self._data = {name: messages[name] for name in messages.dtype.names}
+        return self._data
+
+
+class CachedULog(object):
+    """
+    a log opened from the cache, with the attributes of pyulog's ULog that the tools use.
+    """
+
+    def __init__(self, entry_directory: str,
+                 message_names: Optional[List[str]] = None) -> None:
+        """
+        :param entry_directory: the directory of the cache entry.
+        :param message_names: the topics to open, all if None.
+        """
+        with open(os.path.join(entry_directory, _METADATA_FILENAME), 'r') as file:
+            metadata = json.load(file)
+        self._start_timestamp = metadata['start_timestamp']
+        self._last_timestamp = metadata['last_timestamp']
+        self._msg_info_dict = metadata['msg_info_dict']
+        self._initial_parameters = metadata['initial_parameters']
+        self._data_list = [
+            CachedDataset(os.path.join(entry_directory, topic['filename']), topic['name'],
+                          topic['multi_id'])
+            for topic in metadata['topics']
+            if message_names is None or topic['name'] in message_names]
+
+    @property
+    def start_timestamp(self) -> int:
+        """
+        :return: the timestamp of the file header in microseconds.
+        """
+        return self._start_timestamp
+
+    @property
+    def last_timestamp(self) -> int:
+        """
+        :return: the largest timestamp of the data messages in microseconds.
+        """
+        return self._last_timestamp
+
+    @property
+    def msg_info_dict(self) -> dict:
+        """
+        :return: a dict of the info messages.
+        """
+        return self._msg_info_dict
+
+    @property
+    def initial_parameters(self) -> dict:
+        """
+        :return: a dict of the parameters at the log start.
+        """
+        return self._initial_parameters
+
+    @property
+    def data_list(self) -> List[CachedDataset]:
+        """
+        :return: the topic instances in the order they were added to the log.
+        """
+        return self._data_list
+
+    def get_dataset(self, name: str, multi_instance: int = 0) -> CachedDataset:
+        """
+        :param name:
+        :param multi_instance:
+        :return: the topic instance, raises an IndexError if it is not in the log, as pyulog.
+        """
+        return [dataset for dataset in self._data_list
+                if dataset.name == name and dataset.multi_id == multi_instance][0]
+
+
+class ULogCache(object):
+    """
+    a directory of cached logs, one sub directory per log.
+    """
+
+    def __init__(self, cache_directory: str, max_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+                 max_age_days: float = DEFAULT_MAX_AGE_DAYS) -> None:
+        """
+        :param cache_directory:
+        :param max_bytes: the maximum total size of the cache. The least recently used logs are
+        evicted when a log is added to a full cache.
+        :param max_age_days: logs that were not used for this time are evicted.
+        """
+        self._cache_directory = cache_directory
+        self._max_bytes = max_bytes
+        self._max_age_days = max_age_days
+
+    def open(self, filename: str, message_names: Optional[List[str]] = None) -> CachedULog:
+        """
+        opens a log from the cache. A log that is not cached yet is decoded completely and added,
+        such that it can be opened by tools requiring other topics later.
+        :param filename:
+        :param message_names: the topics to open, all if None.
+        :return:
+        """
+        entry_directory = os.path.join(self._cache_directory, get_ulog_cache_key(filename))
+        metadata_filename = os.path.join(entry_directory, _METADATA_FILENAME)
+        if os.path.exists(metadata_filename):
+            # the modification time of the metadata is the last use of the entry
+            os.utime(metadata_filename)
+        else:
+            self.add(filename, entry_directory)
+            self.evict(keep=entry_directory)
+        return CachedULog(entry_directory, message_names)
+
+    def add(self, filename: str, entry_directory: str) -> None:
+        """
+        decodes a log and writes its topics to a cache entry. The entry is written to a temporary
+        directory first, such that concurrent tools never open a partially written entry.
+        :param filename:
+        :param entry_directory:
+        :return:
+        """
+        ulog = ULog(filename)
+        temporary_directory = '{:s}.tmp{:d}'.format(entry_directory, os.getpid())
+        os.makedirs(temporary_directory, exist_ok=True)
+
+        topics = list()
+        for dataset in ulog.data_list:
+            topic_filename = '{:s}_{:d}.npy'.format(dataset.name, dataset.multi_id)
+            fields = list(dataset.data.keys())
+            messages = np.empty(len(dataset.data['timestamp']), dtype=[
+                (name, dataset.data[name].dtype) for name in fields])
+            for name in fields:
+                messages[name] = dataset.data[name]
+            np.save(os.path.join(temporary_directory, topic_filename), messages)
+            topics.append({'name': dataset.name, 'multi_id': dataset.multi_id,
+                           'filename': topic_filename})
+
+        metadata = {
+            'format_version': ULOG_CACHE_FORMAT_VERSION, 'log_filename': os.path.abspath(filename),
+            'start_timestamp': ulog.start_timestamp, 'last_timestamp': ulog.last_timestamp,
+            'msg_info_dict': ulog.msg_info_dict, 'initial_parameters': ulog.initial_parameters,
+            'topics': topics}
+        with open(os.path.join(temporary_directory, _METADATA_FILENAME), 'w') as file:
+            json.dump(metadata, file, default=str)
+
+        try:
+            os.rename(temporary_directory, entry_directory)
+        except OSError:
+            # another process added the log in the meantime
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+
+    def get_entries(self) -> List[Tuple[str, int, float]]:
+        """
+        :return: a list of (entry directory, size in bytes, time of last use) of all cached logs,
+        the least recently used first.
+        """
+        entries = list()
+        if not os.path.isdir(self._cache_directory):
+            return entries
+        for key in os.listdir(self._cache_directory):
+            entry_directory = os.path.join(self._cache_directory, key)
+            metadata_filename = os.path.join(entry_directory, _METADATA_FILENAME)
+            if not os.path.exists(metadata_filename):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_directory))
+            entries.append((entry_directory, size, os.path.getmtime(metadata_filename)))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        removes the logs that were not used for the maximum age, and the least recently used logs
+        until the cache is smaller than the maximum size.
+        :param keep: an entry directory that is not evicted, e.g. the entry just added.
+        :return: the number of evicted logs.
+        """
+        entries = self.get_entries()
+        total_size = sum(size for _, size, _ in entries)
+        oldest_use = time.time() - self._max_age_days * 24.0 * 3600.0
+        n_evicted = 0
+        for entry_directory, size, last_use in entries:
+            if last_use >= oldest_use and total_size <= self._max_bytes:
+                break
+            if entry_directory == keep:
+                continue
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            total_size -= size
+            n_evicted += 1
+        return n_evicted
+
+
+def open_ulog(filename: str, message_names: Optional[List[str]] = None,
+              cache_directory: Optional[str] = None):
+    """
+    opens a log from the cache if a cache directory is specified or set by the ULOG_CACHE_DIR
+    environment variable, and parses it with pyulog otherwise.
+    :param filename:
+    :param message_names: the topics to load, all if None.
+    :param cache_directory:
+    :return: a ULog or CachedULog.
+    """
+    if cache_directory is None:
+        cache_directory = os.environ.get(ULOG_CACHE_DIR_ENV)
+    if cache_directory is None:
+        return ULog(filename, message_names)
+    return ULogCache(cache_directory).open(filename, message_names)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Manage the cache of decoded ULog files.')
+    parser.add_argument('command', choices=['add', 'list', 'evict', 'clear'],
+                        help='add logs to the cache, list or evict the cached logs, or clear the '
+                             'cache.')
+    parser.add_argument('filenames', metavar='file.ulg', nargs='*', help='ULog files to add')
+    parser.add_argument('--cache-dir', type=str, default=os.environ.get(ULOG_CACHE_DIR_ENV),
+                        required=ULOG_CACHE_DIR_ENV not in os.environ,
+                        help='The cache directory. Defaults to ${:s}.'.format(ULOG_CACHE_DIR_ENV))
+    parser.add_argument('--max-size-gb', type=float,
+                        default=DEFAULT_MAX_CACHE_BYTES / 1024.0 ** 3,
+                        help='The maximum total size of the cache in GB.')
+    parser.add_argument('--max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help='The maximum time since the last use of a cached log in days.')
+    args = parser.parse_args()
+
+    cache = ULogCache(args.cache_dir, max_bytes=int(args.max_size_gb * 1024.0 ** 3),
+                      max_age_days=args.max_age_days)
+    if args.command == 'add':
+        for filename in args.filenames:
+            start_time = time.perf_counter()
+            cache.open(filename)
+            print('{:s} cached ({:.2f}s)'.format(filename, time.perf_counter() - start_time))
+    elif args.command == 'list':
+        for entry_directory, size, last_use in cache.get_entries():
+            with open(os.path.join(entry_directory, _METADATA_FILENAME), 'r') as file:
+                log_filename = json.load(file)['log_filename']
+            print('{:s} {:8.1f} MB, last used {:s}: {:s}'.format(
+                os.path.basename(entry_directory), size / 1024.0 ** 2,
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(last_use)), log_filename))
+    elif args.command == 'evict':
+        print('{:d} logs evicted'.format(cache.evict()))
+    else:
+        for entry_directory, _, _ in cache.get_entries():
+            shutil.rmtree(entry_directory, ignore_errors=True)
+        print('Cache cleared')
+
+
+if __name__ == '__main__':
+    main()
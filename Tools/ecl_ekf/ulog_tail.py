@@ -0,0 +1,239 @@
+#! /usr/bin/env python3
+"""
+Incremental parser of a ULog file that is still being written, e.g. by mavlink_ulog_streaming.py.
+Every read parses only the bytes appended since the previous read and returns the new data
+messages of the subscribed topics, in the same flattened field layout as pyulog.
+"""
+
+import os
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+ULOG_HEADER_MAGIC = b'\x55\x4c\x6f\x67\x01\x12\x35'
+ULOG_HEADER_SIZE = 16
+
+# the size of the message header: msg_size (uint16_t) and msg_type (uint8_t)
+_MESSAGE_HEADER_SIZE = 3
+
+# uORB type name -> numpy type, as used by pyulog
+_FIELD_TYPES = {
+    'int8_t': 'i1', 'uint8_t': 'u1', 'int16_t': '<i2', 'uint16_t': '<u2', 'int32_t': '<i4',
+    'uint32_t': '<u4', 'int64_t': '<i8', 'uint64_t': '<u8', 'float': '<f4', 'double': '<f8',
+    'bool': 'i1', 'char': 'i1'}
+
+# a field of a message format: type name, array length (0 for a scalar), field name
+FormatField = Tuple[str, int, str]
+
+
+class _Subscription(object):
+    """
+    a logged topic instance: the numpy dtype of its data messages and the accumulated payloads.
+    """
+
+    def __init__(self, message_name: str, multi_id: int, dtype: np.dtype,
+                 fields: List[str]) -> None:
+        """
+        :param message_name:
+        :param multi_id: the instance of the topic.
+        :param dtype: the dtype of the payload without the message id.
+        :param fields: the fields to return.
+        """
+        self.message_name = message_name
+        self.multi_id = multi_id
+        self.dtype = dtype
+        self.fields = fields
+        self.payloads = list()  # type: List[bytes]
+
+
+class ULogTail(object):
+    """
+    parses a growing ULog file incrementally. Data messages of topics that are not required are
+    skipped without decoding, and incomplete messages at the end of the file are kept until the
+    rest of the message has been written.
+    """
+
+    def __init__(self, filename: str,
+                 requirements: Optional[Dict[str, Set[str]]] = None) -> None:
+        """
+        :param filename:
+        :param requirements: a dict of topic name to the fields to return, as returned by
+        get_topic_requirements. All topics and fields are returned if None.
+        """
+        self._filename = filename
+        self._requirements = requirements
+        self._file = None
+        self._buffer = b''
+        self._start_timestamp = None  # type: Optional[int]
+        self._formats = dict()  # type: Dict[str, List[FormatField]]
+        self._subscriptions = dict()  # type: Dict[int, _Subscription]
+        self._bytes_read = 0
+
+    @property
+    def start_timestamp(self) -> Optional[int]:
+        """
+        :return: the timestamp of the file header in microseconds, None if it was not read yet.
+        """
+        return self._start_timestamp
+
+    @property
+    def bytes_read(self) -> int:
+        """
+        :return: the number of bytes read from the file.
+        """
+        return self._bytes_read
+
+    def close(self) -> None:
+        """
+        closes the file.
+        :return:
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> 'ULogTail':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def read(self, max_bytes: int = 64 * 1024 * 1024) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        reads and parses the bytes appended to the file since the last read.
+        :param max_bytes: the maximum number of bytes to read, such that a long existing log is
+        processed in several steps.
+        :return: a dict of topic name to a dict of field name to the values of the new data
+        messages. Only the first instance (multi id 0) of every topic is returned.
+        """
+        return {message_name: data for (message_name, multi_id), data in
+                self.read_instances(max_bytes).items() if multi_id == 0}
+
+    def read_instances(self, max_bytes: int = 64 * 1024 * 1024) -> \
+            Dict[Tuple[str, int], Dict[str, np.ndarray]]:
+        """
+        reads and parses the bytes appended to the file since the last read.
+        :param max_bytes: the maximum number of bytes to read.
+        :return: a dict of (topic name, multi id) to a dict of field name to the values of the new
+        data messages of every instance of a topic.
+        """
+        if self._file is None:
+            if not os.path.exists(self._filename):
+                return dict()
+            self._file = open(self._filename, 'rb')
+
+        new_bytes = self._file.read(max_bytes)
+        self._bytes_read += len(new_bytes)
+        self._buffer += new_bytes
+
+        if self._start_timestamp is None:
+            if len(self._buffer) < ULOG_HEADER_SIZE:
+                return dict()
+            if self._buffer[:len(ULOG_HEADER_MAGIC)] != ULOG_HEADER_MAGIC:
+                raise ValueError('{:s} is not a ULog file'.format(self._filename))
+            self._start_timestamp, = struct.unpack_from('<Q', self._buffer, 8)
+            self._buffer = self._buffer[ULOG_HEADER_SIZE:]
+
+        self._buffer = self._buffer[self._parse_messages(self._buffer):]
+
+        new_data = dict()
+        for subscription in self._subscriptions.values():
+            if not subscription.payloads:
+                continue
+            messages = np.frombuffer(b''.join(subscription.payloads), dtype=subscription.dtype)
+            subscription.payloads = list()
+            new_data[(subscription.message_name, subscription.multi_id)] = {
+                field: messages[field] for field in subscription.fields}
+        return new_data
+
+    def _parse_messages(self, buffer: bytes) -> int:
+        """
+        parses the complete messages of a buffer.
+        :param buffer:
+        :return: the number of bytes parsed.
+        """
+        offset = 0
+        unpack_header = struct.Struct('<HB').unpack_from
+        unpack_msg_id = struct.Struct('<H').unpack_from
+        subscriptions = self._subscriptions
+        while offset + _MESSAGE_HEADER_SIZE <= len(buffer):
+            msg_size, msg_type = unpack_header(buffer, offset)
+            end = offset + _MESSAGE_HEADER_SIZE + msg_size
+            if end > len(buffer):
+                break
+            start = offset + _MESSAGE_HEADER_SIZE
+            if msg_type == 0x44:  # 'D'
+                msg_id, = unpack_msg_id(buffer, start)
+                subscription = subscriptions.get(msg_id)
+                # data messages may contain trailing padding, shorter messages are corrupt
+                if subscription is not None and msg_size - 2 >= subscription.dtype.itemsize:
+                    subscription.payloads.append(
+                        buffer[start + 2:start + 2 + subscription.dtype.itemsize])
+            elif msg_type == 0x46:  # 'F'
+                self._add_format(buffer[start:end])
+            elif msg_type == 0x41:  # 'A'
+                self._add_subscription(buffer[start:end])
+            elif msg_type == 0x52:  # 'R'
+                subscriptions.pop(unpack_msg_id(buffer, start)[0], None)
+            offset = end
+        return offset
+
+    def _add_format(self, payload: bytes) -> None:
+        """
+        adds a message format definition, e.g. 'sensor_preflight:uint64_t timestamp;...'.
+        :param payload:
+        :return:
+        """
+        name, _, fields = payload.decode('utf-8', errors='replace').partition(':')
+        format_fields = list()
+        for field in fields.split(';'):
+            if not field:
+                continue
+            type_string, field_name = field.split(' ')
+            array_length = 0
+            if '[' in type_string:
+                type_string, array_string = type_string[:-1].split('[')
+                array_length = int(array_string)
+            format_fields.append((type_string, array_length, field_name))
+        self._formats[name] = format_fields
+
+    def _add_subscription(self, payload: bytes) -> None:
+        """
+        adds a logged topic instance if it is required.
+        :param payload: multi id (uint8_t), message id (uint16_t) and message name.
+        :return:
+        """
+        multi_id, msg_id = struct.unpack_from('<BH', payload)
+        message_name = payload[3:].decode('utf-8', errors='replace')
+        if message_name not in self._formats or (
+                self._requirements is not None and message_name not in self._requirements):
+            return
+
+        dtype_list = self._get_flattened_fields('', message_name)
+        # remove padding fields at the end
+        while dtype_list and dtype_list[-1][0].startswith('_padding'):
+            dtype_list.pop()
+        fields = [name for name, _ in dtype_list if not name.startswith('_padding') and (
+            self._requirements is None or name in self._requirements[message_name])]
+        self._subscriptions[msg_id] = _Subscription(
+            message_name, multi_id, np.dtype(dtype_list), fields)
+
+    def _get_flattened_fields(self, prefix: str, message_name: str) -> List[Tuple[str, str]]:
+        """
+        flattens arrays and nested types to scalar fields named like the fields of pyulog, e.g.
+        'states[10]' or 'nested.field'.
+        :param prefix:
+        :param message_name:
+        :return: a list of (field name, numpy type).
+        """
+        dtype_list = list()
+        for type_name, array_length, field_name in self._formats[message_name]:
+            names = ['{:s}{:s}'.format(prefix, field_name)] if array_length == 0 else [
+                '{:s}{:s}[{:d}]'.format(prefix, field_name, i) for i in range(array_length)]
+            for name in names:
+                if type_name in _FIELD_TYPES:
+                    dtype_list.append((name, _FIELD_TYPES[type_name]))
+                else:
+                    dtype_list.extend(self._get_flattened_fields('{:s}.'.format(name), type_name))
+        return dtype_list
@@ -25,31 +25,35 @@
 #                    0 means the last trigger event equals last image (default)
 #                    1 means the second last trigger event equals last image
 #                    ...etc
+# --bulk: match all images at once to the nearest trigger within --tolerance seconds with a
+#         sorted search, and read and write the Exif information in a pool of --workers threads.
+#         Recommended for surveys with thousands of images. Unmatched images are reported.
 #
 # Parts included from https://gist.github.com/c060604/8a51f8999be12fc2be498e9ca56adc72
 # Parts included from https://github.com/PX4/flight_review/
 
 
 from __future__ import print_function
-import os, sys, time, datetime, piexif
+import argparse
+import os, sys, time, datetime, piexif, traceback
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from pyulog import *
 from pyulog.px4 import *
 from PIL import Image
 from fractions import Fraction
 
+# the decoded logs are shared with other tools through the cache in $ULOG_CACHE_DIR, if set
+from ecl_ekf.ulog_cache import open_ulog
 
-if(len(sys.argv)) < 3:
-    print("Usage: python geotag_images_ulog.py [logfile] [image dir]")
-    print("Example: python geotag_images_ulog.py mylog.ulg ./images")
-    print(len(sys.argv))
-    sys.exit()
 
-logfile = sys.argv[1]
-imageDir = sys.argv[2]
-triggerOffset = 0
+# the default maximum difference in seconds between the offsets of a matched image and trigger in the
+# bulk mode. The image timestamps have a resolution of one second, the serial mode accepts triggers up
+# to two seconds later than the image.
+DEFAULT_MATCH_TOLERANCE = 2.0
 
-if(len(sys.argv) > 3):
-    triggerOffset = int(sys.argv[3])
+# the default number of threads reading and writing the images in the bulk mode
+DEFAULT_IO_WORKERS = 16
 
 def to_deg(value, loc):
     """convert decimal coordinates into degrees, munutes and seconds tuple
@@ -79,46 +83,47 @@ def change_to_rational(number):
     return (f.numerator, f.denominator)
 
 
-
-class ULogException(Exception):
-    """
-    Exception to indicate an ULog parsing error. It is most likely a corrupt log
-    file, but could also be a bug in the parser.
+def get_gps_ifd(lat, lng, altitude):
+    """create the GPS Exif information of a position
+    Keyword arguments: lat and lng in degrees, altitude in meters
+    return: the GPS IFD dict
     """
-    pass
+    lat_deg = to_deg(lat, ["S", "N"])
+    lng_deg = to_deg(lng, ["W", "E"])
 
+    exiv_lat = (change_to_rational(lat_deg[0]), change_to_rational(lat_deg[1]), change_to_rational(lat_deg[2]))
+    exiv_lng = (change_to_rational(lng_deg[0]), change_to_rational(lng_deg[1]), change_to_rational(lng_deg[2]))
 
-def load_ulog_file(file_name):
-    """ load an ULog file
-    :return: ULog object
-    """
-    # The reason to put this method into helper is that the main module gets
-    # (re)loaded on each page request. Thus the caching would not work there.
+    return {
+        piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
+        piexif.GPSIFD.GPSAltitudeRef: 0,
+        piexif.GPSIFD.GPSAltitude: change_to_rational(round(altitude)),
+        piexif.GPSIFD.GPSLatitudeRef: lat_deg[3],
+        piexif.GPSIFD.GPSLatitude: exiv_lat,
+        piexif.GPSIFD.GPSLongitudeRef: lng_deg[3],
+        piexif.GPSIFD.GPSLongitude: exiv_lng,
+    }
 
-    # load only the messages we really need
-    msg_filter = ['camera_capture']
-    try:
-        ulog = ULog(file_name, msg_filter)
-    except FileNotFoundError:
-        print("Error: file %s not found" % file_name)
-        raise
 
-    # catch all other exceptions and turn them into an ULogException
-    except Exception as error:
-        traceback.print_exception(*sys.exc_info())
-        raise ULogException()
+def load_exif(file_name):
+    """load the Exif information of an image
+    Keyword arguments: file_name
+    return: the Exif dict as returned by piexif.load
+    """
+    # only the header of the image is read
+    with Image.open(file_name) as img:
+        return piexif.load(img.info['exif'])
 
-    # filter messages with timestamp = 0 (these are invalid).
-    # The better way is not to publish such messages in the first place, and fix
-    # the code instead (it goes against the monotonicity requirement of ulog).
-    # So we display the values such that the problem becomes visible.
-#    for d in ulog.data_list:
-#        t = d.data['timestamp']
-#        non_zero_indices = t != 0
-#        if not np.all(non_zero_indices):
-#            d.data = np.compress(non_zero_indices, d.data, axis=0)
 
-    return ulog
+def get_exif_timestamp(exif_dict):
+    """
+    Keyword arguments: exif_dict as returned by piexif.load
+    return: the DateTimeOriginal of the image in seconds
+    """
+    timestring = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal]
+    return time.mktime(datetime.datetime.strptime(timestring.decode() if isinstance(timestring, bytes) else timestring,
+                                                  "%Y:%m:%d %H:%M:%S").timetuple())
+
 
 class ULogException(Exception):
     """
@@ -136,11 +141,9 @@ def load_ulog_file(file_name):
     # (re)loaded on each page request. Thus the caching would not work there.
 
     # load only the messages we really need
-    
-
     msg_filter = ['camera_capture']
     try:
-        ulog = ULog(file_name)
+        ulog = open_ulog(file_name, msg_filter)
     except FileNotFoundError:
         print("Error: file %s not found" % file_name)
         raise
@@ -163,77 +166,171 @@ def load_ulog_file(file_name):
     return ulog
 
 
-ulog = load_ulog_file(logfile)
-
-camera_capture = ulog.get_dataset('camera_capture')
-count = len(camera_capture.data['timestamp_utc'])
-init = round(camera_capture.data['timestamp_utc'][count-1-triggerOffset] / 1000000)
-offsets = {}
-
-for i in range(0, count):
-  test = round(camera_capture.data['timestamp_utc'][i] / 1000000)
-  offset = init - test
-  offsets[offset] = i
+def geotag_images(camera_capture, imageDir, triggerOffset):
+    """geo-reference the images one by one, calibrated on the last image and trigger
+    """
+    count = len(camera_capture.data['timestamp_utc'])
+    init = round(camera_capture.data['timestamp_utc'][count-1-triggerOffset] / 1000000)
+    offsets = {}
+
+    for i in range(0, count):
+      test = round(camera_capture.data['timestamp_utc'][i] / 1000000)
+      offset = init - test
+      offsets[offset] = i
+
+    files = os.listdir(imageDir)
+    os.chdir(imageDir)
+    #files.sort(key=lambda x: os.path.getctime(x))
+    files.sort()
+    first = 0
+
+    for f in reversed(files):
+      exif_dict = load_exif(f)
+      timestring = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal]
+      timestamp = get_exif_timestamp(exif_dict)
+      if first == 0:
+        first = timestamp
+        print("Calibrating on",f,"as last image on",timestring)
+        print("")
+        print("[filename] [offset] [trigger seq] [lat] [lng] [alt]")
+
+      offset = first - timestamp
+      print((f), end=' ')
+      print((offset), end=' ')
+      if not offset in offsets:
+        offset += 1
+
+      if not offset in offsets:
+        offset += 1
+
+      if offset in offsets:
+        print((offsets[offset]), end=' ')
+        print((camera_capture.data['lat'][offsets[offset]]), end=' ')
+        print((camera_capture.data['lon'][offsets[offset]]), end=' ')
+        print(camera_capture.data['alt'][offsets[offset]])
+
+        lat = camera_capture.data['lat'][offsets[offset]]
+        lng = camera_capture.data['lon'][offsets[offset]]
+        altitude = camera_capture.data['alt'][offsets[offset]]
+
+        exif_dict["GPS"] = get_gps_ifd(lat, lng, altitude)
+        exif_bytes = piexif.dump(exif_dict)
+        piexif.insert(exif_bytes, f)
+      else:
+        print("Could not georeference")
+
+
+def read_image_timestamp(file_name):
+    """
+    Keyword arguments: file_name
+    return: the DateTimeOriginal of the image in seconds, None if the image has no Exif timestamp
+    """
+    try:
+        return get_exif_timestamp(load_exif(file_name))
+    except (OSError, KeyError, ValueError):
+        return None
 
 
+def write_image_position(file_name, lat, lng, altitude):
+    """add the GPS Exif information of a position to an image in place
+    """
+    exif_dict = load_exif(file_name)
+    exif_dict["GPS"] = get_gps_ifd(lat, lng, altitude)
+    piexif.insert(piexif.dump(exif_dict), file_name)
 
-files = os.listdir(imageDir)
-os.chdir(imageDir)
-#files.sort(key=lambda x: os.path.getctime(x))
-files.sort()
-first = 0
 
-for f in reversed(files):
-  img = Image.open(f)
-  exif_dict = piexif.load(img.info['exif'])
-  timestring = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal]
-  timestamp = time.mktime(datetime.datetime.strptime(timestring, "%Y:%m:%d %H:%M:%S").timetuple())
-  if first == 0:
-    first = timestamp
-    print("Calibrating on",f,"as last image on",timestring)
+def match_images_to_triggers(image_offsets, trigger_offsets, tolerance):
+    """match every image to the trigger with the nearest offset
+    Keyword arguments: the offsets in seconds of the images and triggers to the calibration image and
+    trigger, and the maximum difference of the offsets of a match in seconds
+    return: the index of the matched trigger of every image, -1 for unmatched images
+    """
+    order = np.argsort(trigger_offsets, kind='stable')
+    sorted_offsets = trigger_offsets[order]
+    right = np.clip(np.searchsorted(sorted_offsets, image_offsets), 0, len(sorted_offsets) - 1)
+    left = np.clip(right - 1, 0, len(sorted_offsets) - 1)
+    # on a tie, prefer the later trigger offset like the serial mode
+    nearest = np.where(np.abs(sorted_offsets[left] - image_offsets) <
+                       np.abs(sorted_offsets[right] - image_offsets), left, right)
+    matched = np.abs(sorted_offsets[nearest] - image_offsets) <= tolerance
+    return np.where(matched, order[nearest], -1)
+
+
+def geotag_images_bulk(camera_capture, imageDir, triggerOffset, tolerance=DEFAULT_MATCH_TOLERANCE,
+                       workers=DEFAULT_IO_WORKERS):
+    """geo-reference all images at once: the Exif timestamps are read in a thread pool, every image is
+    matched to the nearest trigger and the Exif information is written in a thread pool
+    return: the file names of the images that could not be georeferenced
+    """
+    count = len(camera_capture.data['timestamp_utc'])
+    trigger_times = np.round(camera_capture.data['timestamp_utc'] / 1000000)
+    trigger_offsets = trigger_times[count-1-triggerOffset] - trigger_times
+
+    files = sorted(os.listdir(imageDir))
+    paths = [os.path.join(imageDir, f) for f in files]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        timestamps = list(executor.map(read_image_timestamp, paths))
+
+    images = [i for i, timestamp in enumerate(timestamps) if timestamp is not None]
+    unmatched = [files[i] for i, timestamp in enumerate(timestamps) if timestamp is None]
+    if not images:
+        print("No images with Exif timestamps found")
+        return unmatched
+
+    # calibrate on the last image
+    image_times = np.array([timestamps[i] for i in images])
+    print("Calibrating on", files[images[-1]], "as last image")
     print("")
     print("[filename] [offset] [trigger seq] [lat] [lng] [alt]")
+    triggers = match_images_to_triggers(image_times[-1] - image_times, trigger_offsets, tolerance)
+
+    jobs = list()
+    for image, image_time, trigger in zip(images, image_times, triggers):
+        if trigger < 0:
+            unmatched.append(files[image])
+            continue
+        lat = camera_capture.data['lat'][trigger]
+        lng = camera_capture.data['lon'][trigger]
+        altitude = camera_capture.data['alt'][trigger]
+        print(files[image], image_times[-1] - image_time, trigger, lat, lng, altitude)
+        jobs.append((paths[image], lat, lng, altitude))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # consume the results to raise the exceptions of the workers
+        list(executor.map(lambda job: write_image_position(*job), jobs))
 
-  offset = first - timestamp
-  print((f), end=' ')
-  print((offset), end=' ')
-  if not offset in offsets:
-    offset += 1
-
-  if not offset in offsets:
-    offset += 1
-
-  if offset in offsets:
-    print((offsets[offset]), end=' ')
-    print((camera_capture.data['lat'][offsets[offset]]), end=' ')
-    print((camera_capture.data['lon'][offsets[offset]]), end=' ')
-    print(camera_capture.data['alt'][offsets[offset]])
-
-    lat = camera_capture.data['lat'][offsets[offset]]
-    lng = camera_capture.data['lon'][offsets[offset]]
-    altitude = camera_capture.data['alt'][offsets[offset]]
-
-    lat_deg = to_deg(lat, ["S", "N"])
-    lng_deg = to_deg(lng, ["W", "E"])
-
-    exiv_lat = (change_to_rational(lat_deg[0]), change_to_rational(lat_deg[1]), change_to_rational(lat_deg[2]))
-    exiv_lng = (change_to_rational(lng_deg[0]), change_to_rational(lng_deg[1]), change_to_rational(lng_deg[2]))
-
-    gps_ifd = {
-        piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
-        piexif.GPSIFD.GPSAltitudeRef: 0,
-        piexif.GPSIFD.GPSAltitude: change_to_rational(round(altitude)),
-        piexif.GPSIFD.GPSLatitudeRef: lat_deg[3],
-        piexif.GPSIFD.GPSLatitude: exiv_lat,
-        piexif.GPSIFD.GPSLongitudeRef: lng_deg[3],
-        piexif.GPSIFD.GPSLongitude: exiv_lng,
-    }
+    print("")
+    print("{:d} images georeferenced, {:d} could not be georeferenced".format(len(jobs), len(unmatched)))
+    for f in sorted(unmatched):
+        print("Could not georeference", f)
+    return unmatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geo-reference survey images with the camera_capture events of a ulog file.')
+    parser.add_argument('logfile', help='a ulog formatted logfile containing camera_capture events')
+    parser.add_argument('image_dir', help='the directory where the images are located')
+    parser.add_argument('offset', nargs='?', type=int, default=0,
+                        help='skip [offset] triggers to reference the last image')
+    parser.add_argument('--bulk', action='store_true',
+                        help='match all images at once and read and write the images in a thread pool')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_MATCH_TOLERANCE,
+                        help='the maximum difference in seconds of a matched image and trigger in the bulk mode')
+    parser.add_argument('--workers', type=int, default=DEFAULT_IO_WORKERS,
+                        help='the number of threads reading and writing the images in the bulk mode')
+    args = parser.parse_args()
+
+    ulog = load_ulog_file(args.logfile)
+    camera_capture = ulog.get_dataset('camera_capture')
+
+    if args.bulk:
+        geotag_images_bulk(camera_capture, args.image_dir, args.offset, tolerance=args.tolerance,
+                           workers=args.workers)
+    else:
+        geotag_images(camera_capture, args.image_dir, args.offset)
 
-    exif_dict["GPS"] = gps_ifd
-    exif_bytes = piexif.dump(exif_dict)
-    piexif.insert(exif_bytes, f)
-  else:
-    print("Could not georeference")
+    print("Done")
 
 
-print("Done")
+if __name__ == '__main__':
+    main()
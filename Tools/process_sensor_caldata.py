@@ -1,14 +1,4 @@
-#! /usr/bin/env python
-
-from __future__ import print_function
-
-import argparse
-import os
-import matplotlib.pyplot as plt
-import numpy as np
-
-from pyulog import *
-
+#! /usr/bin/env python3
 """
 Reads in IMU data from a static thermal calibration test and performs a curve fit of gyro, accel and baro bias vs temperature
 Data can be gathered using the following sequence:
@@ -29,869 +19,792 @@ Data can be gathered using the following sequence:
 Outputs thermal compensation parameters in a file named <inputfilename>.params which can be loaded onto the board using QGroundControl
 Outputs summary plots in a pdf file named <inputfilename>.pdf
 
+All instances of a sensor type found in the log are calibrated. The log is read in chunks and the
+samples of every instance are reduced to statistics in temperature bins, such that the memory does not
+depend on the length of the log. The bias polynomials of all axes of an instance are then fitted to the
+bin means in a single least squares solve on the Vandermonde matrix of the bin temperatures.
 """
 
-parser = argparse.ArgumentParser(description='Reads in IMU data from a static thermal calibration test and performs a curve fit of gyro, accel and baro bias vs temperature')
-parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-def is_valid_directory(parser, arg):
-    if os.path.isdir(arg):
-        # Directory exists so return the directory
-        return arg
-    else:
-        parser.error('The directory {} does not exist'.format(arg))
-
-args = parser.parse_args()
-ulog_file_name = args.filename
-
-ulog = ULog(ulog_file_name, None)
-data = ulog.data_list
-
-# extract gyro data
-sensor_instance = 0
-num_gyros = 0
-for d in data:
-    if d.name == 'sensor_gyro':
-        if sensor_instance == 0:
-            sensor_gyro_0 = d.data
-            print('found gyro 0 data')
-            num_gyros = 1
-        if sensor_instance == 1:
-            sensor_gyro_1 = d.data
-            print('found gyro 1 data')
-            num_gyros = 2
-        if sensor_instance == 2:
-            sensor_gyro_2 = d.data
-            print('found gyro 2 data')
-            num_gyros = 3
-        sensor_instance = sensor_instance +1
-
-# extract accel data
-sensor_instance = 0
-num_accels = 0
-for d in data:
-    if d.name == 'sensor_accel':
-        if sensor_instance == 0:
-            sensor_accel_0 = d.data
-            print('found accel 0 data')
-            num_accels = 1
-        if sensor_instance == 1:
-            sensor_accel_1 = d.data
-            print('found accel 1 data')
-            num_accels = 2
-        if sensor_instance == 2:
-            sensor_accel_2 = d.data
-            print('found accel 2 data')
-            num_accels = 3
-        sensor_instance = sensor_instance +1
-
-# extract baro data
-sensor_instance = 0
-num_baros = 0
-for d in data:
-    if d.name == 'sensor_baro':
-        if sensor_instance == 0:
-            sensor_baro_0 = d.data
-            print('found baro 0 data')
-            num_baros = 1
-        if sensor_instance == 1:
-            sensor_baro_1 = d.data
-            print('found baro 1 data')
-            num_baros = 2
-        sensor_instance = sensor_instance +1
-
-# open file to save plots to PDF
+import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
-output_plot_filename = ulog_file_name + ".pdf"
-pp = PdfPages(output_plot_filename)
-
-#################################################################################
-
-# define data dictionary of gyro 0 thermal correction  parameters
-gyro_0_params = {
-'TC_G0_ID':0,
-'TC_G0_TMIN':0.0,
-'TC_G0_TMAX':0.0,
-'TC_G0_TREF':0.0,
-'TC_G0_X0_0':0.0,
-'TC_G0_X1_0':0.0,
-'TC_G0_X2_0':0.0,
-'TC_G0_X3_0':0.0,
-'TC_G0_X0_1':0.0,
-'TC_G0_X1_1':0.0,
-'TC_G0_X2_1':0.0,
-'TC_G0_X3_1':0.0,
-'TC_G0_X0_2':0.0,
-'TC_G0_X1_2':0.0,
-'TC_G0_X2_2':0.0,
-'TC_G0_X3_2':0.0,
-'TC_G0_SCL_0':1.0,
-'TC_G0_SCL_1':1.0,
-'TC_G0_SCL_2':1.0
-}
-
-# curve fit the data for gyro 0 corrections
-if num_gyros >= 1:
-    gyro_0_params['TC_G0_ID'] = int(np.median(sensor_gyro_0['device_id']))
-
-    # find the min, max and reference temperature
-    gyro_0_params['TC_G0_TMIN'] = np.amin(sensor_gyro_0['temperature'])
-    gyro_0_params['TC_G0_TMAX'] = np.amax(sensor_gyro_0['temperature'])
-    gyro_0_params['TC_G0_TREF'] = 0.5 * (gyro_0_params['TC_G0_TMIN'] + gyro_0_params['TC_G0_TMAX'])
-    temp_rel = sensor_gyro_0['temperature'] - gyro_0_params['TC_G0_TREF']
-    temp_rel_resample = np.linspace(gyro_0_params['TC_G0_TMIN']-gyro_0_params['TC_G0_TREF'], gyro_0_params['TC_G0_TMAX']-gyro_0_params['TC_G0_TREF'], 100)
-    temp_resample = temp_rel_resample + gyro_0_params['TC_G0_TREF']
-
-    # fit X axis
-    coef_gyro_0_x = np.polyfit(temp_rel,sensor_gyro_0['x'],3)
-    gyro_0_params['TC_G0_X3_0'] = coef_gyro_0_x[0]
-    gyro_0_params['TC_G0_X2_0'] = coef_gyro_0_x[1]
-    gyro_0_params['TC_G0_X1_0'] = coef_gyro_0_x[2]
-    gyro_0_params['TC_G0_X0_0'] = coef_gyro_0_x[3]
-    fit_coef_gyro_0_x = np.poly1d(coef_gyro_0_x)
-    gyro_0_x_resample = fit_coef_gyro_0_x(temp_rel_resample)
-
-    # fit Y axis
-    coef_gyro_0_y = np.polyfit(temp_rel,sensor_gyro_0['y'],3)
-    gyro_0_params['TC_G0_X3_1'] = coef_gyro_0_y[0]
-    gyro_0_params['TC_G0_X2_1'] = coef_gyro_0_y[1]
-    gyro_0_params['TC_G0_X1_1'] = coef_gyro_0_y[2]
-    gyro_0_params['TC_G0_X0_1'] = coef_gyro_0_y[3]
-    fit_coef_gyro_0_y = np.poly1d(coef_gyro_0_y)
-    gyro_0_y_resample = fit_coef_gyro_0_y(temp_rel_resample)
-
-    # fit Z axis
-    coef_gyro_0_z = np.polyfit(temp_rel,sensor_gyro_0['z'],3)
-    gyro_0_params['TC_G0_X3_2'] = coef_gyro_0_z[0]
-    gyro_0_params['TC_G0_X2_2'] = coef_gyro_0_z[1]
-    gyro_0_params['TC_G0_X1_2'] = coef_gyro_0_z[2]
-    gyro_0_params['TC_G0_X0_2'] = coef_gyro_0_z[3]
-    fit_coef_gyro_0_z = np.poly1d(coef_gyro_0_z)
-    gyro_0_z_resample = fit_coef_gyro_0_z(temp_rel_resample)
-
-    # gyro0 vs temperature
-    plt.figure(1,figsize=(20,13))
-
-    # draw plots
-    plt.subplot(3,1,1)
-    plt.plot(sensor_gyro_0['temperature'],sensor_gyro_0['x'],'b')
-    plt.plot(temp_resample,gyro_0_x_resample,'r')
-    plt.title('Gyro 0 Bias vs Temperature')
-    plt.ylabel('X bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,2)
-    plt.plot(sensor_gyro_0['temperature'],sensor_gyro_0['y'],'b')
-    plt.plot(temp_resample,gyro_0_y_resample,'r')
-    plt.ylabel('Y bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,3)
-    plt.plot(sensor_gyro_0['temperature'],sensor_gyro_0['z'],'b')
-    plt.plot(temp_resample,gyro_0_z_resample,'r')
-    plt.ylabel('Z bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-#################################################################################
-
-# define data dictionary of gyro 1 thermal correction  parameters
-gyro_1_params = {
-'TC_G1_ID':0,
-'TC_G1_TMIN':0.0,
-'TC_G1_TMAX':0.0,
-'TC_G1_TREF':0.0,
-'TC_G1_X0_0':0.0,
-'TC_G1_X1_0':0.0,
-'TC_G1_X2_0':0.0,
-'TC_G1_X3_0':0.0,
-'TC_G1_X0_1':0.0,
-'TC_G1_X1_1':0.0,
-'TC_G1_X2_1':0.0,
-'TC_G1_X3_1':0.0,
-'TC_G1_X0_2':0.0,
-'TC_G1_X1_2':0.0,
-'TC_G1_X2_2':0.0,
-'TC_G1_X3_2':0.0,
-'TC_G1_SCL_0':1.0,
-'TC_G1_SCL_1':1.0,
-'TC_G1_SCL_2':1.0
-}
-
-# curve fit the data for gyro 1 corrections
-if num_gyros >= 2:
-    gyro_1_params['TC_G1_ID'] = int(np.median(sensor_gyro_1['device_id']))
-
-    # find the min, max and reference temperature
-    gyro_1_params['TC_G1_TMIN'] = np.amin(sensor_gyro_1['temperature'])
-    gyro_1_params['TC_G1_TMAX'] = np.amax(sensor_gyro_1['temperature'])
-    gyro_1_params['TC_G1_TREF'] = 0.5 * (gyro_1_params['TC_G1_TMIN'] + gyro_1_params['TC_G1_TMAX'])
-    temp_rel = sensor_gyro_1['temperature'] - gyro_1_params['TC_G1_TREF']
-    temp_rel_resample = np.linspace(gyro_1_params['TC_G1_TMIN']-gyro_1_params['TC_G1_TREF'], gyro_1_params['TC_G1_TMAX']-gyro_1_params['TC_G1_TREF'], 100)
-    temp_resample = temp_rel_resample + gyro_1_params['TC_G1_TREF']
-
-    # fit X axis
-    coef_gyro_1_x = np.polyfit(temp_rel,sensor_gyro_1['x'],3)
-    gyro_1_params['TC_G1_X3_0'] = coef_gyro_1_x[0]
-    gyro_1_params['TC_G1_X2_0'] = coef_gyro_1_x[1]
-    gyro_1_params['TC_G1_X1_0'] = coef_gyro_1_x[2]
-    gyro_1_params['TC_G1_X0_0'] = coef_gyro_1_x[3]
-    fit_coef_gyro_1_x = np.poly1d(coef_gyro_1_x)
-    gyro_1_x_resample = fit_coef_gyro_1_x(temp_rel_resample)
-
-    # fit Y axis
-    coef_gyro_1_y = np.polyfit(temp_rel,sensor_gyro_1['y'],3)
-    gyro_1_params['TC_G1_X3_1'] = coef_gyro_1_y[0]
-    gyro_1_params['TC_G1_X2_1'] = coef_gyro_1_y[1]
-    gyro_1_params['TC_G1_X1_1'] = coef_gyro_1_y[2]
-    gyro_1_params['TC_G1_X0_1'] = coef_gyro_1_y[3]
-    fit_coef_gyro_1_y = np.poly1d(coef_gyro_1_y)
-    gyro_1_y_resample = fit_coef_gyro_1_y(temp_rel_resample)
-
-    # fit Z axis
-    coef_gyro_1_z = np.polyfit(temp_rel,sensor_gyro_1['z'],3)
-    gyro_1_params['TC_G1_X3_2'] = coef_gyro_1_z[0]
-    gyro_1_params['TC_G1_X2_2'] = coef_gyro_1_z[1]
-    gyro_1_params['TC_G1_X1_2'] = coef_gyro_1_z[2]
-    gyro_1_params['TC_G1_X0_2'] = coef_gyro_1_z[3]
-    fit_coef_gyro_1_z = np.poly1d(coef_gyro_1_z)
-    gyro_1_z_resample = fit_coef_gyro_1_z(temp_rel_resample)
-
-    # gyro1 vs temperature
-    plt.figure(2,figsize=(20,13))
-
-    # draw plots
-    plt.subplot(3,1,1)
-    plt.plot(sensor_gyro_1['temperature'],sensor_gyro_1['x'],'b')
-    plt.plot(temp_resample,gyro_1_x_resample,'r')
-    plt.title('Gyro 1 Bias vs Temperature')
-    plt.ylabel('X bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,2)
-    plt.plot(sensor_gyro_1['temperature'],sensor_gyro_1['y'],'b')
-    plt.plot(temp_resample,gyro_1_y_resample,'r')
-    plt.ylabel('Y bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,3)
-    plt.plot(sensor_gyro_1['temperature'],sensor_gyro_1['z'],'b')
-    plt.plot(temp_resample,gyro_1_z_resample,'r')
-    plt.ylabel('Z bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-#################################################################################
-
-# define data dictionary of gyro 2 thermal correction  parameters
-gyro_2_params = {
-'TC_G2_ID':0,
-'TC_G2_TMIN':0.0,
-'TC_G2_TMAX':0.0,
-'TC_G2_TREF':0.0,
-'TC_G2_X0_0':0.0,
-'TC_G2_X1_0':0.0,
-'TC_G2_X2_0':0.0,
-'TC_G2_X3_0':0.0,
-'TC_G2_X0_1':0.0,
-'TC_G2_X1_1':0.0,
-'TC_G2_X2_1':0.0,
-'TC_G2_X3_1':0.0,
-'TC_G2_X0_2':0.0,
-'TC_G2_X1_2':0.0,
-'TC_G2_X2_2':0.0,
-'TC_G2_X3_2':0.0,
-'TC_G2_SCL_0':1.0,
-'TC_G2_SCL_1':1.0,
-'TC_G2_SCL_2':1.0
-}
-
-# curve fit the data for gyro 2 corrections
-if num_gyros >= 3:
-    gyro_2_params['TC_G2_ID'] = int(np.median(sensor_gyro_2['device_id']))
-
-    # find the min, max and reference temperature
-    gyro_2_params['TC_G2_TMIN'] = np.amin(sensor_gyro_2['temperature'])
-    gyro_2_params['TC_G2_TMAX'] = np.amax(sensor_gyro_2['temperature'])
-    gyro_2_params['TC_G2_TREF'] = 0.5 * (gyro_2_params['TC_G2_TMIN'] + gyro_2_params['TC_G2_TMAX'])
-    temp_rel = sensor_gyro_2['temperature'] - gyro_2_params['TC_G2_TREF']
-    temp_rel_resample = np.linspace(gyro_2_params['TC_G2_TMIN']-gyro_2_params['TC_G2_TREF'], gyro_2_params['TC_G2_TMAX']-gyro_2_params['TC_G2_TREF'], 100)
-    temp_resample = temp_rel_resample + gyro_2_params['TC_G2_TREF']
-
-    # fit X axis
-    coef_gyro_2_x = np.polyfit(temp_rel,sensor_gyro_2['x'],3)
-    gyro_2_params['TC_G2_X3_0'] = coef_gyro_2_x[0]
-    gyro_2_params['TC_G2_X2_0'] = coef_gyro_2_x[1]
-    gyro_2_params['TC_G2_X1_0'] = coef_gyro_2_x[2]
-    gyro_2_params['TC_G2_X0_0'] = coef_gyro_2_x[3]
-    fit_coef_gyro_2_x = np.poly1d(coef_gyro_2_x)
-    gyro_2_x_resample = fit_coef_gyro_2_x(temp_rel_resample)
-
-    # fit Y axis
-    coef_gyro_2_y = np.polyfit(temp_rel,sensor_gyro_2['y'],3)
-    gyro_2_params['TC_G2_X3_1'] = coef_gyro_2_y[0]
-    gyro_2_params['TC_G2_X2_1'] = coef_gyro_2_y[1]
-    gyro_2_params['TC_G2_X1_1'] = coef_gyro_2_y[2]
-    gyro_2_params['TC_G2_X0_1'] = coef_gyro_2_y[3]
-    fit_coef_gyro_2_y = np.poly1d(coef_gyro_2_y)
-    gyro_2_y_resample = fit_coef_gyro_2_y(temp_rel_resample)
-
-    # fit Z axis
-    coef_gyro_2_z = np.polyfit(temp_rel,sensor_gyro_2['z'],3)
-    gyro_2_params['TC_G2_X3_2'] = coef_gyro_2_z[0]
-    gyro_2_params['TC_G2_X2_2'] = coef_gyro_2_z[1]
-    gyro_2_params['TC_G2_X1_2'] = coef_gyro_2_z[2]
-    gyro_2_params['TC_G2_X0_2'] = coef_gyro_2_z[3]
-    fit_coef_gyro_2_z = np.poly1d(coef_gyro_2_z)
-    gyro_2_z_resample = fit_coef_gyro_2_z(temp_rel_resample)
-
-    # gyro2 vs temperature
-    plt.figure(3,figsize=(20,13))
-
-    # draw plots
-    plt.subplot(3,1,1)
-    plt.plot(sensor_gyro_2['temperature'],sensor_gyro_2['x'],'b')
-    plt.plot(temp_resample,gyro_2_x_resample,'r')
-    plt.title('Gyro 2 Bias vs Temperature')
-    plt.ylabel('X bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,2)
-    plt.plot(sensor_gyro_2['temperature'],sensor_gyro_2['y'],'b')
-    plt.plot(temp_resample,gyro_2_y_resample,'r')
-    plt.ylabel('Y bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,3)
-    plt.plot(sensor_gyro_2['temperature'],sensor_gyro_2['z'],'b')
-    plt.plot(temp_resample,gyro_2_z_resample,'r')
-    plt.ylabel('Z bias (rad/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-#################################################################################
-
-# define data dictionary of accel 0 thermal correction  parameters
-accel_0_params = {
-'TC_A0_ID':0,
-'TC_A0_TMIN':0.0,
-'TC_A0_TMAX':0.0,
-'TC_A0_TREF':0.0,
-'TC_A0_X0_0':0.0,
-'TC_A0_X1_0':0.0,
-'TC_A0_X2_0':0.0,
-'TC_A0_X3_0':0.0,
-'TC_A0_X0_1':0.0,
-'TC_A0_X1_1':0.0,
-'TC_A0_X2_1':0.0,
-'TC_A0_X3_1':0.0,
-'TC_A0_X0_2':0.0,
-'TC_A0_X1_2':0.0,
-'TC_A0_X2_2':0.0,
-'TC_A0_X3_2':0.0,
-'TC_A0_SCL_0':1.0,
-'TC_A0_SCL_1':1.0,
-'TC_A0_SCL_2':1.0
-}
-
-# curve fit the data for accel 0 corrections
-if num_accels >= 1:
-    accel_0_params['TC_A0_ID'] = int(np.median(sensor_accel_0['device_id']))
+from matplotlib.figure import Figure
+
+from ecl_ekf.population_sketch import MetricSketch
+from ecl_ekf.ulog_cache import open_ulog, ULOG_CACHE_DIR_ENV
+from ecl_ekf.ulog_tail import ULogTail
+
+# the calibrated sensor types in the order they are written to the parameter file: topic, parameter
+# prefix, plot name, fitted fields with their plot label, polynomial order, whether the median of
+# the field is removed, scale factor of the field (e.g. hPa to Pa) and the minimum number of
+# instances written to the parameter file.
+SENSOR_TYPES = [
+    ('sensor_accel', 'TC_A', 'Accel',
+     [('x', 'X bias (m/s/s)'), ('y', 'Y bias (m/s/s)'), ('z', 'Z bias (m/s/s)')], 3, True, 1.0, 3),
+    ('sensor_baro', 'TC_B', 'Baro', [('pressure', 'Z bias (Pa)')], 5, True, 100.0, 2),
+    ('sensor_gyro', 'TC_G', 'Gyro',
+     [('x', 'X bias (rad/s)'), ('y', 'Y bias (rad/s)'), ('z', 'Z bias (rad/s)')], 3, False, 1.0, 3),
+]
+
+# the number of temperatures the fitted polynomials are plotted at
+PLOT_RESAMPLE_POINTS = 100
+
+# the default width of the temperature bins the samples are reduced to before the fit, in degC
+DEFAULT_BIN_WIDTH = 0.1
+
+# the number of bytes of the log read at a time by the streaming reduction
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+
+# the default width of the temperature bands the residuals of a validation are reported in, in degC
+DEFAULT_VALIDATION_BAND_WIDTH = 5.0
+
+
+class SensorCalibration(object):
+    """
+    the thermal calibration of a sensor instance: the biases of its fields in temperature bins and
+    the fitted polynomials.
+    """
+
+    def __init__(self, params: Dict[str, object], temperature: np.ndarray, biases: np.ndarray,
+                 bias_std: np.ndarray, coefficients: np.ndarray, residual_rms: np.ndarray) -> None:
+        """
+        :param params: the TC_* parameters of the instance.
+        :param temperature: the mean temperature of every temperature bin.
+        :param biases: the mean bias of every bin (rows) and field (columns).
+        :param bias_std: the standard deviation of the bias of every bin (rows) and field (columns).
+        :param coefficients: the polynomial coefficients, highest power first (rows), of every
+        field (columns), relative to the reference temperature.
+        :param residual_rms: the root mean square of the residuals of all samples to the fitted
+        polynomial of every field.
+        """
+        self.params = params
+        self.temperature = temperature
+        self.biases = biases
+        self.bias_std = bias_std
+        self.coefficients = coefficients
+        self.residual_rms = residual_rms
+
+    @property
+    def reference_temperature(self) -> float:
+        """
+        :return: the temperature the polynomials are relative to.
+        """
+        return next(value for name, value in self.params.items() if name.endswith('_TREF'))
+
+
+def get_calibration_param_names(param_prefix: str, instance: int, n_fields: int,
+                                polynomial_order: int) -> Tuple[str, List[List[str]], List[str]]:
+    """
+    :param param_prefix: e.g. 'TC_G'.
+    :param instance:
+    :param n_fields:
+    :param polynomial_order:
+    :return: the parameter name prefix of the instance, e.g. 'TC_G0', the names of the polynomial
+    coefficients for every power (rows) and field (columns) and the names of the scale factors.
+    """
+    prefix = '{:s}{:d}'.format(param_prefix, instance)
+    field_suffixes = ['_{:d}'.format(i) for i in range(n_fields)] if n_fields > 1 else ['']
+    coefficient_names = [['{:s}_X{:d}{:s}'.format(prefix, power, suffix) for suffix in field_suffixes]
+                         for power in range(polynomial_order + 1)]
+    scale_names = ['{:s}_SCL{:s}'.format(prefix, suffix) for suffix in field_suffixes]
+    return prefix, coefficient_names, scale_names
+
+
+def get_default_calibration_params(param_prefix: str, instance: int, n_fields: int,
+                                   polynomial_order: int) -> Dict[str, object]:
+    """
+    :param param_prefix:
+    :param instance:
+    :param n_fields:
+    :param polynomial_order:
+    :return: the TC_* parameters of an instance without thermal compensation.
+    """
+    prefix, coefficient_names, scale_names = get_calibration_param_names(
+        param_prefix, instance, n_fields, polynomial_order)
+    params = OrderedDict()
+    params['{:s}_ID'.format(prefix)] = 0
+    for name in ['TMIN', 'TMAX', 'TREF']:
+        params['{:s}_{:s}'.format(prefix, name)] = 0.0
+    # the coefficients are ordered by field, then by power
+    for names in zip(*coefficient_names):
+        for name in names:
+            params[name] = 0.0
+    for name in scale_names:
+        params[name] = 1.0
+    return params
+
+
+class SensorSamples(object):
+    """
+    the raw samples of a sensor instance.
+    """
+
+    def __init__(self, data: Dict[str, np.ndarray], fields: List[str]) -> None:
+        """
+        :param data: the logged data of the instance.
+        :param fields: the fitted fields.
+        """
+        self._data = data
+        self._fields = fields
+
+    @property
+    def device_id(self) -> int:
+        """
+        :return: the median device id.
+        """
+        return int(np.median(self._data['device_id']))
+
+    @property
+    def temperature_min(self) -> np.floating:
+        return np.amin(self._data['temperature'])
+
+    @property
+    def temperature_max(self) -> np.floating:
+        return np.amax(self._data['temperature'])
+
+    def get_medians(self) -> np.ndarray:
+        """
+        :return: the median of every field.
+        """
+        return np.median(self.get_fit_data()[1], axis=0)
+
+    def get_fit_data(self) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        :return: the temperature, the values of the fields (columns) and no weights: every sample
+        is fitted with the same weight.
+        """
+        return (self._data['temperature'],
+                np.column_stack([self._data[field] for field in self._fields]), None)
+
+    def get_m2(self) -> np.ndarray:
+        """
+        :return: the sum of squared deviations of the samples from the fitted values of every
+        field, which is zero because every sample is fitted.
+        """
+        return np.zeros(len(self._fields))
+
+    def reduce(self, bin_width: float) -> 'TemperatureBinnedStatistics':
+        """
+        :param bin_width: the width of the temperature bins in degC.
+        :return: the statistics of the samples in temperature bins.
+        """
+        statistics = TemperatureBinnedStatistics(self._fields, bin_width)
+        statistics.add(self._data)
+        return statistics
+
+
+class TemperatureBinnedStatistics(object):
+    """
+    streaming statistics of the samples of a sensor instance in temperature bins: the number of
+    samples and the mean and sum of squared deviations from the mean (M2) of the temperature and
+    of every field. The statistics are updated chunk by chunk with the parallel algorithm of Chan
+    et al., such that the memory does not depend on the number of samples. The medians of the fields
+    are estimated by sketches of their deviations from the median of the first chunk; the
+    temperature range and the median device id are exact.
+    """
+
+    def __init__(self, fields: List[str], bin_width: float) -> None:
+        """
+        :param fields: the fitted fields.
+        :param bin_width: the width of the temperature bins in degC.
+        """
+        self._fields = fields
+        self._bin_width = bin_width
+        self._first_bin = 0
+        self._counts = np.zeros(0, dtype=np.int64)
+        # the mean and M2 of the temperature (first column) and the fields of every bin (rows)
+        self._means = np.zeros((0, len(fields) + 1))
+        self._m2 = np.zeros((0, len(fields) + 1))
+        self._temperature_min = None  # type: Optional[np.floating]
+        self._temperature_max = None  # type: Optional[np.floating]
+        self._device_id_counts = dict()  # type: Dict[int, int]
+        self._median_references = None  # type: Optional[np.ndarray]
+        self._median_sketches = [MetricSketch() for _ in fields]
+
+    def _resize(self, first_bin: int, last_bin: int) -> None:
+        """
+        extends the bins to cover the bins from first_bin to last_bin.
+        :param first_bin:
+        :param last_bin:
+        :return:
+        """
+        if len(self._counts) == 0:
+            self._first_bin = first_bin
+        n_before = max(self._first_bin - first_bin, 0)
+        n_after = max(last_bin - (self._first_bin + len(self._counts) - 1), 0)
+        if n_before > 0 or n_after > 0:
+            self._counts = np.pad(self._counts, (n_before, n_after))
+            self._means = np.pad(self._means, ((n_before, n_after), (0, 0)))
+            self._m2 = np.pad(self._m2, ((n_before, n_after), (0, 0)))
+            self._first_bin -= n_before
+
+    def add(self, data: Dict[str, np.ndarray]) -> None:
+        """
+        adds a chunk of samples. Samples without a finite temperature are skipped.
+        :param data: the logged data of the sensor instance.
+        :return:
+        """
+        temperature = data['temperature']
+        finite = np.isfinite(temperature)
+        if not np.any(finite):
+            return
+        temperature = temperature[finite]
+        values = np.column_stack([temperature] + [data[field][finite] for field in self._fields]
+                                 ).astype(float)
+
+        self._temperature_min = np.amin(temperature) if self._temperature_min is None else \
+            np.minimum(self._temperature_min, np.amin(temperature))
+        self._temperature_max = np.amax(temperature) if self._temperature_max is None else \
+            np.maximum(self._temperature_max, np.amax(temperature))
+        device_ids, device_id_counts = np.unique(data['device_id'], return_counts=True)
+        for device_id, count in zip(device_ids.tolist(), device_id_counts.tolist()):
+            self._device_id_counts[device_id] = self._device_id_counts.get(device_id, 0) + count
+
+        if self._median_references is None:
+            self._median_references = np.median(values[:, 1:], axis=0)
+        for i, sketch in enumerate(self._median_sketches):
+            sketch.add(values[:, i + 1] - self._median_references[i])
+
+        # the statistics of the chunk
+        bins = np.floor(temperature / self._bin_width).astype(np.int64)
+        self._resize(int(np.amin(bins)), int(np.amax(bins)))
+        index = bins - self._first_bin
+        counts = np.bincount(index, minlength=len(self._counts))
+        used = counts > 0
+        means = np.zeros_like(self._means)
+        m2 = np.zeros_like(self._m2)
+        for i in range(values.shape[1]):
+            means[used, i] = np.bincount(index, weights=values[:, i],
+                                         minlength=len(counts))[used] / counts[used]
+            m2[:, i] = np.bincount(index, weights=(values[:, i] - means[index, i]) ** 2,
+                                   minlength=len(counts))
+
+        # merge the statistics of the chunk
+        total_counts = self._counts[used] + counts[used]
+        delta = means[used] - self._means[used]
+        self._m2[used] += m2[used] + delta ** 2 * (
+            self._counts[used] * counts[used] / total_counts)[:, np.newaxis]
+        self._means[used] += delta * (counts[used] / total_counts)[:, np.newaxis]
+        self._counts[used] = total_counts
+
+    @property
+    def count(self) -> int:
+        """
+        :return: the number of samples.
+        """
+        return int(np.sum(self._counts))
+
+    @property
+    def bin_width(self) -> float:
+        """
+        :return: the width of the temperature bins in degC.
+        """
+        return self._bin_width
+
+    @property
+    def device_id(self) -> int:
+        """
+        :return: the median device id.
+        """
+        device_ids = sorted(self._device_id_counts.keys())
+        cumulative_counts = np.cumsum([self._device_id_counts[i] for i in device_ids])
+        lower = device_ids[np.searchsorted(cumulative_counts, (cumulative_counts[-1] - 1) // 2,
+                                           side='right')]
+        upper = device_ids[np.searchsorted(cumulative_counts, cumulative_counts[-1] // 2,
+                                           side='right')]
+        return int(0.5 * (lower + upper))
+
+    @property
+    def temperature_min(self) -> np.floating:
+        return self._temperature_min
+
+    @property
+    def temperature_max(self) -> np.floating:
+        return self._temperature_max
+
+    def get_medians(self) -> np.ndarray:
+        """
+        :return: the estimated median of every field.
+        """
+        return self._median_references + np.array(
+            [sketch.quantile(0.5) for sketch in self._median_sketches])
+
+    def get_variances(self) -> np.ndarray:
+        """
+        :return: the variance of the fields (columns) in every non empty bin (rows).
+        """
+        used = self._counts > 0
+        return self._m2[used, 1:] / self._counts[used, np.newaxis]
+
+    def get_bin_edges(self) -> np.ndarray:
+        """
+        :return: the lower temperature edge of every non empty bin.
+        """
+        used = self._counts > 0
+        return (self._first_bin + np.flatnonzero(used)) * self._bin_width
+
+    def get_fit_data(self) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        :return: the mean temperature, the mean of the fields (columns) and the number of samples
+        of every non empty bin (rows). The bins are fitted with a weight of their number of
+        samples, which is equivalent to fitting the samples if the temperature spread in a bin is
+        small.
+        """
+        used = self._counts > 0
+        return self._means[used, 0], self._means[used, 1:], self._counts[used]
+
+    def get_m2(self) -> np.ndarray:
+        """
+        :return: the sum of squared deviations of the samples from their bin mean of every field.
+        """
+        return np.sum(self._m2[:, 1:], axis=0)
+
+
+def calibrate_sensor_instance(
+        sensor_data, param_prefix: str, instance: int, n_fields: int, polynomial_order: int,
+        remove_median: bool, scale: float) -> SensorCalibration:
+    """
+    fits the bias polynomials of all fields of a sensor instance vs temperature.
+    :param sensor_data: the SensorSamples or TemperatureBinnedStatistics of the instance.
+    :param param_prefix:
+    :param instance:
+    :param n_fields:
+    :param polynomial_order:
+    :param remove_median: whether the median of a field is removed before the fit.
+    :param scale: the scale factor of the fields.
+    :return:
+    """
+    params = get_default_calibration_params(param_prefix, instance, n_fields, polynomial_order)
+    prefix, coefficient_names, _ = get_calibration_param_names(
+        param_prefix, instance, n_fields, polynomial_order)
+
+    params['{:s}_ID'.format(prefix)] = sensor_data.device_id
 
     # find the min, max and reference temperature
-    accel_0_params['TC_A0_TMIN'] = np.amin(sensor_accel_0['temperature'])
-    accel_0_params['TC_A0_TMAX'] = np.amax(sensor_accel_0['temperature'])
-    accel_0_params['TC_A0_TREF'] = 0.5 * (accel_0_params['TC_A0_TMIN'] + accel_0_params['TC_A0_TMAX'])
-    temp_rel = sensor_accel_0['temperature'] - accel_0_params['TC_A0_TREF']
-    temp_rel_resample = np.linspace(accel_0_params['TC_A0_TMIN']-accel_0_params['TC_A0_TREF'], accel_0_params['TC_A0_TMAX']-accel_0_params['TC_A0_TREF'], 100)
-    temp_resample = temp_rel_resample + accel_0_params['TC_A0_TREF']
-
-    # fit X axis
-    correction_x = sensor_accel_0['x'] - np.median(sensor_accel_0['x'])
-    coef_accel_0_x = np.polyfit(temp_rel,correction_x,3)
-    accel_0_params['TC_A0_X3_0'] = coef_accel_0_x[0]
-    accel_0_params['TC_A0_X2_0'] = coef_accel_0_x[1]
-    accel_0_params['TC_A0_X1_0'] = coef_accel_0_x[2]
-    accel_0_params['TC_A0_X0_0'] = coef_accel_0_x[3]
-    fit_coef_accel_0_x = np.poly1d(coef_accel_0_x)
-    correction_x_resample = fit_coef_accel_0_x(temp_rel_resample)
-
-    # fit Y axis
-    correction_y = sensor_accel_0['y']-np.median(sensor_accel_0['y'])
-    coef_accel_0_y = np.polyfit(temp_rel,correction_y,3)
-    accel_0_params['TC_A0_X3_1'] = coef_accel_0_y[0]
-    accel_0_params['TC_A0_X2_1'] = coef_accel_0_y[1]
-    accel_0_params['TC_A0_X1_1'] = coef_accel_0_y[2]
-    accel_0_params['TC_A0_X0_1'] = coef_accel_0_y[3]
-    fit_coef_accel_0_y = np.poly1d(coef_accel_0_y)
-    correction_y_resample = fit_coef_accel_0_y(temp_rel_resample)
-
-    # fit Z axis
-    correction_z = sensor_accel_0['z']-np.median(sensor_accel_0['z'])
-    coef_accel_0_z = np.polyfit(temp_rel,correction_z,3)
-    accel_0_params['TC_A0_X3_2'] = coef_accel_0_z[0]
-    accel_0_params['TC_A0_X2_2'] = coef_accel_0_z[1]
-    accel_0_params['TC_A0_X1_2'] = coef_accel_0_z[2]
-    accel_0_params['TC_A0_X0_2'] = coef_accel_0_z[3]
-    fit_coef_accel_0_z = np.poly1d(coef_accel_0_z)
-    correction_z_resample = fit_coef_accel_0_z(temp_rel_resample)
-
-    # accel 0 vs temperature
-    plt.figure(4,figsize=(20,13))
-
-    # draw plots
-    plt.subplot(3,1,1)
-    plt.plot(sensor_accel_0['temperature'],correction_x,'b')
-    plt.plot(temp_resample,correction_x_resample,'r')
-    plt.title('Accel 0 Bias vs Temperature')
-    plt.ylabel('X bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,2)
-    plt.plot(sensor_accel_0['temperature'],correction_y,'b')
-    plt.plot(temp_resample,correction_y_resample,'r')
-    plt.ylabel('Y bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,3)
-    plt.plot(sensor_accel_0['temperature'],correction_z,'b')
-    plt.plot(temp_resample,correction_z_resample,'r')
-    plt.ylabel('Z bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-#################################################################################
-
-# define data dictionary of accel 1 thermal correction  parameters
-accel_1_params = {
-'TC_A1_ID':0,
-'TC_A1_TMIN':0.0,
-'TC_A1_TMAX':0.0,
-'TC_A1_TREF':0.0,
-'TC_A1_X0_0':0.0,
-'TC_A1_X1_0':0.0,
-'TC_A1_X2_0':0.0,
-'TC_A1_X3_0':0.0,
-'TC_A1_X0_1':0.0,
-'TC_A1_X1_1':0.0,
-'TC_A1_X2_1':0.0,
-'TC_A1_X3_1':0.0,
-'TC_A1_X0_2':0.0,
-'TC_A1_X1_2':0.0,
-'TC_A1_X2_2':0.0,
-'TC_A1_X3_2':0.0,
-'TC_A1_SCL_0':1.0,
-'TC_A1_SCL_1':1.0,
-'TC_A1_SCL_2':1.0
-}
-
-# curve fit the data for accel 1 corrections
-if num_accels >= 2:
-    accel_1_params['TC_A1_ID'] = int(np.median(sensor_accel_1['device_id']))
-
-    # find the min, max and reference temperature
-    accel_1_params['TC_A1_TMIN'] = np.amin(sensor_accel_1['temperature'])
-    accel_1_params['TC_A1_TMAX'] = np.amax(sensor_accel_1['temperature'])
-    accel_1_params['TC_A1_TREF'] = 0.5 * (accel_1_params['TC_A1_TMIN'] + accel_1_params['TC_A1_TMAX'])
-    temp_rel = sensor_accel_1['temperature'] - accel_1_params['TC_A1_TREF']
-    temp_rel_resample = np.linspace(accel_1_params['TC_A1_TMIN']-accel_1_params['TC_A1_TREF'], accel_1_params['TC_A1_TMAX']-accel_1_params['TC_A1_TREF'], 100)
-    temp_resample = temp_rel_resample + accel_1_params['TC_A1_TREF']
-
-    # fit X axis
-    correction_x = sensor_accel_1['x']-np.median(sensor_accel_1['x'])
-    coef_accel_1_x = np.polyfit(temp_rel,correction_x,3)
-    accel_1_params['TC_A1_X3_0'] = coef_accel_1_x[0]
-    accel_1_params['TC_A1_X2_0'] = coef_accel_1_x[1]
-    accel_1_params['TC_A1_X1_0'] = coef_accel_1_x[2]
-    accel_1_params['TC_A1_X0_0'] = coef_accel_1_x[3]
-    fit_coef_accel_1_x = np.poly1d(coef_accel_1_x)
-    correction_x_resample = fit_coef_accel_1_x(temp_rel_resample)
-
-    # fit Y axis
-    correction_y = sensor_accel_1['y']-np.median(sensor_accel_1['y'])
-    coef_accel_1_y = np.polyfit(temp_rel,correction_y,3)
-    accel_1_params['TC_A1_X3_1'] = coef_accel_1_y[0]
-    accel_1_params['TC_A1_X2_1'] = coef_accel_1_y[1]
-    accel_1_params['TC_A1_X1_1'] = coef_accel_1_y[2]
-    accel_1_params['TC_A1_X0_1'] = coef_accel_1_y[3]
-    fit_coef_accel_1_y = np.poly1d(coef_accel_1_y)
-    correction_y_resample = fit_coef_accel_1_y(temp_rel_resample)
-
-    # fit Z axis
-    correction_z = (sensor_accel_1['z'])-np.median(sensor_accel_1['z'])
-    coef_accel_1_z = np.polyfit(temp_rel,correction_z,3)
-    accel_1_params['TC_A1_X3_2'] = coef_accel_1_z[0]
-    accel_1_params['TC_A1_X2_2'] = coef_accel_1_z[1]
-    accel_1_params['TC_A1_X1_2'] = coef_accel_1_z[2]
-    accel_1_params['TC_A1_X0_2'] = coef_accel_1_z[3]
-    fit_coef_accel_1_z = np.poly1d(coef_accel_1_z)
-    correction_z_resample = fit_coef_accel_1_z(temp_rel_resample)
-
-    # accel 1 vs temperature
-    plt.figure(5,figsize=(20,13))
-
-    # draw plots
-    plt.subplot(3,1,1)
-    plt.plot(sensor_accel_1['temperature'],correction_x,'b')
-    plt.plot(temp_resample,correction_x_resample,'r')
-    plt.title('Accel 1 Bias vs Temperature')
-    plt.ylabel('X bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,2)
-    plt.plot(sensor_accel_1['temperature'],correction_y,'b')
-    plt.plot(temp_resample,correction_y_resample,'r')
-    plt.ylabel('Y bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,3)
-    plt.plot(sensor_accel_1['temperature'],correction_z,'b')
-    plt.plot(temp_resample,correction_z_resample,'r')
-    plt.ylabel('Z bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-#################################################################################
-
-# define data dictionary of accel 2 thermal correction  parameters
-accel_2_params = {
-'TC_A2_ID':0,
-'TC_A2_TMIN':0.0,
-'TC_A2_TMAX':0.0,
-'TC_A2_TREF':0.0,
-'TC_A2_X0_0':0.0,
-'TC_A2_X1_0':0.0,
-'TC_A2_X2_0':0.0,
-'TC_A2_X3_0':0.0,
-'TC_A2_X0_1':0.0,
-'TC_A2_X1_1':0.0,
-'TC_A2_X2_1':0.0,
-'TC_A2_X3_1':0.0,
-'TC_A2_X0_2':0.0,
-'TC_A2_X1_2':0.0,
-'TC_A2_X2_2':0.0,
-'TC_A2_X3_2':0.0,
-'TC_A2_SCL_0':1.0,
-'TC_A2_SCL_1':1.0,
-'TC_A2_SCL_2':1.0
-}
-
-# curve fit the data for accel 2 corrections
-if num_accels >= 3:
-    accel_2_params['TC_A2_ID'] = int(np.median(sensor_accel_2['device_id']))
-
-    # find the min, max and reference temperature
-    accel_2_params['TC_A2_TMIN'] = np.amin(sensor_accel_2['temperature'])
-    accel_2_params['TC_A2_TMAX'] = np.amax(sensor_accel_2['temperature'])
-    accel_2_params['TC_A2_TREF'] = 0.5 * (accel_2_params['TC_A2_TMIN'] + accel_2_params['TC_A2_TMAX'])
-    temp_rel = sensor_accel_2['temperature'] - accel_2_params['TC_A2_TREF']
-    temp_rel_resample = np.linspace(accel_2_params['TC_A2_TMIN']-accel_2_params['TC_A2_TREF'], accel_2_params['TC_A2_TMAX']-accel_2_params['TC_A2_TREF'], 100)
-    temp_resample = temp_rel_resample + accel_2_params['TC_A2_TREF']
-
-    # fit X axis
-    correction_x = sensor_accel_2['x']-np.median(sensor_accel_2['x'])
-    coef_accel_2_x = np.polyfit(temp_rel,correction_x,3)
-    accel_2_params['TC_A2_X3_0'] = coef_accel_2_x[0]
-    accel_2_params['TC_A2_X2_0'] = coef_accel_2_x[1]
-    accel_2_params['TC_A2_X1_0'] = coef_accel_2_x[2]
-    accel_2_params['TC_A2_X0_0'] = coef_accel_2_x[3]
-    fit_coef_accel_2_x = np.poly1d(coef_accel_2_x)
-    correction_x_resample = fit_coef_accel_2_x(temp_rel_resample)
-
-    # fit Y axis
-    correction_y = sensor_accel_2['y']-np.median(sensor_accel_2['y'])
-    coef_accel_2_y = np.polyfit(temp_rel,correction_y,3)
-    accel_2_params['TC_A2_X3_1'] = coef_accel_2_y[0]
-    accel_2_params['TC_A2_X2_1'] = coef_accel_2_y[1]
-    accel_2_params['TC_A2_X1_1'] = coef_accel_2_y[2]
-    accel_2_params['TC_A2_X0_1'] = coef_accel_2_y[3]
-    fit_coef_accel_2_y = np.poly1d(coef_accel_2_y)
-    correction_y_resample = fit_coef_accel_2_y(temp_rel_resample)
-
-    # fit Z axis
-    correction_z = sensor_accel_2['z']-np.median(sensor_accel_2['z'])
-    coef_accel_2_z = np.polyfit(temp_rel,correction_z,3)
-    accel_2_params['TC_A2_X3_2'] = coef_accel_2_z[0]
-    accel_2_params['TC_A2_X2_2'] = coef_accel_2_z[1]
-    accel_2_params['TC_A2_X1_2'] = coef_accel_2_z[2]
-    accel_2_params['TC_A2_X0_2'] = coef_accel_2_z[3]
-    fit_coef_accel_2_z = np.poly1d(coef_accel_2_z)
-    correction_z_resample = fit_coef_accel_2_z(temp_rel_resample)
-
-    # accel 2 vs temperature
-    plt.figure(6,figsize=(20,13))
-
-    # draw plots
-    plt.subplot(3,1,1)
-    plt.plot(sensor_accel_2['temperature'],correction_x,'b')
-    plt.plot(temp_resample,correction_x_resample,'r')
-    plt.title('Accel 2 Bias vs Temperature')
-    plt.ylabel('X bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,2)
-    plt.plot(sensor_accel_2['temperature'],correction_y,'b')
-    plt.plot(temp_resample,correction_y_resample,'r')
-    plt.ylabel('Y bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    # draw plots
-    plt.subplot(3,1,3)
-    plt.plot(sensor_accel_2['temperature'],correction_z,'b')
-    plt.plot(temp_resample,correction_z_resample,'r')
-    plt.ylabel('Z bias (m/s/s)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-#################################################################################
-
-# define data dictionary of baro 0 thermal correction  parameters
-baro_0_params = {
-'TC_B0_ID':0,
-'TC_B0_TMIN':0.0,
-'TC_B0_TMAX':0.0,
-'TC_B0_TREF':0.0,
-'TC_B0_X0':0.0,
-'TC_B0_X1':0.0,
-'TC_B0_X2':0.0,
-'TC_B0_X3':0.0,
-'TC_B0_X4':0.0,
-'TC_B0_X5':0.0,
-'TC_B0_SCL':1.0,
-}
-
-# curve fit the data for baro 0 corrections
-baro_0_params['TC_B0_ID'] = int(np.median(sensor_baro_0['device_id']))
-
-# find the min, max and reference temperature
-baro_0_params['TC_B0_TMIN'] = np.amin(sensor_baro_0['temperature'])
-baro_0_params['TC_B0_TMAX'] = np.amax(sensor_baro_0['temperature'])
-baro_0_params['TC_B0_TREF'] = 0.5 * (baro_0_params['TC_B0_TMIN'] + baro_0_params['TC_B0_TMAX'])
-temp_rel = sensor_baro_0['temperature'] - baro_0_params['TC_B0_TREF']
-temp_rel_resample = np.linspace(baro_0_params['TC_B0_TMIN']-baro_0_params['TC_B0_TREF'], baro_0_params['TC_B0_TMAX']-baro_0_params['TC_B0_TREF'], 100)
-temp_resample = temp_rel_resample + baro_0_params['TC_B0_TREF']
-
-# fit data
-median_pressure = np.median(sensor_baro_0['pressure']);
-coef_baro_0_x = np.polyfit(temp_rel,100*(sensor_baro_0['pressure']-median_pressure),5) # convert from hPa to Pa
-baro_0_params['TC_B0_X5'] = coef_baro_0_x[0]
-baro_0_params['TC_B0_X4'] = coef_baro_0_x[1]
-baro_0_params['TC_B0_X3'] = coef_baro_0_x[2]
-baro_0_params['TC_B0_X2'] = coef_baro_0_x[3]
-baro_0_params['TC_B0_X1'] = coef_baro_0_x[4]
-baro_0_params['TC_B0_X0'] = coef_baro_0_x[5]
-fit_coef_baro_0_x = np.poly1d(coef_baro_0_x)
-baro_0_x_resample = fit_coef_baro_0_x(temp_rel_resample)
-
-# baro 0 vs temperature
-plt.figure(7,figsize=(20,13))
-
-# draw plots
-plt.plot(sensor_baro_0['temperature'],100*sensor_baro_0['pressure']-100*median_pressure,'b')
-plt.plot(temp_resample,baro_0_x_resample,'r')
-plt.title('Baro 0 Bias vs Temperature')
-plt.ylabel('Z bias (Pa)')
-plt.xlabel('temperature (degC)')
-plt.grid()
-
-pp.savefig()
-
-# define data dictionary of baro 1 thermal correction  parameters
-baro_1_params = {
-'TC_B1_ID':0,
-'TC_B1_TMIN':0.0,
-'TC_B1_TMAX':0.0,
-'TC_B1_TREF':0.0,
-'TC_B1_X0':0.0,
-'TC_B1_X1':0.0,
-'TC_B1_X2':0.0,
-'TC_B1_X3':0.0,
-'TC_B1_X4':0.0,
-'TC_B1_X5':0.0,
-'TC_B1_SCL':1.0,
-}
-
-if num_baros >= 2:
-
-    # curve fit the data for baro 0 corrections
-    baro_1_params['TC_B1_ID'] = int(np.median(sensor_baro_1['device_id']))
-
-    # find the min, max and reference temperature
-    baro_1_params['TC_B1_TMIN'] = np.amin(sensor_baro_1['temperature'])
-    baro_1_params['TC_B1_TMAX'] = np.amax(sensor_baro_1['temperature'])
-    baro_1_params['TC_B1_TREF'] = 0.5 * (baro_1_params['TC_B1_TMIN'] + baro_1_params['TC_B1_TMAX'])
-    temp_rel = sensor_baro_1['temperature'] - baro_1_params['TC_B1_TREF']
-    temp_rel_resample = np.linspace(baro_1_params['TC_B1_TMIN']-baro_1_params['TC_B1_TREF'], baro_1_params['TC_B1_TMAX']-baro_1_params['TC_B1_TREF'], 100)
-    temp_resample = temp_rel_resample + baro_1_params['TC_B1_TREF']
-
-    # fit data
-    median_pressure = np.median(sensor_baro_1['pressure']);
-    coef_baro_1_x = np.polyfit(temp_rel,100*(sensor_baro_1['pressure']-median_pressure),5) # convert from hPa to Pa
-    baro_1_params['TC_B1_X5'] = coef_baro_1_x[0]
-    baro_1_params['TC_B1_X4'] = coef_baro_1_x[1]
-    baro_1_params['TC_B1_X3'] = coef_baro_1_x[2]
-    baro_1_params['TC_B1_X2'] = coef_baro_1_x[3]
-    baro_1_params['TC_B1_X1'] = coef_baro_1_x[4]
-    baro_1_params['TC_B1_X0'] = coef_baro_1_x[5]
-    fit_coef_baro_1_x = np.poly1d(coef_baro_1_x)
-    baro_1_x_resample = fit_coef_baro_1_x(temp_rel_resample)
-
-    # baro 1 vs temperature
-    plt.figure(8,figsize=(20,13))
-
-    # draw plots
-    plt.plot(sensor_baro_1['temperature'],100*sensor_baro_1['pressure']-100*median_pressure,'b')
-    plt.plot(temp_resample,baro_1_x_resample,'r')
-    plt.title('Baro 1 Bias vs Temperature')
-    plt.ylabel('Z bias (Pa)')
-    plt.xlabel('temperature (degC)')
-    plt.grid()
-
-    pp.savefig()
-
-#################################################################################
-
-# close the pdf file
-pp.close()
-
-# clase all figures
-plt.close("all")
-
-# write correction parameters to file
-test_results_filename = ulog_file_name + ".params"
-file = open(test_results_filename,"w")
-file.write("# Sensor thermal compensation parameters\n")
-file.write("#\n")
-file.write("# Vehicle-Id Component-Id Name Value Type\n")
-
-# accel 0 corrections
-key_list_accel = list(accel_0_params.keys())
-key_list_accel.sort
-for key in key_list_accel:
-    if key == 'TC_A0_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(accel_0_params[key])+"\t"+type+"\n")
-
-# accel 1 corrections
-key_list_accel = list(accel_1_params.keys())
-key_list_accel.sort
-for key in key_list_accel:
-    if key == 'TC_A1_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(accel_1_params[key])+"\t"+type+"\n")
-
-# accel 2 corrections
-key_list_accel = list(accel_2_params.keys())
-key_list_accel.sort
-for key in key_list_accel:
-    if key == 'TC_A2_ID':
-        type = "6"
+    params['{:s}_TMIN'.format(prefix)] = sensor_data.temperature_min
+    params['{:s}_TMAX'.format(prefix)] = sensor_data.temperature_max
+    params['{:s}_TREF'.format(prefix)] = 0.5 * (
+        params['{:s}_TMIN'.format(prefix)] + params['{:s}_TMAX'.format(prefix)])
+
+    temperature, biases, counts = sensor_data.get_fit_data()
+    temp_rel = temperature - params['{:s}_TREF'.format(prefix)]
+    if remove_median:
+        biases = biases - sensor_data.get_medians()
+    if scale != 1.0:
+        biases = scale * biases
+
+    # a single least squares solve for all fields: they share the Vandermonde matrix
+    coefficients = np.polyfit(temp_rel, biases, polynomial_order,
+                              w=np.sqrt(counts) if counts is not None else None)
+    for power in range(polynomial_order + 1):
+        for i, name in enumerate(coefficient_names[power]):
+            params[name] = coefficients[polynomial_order - power, i]
+
+    # the sum of squared residuals of the samples is the sum of squared deviations from the fitted
+    # values plus the weighted sum of squared residuals of the fitted values
+    residuals = biases - np.vander(temp_rel, polynomial_order + 1).dot(coefficients)
+    weights = counts if counts is not None else np.ones(len(temperature))
+    residual_rms = np.sqrt((weights.dot(residuals ** 2) + scale ** 2 * sensor_data.get_m2()) /
+                           np.sum(weights))
+
+    # the biases are kept as the mean and standard deviation in temperature bins, which is what is
+    # plotted instead of every sample
+    binned_data = sensor_data.reduce(DEFAULT_BIN_WIDTH) \
+        if isinstance(sensor_data, SensorSamples) else sensor_data
+    bin_temperature, bin_biases, _ = binned_data.get_fit_data()
+    if remove_median:
+        bin_biases = bin_biases - sensor_data.get_medians()
+    bin_biases = scale * bin_biases
+    bin_bias_std = abs(scale) * np.sqrt(binned_data.get_variances())
+
+    return SensorCalibration(params, bin_temperature, bin_biases, bin_bias_std, coefficients,
+                             residual_rms)
+
+
+def load_sensor_data(ulog) -> Dict[str, List[SensorSamples]]:
+    """
+    :param ulog: a ULog or CachedULog.
+    :return: a dict of topic name to the raw samples of its instances, ordered by instance.
+    """
+    sensor_data = dict()
+    for topic, _, _, fields, _, _, _, _ in SENSOR_TYPES:
+        sensor_data[topic] = [
+            SensorSamples(d.data, [field for field, _ in fields]) for d in sorted(
+                [d for d in ulog.data_list if d.name == topic], key=lambda d: d.multi_id)]
+    return sensor_data
+
+
+def reduce_sensor_data(
+        filename: str, bin_width: float, read_chunk_bytes: int = READ_CHUNK_BYTES) -> \
+        Dict[str, List[TemperatureBinnedStatistics]]:
+    """
+    reads a log in chunks and reduces the samples of every sensor instance to temperature binned
+    statistics, without loading the whole log into memory.
+    :param filename:
+    :param bin_width: the width of the temperature bins in degC.
+    :param read_chunk_bytes: the number of bytes read at a time.
+    :return: a dict of topic name to the statistics of its instances, ordered by instance.
+    """
+    topic_fields = {topic: [field for field, _ in fields]
+                    for topic, _, _, fields, _, _, _, _ in SENSOR_TYPES}
+    requirements = {topic: {'device_id', 'temperature'} | set(fields)
+                    for topic, fields in topic_fields.items()}
+    statistics = dict()  # type: Dict[Tuple[str, int], TemperatureBinnedStatistics]
+    with ULogTail(filename, requirements) as ulog_tail:
+        while True:
+            bytes_read = ulog_tail.bytes_read
+            for (topic, multi_id), data in ulog_tail.read_instances(read_chunk_bytes).items():
+                if (topic, multi_id) not in statistics:
+                    statistics[(topic, multi_id)] = TemperatureBinnedStatistics(
+                        topic_fields[topic], bin_width)
+                statistics[(topic, multi_id)].add(data)
+            if ulog_tail.bytes_read == bytes_read:
+                break
+
+    return {topic: [statistics[key] for key in sorted(statistics.keys())
+                    if key[0] == topic and statistics[key].count > 0]
+            for topic, _, _, _, _, _, _, _ in SENSOR_TYPES}
+
+
+def calibrate_sensors(sensor_data: Dict[str, list]) -> Dict[str, List[SensorCalibration]]:
+    """
+    calibrates all instances of the calibrated sensor types.
+    :param sensor_data: a dict of topic name to the SensorSamples or TemperatureBinnedStatistics
+    of its instances, as returned by load_sensor_data or reduce_sensor_data.
+    :return: a dict of topic name to the calibrations of its instances.
+    """
+    calibrations = dict()
+    for topic, param_prefix, name, fields, polynomial_order, remove_median, scale, _ in \
+            SENSOR_TYPES:
+        calibrations[topic] = list()
+        for instance, instance_data in enumerate(sensor_data[topic]):
+            print('found {:s} {:d} data'.format(name.lower(), instance))
+            calibrations[topic].append(calibrate_sensor_instance(
+                instance_data, param_prefix, instance, len(fields), polynomial_order,
+                remove_median, scale))
+    return calibrations
+
+
+def plot_calibrations(calibrations: Dict[str, List[SensorCalibration]],
+                      output_plot_filename: str) -> None:
+    """
+    plots the biases and the fitted polynomials of every sensor instance vs temperature to a pdf
+    file with one page per instance. The biases are plotted as the mean and an envelope of two
+    standard deviations per temperature bin. Only the object oriented matplotlib interface is used,
+    such that the plots can be rendered in a background thread.
+    :param calibrations:
+    :param output_plot_filename:
+    :return:
+    """
+    with PdfPages(output_plot_filename) as pp:
+        for topic, _, name, fields, _, _, _, _ in SENSOR_TYPES:
+            for instance, calibration in enumerate(calibrations[topic]):
+                tref = calibration.reference_temperature
+                temp_resample = np.linspace(
+                    np.amin(calibration.temperature), np.amax(calibration.temperature),
+                    PLOT_RESAMPLE_POINTS)
+                figure = Figure(figsize=(20, 13))
+                for i, (_, label) in enumerate(fields):
+                    axes = figure.add_subplot(len(fields), 1, i + 1)
+                    axes.fill_between(
+                        calibration.temperature,
+                        calibration.biases[:, i] - 2.0 * calibration.bias_std[:, i],
+                        calibration.biases[:, i] + 2.0 * calibration.bias_std[:, i],
+                        color='b', alpha=0.2, linewidth=0)
+                    axes.plot(calibration.temperature, calibration.biases[:, i], 'b')
+                    axes.plot(temp_resample,
+                              np.polyval(calibration.coefficients[:, i], temp_resample - tref), 'r')
+                    if i == 0:
+                        axes.set_title('{:s} {:d} Bias vs Temperature'.format(name, instance))
+                    axes.set_ylabel(label)
+                    axes.set_xlabel('temperature (degC)')
+                    axes.grid()
+                pp.savefig(figure)
+
+
+def write_params_file(calibrations: Dict[str, List[SensorCalibration]],
+                      params_filename: str) -> None:
+    """
+    writes the TC_* parameters of all sensor instances in the QGroundControl parameter file format.
+    Instances up to the minimum number of instances of a sensor type are written with default
+    parameters if they were not found in the log.
+    :param calibrations:
+    :param params_filename:
+    :return:
+    """
+    with open(params_filename, 'w') as file:
+        file.write("# Sensor thermal compensation parameters\n")
+        file.write("#\n")
+        file.write("# Vehicle-Id Component-Id Name Value Type\n")
+        for topic, param_prefix, _, fields, polynomial_order, _, _, min_instances in \
+                SENSOR_TYPES:
+            instance_params = [calibration.params for calibration in calibrations[topic]]
+            for instance in range(len(instance_params), min_instances):
+                instance_params.append(get_default_calibration_params(
+                    param_prefix, instance, len(fields), polynomial_order))
+            for params in instance_params:
+                for key, value in params.items():
+                    # the device id is an int32, all other parameters are floats
+                    param_type = "6" if key.endswith('_ID') else "9"
+                    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(value)+"\t"+param_type+"\n")
+
+
+def load_params_file(params_filename: str) -> Dict[str, float]:
+    """
+    :param params_filename: a parameter file in the QGroundControl format, as written by
+    write_params_file.
+    :return: a dict of parameter name to value.
+    """
+    params = dict()
+    with open(params_filename, 'r') as file:
+        for line in file:
+            columns = line.split('\t')
+            if line.startswith('#') or len(columns) < 4:
+                continue
+            params[columns[2]] = float(columns[3])
+    return params
+
+
+def get_instance_coefficients(
+        params: Dict[str, float], param_prefix: str, device_id: int, n_fields: int,
+        polynomial_order: int) -> Optional[Tuple[str, np.ndarray]]:
+    """
+    finds the thermal compensation of a sensor by its device id, as the firmware does.
+    :param params: the parameters of a parameter file.
+    :param param_prefix: e.g. 'TC_G'.
+    :param device_id:
+    :param n_fields:
+    :param polynomial_order:
+    :return: the parameter name prefix of the instance, e.g. 'TC_G0', and the polynomial
+    coefficients, highest power first (rows), of every field (columns), or None if the parameters
+    contain no compensation for the device id.
+    """
+    instance = 0
+    while '{:s}{:d}_ID'.format(param_prefix, instance) in params:
+        if int(params['{:s}{:d}_ID'.format(param_prefix, instance)]) == device_id:
+            prefix, coefficient_names, _ = get_calibration_param_names(
+                param_prefix, instance, n_fields, polynomial_order)
+            return prefix, np.array([[params[name] for name in names]
+                                     for names in coefficient_names[::-1]])
+        instance += 1
+    return None
+
+
+class SensorValidation(object):
+    """
+    the residuals of a sensor instance of a log after the thermal compensation of a parameter file,
+    in temperature bands.
+    """
+
+    def __init__(self, sensor: str, device_id: int, residuals: TemperatureBinnedStatistics,
+                 offsets: np.ndarray) -> None:
+        """
+        :param sensor: the parameter name prefix of the compensation, e.g. 'TC_G0'.
+        :param device_id:
+        :param residuals: the statistics of the residuals of every field in temperature bands.
+        :param offsets: the offset of every field removed from the residuals.
+        """
+        self.sensor = sensor
+        self.device_id = device_id
+        self.residuals = residuals
+        self.offsets = offsets
+
+    def get_band_statistics(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: the lower temperature edge and the number of samples of every band, and the mean
+        and standard deviation of the residuals of every band (rows) and field (columns).
+        """
+        _, means, counts = self.residuals.get_fit_data()
+        return (self.residuals.get_bin_edges(), counts, means - self.offsets,
+                np.sqrt(self.residuals.get_variances()))
+
+
+def validate_sensor_caldata(
+        ulog_file_name: str, params: Dict[str, float],
+        band_width: float = DEFAULT_VALIDATION_BAND_WIDTH,
+        read_chunk_bytes: int = READ_CHUNK_BYTES) -> Dict[str, List[SensorValidation]]:
+    """
+    evaluates the thermal compensation of a parameter file on the samples of a log in a single
+    streaming pass. The compensation of a sensor instance is found by its device id, and its
+    polynomials are evaluated at the temperature limited to the calibrated range, as on the vehicle.
+    The median of the residuals is removed for the sensor types whose median is removed before the
+    fit, because their offset is not part of the thermal compensation.
+    :param ulog_file_name:
+    :param params: the parameters of a parameter file.
+    :param band_width: the width of the temperature bands in degC.
+    :param read_chunk_bytes: the number of bytes read at a time.
+    :return: a dict of topic name to the validations of its instances with a compensation, ordered
+    by instance.
+    """
+    sensor_types = {sensor_type[0]: sensor_type for sensor_type in SENSOR_TYPES}
+    requirements = {topic: {'device_id', 'temperature'} | {field for field, _ in fields}
+                    for topic, _, _, fields, _, _, _, _ in SENSOR_TYPES}
+    # (topic, multi id) -> compensation prefix, device id, coefficients and residual statistics.
+    # Instances without compensation are None.
+    instances = dict()
+    with ULogTail(ulog_file_name, requirements) as ulog_tail:
+        while True:
+            bytes_read = ulog_tail.bytes_read
+            for (topic, multi_id), data in ulog_tail.read_instances(read_chunk_bytes).items():
+                _, param_prefix, name, fields, polynomial_order, _, scale, _ = sensor_types[topic]
+                if (topic, multi_id) not in instances:
+                    device_id = int(np.median(data['device_id']))
+                    compensation = get_instance_coefficients(
+                        params, param_prefix, device_id, len(fields), polynomial_order)
+                    if compensation is None:
+                        print('no thermal compensation found for {:s} {:d} (device id {:d})'.format(
+                            name.lower(), multi_id, device_id))
+                        instances[(topic, multi_id)] = None
+                    else:
+                        instances[(topic, multi_id)] = (
+                            compensation[0], device_id, compensation[1],
+                            TemperatureBinnedStatistics([field for field, _ in fields], band_width))
+                if instances[(topic, multi_id)] is None:
+                    continue
+
+                prefix, _, coefficients, residuals = instances[(topic, multi_id)]
+                temp_rel = np.clip(data['temperature'], params['{:s}_TMIN'.format(prefix)],
+                                   params['{:s}_TMAX'.format(prefix)]) - \
+                    params['{:s}_TREF'.format(prefix)]
+                corrections = np.vander(temp_rel, len(coefficients)).dot(coefficients)
+                residual_data = {'temperature': data['temperature'],
+                                 'device_id': data['device_id']}
+                for i, (field, _) in enumerate(fields):
+                    residual_data[field] = scale * data[field].astype(float) - corrections[:, i]
+                residuals.add(residual_data)
+            if ulog_tail.bytes_read == bytes_read:
+                break
+
+    validations = dict()
+    for topic, _, _, fields, _, remove_median, _, _ in SENSOR_TYPES:
+        validations[topic] = list()
+        for key in sorted(key for key in instances.keys() if key[0] == topic):
+            if instances[key] is None or instances[key][3].count == 0:
+                continue
+            prefix, device_id, _, residuals = instances[key]
+            offsets = residuals.get_medians() if remove_median else np.zeros(len(fields))
+            validations[topic].append(SensorValidation(prefix, device_id, residuals, offsets))
+    return validations
+
+
+def write_validation_report(
+        validations: Dict[str, List[SensorValidation]], report_filename: str) -> None:
+    """
+    prints the residual statistics of every sensor instance in temperature bands and over all
+    temperatures, and writes them to a csv file.
+    :param validations:
+    :param report_filename:
+    :return:
+    """
+    with open(report_filename, 'w') as file:
+        file.write('sensor,device_id,field,band_min,band_max,samples,mean,std,rms\n')
+        for topic, _, _, fields, _, _, _, _ in SENSOR_TYPES:
+            for validation in validations[topic]:
+                edges, counts, means, stds = validation.get_band_statistics()
+                print('{:s} (device id {:d}):'.format(validation.sensor, validation.device_id))
+                print('    {:<8s} {:>15s} {:>9s} {:>12s} {:>12s} {:>12s}'.format(
+                    'field', 'band (degC)', 'samples', 'mean', 'std', 'rms'))
+                for i, (field, _) in enumerate(fields):
+                    # the statistics over all bands
+                    total_count = np.sum(counts)
+                    total_mean = counts.dot(means[:, i]) / total_count
+                    total_std = np.sqrt(counts.dot(
+                        stds[:, i] ** 2 + (means[:, i] - total_mean) ** 2) / total_count)
+                    rows = [(edges[j], edges[j] + validation.residuals.bin_width, counts[j],
+                             means[j, i], stds[j, i]) for j in range(len(edges))]
+                    rows.append((-np.inf, np.inf, total_count, total_mean, total_std))
+                    for band_min, band_max, count, mean, std in rows:
+                        rms = np.sqrt(mean ** 2 + std ** 2)
+                        band = 'all' if np.isinf(band_min) else '{:.1f} - {:.1f}'.format(
+                            band_min, band_max)
+                        print('    {:<8s} {:>15s} {:9d} {:12.4g} {:12.4g} {:12.4g}'.format(
+                            field, band, int(count), mean, std, rms))
+                        file.write('{:s},{:d},{:s},{:s},{:s},{:d},{:g},{:g},{:g}\n'.format(
+                            validation.sensor, validation.device_id, field,
+                            '' if np.isinf(band_min) else '{:g}'.format(band_min),
+                            '' if np.isinf(band_max) else '{:g}'.format(band_max),
+                            int(count), mean, std, rms))
+
+
+def process_sensor_caldata(
+        ulog_file_name: str, bin_width: float = DEFAULT_BIN_WIDTH, plot: bool = True,
+        ulog_cache_directory: Optional[str] = None) -> Dict[str, List[SensorCalibration]]:
+    """
+    calibrates the sensors of a thermal calibration log and writes the parameters to
+    <ulog_file_name>.params and the plots to <ulog_file_name>.pdf. The plots are rendered in a
+    background thread while the parameters are written.
+    :param ulog_file_name:
+    :param bin_width: the width of the temperature bins in degC. The samples are fitted directly if
+    0.
+    :param plot: whether to plot the biases and fitted polynomials.
+    :param ulog_cache_directory: the directory of the cache of decoded logs, only used if the
+    samples are fitted directly.
+    :return: a dict of topic name to the calibrations of its instances.
+    """
+    if bin_width > 0:
+        sensor_data = reduce_sensor_data(ulog_file_name, bin_width)
     else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(accel_2_params[key])+"\t"+type+"\n")
-
-# baro 0 corrections
-key_list_baro = list(baro_0_params.keys())
-key_list_baro.sort
-for key in key_list_baro:
-    if key == 'TC_B0_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(baro_0_params[key])+"\t"+type+"\n")
-
-# baro 1 corrections
-key_list_baro = list(baro_1_params.keys())
-key_list_baro.sort
-for key in key_list_baro:
-    if key == 'TC_B1_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(baro_1_params[key])+"\t"+type+"\n")
-
-# gyro 0 corrections
-key_list_gyro = list(gyro_0_params.keys())
-key_list_gyro.sort()
-for key in key_list_gyro:
-    if key == 'TC_G0_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(gyro_0_params[key])+"\t"+type+"\n")
-
-# gyro 1 corrections
-key_list_gyro = list(gyro_1_params.keys())
-key_list_gyro.sort()
-for key in key_list_gyro:
-    if key == 'TC_G1_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(gyro_1_params[key])+"\t"+type+"\n")
-
-# gyro 2 corrections
-key_list_gyro = list(gyro_2_params.keys())
-key_list_gyro.sort()
-for key in key_list_gyro:
-    if key == 'TC_G2_ID':
-        type = "6"
-    else:
-        type = "9"
-    file.write("1"+"\t"+"1"+"\t"+key+"\t"+str(gyro_2_params[key])+"\t"+type+"\n")
-
-file.close()
-
-print('Correction parameters written to ' + test_results_filename)
-print('Plots saved to ' + output_plot_filename)
+        sensor_data = load_sensor_data(open_ulog(
+            ulog_file_name, [topic for topic, _, _, _, _, _, _, _ in SENSOR_TYPES],
+            cache_directory=ulog_cache_directory))
+    calibrations = calibrate_sensors(sensor_data)
+    # e.g. an EKF log or a truncated file, no parameters are written that could be loaded onto a board
+    if not any(calibrations.values()):
+        raise ValueError('no sensor data found in {:s}'.format(ulog_file_name))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        output_plot_filename = ulog_file_name + ".pdf"
+        plot_future = executor.submit(plot_calibrations, calibrations, output_plot_filename) \
+            if plot else None
+
+        # write correction parameters to file
+        test_results_filename = ulog_file_name + ".params"
+        write_params_file(calibrations, test_results_filename)
+        print('Correction parameters written to ' + test_results_filename)
+
+        if plot_future is not None:
+            plot_future.result()
+            print('Plots saved to ' + output_plot_filename)
+    return calibrations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Reads in IMU data from a static thermal calibration test and performs a curve fit of gyro, accel and baro bias vs temperature')
+    parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
+    parser.add_argument('--ulog-cache', type=str, default=None,
+                        help='The directory of the cache of decoded logs shared with other tools. '
+                             'Defaults to ${:s} if set. Only used with --bin-width 0.'.format(
+                             ULOG_CACHE_DIR_ENV))
+    parser.add_argument('--bin-width', type=float, default=DEFAULT_BIN_WIDTH,
+                        help='The width of the temperature bins in degC the samples are reduced to '
+                             'while the log is read, before the fit. 0 loads all samples into '
+                             'memory and fits them directly.')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Whether to only write the parameters and not plot the biases.')
+    parser.add_argument('--validate', type=str, default=None, metavar='file.params',
+                        help='Validate the thermal compensation of an existing .params file on the '
+                             'log instead of calibrating. The residuals are written to '
+                             '<inputfilename>.validation.csv.')
+    parser.add_argument('--band-width', type=float, default=DEFAULT_VALIDATION_BAND_WIDTH,
+                        help='The width of the temperature bands in degC the residuals of a '
+                             'validation are reported in.')
+    args = parser.parse_args()
+
+    if args.validate is not None:
+        validations = validate_sensor_caldata(
+            args.filename, load_params_file(args.validate), band_width=args.band_width)
+        report_filename = args.filename + ".validation.csv"
+        write_validation_report(validations, report_filename)
+        print('Validation report written to ' + report_filename)
+        return
+
+    process_sensor_caldata(args.filename, bin_width=args.bin_width, plot=not args.no_plots,
+                           ulog_cache_directory=args.ulog_cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+#! /usr/bin/env python3
+"""
+Emulates the PX4 bootloader on a pseudo-terminal, such that px_uploader.py can be tested and benchmarked
+without hardware. The protocol of px_uploader.uploader is implemented up to bootloader revision 5, with
+the timing of a USB CDC or UART link and of the flash, and optionally injected faults.
+
+Run it and upload to the printed port, or to a symlink created with --link:
+    python px_bootloader_emulator.py --bl-rev 5 --link /tmp/ttyACM_emulator
+    python px_uploader.py --port /tmp/ttyACM_emulator firmware.px4
+"""
+
+import argparse
+import collections
+import os
+import pty
+import queue
+import struct
+import termios
+import threading
+import time
+import tty
+import zlib
+from typing import Dict, Optional
+
+from px_uploader import uploader
+
+DEFAULT_FLASH_SIZE = 2 * 1024 * 1024 - 16 * 1024
+DEFAULT_ERASE_TIME = 1.0
+# the time to program a 32 bit word of STM32F4 flash
+DEFAULT_WORD_PROGRAM_TIME = 16e-6
+# the reply latency of a full speed USB CDC link, the bulk IN endpoint is polled once per frame
+DEFAULT_USB_LATENCY = 0.001
+
+# the injected faults: name -> description. The faults of PROG_MULTI apply to the block with the
+# index given as argument.
+FAULTS = {
+    'erase-fail': 'CHIP_ERASE reports OPERATION FAILED',
+    'bad-silicon': 'CHIP_ERASE reports BAD_SILICON_REV',
+    'corrupt-block': 'PROG_MULTI block N is acknowledged but written with a flipped bit',
+    'drop-ack': 'the SYNC,<result> of PROG_MULTI block N is not sent',
+    'rx-overrun': 'received bytes beyond N waiting to be processed are dropped, like a UART overrun',
+}
+
+
+class BootloaderEmulator(object):
+    """
+    a bootloader on the slave side of a pseudo-terminal. Received bytes are buffered by a reader thread
+    and processed by a command thread, replies are delivered by a writer thread after the link latency.
+    """
+    def __init__(self, bl_rev: int = 5, board_id: int = 9, board_rev: int = 0,
+                 flash_size: int = DEFAULT_FLASH_SIZE, baudrate: Optional[int] = None,
+                 latency: Optional[float] = None, erase_time: float = DEFAULT_ERASE_TIME,
+                 word_program_time: float = DEFAULT_WORD_PROGRAM_TIME,
+                 serial_number: bytes = bytes(range(12)), chip: int = 0x10016419,
+                 chip_description: bytes = b'STM32F42x,3', faults: Optional[Dict[str, int]] = None,
+                 link: Optional[str] = None) -> None:
+        """
+        :param bl_rev: the bootloader protocol revision.
+        :param board_id:
+        :param board_rev:
+        :param flash_size: the size of the application flash in bytes.
+        :param baudrate: the baud rate of a UART link, bytes received at another line speed are lost.
+        None emulates a USB CDC link, on which the line speed is ignored.
+        :param latency: the delay of every reply in seconds. Defaults to DEFAULT_USB_LATENCY on USB and
+        to 0 on a UART link.
+        :param erase_time: the duration of CHIP_ERASE in seconds.
+        :param word_program_time: the time to program 4 bytes in seconds.
+        :param serial_number: the 12 bytes reported by GET_SN.
+        :param chip: the chip id reported by GET_CHIP.
+        :param chip_description: the family and revision reported by GET_CHIP_DES.
+        :param faults: the injected faults, a dict of a FAULTS key to its argument.
+        :param link: the path of a symlink to the emulated port.
+        """
+        if not uploader.BL_REV_MIN <= bl_rev <= uploader.BL_REV_MAX:
+            raise ValueError('unsupported bootloader revision {:d}'.format(bl_rev))
+        for fault in (faults or {}):
+            if fault not in FAULTS:
+                raise ValueError('unknown fault {:s}'.format(fault))
+        self.bl_rev = bl_rev
+        self.board_id = board_id
+        self.board_rev = board_rev
+        self.flash_size = flash_size
+        self.baudrate = baudrate
+        self.latency = latency if latency is not None else (DEFAULT_USB_LATENCY if baudrate is None else 0.0)
+        self.erase_time = erase_time
+        self.word_program_time = word_program_time
+        self.serial_number = serial_number
+        self.chip = chip
+        self.chip_description = chip_description
+        self.faults = dict(faults or {})
+        self.otp = b'\xff' * 512
+
+        self.flash = bytearray(b'\xff' * flash_size)
+        self.address = 0
+        self.boot_delay = 0
+        self.n_blocks = 0
+        self.n_reboots = 0
+        self.n_overruns = 0
+        self.rebooted = threading.Event()
+
+        # time per byte on a UART link, 8N1
+        self._byte_time = 10.0 / baudrate if baudrate is not None else 0.0
+        self._line_speed = getattr(termios, 'B{:d}'.format(baudrate)) if baudrate is not None else None
+        self._rx = collections.deque()
+        self._rx_size = 0
+        self._rx_ready = 0.0
+        self._rx_condition = threading.Condition()
+        self._tx = queue.Queue()
+        self._tx_ready = 0.0
+        self._closed = False
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.link = link
+        if link is not None:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(self.port, link)
+
+        self._threads = [threading.Thread(target=target) for target in
+                         [self._receive, self._process, self._transmit]]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def close(self) -> None:
+        self._closed = True
+        with self._rx_condition:
+            self._rx_condition.notify_all()
+        self._tx.put(None)
+        os.close(self._slave)
+        os.close(self._master)
+        if self.link is not None and os.path.lexists(self.link):
+            os.remove(self.link)
+
+    def __enter__(self) -> 'BootloaderEmulator':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def get_crc(self) -> int:
+        """
+        :return: the CRC of the whole flash as reported by GET_CRC, the reflected CRC-32 starting
+        from 0 without final XOR.
+        """
+        return (zlib.crc32(bytes(self.flash), 0xffffffff) & 0xffffffff) ^ 0xffffffff
+
+    def _receive(self) -> None:
+        while not self._closed:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            now = time.time()
+            # bytes sent at another line speed arrive as garbage on a UART
+            if self._line_speed is not None and termios.tcgetattr(self._master)[4] != self._line_speed:
+                continue
+            with self._rx_condition:
+                if 'rx-overrun' in self.faults and self._rx_size + len(data) > self.faults['rx-overrun']:
+                    data = data[:max(0, self.faults['rx-overrun'] - self._rx_size)]
+                    self.n_overruns += 1
+                # the bytes are processed once they went over the link
+                self._rx_ready = max(self._rx_ready, now) + len(data) * self._byte_time
+                self._rx.append((self._rx_ready, data))
+                self._rx_size += len(data)
+                self._rx_condition.notify()
+
+    def _read(self, count: int) -> bytes:
+        data = b''
+        while len(data) < count:
+            with self._rx_condition:
+                while not self._rx and not self._closed:
+                    self._rx_condition.wait()
+                if self._closed:
+                    raise EOFError()
+                ready, chunk = self._rx.popleft()
+                if len(chunk) > count - len(data):
+                    self._rx.appendleft((ready, chunk[count - len(data):]))
+                    chunk = chunk[:count - len(data)]
+                self._rx_size -= len(chunk)
+            wait = ready - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            data += chunk
+        return data
+
+    def _reply(self, data: bytes = b'', result: bytes = uploader.OK) -> None:
+        reply = data + uploader.INSYNC + result
+        # the replies keep their order and go over the link one after the other
+        self._tx_ready = max(self._tx_ready, time.time() + self.latency) + len(reply) * self._byte_time
+        self._tx.put((self._tx_ready, reply))
+
+    def _transmit(self) -> None:
+        while True:
+            item = self._tx.get()
+            if item is None:
+                return
+            ready, data = item
+            wait = ready - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                os.write(self._master, data)
+            except OSError:
+                return
+
+    def _get_device(self, param: int) -> Optional[int]:
+        return {
+            uploader.INFO_BL_REV[0]: self.bl_rev,
+            uploader.INFO_BOARD_ID[0]: self.board_id,
+            uploader.INFO_BOARD_REV[0]: self.board_rev,
+            uploader.INFO_FLASH_SIZE[0]: self.flash_size,
+        }.get(param)
+
+    def _program(self, data: bytes) -> bytes:
+        """
+        programs a PROG_MULTI block at the current address. Flash bits can only be cleared, the block
+        fails if the flash was not erased.
+        :return: the result byte.
+        """
+        if len(data) % 4 != 0 or self.address + len(data) > self.flash_size:
+            return uploader.INVALID
+        time.sleep(self.word_program_time * len(data) / 4)
+        old = self.flash[self.address:self.address + len(data)]
+        programmed = (int.from_bytes(old, 'little') & int.from_bytes(data, 'little')).to_bytes(
+            len(data), 'little')
+        self.flash[self.address:self.address + len(data)] = programmed
+        if self.faults.get('corrupt-block') == self.n_blocks and data:
+            self.flash[self.address] ^= 0x01
+        self.address += len(data)
+        return uploader.OK if programmed == data else uploader.FAILED
+
+    def _process(self) -> None:
+        try:
+            while True:
+                self._process_command(self._read(1))
+        except EOFError:
+            return
+
+    def _process_command(self, command: bytes) -> None:
+        """
+        handles a command like the bootloader: the arguments are read, an unknown command, a command
+        not supported by the bootloader revision or a missing EOC is answered with INVALID.
+        """
+        rev = self.bl_rev
+        argument = b''
+        if command == uploader.GET_DEVICE or command == uploader.SET_BOOT_DELAY or \
+                (command == uploader.READ_MULTI and rev == 2):
+            argument = self._read(1)
+        elif command in [uploader.GET_OTP, uploader.GET_SN] and rev >= 4:
+            argument = self._read(4)
+        elif command == uploader.PROG_MULTI:
+            argument = self._read(1)
+            argument += self._read(argument[0])
+
+        if self._read(1) != uploader.EOC:
+            self._reply(result=uploader.INVALID)
+            return
+
+        if command == uploader.GET_SYNC:
+            self._reply()
+        elif command == uploader.GET_DEVICE:
+            value = self._get_device(argument[0])
+            if value is None:
+                self._reply(result=uploader.INVALID)
+            else:
+                self._reply(struct.pack('<I', value))
+        elif command == uploader.CHIP_ERASE:
+            if 'bad-silicon' in self.faults:
+                self._reply(result=uploader.BAD_SILICON_REV)
+                return
+            time.sleep(self.erase_time)
+            self.flash[:] = b'\xff' * self.flash_size
+            self.address = 0
+            self.n_blocks = 0
+            self._reply(result=uploader.FAILED if 'erase-fail' in self.faults else uploader.OK)
+        elif command == uploader.PROG_MULTI:
+            result = self._program(argument[1:])
+            if self.faults.get('drop-ack') != self.n_blocks:
+                self._reply(result=result)
+            self.n_blocks += 1
+        elif command == uploader.CHIP_VERIFY and rev == 2:
+            self.address = 0
+            self._reply()
+        elif command == uploader.READ_MULTI and rev == 2:
+            data = bytes(self.flash[self.address:self.address + argument[0]])
+            self.address += len(data)
+            self._reply(data)
+        elif command == uploader.GET_CRC and rev >= 3:
+            self._reply(struct.pack('<I', self.get_crc()))
+        elif command == uploader.GET_OTP and rev >= 4:
+            address = struct.unpack('<I', argument)[0]
+            self._reply(self.otp[address:address + 4].ljust(4, b'\xff'))
+        elif command == uploader.GET_SN and rev >= 4:
+            address = struct.unpack('<I', argument)[0]
+            # the words of the unique id are sent little endian
+            self._reply(self.serial_number[address:address + 4][::-1])
+        elif command == uploader.GET_CHIP and rev >= 5:
+            self._reply(struct.pack('<I', self.chip))
+        elif command == uploader.SET_BOOT_DELAY and rev >= 5:
+            self.boot_delay = struct.unpack('b', argument)[0]
+            self._reply()
+        elif command == uploader.GET_CHIP_DES and rev >= 5:
+            self._reply(struct.pack('<I', len(self.chip_description)) + self.chip_description)
+        elif command == uploader.REBOOT:
+            # v3+ reports whether the first word could be written
+            if rev >= 3:
+                self._reply()
+            self.address = 0
+            self.n_reboots += 1
+            self.rebooted.set()
+        else:
+            self._reply(result=uploader.INVALID)
+
+
+def parse_fault(fault: str) -> tuple:
+    """
+    :param fault: a FAULTS key, optionally followed by :N.
+    :return: a tuple of the fault name and its argument.
+    """
+    name, _, argument = fault.partition(':')
+    if name not in FAULTS:
+        raise argparse.ArgumentTypeError('unknown fault {:s}'.format(name))
+    return name, int(argument) if argument else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Emulate the PX4 bootloader on a pseudo-terminal.')
+    parser.add_argument('--bl-rev', type=int, default=5, help='The bootloader protocol revision.')
+    parser.add_argument('--board-id', type=int, default=9, help='The board id reported to the uploader.')
+    parser.add_argument('--board-rev', type=int, default=0, help='The board revision.')
+    parser.add_argument('--flash-size', type=int, default=DEFAULT_FLASH_SIZE,
+                        help='The size of the application flash in bytes.')
+    parser.add_argument('--serial-number', type=bytes.fromhex, default=bytes(range(12)),
+                        help='The 12 byte serial number in hex, distinct per board to emulate several boards.')
+    parser.add_argument('--baudrate', type=int, default=None,
+                        help='Emulate a UART link at this baud rate instead of USB CDC.')
+    parser.add_argument('--latency', type=float, default=None,
+                        help='The reply latency in seconds, by default {:g} on USB and 0 on a UART '
+                             'link.'.format(DEFAULT_USB_LATENCY))
+    parser.add_argument('--erase-time', type=float, default=DEFAULT_ERASE_TIME,
+                        help='The duration of the chip erase in seconds.')
+    parser.add_argument('--word-program-time', type=float, default=DEFAULT_WORD_PROGRAM_TIME,
+                        help='The time to program a 32 bit word in seconds.')
+    parser.add_argument('--fault', type=parse_fault, action='append', default=[],
+                        help='Inject a fault, one of: {:s}.'.format('; '.join(
+                            '{:s}: {:s}'.format(name, description) for name, description in FAULTS.items())))
+    parser.add_argument('--link', type=str, default=None, help='Create a symlink to the emulated port.')
+    args = parser.parse_args()
+
+    emulator = BootloaderEmulator(
+        bl_rev=args.bl_rev, board_id=args.board_id, board_rev=args.board_rev,
+        flash_size=args.flash_size, serial_number=args.serial_number, baudrate=args.baudrate,
+        latency=args.latency,
+        erase_time=args.erase_time, word_program_time=args.word_program_time,
+        faults=dict(args.fault), link=args.link)
+    print('Emulating bootloader revision {:d} on {:s}'.format(args.bl_rev, args.link or emulator.port))
+    try:
+        while True:
+            emulator.rebooted.wait()
+            emulator.rebooted.clear()
+            print('Rebooted after {:d} program blocks, flash CRC 0x{:08x}'.format(
+                emulator.n_blocks, emulator.get_crc()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Binary PX4 firmware file, an alternative to the JSON encoded .px4 file of px_mkfw.py that can be read
+without decoding the whole file. It starts with a header, followed by the section table, the JSON
+description of the firmware and the section contents, all little endian:
+
+header:   magic 'PX4FWBIN', format version (uint16), number of sections (uint16),
+          metadata offset (uint32), metadata length (uint32)
+section:  name (16 bytes, NUL padded), compression (uint32, 0 none, 1 zlib), offset (uint64),
+          stored length (uint64), length (uint64), CRC-32 of the contents (uint32)
+metadata: the firmware description of the JSON format without the image and XML fields
+
+The sections are image, parameter_xml and airframe_xml. An uncompressed section starts at a page
+boundary, such that the image can be used straight from a memory map of the file.
+"""
+
+from __future__ import print_function
+
+import json
+import mmap
+import struct
+import zlib
+
+MAGIC = b'PX4FWBIN'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHII')
+SECTION = struct.Struct('<16sIQQQI')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+PAGE_SIZE = 4096
+
+# the fields of the JSON description that are stored as sections
+SECTION_NAMES = ['image', 'parameter_xml', 'airframe_xml']
+
+
+def is_container(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_container(f, desc, sections):
+    '''Writes a binary firmware file
+
+    f: a file opened for binary writing
+    desc: the firmware description, without the section fields
+    sections: a list of (name, contents, compress) tuples
+    '''
+    metadata = json.dumps(desc, sort_keys=True).encode('utf-8')
+    metadata_offset = HEADER.size + len(sections) * SECTION.size
+    offset = metadata_offset + len(metadata)
+
+    table = []
+    payloads = []
+    for name, contents, compress in sections:
+        if compress:
+            stored = zlib.compress(contents, 9)
+        else:
+            stored = contents
+            padding = -offset % PAGE_SIZE
+            payloads.append(b'\x00' * padding)
+            offset += padding
+        table.append(SECTION.pack(name.encode('ascii'), COMPRESSION_ZLIB if compress else COMPRESSION_NONE,
+                                  offset, len(stored), len(contents), zlib.crc32(contents) & 0xffffffff))
+        payloads.append(stored)
+        offset += len(stored)
+
+    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), metadata_offset, len(metadata)))
+    for entry in table:
+        f.write(entry)
+    f.write(metadata)
+    for payload in payloads:
+        f.write(payload)
+
+
+class container(object):
+    '''Reads a binary firmware file through a read-only memory map'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise ValueError("firmware file is truncated")
+        magic, version, count, metadata_offset, metadata_length = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("not a binary firmware file")
+        if version != FORMAT_VERSION:
+            raise ValueError("unsupported binary firmware format version %u" % version)
+        if metadata_offset + metadata_length > len(self.data):
+            raise ValueError("firmware file is truncated")
+
+        self.desc = json.loads(self.data[metadata_offset:metadata_offset + metadata_length].decode('utf-8'))
+        self.sections = {}
+        for i in range(count):
+            entry = SECTION.unpack_from(self.data, HEADER.size + i * SECTION.size)
+            self.sections[entry[0].rstrip(b'\x00').decode('ascii')] = entry[1:]
+
+    def section(self, name):
+        '''Returns the checked contents of a section, a view of the memory map if it is uncompressed'''
+        compression, offset, stored_length, length, crc = self.sections[name]
+        if offset + stored_length > len(self.data):
+            raise ValueError("section %s is truncated" % name)
+
+        if compression == COMPRESSION_ZLIB:
+            contents = zlib.decompress(self.data[offset:offset + stored_length])
+        elif compression == COMPRESSION_NONE:
+            contents = memoryview(self.data)[offset:offset + stored_length]
+        else:
+            raise ValueError("section %s has unknown compression %u" % (name, compression))
+
+        if len(contents) != length or (zlib.crc32(contents) & 0xffffffff) != crc:
+            raise ValueError("section %s is corrupt" % name)
+        return contents
@@ -37,15 +37,20 @@
 #
 # The PX4 firmware file is a JSON-encoded Python object, containing
 # metadata fields and a zlib-compressed base64-encoded firmware image.
+# With --format binary, the binary firmware file of px_firmware_container.py
+# is written instead.
 #
 
 import argparse
 import json
 import base64
+import sys
 import zlib
 import time
 import subprocess
 
+import px_firmware_container
+
 #
 # Construct a basic firmware description
 #
@@ -76,8 +81,14 @@ parser.add_argument("--git_identity",	action="store", help="the working director
 parser.add_argument("--parameter_xml",	action="store", help="the parameters.xml file")
 parser.add_argument("--airframe_xml",	action="store", help="the airframes.xml file")
 parser.add_argument("--image",		action="store", help="the firmware image")
+parser.add_argument("--format",		action="store", choices=["json", "binary"], default="json", help="the format of the firmware file (default json)")
+parser.add_argument("--raw_image",	action="store_true", help="store the image uncompressed and page aligned in a binary firmware file")
+parser.add_argument("--output",		action="store", help="the firmware file, written to stdout if not set")
 args = parser.parse_args()
 
+# the sections of a binary firmware file
+sections = []
+
 # Fetch the firmware descriptor prototype if specified
 if args.prototype != None:
 	f = open(args.prototype,"r")
@@ -111,17 +122,42 @@ if args.parameter_xml != None:
 	f = open(args.parameter_xml, "rb")
 	bytes = f.read()
 	desc['parameter_xml_size'] = len(bytes)
-	desc['parameter_xml'] = base64.b64encode(zlib.compress(bytes,9)).decode('utf-8')
+	if args.format == "binary":
+		sections.append(('parameter_xml', bytes, True))
+	else:
+		desc['parameter_xml'] = base64.b64encode(zlib.compress(bytes,9)).decode('utf-8')
 	desc['mav_autopilot'] = 12 # 12 = MAV_AUTOPILOT_PX4
 if args.airframe_xml != None:
 	f = open(args.airframe_xml, "rb")
 	bytes = f.read()
 	desc['airframe_xml_size'] = len(bytes)
-	desc['airframe_xml'] = base64.b64encode(zlib.compress(bytes,9)).decode('utf-8')
+	if args.format == "binary":
+		sections.append(('airframe_xml', bytes, True))
+	else:
+		desc['airframe_xml'] = base64.b64encode(zlib.compress(bytes,9)).decode('utf-8')
 if args.image != None:
 	f = open(args.image, "rb")
 	bytes = f.read()
 	desc['image_size'] = len(bytes)
-	desc['image'] = base64.b64encode(zlib.compress(bytes,9)).decode('utf-8')
+	if args.format == "binary":
+		# a raw image is padded to the 4-byte length the uploader flashes, such that it can be used in place
+		if args.raw_image:
+			bytes += b'\xff' * (-len(bytes) % 4)
+		sections.insert(0, ('image', bytes, not args.raw_image))
+	else:
+		desc['image'] = base64.b64encode(zlib.compress(bytes,9)).decode('utf-8')
 
-print(json.dumps(desc, indent=4))
+if args.output != None:
+	output = open(args.output, "wb" if args.format == "binary" else "w")
+elif args.format == "binary":
+	output = getattr(sys.stdout, 'buffer', sys.stdout)
+else:
+	output = sys.stdout
+
+if args.format == "binary":
+	for name in px_firmware_container.SECTION_NAMES:
+		desc.pop(name, None)
+	px_firmware_container.write_container(output, desc, sections)
+else:
+	output.write(json.dumps(desc, indent=4) + "\n")
+output.flush()
@@ -36,7 +36,9 @@
 # Serial firmware uploader for the PX4FMU bootloader
 #
 # The PX4 firmware file is a JSON-encoded Python object, containing
-# metadata fields and a zlib-compressed base64-encoded firmware image.
+# metadata fields and a zlib-compressed base64-encoded firmware image,
+# or a binary firmware file of px_firmware_container.py with the same
+# metadata fields and separately stored sections.
 #
 # The uploader uses the following fields from the firmware file:
 #
@@ -64,10 +66,15 @@ import zlib
 import base64
 import time
 import array
+import collections
+import math
 import os
+import threading
 
 from sys import platform as _platform
 
+import px_firmware_container
+
 # Detect python version
 if sys.version_info[0] < 3:
     runningPython3 = False
@@ -75,6 +82,43 @@ else:
     runningPython3 = True
 
 
+# The CRC-32 of the bootloader is the reflected CRC-32 of zlib, starting from 0 and without final
+# XOR. Its state after some data is an affine function over GF(2) of the state before, the 32x32
+# matrices are stored as a list of 32 column words like in zlib's crc32_combine().
+def _crc32_raw(data, state):
+    return (zlib.crc32(data, state ^ 0xffffffff) & 0xffffffff) ^ 0xffffffff
+
+
+def _gf2_matrix_times(mat, vec):
+    total = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[i]
+        vec >>= 1
+        i += 1
+    return total
+
+
+# compose two affine maps (mat, vec) to first apply b and then a
+def _crc32_affine_compose(a, b):
+    return ([_gf2_matrix_times(a[0], column) for column in b[0]],
+            _gf2_matrix_times(a[0], b[1]) ^ a[1])
+
+
+# the affine map of the CRC-32 state over count repetitions of data, by repeated squaring
+def _crc32_affine_power(data, count):
+    offset = _crc32_raw(data, 0)
+    base = ([_crc32_raw(data, 1 << n) ^ offset for n in range(32)], offset)
+    result = ([1 << n for n in range(32)], 0)
+    while count:
+        if count & 1:
+            result = _crc32_affine_compose(base, result)
+        base = _crc32_affine_compose(base, base)
+        count >>= 1
+    return result
+
+
 class firmware(object):
     '''Loads a firmware file'''
 
@@ -117,17 +161,28 @@ class firmware(object):
 
     def __init__(self, path):
 
-        # read the file
-        f = open(path, "r")
-        self.desc = json.load(f)
-        f.close()
+        if px_firmware_container.is_container(path):
+            # the file is memory mapped, an uncompressed image is used in place
+            container = px_firmware_container.container(path)
+            self.desc = container.desc
+            self.image = container.section('image')
+        else:
+            # read the file
+            f = open(path, "r")
+            self.desc = json.load(f)
+            f.close()
 
-        self.image = bytearray(zlib.decompress(base64.b64decode(self.desc['image'])))
+            self.image = bytearray(zlib.decompress(base64.b64decode(self.desc['image'])))
 
         # pad image to 4-byte length
+        if (len(self.image) % 4) != 0:
+            self.image = bytearray(self.image)
         while ((len(self.image) % 4) != 0):
             self.image.extend(b'\xff')
 
+        # the CRCs per padlen, shared by all boards flashed with the image
+        self.crcs = {}
+
     def property(self, propname):
         return self.desc[propname]
 
@@ -137,12 +192,66 @@ class firmware(object):
             state = self.crctab[index] ^ (state >> 8)
         return state
 
-    def crc(self, padlen):
+    # table driven reference implementation of crc(), one byte at a time
+    def crc_bytewise(self, padlen):
         state = self.__crc32(self.image, int(0))
         for i in range(len(self.image), (padlen - 1), 4):
             state = self.__crc32(self.crcpad, state)
         return state
 
+    # CRC of the image padded with 0xff words up to padlen, as reported by GET_CRC
+    def crc(self, padlen):
+        if padlen not in self.crcs:
+            state = _crc32_raw(self.image, 0)
+            # the padding is applied in closed form rather than word by word
+            padwords = max(0, (padlen - 1 - len(self.image) + 3) // 4)
+            mat, vec = _crc32_affine_power(self.crcpad, padwords)
+            self.crcs[padlen] = _gf2_matrix_times(mat, state) ^ vec
+        return self.crcs[padlen]
+
+
+class upload_stats(object):
+    '''Collects the timing of an upload'''
+
+    def __init__(self):
+        self.phase_times = []
+        # time from the end of each PROG_MULTI block to its SYNC,<result>, not measured for the
+        # acks gathered in a fixed window
+        self.sync_latencies = []
+        self.window_sizes = []
+        self.retries = collections.OrderedDict([('erase sync', 0), ('reboot', 0), ('window backoff', 0)])
+        self.image_size = 0
+
+    def retry(self, name):
+        self.retries[name] += 1
+
+    def __percentile(self, values, percent):
+        return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+    def report(self):
+        print("Upload statistics:")
+        for phase, duration in self.phase_times:
+            print("  %-8s %8.3f s" % (phase, duration))
+        total = sum(duration for phase, duration in self.phase_times)
+        program = sum(duration for phase, duration in self.phase_times if phase == 'program')
+        if program > 0:
+            print("  program rate: %.0f bytes/s" % (self.image_size / program))
+        if total > 0:
+            print("  effective rate: %.0f bytes/s" % (self.image_size / total))
+        if self.sync_latencies:
+            latencies = sorted(self.sync_latencies)
+            print("  sync latency (ms): n=%d min %.2f median %.2f p90 %.2f p99 %.2f max %.2f" % (
+                len(latencies), 1000 * latencies[0], 1000 * self.__percentile(latencies, 50),
+                1000 * self.__percentile(latencies, 90), 1000 * self.__percentile(latencies, 99),
+                1000 * latencies[-1]))
+        else:
+            print("  sync latency: not measured")
+        if self.window_sizes:
+            print("  window (blocks): mean %.1f max %d final %d" % (
+                float(sum(self.window_sizes)) / len(self.window_sizes), max(self.window_sizes),
+                self.window_sizes[-1]))
+        print("  retries: " + ", ".join("%s %d" % (name, count) for name, count in self.retries.items()))
+
 
 class uploader(object):
     '''Uploads a firmware file to the PX FMU bootloader'''
@@ -193,6 +302,10 @@ class uploader(object):
 
     MAX_FLASH_PRGRAM_TIME  = 0.001  # Time on an F7 to send SYNC, RESULT from last data in multi RXed
 
+    PROG_WINDOW_MAX = 8             # default max unacknowledged blocks of the adaptive window
+    PROG_RTT_BACKOFF = 4.0          # shrink the adaptive window if the ack round trip exceeds this factor
+    PROG_UART_WINDOW_BYTES = 512    # max unacknowledged bytes on a UART link, one block programming and one queued
+
     def __init__(self, portname, baudrate_bootloader, baudrate_flightstack):
         # Open the port, keep the default timeout short so we can poll quickly.
         # On some systems writes can suddenly get stuck without having a
@@ -205,12 +318,20 @@ class uploader(object):
         self.window_max = 256
         self.window_per = 2  # Sync,<result>
         self.ackWindowedMode = False  # Assume Non Widowed mode for all USB CDC
+        # size the window of unacknowledged blocks to the measured ack round trip, on any interface
+        self.adaptiveWindow = False
+        self.adaptive_window_max = uploader.PROG_WINDOW_MAX
+        self.stats = upload_stats()
         self.port = serial.Serial(portname, baudrate_bootloader, timeout=0.5, write_timeout=0)
         self.otp = b''
         self.sn = b''
         self.baudrate_bootloader = baudrate_bootloader
         self.baudrate_flightstack = baudrate_flightstack
         self.baudrate_flightstack_idx = -1
+        # print the board info and progress bars, workers of the concurrent mode only record the progress
+        self.verbose = True
+        self.progress_label = None
+        self.progress_percent = 0.0
 
     def close(self):
         if self.port is not None:
@@ -240,6 +361,10 @@ class uploader(object):
             else:
                 break
 
+    def __print(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
     # debugging code
     def __probe(self, state):
         # self.port.setRTS(state)
@@ -256,6 +381,12 @@ class uploader(object):
         # print("recv " + binascii.hexlify(c))
         return c
 
+    def __in_waiting(self):
+        try:
+            return self.port.in_waiting
+        except AttributeError:
+            return self.port.inWaiting()
+
     def __recv_int(self):
         raw = self.__recv(4)
         val = struct.unpack("<I", raw)
@@ -284,14 +415,14 @@ class uploader(object):
             if (len(data) != count):
                 raise RuntimeError("Ack Window %i not %i " % (len(data), count))
             for i in range(0, len(data), 2):
-                if chr(data[i]) != self.INSYNC:
+                if bytes(data[i:i+1]) != self.INSYNC:
                     raise RuntimeError("unexpected %s instead of INSYNC" % data[i])
-                if chr(data[i+1]) == self.INVALID:
+                if bytes(data[i+1:i+2]) == self.INVALID:
                     raise RuntimeError("bootloader reports INVALID OPERATION")
-                if chr(data[i+1]) == self.FAILED:
+                if bytes(data[i+1:i+2]) == self.FAILED:
                     raise RuntimeError("bootloader reports OPERATION FAILED")
-                if chr(data[i+1]) != self.OK:
-                    raise RuntimeError("unexpected response 0x%x instead of OK" % ord(data[i+1]))
+                if bytes(data[i+1:i+2]) != self.OK:
+                    raise RuntimeError("unexpected response 0x%x instead of OK" % data[i+1])
 
     # attempt to get back into sync with the bootloader
     def __sync(self):
@@ -390,14 +521,17 @@ class uploader(object):
             progress = maxVal
 
         percent = (float(progress) / float(maxVal)) * 100.0
+        self.progress_label = label.strip()
+        self.progress_percent = percent
 
-        sys.stdout.write("\r%s: [%-20s] %.1f%%" % (label, '='*int(percent/5.0), percent))
-        sys.stdout.flush()
+        if self.verbose:
+            sys.stdout.write("\r%s: [%-20s] %.1f%%" % (label, '='*int(percent/5.0), percent))
+            sys.stdout.flush()
 
     # send the CHIP_ERASE command and wait for the bootloader to become ready
     def __erase(self, label):
-        print("Windowed mode: %s" % self.ackWindowedMode)
-        print("\n", end='')
+        self.__print("Windowed mode: %s" % self.ackWindowedMode)
+        self.__print("\n", end='')
         self.__send(uploader.CHIP_ERASE +
                     uploader.EOC)
 
@@ -411,12 +545,14 @@ class uploader(object):
                 self.__drawProgressBar(label, 30.0-estimatedTimeRemaining, usualEraseDuration)
             else:
                 self.__drawProgressBar(label, 10.0, 10.0)
-                sys.stdout.write(" (timeout: %d seconds) " % int(deadline-time.time()))
-                sys.stdout.flush()
+                if self.verbose:
+                    sys.stdout.write(" (timeout: %d seconds) " % int(deadline-time.time()))
+                    sys.stdout.flush()
 
             if self.__trySync():
                 self.__drawProgressBar(label, 10.0, 10.0)
                 return
+            self.stats.retry('erase sync')
 
         raise RuntimeError("timed out waiting for erase")
 
@@ -433,7 +569,9 @@ class uploader(object):
         self.__send(data)
         self.__send(uploader.EOC)
         if (not windowMode):
+            sent = time.time()
             self.__getSync(False)
+            self.stats.sync_latencies.append(time.time() - sent)
         else:
             # The following is done to have minimum delay on the transmission
             # of the ne fw. The per block cost of __getSync was about 16 mS per.
@@ -478,14 +616,70 @@ class uploader(object):
     def __split_len(self, seq, length):
         return [seq[i:i+length] for i in range(0, len(seq), length)]
 
+    # upload code with a window of unacknowledged PROG_MULTI blocks sized to keep the link busy: the
+    # round trip of an unloaded block over the interval of the acks of a full window is the number
+    # of blocks in flight, one more is queued so the bootloader never waits for data. The window is
+    # capped to bound the bytes the bootloader has to buffer, and halved when the round trip shows
+    # blocks queuing up. A UART bootloader drops the bytes beyond its receive buffer, on a UART link
+    # the window is capped in bytes such that at most one block waits while one is programmed.
+    def __program_adaptive(self, label, groups):
+        outstanding = collections.deque()
+        window = 1
+        window_max = self.adaptive_window_max
+        if self.ackWindowedMode:
+            block_size = len(uploader.PROG_MULTI) + 1 + uploader.PROG_MULTI_MAX + len(uploader.EOC)
+            window_max = max(1, min(window_max, uploader.PROG_UART_WINDOW_BYTES // block_size))
+        rtt_min = None
+        ack_interval = None
+        last_ack = None
+
+        for uploadProgress, data in enumerate(groups, 1):
+            # wait for the oldest block if the window is full, also take any ack already received
+            while outstanding and (len(outstanding) >= window or self.__in_waiting() >= 2):
+                window_full = len(outstanding) >= window
+                self.__getSync(False)
+                now = time.time()
+                rtt = now - outstanding.popleft()
+                self.stats.sync_latencies.append(rtt)
+                rtt_min = rtt if rtt_min is None else min(rtt_min, rtt)
+                if window_full and last_ack is not None:
+                    interval = now - last_ack
+                    ack_interval = interval if ack_interval is None else 0.875 * ack_interval + 0.125 * interval
+                last_ack = now
+
+                if ack_interval is not None:
+                    if window > 1 and rtt > uploader.PROG_RTT_BACKOFF * (rtt_min + ack_interval):
+                        window = max(1, window // 2)
+                        self.stats.retry('window backoff')
+                    else:
+                        window = min(window_max, int(math.ceil(rtt_min / max(ack_interval, 1e-6))) + 1)
+
+            self.__send(uploader.PROG_MULTI +
+                        struct.pack("B", len(data)) +
+                        bytes(data) +
+                        uploader.EOC)
+            outstanding.append(time.time())
+            self.stats.window_sizes.append(window)
+
+            if uploadProgress % 256 == 0:
+                self.__drawProgressBar(label, uploadProgress, len(groups))
+
+        while outstanding:
+            self.__getSync(False)
+            self.stats.sync_latencies.append(time.time() - outstanding.popleft())
+        self.__drawProgressBar(label, 100, 100)
+
     # upload code
     def __program(self, label, fw):
         self.__probe(False)
-        print("\n", end='')
+        self.__print("\n", end='')
         code = fw.image
         groups = self.__split_len(code, uploader.PROG_MULTI_MAX)
         # Give imedate feedback
         self.__drawProgressBar(label, 0, len(groups))
+        if self.adaptiveWindow:
+            self.__program_adaptive(label, groups)
+            return
         uploadProgress = 0
         for bytes in groups:
             self.__program_multi(bytes, self.ackWindowedMode)
@@ -511,7 +705,7 @@ class uploader(object):
 
     # verify code
     def __verify_v2(self, label, fw):
-        print("\n", end='')
+        self.__print("\n", end='')
         self.__send(uploader.CHIP_VERIFY +
                     uploader.EOC)
         self.__getSync()
@@ -527,7 +721,7 @@ class uploader(object):
         self.__drawProgressBar(label, 100, 100)
 
     def __verify_v3(self, label, fw):
-        print("\n", end='')
+        self.__print("\n", end='')
         self.__drawProgressBar(label, 1, 100)
         expect_crc = fw.crc(self.fw_maxsize)
         self.__send(uploader.GET_CRC + uploader.EOC)
@@ -546,6 +740,17 @@ class uploader(object):
                     uploader.EOC)
         self.__getSync()
 
+    # get the serial number as hex string, None before bootloader v4
+    def serial_number(self):
+        if self.bl_rev < 4:
+            return None
+        if not self.sn:
+            for byte in range(0, 12, 4):
+                x = self.__getSN(byte)
+                x = x[::-1]  # reverse the bytes
+                self.sn = self.sn + x
+        return binascii.hexlify(self.sn).decode('Latin-1')
+
     # get basic data about the board
     def identify(self):
         self.__determineInterface()
@@ -593,22 +798,16 @@ class uploader(object):
             self.otp_coa = self.otp[32:160]
             # show user:
             try:
-                print("sn: ", end='')
-                for byte in range(0, 12, 4):
-                    x = self.__getSN(byte)
-                    x = x[::-1]  # reverse the bytes
-                    self.sn = self.sn + x
-                    print(binascii.hexlify(x).decode('Latin-1'), end='')  # show user
-                print('')
-                print("chip: %08x" % self.__getCHIP())
+                self.__print("sn: " + self.serial_number())
+                self.__print("chip: %08x" % self.__getCHIP())
 
                 otp_id = self.otp_id.decode('Latin-1')
                 if ("PX4" in otp_id):
-                    print("OTP id: " + otp_id)
-                    print("OTP idtype: " + binascii.b2a_qp(self.otp_idtype).decode('Latin-1'))
-                    print("OTP vid: " + binascii.hexlify(self.otp_vid).decode('Latin-1'))
-                    print("OTP pid: " + binascii.hexlify(self.otp_pid).decode('Latin-1'))
-                    print("OTP coa: " + binascii.b2a_base64(self.otp_coa).decode('Latin-1'))
+                    self.__print("OTP id: " + otp_id)
+                    self.__print("OTP idtype: " + binascii.b2a_qp(self.otp_idtype).decode('Latin-1'))
+                    self.__print("OTP vid: " + binascii.hexlify(self.otp_vid).decode('Latin-1'))
+                    self.__print("OTP pid: " + binascii.hexlify(self.otp_pid).decode('Latin-1'))
+                    self.__print("OTP coa: " + binascii.b2a_base64(self.otp_coa).decode('Latin-1'))
 
             except Exception:
                 # ignore bad character encodings
@@ -618,9 +817,9 @@ class uploader(object):
         if (self.bl_rev >= 5):
             des = self.__getCHIPDes()
             if (len(des) == 2):
-                print("family: %s" % des[0])
-                print("revision: %s" % des[1])
-                print("flash: %d bytes" % self.fw_maxsize)
+                self.__print("family: %s" % des[0])
+                self.__print("revision: %s" % des[1])
+                self.__print("flash: %d bytes" % self.fw_maxsize)
 
                 # Prevent uploads where the maximum image size of the board config is smaller than the flash
                 # of the board. This is a hint the user chose the wrong config and will lack features
@@ -647,21 +846,29 @@ class uploader(object):
                                    "If you know you that the board does not have the silicon errata, use\n"
                                    "this script with --force, or update the bootloader. If you are invoking\n"
                                    "upload using make, you can use force-upload target to force the upload.\n")
+        self.stats.image_size = fw.property('image_size')
+        phase_start = time.time()
         self.__erase("Erase  ")
+        self.stats.phase_times.append(('erase', time.time() - phase_start))
+
+        phase_start = time.time()
         self.__program("Program", fw)
+        self.stats.phase_times.append(('program', time.time() - phase_start))
 
+        phase_start = time.time()
         if self.bl_rev == 2:
             self.__verify_v2("Verify ", fw)
         else:
             self.__verify_v3("Verify ", fw)
+        self.stats.phase_times.append(('verify', time.time() - phase_start))
 
         if boot_delay is not None:
             self.__set_boot_delay(boot_delay)
 
-        print("\nRebooting.", end='')
+        self.__print("\nRebooting.", end='')
         self.__reboot()
         self.port.close()
-        print(" Elapsed Time %3.3f\n" % (time.time() - start))
+        self.__print(" Elapsed Time %3.3f\n" % (time.time() - start))
 
     def __next_baud_flightstack(self):
         if self.baudrate_flightstack_idx + 1 >= len(self.baudrate_flightstack):
@@ -678,6 +885,7 @@ class uploader(object):
     def send_reboot(self):
         if (not self.__next_baud_flightstack()):
             return False
+        self.stats.retry('reboot')
 
         print("Attempting reboot on %s with baudrate=%d..." % (self.port.port, self.port.baudrate), file=sys.stderr)
         if "ttyS" in self.port.port:
@@ -707,6 +915,216 @@ class uploader(object):
         return True
 
 
+# time without a worker after which the concurrent mode stops waiting for more boards, unless the
+# number of boards is given
+CONCURRENT_SETTLE_TIME = 3.0
+
+# time after which the concurrent mode gives up on a port that does not answer as bootloader
+CONCURRENT_BOOTLOADER_TIMEOUT = 30.0
+
+
+def get_portlist(port_patterns):
+    portlist = []
+    patterns = port_patterns.split(",")
+    # on unix-like platforms use glob to support wildcard ports. This allows
+    # the use of /dev/serial/by-id/usb-3D_Robotics on Linux, which prevents the upload from
+    # causing modem hangups etc
+    if "linux" in _platform or "darwin" in _platform or "cygwin" in _platform:
+        import glob
+        for pattern in patterns:
+            portlist += glob.glob(pattern)
+    else:
+        portlist = patterns
+    return portlist
+
+
+# create an uploader attached to the port, None for ports of other platforms
+def open_uploader(port, baud_bootloader, baud_flightstack):
+    if "linux" in _platform:
+        # Linux, don't open Mac OS and Win ports
+        if "COM" not in port and "tty.usb" not in port:
+            return uploader(port, baud_bootloader, baud_flightstack)
+    elif "darwin" in _platform:
+        # OS X, don't open Windows and Linux ports
+        if "COM" not in port and "ACM" not in port:
+            return uploader(port, baud_bootloader, baud_flightstack)
+    elif "cygwin" in _platform:
+        # Cygwin, don't open native Windows COM and Linux ports
+        if "COM" not in port and "ACM" not in port:
+            return uploader(port, baud_bootloader, baud_flightstack)
+    elif "win" in _platform:
+        # Windows, don't open POSIX ports
+        if "/" not in port:
+            return uploader(port, baud_bootloader, baud_flightstack)
+    return None
+
+
+# identify the bootloader, rebooting the flight stack into it, False if no bootloader answers
+def find_bootloader(up):
+    while (True):
+        up.open()
+
+        # port is open, try talking to it
+        try:
+            # identify the bootloader
+            up.identify()
+            return True
+
+        except Exception:
+
+            if not up.send_reboot():
+                return False
+
+            # wait for the reboot, without we might run into Serial I/O Error 5
+            time.sleep(0.25)
+
+            # always close the port
+            up.close()
+
+            # wait for the close, without we might run into Serial I/O Error 6
+            time.sleep(0.3)
+
+
+# flash the board on a port in a worker thread of the concurrent mode, the outcome is recorded in board
+def flash_board(port, args, baud_flightstack, fw, board):
+    start = time.time()
+    try:
+        up = open_uploader(port, args.baud_bootloader, baud_flightstack)
+    except Exception:
+        up = None
+    if up is None:
+        board['status'] = 'unavailable'
+        return
+
+    up.verbose = False
+    up.adaptiveWindow = args.adaptive_window
+    up.adaptive_window_max = args.window_max
+    board['uploader'] = up
+    try:
+        if not find_bootloader(up):
+            # the port may come back as the bootloader, it is tried again by the next scan
+            board['status'] = 'no bootloader'
+            return
+
+        board['sn'] = up.serial_number()
+        board['board'] = "%s,%s" % (up.board_type, up.board_rev)
+        # a single write, so the lines of the workers do not interleave
+        sys.stdout.write("Found board id: %s bootloader version: %s sn: %s on %s\n" % (board['board'], up.bl_rev, board['sn'], port))
+
+        board['status'] = 'flashing'
+        up.upload(fw, force=args.force, boot_delay=args.boot_delay)
+        board['status'] = 'ok'
+
+    except Exception as ex:
+        board['status'] = 'failed'
+        board['error'] = str(ex)
+
+    finally:
+        # always close the port
+        up.close()
+        board['elapsed'] = time.time() - start
+
+
+def get_board_stage(board):
+    if board['status'] == 'flashing' and board['uploader'].progress_label is not None:
+        return board['uploader'].progress_label.lower()
+    return board['status']
+
+
+def print_board_results(boards, stats=False):
+    print()
+    print("%-26s %-10s %-8s %8s  %s" % ("sn", "board", "status", "time", "port"))
+    for key in sorted(boards.keys()):
+        board = boards[key]
+        print("%-26s %-10s %-8s %7.1fs  %s" % (board['sn'] or '-', board['board'] or '-', board['status'], board['elapsed'], board['port']))
+        if board['error']:
+            print("    ERROR: %s" % board['error'])
+    if stats:
+        # a port that could not be opened has no uploader
+        for key in sorted(key for key in boards.keys() if boards[key]['uploader'] is not None):
+            print("\n%s:" % key)
+            boards[key]['uploader'].stats.report()
+
+
+# flash all boards found on the ports concurrently, one worker thread per port, returns the exit status
+def upload_concurrent(args, fw, baud_flightstack):
+    workers = {}
+    boards = {}
+    searching_since = {}
+    last_active = time.time()
+    last_status = None
+
+    try:
+        while True:
+            # start a worker on every new port, and on ports which did not answer as bootloader before,
+            # such as a flight stack that rebooted into the bootloader on the same port
+            for port in get_portlist(args.port):
+                worker = workers.get(port)
+                if worker is None:
+                    searching_since[port] = time.time()
+                elif worker[0].is_alive() or worker[1]['status'] in ['ok', 'failed']:
+                    continue
+                elif time.time() - searching_since[port] > CONCURRENT_BOOTLOADER_TIMEOUT:
+                    # a bricked board or another device on the port, it is reported as failed
+                    worker[1]['status'] = 'failed'
+                    worker[1]['error'] = "no bootloader found within %.0f seconds" % CONCURRENT_BOOTLOADER_TIMEOUT
+                    worker[1]['elapsed'] = time.time() - searching_since[port]
+                    continue
+                board = {'port': port, 'status': 'starting', 'sn': None, 'board': None, 'error': '',
+                         'elapsed': 0.0, 'uploader': None}
+                thread = threading.Thread(target=flash_board, args=(port, args, baud_flightstack, fw, board))
+                thread.daemon = True
+                thread.start()
+                workers[port] = (thread, board)
+
+            # the results are collected per serial number, a board that moved to another port is counted once
+            active = False
+            flashing = False
+            stages = {}
+            for thread, board in workers.values():
+                if thread.is_alive():
+                    active = True
+                    flashing = flashing or board['sn'] is not None
+                    stage = get_board_stage(board)
+                    stages[stage] = stages.get(stage, 0) + 1
+                elif board['status'] in ['ok', 'failed']:
+                    boards[board['sn'] or board['port']] = board
+
+            status = ", ".join(["%d %s" % (stages[stage], stage) for stage in sorted(stages.keys())] +
+                               ["%d ok" % sum(1 for b in boards.values() if b['status'] == 'ok'),
+                                "%d failed" % sum(1 for b in boards.values() if b['status'] == 'failed')])
+            if status != last_status:
+                print("Boards: %s" % status)
+                last_status = status
+
+            # ports which are still searching for a bootloader do not hold up the end, once the
+            # expected boards are done
+            if active:
+                last_active = time.time()
+            if args.boards is not None:
+                if len(boards) >= args.boards and not flashing:
+                    break
+            elif boards and time.time() - last_active > CONCURRENT_SETTLE_TIME:
+                break
+
+            # Delay retries to < 20 Hz to prevent spin-lock from hogging the CPU
+            time.sleep(0.05)
+
+    # CTRL+C aborts the upload/spin-lock by interrupt mechanics
+    except KeyboardInterrupt:
+        print("\n Upload aborted by user.")
+
+    print_board_results(boards, stats=args.stats)
+
+    failed = [key for key in boards if boards[key]['status'] != 'ok']
+    expected = args.boards if args.boards is not None else 1
+    if failed or len(boards) < expected:
+        print("\nERROR: %d of %d boards flashed" % (len(boards) - len(failed), max(expected, len(boards))))
+        return 1
+    print("\n%d boards flashed" % len(boards))
+    return 0
+
+
 def main():
 
     # Parse commandline arguments
@@ -716,6 +1134,11 @@ def main():
     parser.add_argument('--baud-flightstack', action="store", default="57600", help="Comma-separated list of baud rate of the serial port (default is 57600) when communicating with flight stack (Mavlink or NSH), only required for true serial ports.")
     parser.add_argument('--force', action='store_true', default=False, help='Override board type check, or silicon errata checks and continue loading')
     parser.add_argument('--boot-delay', type=int, default=None, help='minimum boot delay to store in flash')
+    parser.add_argument('--adaptive-window', action='store_true', default=False, help='Size the window of unacknowledged program blocks to the measured ack round trip')
+    parser.add_argument('--window-max', type=int, default=uploader.PROG_WINDOW_MAX, help='Maximum number of unacknowledged program blocks of the adaptive window (default is %d)' % uploader.PROG_WINDOW_MAX)
+    parser.add_argument('--stats', action='store_true', default=False, help='Report the program rate, sync latency distribution and retries of the upload')
+    parser.add_argument('--concurrent', action='store_true', default=False, help='Flash the boards on all ports matching --port at once, one worker per port')
+    parser.add_argument('--boards', type=int, default=None, help='Number of boards to wait for in concurrent mode, by default until no new board shows up')
     parser.add_argument('firmware', action="store", help="Firmware file to be uploaded")
     args = parser.parse_args()
 
@@ -777,22 +1200,15 @@ def main():
     # close the socket
     s.close()
 
+    baud_flightstack = [int(x) for x in args.baud_flightstack.split(',')]
+
+    if args.concurrent:
+        sys.exit(upload_concurrent(args, fw, baud_flightstack))
+
     # Spin waiting for a device to show up
     try:
         while True:
-            portlist = []
-            patterns = args.port.split(",")
-            # on unix-like platforms use glob to support wildcard ports. This allows
-            # the use of /dev/serial/by-id/usb-3D_Robotics on Linux, which prevents the upload from
-            # causing modem hangups etc
-            if "linux" in _platform or "darwin" in _platform or "cygwin" in _platform:
-                import glob
-                for pattern in patterns:
-                    portlist += glob.glob(pattern)
-            else:
-                portlist = patterns
-
-            baud_flightstack = [int(x) for x in args.baud_flightstack.split(',')]
+            portlist = get_portlist(args.port)
 
             successful = False
             for port in portlist:
@@ -801,22 +1217,7 @@ def main():
 
                 # create an uploader attached to the port
                 try:
-                    if "linux" in _platform:
-                        # Linux, don't open Mac OS and Win ports
-                        if "COM" not in port and "tty.usb" not in port:
-                            up = uploader(port, args.baud_bootloader, baud_flightstack)
-                    elif "darwin" in _platform:
-                        # OS X, don't open Windows and Linux ports
-                        if "COM" not in port and "ACM" not in port:
-                            up = uploader(port, args.baud_bootloader, baud_flightstack)
-                    elif "cygwin" in _platform:
-                        # Cygwin, don't open native Windows COM and Linux ports
-                        if "COM" not in port and "ACM" not in port:
-                            up = uploader(port, args.baud_bootloader, baud_flightstack)
-                    elif "win" in _platform:
-                        # Windows, don't open POSIX ports
-                        if "/" not in port:
-                            up = uploader(port, args.baud_bootloader, baud_flightstack)
+                    up = open_uploader(port, args.baud_bootloader, baud_flightstack)
                 except Exception:
                     # open failed, rate-limit our attempts
                     time.sleep(0.05)
@@ -824,37 +1225,19 @@ def main():
                     # and loop to the next port
                     continue
 
-                found_bootloader = False
-                while (True):
-                    up.open()
-
-                    # port is open, try talking to it
-                    try:
-                        # identify the bootloader
-                        up.identify()
-                        found_bootloader = True
-                        print()
-                        print("Found board id: %s,%s bootloader version: %s on %s" % (up.board_type, up.board_rev, up.bl_rev, port))
-                        break
-
-                    except Exception:
-
-                        if not up.send_reboot():
-                            break
-
-                        # wait for the reboot, without we might run into Serial I/O Error 5
-                        time.sleep(0.25)
-
-                        # always close the port
-                        up.close()
+                if up is None:
+                    continue
 
-                        # wait for the close, without we might run into Serial I/O Error 6
-                        time.sleep(0.3)
+                up.adaptiveWindow = args.adaptive_window
+                up.adaptive_window_max = args.window_max
 
-                if not found_bootloader:
+                if not find_bootloader(up):
                     # Go to the next port
                     continue
 
+                print()
+                print("Found board id: %s,%s bootloader version: %s on %s" % (up.board_type, up.board_rev, up.bl_rev, port))
+
                 try:
                     # ok, we have a bootloader, try flashing it
                     up.upload(fw, force=args.force, boot_delay=args.boot_delay)
@@ -873,6 +1256,9 @@ def main():
                 finally:
                     # always close the port
                     up.close()
+                    if args.stats:
+                        print()
+                        up.stats.report()
 
                 # we could loop here if we wanted to wait for more boards...
                 if successful:
@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+"""
+tests that the thermal calibration fitted to temperature binned statistics matches the fit to the
+raw samples of a generated log with several instances of every sensor, also if the log is reduced
+in many chunks, which the medians of the fields are estimated over.
+"""
+
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from ecl_ekf.synthetic_ulog import ULOG_HEADER_MAGIC, ULOG_FILE_VERSION, get_data_dtype, \
+    get_format_message, get_message
+from process_sensor_caldata import DEFAULT_BIN_WIDTH, SENSOR_TYPES, calibrate_sensors, \
+    process_sensor_caldata, reduce_sensor_data
+
+# topic name -> list of fields
+SENSOR_TOPICS = {
+    'sensor_accel': [('uint64_t', 'timestamp', 0), ('uint32_t', 'device_id', 0), ('float', 'x', 0),
+                     ('float', 'y', 0), ('float', 'z', 0), ('float', 'temperature', 0)],
+    'sensor_baro': [('uint64_t', 'timestamp', 0), ('uint32_t', 'device_id', 0),
+                    ('float', 'pressure', 0), ('float', 'temperature', 0)],
+    'sensor_gyro': [('uint64_t', 'timestamp', 0), ('uint32_t', 'device_id', 0), ('float', 'x', 0),
+                    ('float', 'y', 0), ('float', 'z', 0), ('float', 'temperature', 0)],
+}
+
+# the maximum difference of the fitted curves over the calibrated temperature range, relative to
+# the range of the curve fitted to the raw samples
+MAX_CURVE_DIFFERENCE = 0.005
+
+# the maximum difference of the fitted curves at the reference temperature, in the units of the
+# parameters: m/s/s, Pa and rad/s
+MAX_OFFSET_DIFFERENCE = {'sensor_accel': 5e-4, 'sensor_baro': 5e-2, 'sensor_gyro': 1e-5}
+
+# the number of bytes read at a time to reduce the log in many chunks
+SMALL_READ_CHUNK_BYTES = 64 * 1024
+
+
+def write_calibration_log(filename: str, n_instances: dict, duration: float = 600.0,
+                          rate: float = 50.0) -> None:
+    """
+    writes a log of a board warming up with the biases of every sensor instance following a
+    quadratic polynomial in temperature plus noise.
+    :param filename:
+    :param n_instances: a dict of topic name to the number of instances.
+    :param duration: in seconds.
+    :param rate: of every sensor instance in Hz.
+    """
+    rng = np.random.default_rng(0)
+    timestamps = (np.arange(int(duration * rate)) * 1e6 / rate).astype(np.uint64) + 1000
+    subscriptions = list()
+    with open(filename, 'wb') as file:
+        file.write(ULOG_HEADER_MAGIC + struct.pack('<BQ', ULOG_FILE_VERSION, 0))
+        for topic, fields in SENSOR_TOPICS.items():
+            file.write(get_message(b'F', get_format_message(topic, fields)))
+        for topic, fields in SENSOR_TOPICS.items():
+            for instance in range(n_instances[topic]):
+                msg_id = len(subscriptions)
+                file.write(get_message(b'A', struct.pack('<BH', instance, msg_id) + topic.encode()))
+
+                data = np.zeros(len(timestamps), dtype=get_data_dtype(fields))
+                data['msg_size'] = data.dtype.itemsize - 3
+                data['msg_type'] = ord('D')
+                data['msg_id'] = msg_id
+                data['timestamp'] = timestamps
+                data['device_id'] = 1000 * (msg_id + 1)
+                temperature = 10.0 + instance + 40.0 * (1.0 - np.exp(
+                    -3.0 * np.arange(len(timestamps)) / len(timestamps))) + \
+                    rng.normal(0.0, 0.05, len(timestamps))
+                data['temperature'] = temperature
+                if topic == 'sensor_baro':
+                    data['pressure'] = 1013.0 + 0.01 * (temperature - 30.0) + \
+                        1e-4 * (temperature - 30.0) ** 2 + rng.normal(0.0, 0.02, len(timestamps))
+                else:
+                    for axis, field in enumerate(['x', 'y', 'z']):
+                        offset = 9.81 if topic == 'sensor_accel' and field == 'z' else 0.0
+                        data[field] = offset + 1e-3 * (axis + 1) * (temperature - 30.0) + \
+                            1e-5 * (temperature - 30.0) ** 2 + rng.normal(0.0, 0.01, len(timestamps))
+                subscriptions.append(data)
+
+        # interleave the instances in blocks of one second
+        block = int(rate)
+        for start in range(0, len(timestamps), block):
+            for data in subscriptions:
+                file.write(data[start:start + block].tobytes())
+
+
+def get_curves(calibration, polynomial_order: int) -> np.ndarray:
+    """
+    :param calibration:
+    :param polynomial_order:
+    :return: the fitted polynomials of all fields (columns) evaluated over the calibrated
+    temperature range (rows).
+    """
+    params = calibration.params
+    prefix = next(name for name in params if name.endswith('_TMIN'))[:-len('_TMIN')]
+    temperature = np.linspace(params[prefix + '_TMIN'], params[prefix + '_TMAX'], 200)
+    return np.vander(temperature - calibration.reference_temperature, polynomial_order + 1).dot(
+        calibration.coefficients)
+
+
+@pytest.fixture(scope='module')
+def calibrations(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('caldata') / 'thermal_calibration.ulg')
+    write_calibration_log(filename, {'sensor_accel': 3, 'sensor_baro': 2, 'sensor_gyro': 3})
+    return {'samples': process_sensor_caldata(filename, bin_width=0, plot=False),
+            'binned': process_sensor_caldata(filename, bin_width=DEFAULT_BIN_WIDTH, plot=False),
+            'binned_chunks': calibrate_sensors(reduce_sensor_data(
+                filename, DEFAULT_BIN_WIDTH, read_chunk_bytes=SMALL_READ_CHUNK_BYTES))}
+
+
+@pytest.mark.parametrize('binned', ['binned', 'binned_chunks'])
+@pytest.mark.parametrize('topic, polynomial_order',
+                         [(topic, order) for topic, _, _, _, order, _, _, _ in SENSOR_TYPES])
+def test_binned_fit_matches_sample_fit(calibrations, binned, topic, polynomial_order):
+    sample_calibrations, binned_calibrations = calibrations['samples'], calibrations[binned]
+    assert len(sample_calibrations[topic]) == len(binned_calibrations[topic]) > 1
+    for sample_calibration, binned_calibration in zip(sample_calibrations[topic],
+                                                      binned_calibrations[topic]):
+        for name in sample_calibration.params:
+            if name.endswith(('_ID', '_TMIN', '_TMAX', '_TREF')):
+                assert binned_calibration.params[name] == pytest.approx(sample_calibration.params[name])
+
+        sample_curves = get_curves(sample_calibration, polynomial_order)
+        binned_curves = get_curves(binned_calibration, polynomial_order)
+        difference = np.amax(np.abs(binned_curves - sample_curves), axis=0)
+        assert np.all(difference <= MAX_CURVE_DIFFERENCE * np.ptp(sample_curves, axis=0))
+
+        offset_difference = np.abs(binned_calibration.coefficients[-1] -
+                                   sample_calibration.coefficients[-1])
+        assert np.all(offset_difference <= MAX_OFFSET_DIFFERENCE[topic])
@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+"""
+tests that the fast firmware CRC matches the table driven reference implementation of the bootloader
+CRC, for any image length and padding, that the JSON and binary firmware files of px_mkfw.py load
+the same firmware, that uploads to an emulated UART bootloader do not overrun its receive buffer, and
+that the concurrent mode reports boards and ports that can not be flashed.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import px_uploader
+from px_uploader import firmware
+from px_firmware_container import container
+from px_bootloader_emulator import BootloaderEmulator
+
+TOOLS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def write_firmware(path, image: bytes) -> str:
+    desc = {'board_id': 9, 'board_revision': 0, 'image_size': len(image), 'image_maxsize': 2 * 1024 * 1024,
+            'image': base64.b64encode(zlib.compress(image, 9)).decode('utf-8')}
+    filename = str(path / 'test.px4')
+    with open(filename, 'w') as file:
+        json.dump(desc, file)
+    return filename
+
+
+@pytest.mark.parametrize('image_size', [0, 1, 3, 4, 5, 252, 1023])
+@pytest.mark.parametrize('padding', [-8, -1, 0, 1, 2, 3, 4, 5, 1000])
+def test_crc_matches_reference(tmp_path, image_size, padding):
+    image = bytes(random.Random(image_size).getrandbits(8) for _ in range(image_size))
+    fw = firmware(write_firmware(tmp_path, image))
+    padlen = len(fw.image) + padding
+    assert fw.crc(padlen) == fw.crc_bytewise(padlen)
+
+
+def test_crc_flash_size(tmp_path):
+    image = random.Random(0).getrandbits(8 * 100001).to_bytes(100001, 'little')
+    fw = firmware(write_firmware(tmp_path, image))
+    padlen = 2 * 1024 * 1024 - 16384
+    assert fw.crc(padlen) == fw.crc_bytewise(padlen)
+    # memoized
+    assert fw.crcs == {padlen: fw.crc(padlen)}
+
+
+def make_firmware(path, image: bytes, mkfw_args: list) -> str:
+    image_filename = str(path / 'image.bin')
+    with open(image_filename, 'wb') as file:
+        file.write(image)
+    xml_filename = str(path / 'parameters.xml')
+    with open(xml_filename, 'w') as file:
+        file.write('<parameters></parameters>')
+    firmware_filename = str(path / 'firmware_{:s}.px4'.format('_'.join(mkfw_args) or 'json'))
+    subprocess.check_call([sys.executable, os.path.join(TOOLS_DIRECTORY, 'px_mkfw.py'), '--board_id', '9',
+                           '--parameter_xml', xml_filename, '--image', image_filename,
+                           '--output', firmware_filename] + mkfw_args)
+    return firmware_filename
+
+
+@pytest.mark.parametrize('image_size', [1021, 4096])
+def test_firmware_formats(tmp_path, image_size):
+    image = random.Random(image_size).getrandbits(8 * image_size).to_bytes(image_size, 'little')
+    firmwares = [firmware(make_firmware(tmp_path, image, mkfw_args)) for mkfw_args in
+                 [[], ['--format', 'binary'], ['--format', 'binary', '--raw_image']]]
+    padlen = 64 * 1024
+    for fw in firmwares:
+        assert bytes(fw.image[:image_size]) == image
+        assert len(fw.image) == len(firmwares[0].image)
+        assert fw.property('image_size') == image_size
+        assert fw.property('board_id') == 9
+        assert fw.crc(padlen) == firmwares[0].crc(padlen)
+
+
+def test_binary_firmware_corrupt(tmp_path):
+    filename = make_firmware(tmp_path, b'\x01' * 4096, ['--format', 'binary', '--raw_image'])
+    image_offset = container(filename).sections['image'][1]
+    with open(filename, 'r+b') as file:
+        file.seek(image_offset + 100)
+        file.write(b'\x00')
+    with pytest.raises(ValueError, match='corrupt'):
+        firmware(filename)
+
+
+@pytest.mark.parametrize('upload_args', [[], ['--adaptive-window']])
+def test_upload_uart_rx_overrun(tmp_path, upload_args):
+    # the bootloader drops the bytes beyond its receive buffer, the upload must not overrun it
+    image = random.Random(0).getrandbits(8 * 65536).to_bytes(65536, 'little')
+    firmware_filename = write_firmware(tmp_path, image)
+    with BootloaderEmulator(bl_rev=5, baudrate=921600, erase_time=0.1, faults={'rx-overrun': 600}) as emulator:
+        result = subprocess.run(
+            [sys.executable, os.path.join(TOOLS_DIRECTORY, 'px_uploader.py'), '--port', emulator.port,
+             '--baud-bootloader', '921600', firmware_filename] + upload_args,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+        assert result.returncode == 0, result.stdout.decode('utf-8', 'replace')
+        assert emulator.n_overruns == 0
+        assert bytes(emulator.flash[:len(image)]) == image
+
+
+def test_upload_concurrent_stats(tmp_path, monkeypatch, capsys):
+    # two boards and a port that cannot be opened, which is given up on and reported as failed
+    monkeypatch.setattr(px_uploader, 'CONCURRENT_BOOTLOADER_TIMEOUT', 1.0)
+    image = random.Random(0).getrandbits(8 * 16384).to_bytes(16384, 'little')
+    fw = firmware(write_firmware(tmp_path, image))
+    with open(str(tmp_path / 'port2'), 'w') as file:
+        file.write('not a serial port')
+    emulators = [BootloaderEmulator(serial_number=bytes([i] * 12), erase_time=0.1,
+                                    link=str(tmp_path / 'port{:d}'.format(i))) for i in range(2)]
+    try:
+        args = argparse.Namespace(
+            port=str(tmp_path / 'port*'), baud_bootloader=115200, force=False, boot_delay=None,
+            adaptive_window=False, window_max=px_uploader.uploader.PROG_WINDOW_MAX, stats=True, boards=None)
+        assert px_uploader.upload_concurrent(args, fw, [57600]) == 1
+        for emulator in emulators:
+            assert bytes(emulator.flash[:len(image)]) == image
+    finally:
+        for emulator in emulators:
+            emulator.close()
+
+    output = capsys.readouterr().out
+    assert 'ERROR: 2 of 3 boards flashed' in output
+    assert 'no bootloader found' in output
+    assert output.count('program') >= 2